@@ -18,12 +18,14 @@ Controller for Image Cache Management API
 """
 
 from oslo_log import log as logging
+import six
 import webob.exc
 
 from glance.api import policy
 from glance.api.v1 import controller
 from glance.common import exception
 from glance.common import wsgi
+from glance.i18n import _
 from glance import image_cache
 
 LOG = logging.getLogger(__name__)
@@ -46,6 +48,17 @@ class Controller(controller.BaseController):
             LOG.debug("User not permitted to manage the image cache")
             raise webob.exc.HTTPForbidden()
 
+    def _get_image_ids(self, body):
+        """Returns the list of image IDs in a request body"""
+        image_ids = body.get('image_ids') if isinstance(body, dict) else None
+        if (not isinstance(image_ids, list) or
+                not all(isinstance(image_id, six.string_types)
+                        for image_id in image_ids)):
+            msg = _("The request body must be a JSON object with an "
+                    "'image_ids' list of image IDs.")
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+        return image_ids
+
     def get_cached_images(self, req):
         """
         GET /cached_images
@@ -74,6 +87,26 @@ class Controller(controller.BaseController):
         self._enforce(req)
         return dict(num_deleted=self.cache.delete_all_cached_images())
 
+    def delete_listed_cached_images(self, req, body=None):
+        """
+        POST /cached_images/delete
+
+        Removes the images with the IDs listed in the 'image_ids' key of the
+        request body from the cache.
+        """
+        self._enforce(req)
+        image_ids = self._get_image_ids(body)
+        return dict(num_deleted=self.cache.delete_cached_images(image_ids))
+
+    def get_cache_stats(self, req):
+        """
+        GET /cache_stats
+
+        Returns the statistics of the cache.
+        """
+        self._enforce(req)
+        return dict(cache_stats=self.cache.get_stats())
+
     def get_queued_images(self, req):
         """
         GET /queued_images
@@ -91,9 +124,35 @@ class Controller(controller.BaseController):
         Queues an image for caching. We do not check to see if
         the image is in the registry here. That is done by the
         prefetcher...
+
+        An optional integer 'priority' query parameter makes the
+        prefetcher fetch images with a higher priority first.
+        """
+        self._enforce(req)
+        try:
+            priority = int(req.params.get('priority', 0))
+        except ValueError:
+            msg = _("The priority of a queued image must be an integer.")
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+        self.cache.queue_image(image_id, priority)
+
+    def queue_images(self, req, body=None):
+        """
+        POST /queued_images
+
+        Queues the images with the IDs listed in the 'image_ids' key of the
+        request body for caching, leaving out those that are already queued
+        or cached. An optional integer 'priority' key makes the prefetcher
+        fetch the images before those with a lower priority.
         """
         self._enforce(req)
-        self.cache.queue_image(image_id)
+        image_ids = self._get_image_ids(body)
+        priority = body.get('priority') or 0
+        if (not isinstance(priority, six.integer_types) or
+                isinstance(priority, bool)):
+            msg = _("The priority of a queued image must be an integer.")
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+        return dict(num_queued=self.cache.queue_images(image_ids, priority))
 
     def delete_queued_image(self, req, image_id):
         """
@@ -18,10 +18,10 @@ import re
 from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log as logging
-from oslo_utils import excutils
 from oslo_utils import units
 
 from glance.common import exception
+from glance.common import utils
 from glance.common import wsgi
 from glance.i18n import _, _LE, _LW
 
@@ -31,13 +31,61 @@ CONF = cfg.CONF
 _CACHED_THREAD_POOL = {}
 
 
+class SizeCheck(utils.ImageStreamListener):
+    """
+    Fails an image download which did not send the expected number of
+    bytes, and notifies of the image being sent once the response is.
+    """
+
+    def __init__(self, image_id, expected_size, image_iter):
+        """
+        :param image_id: Image ID
+        :param expected_size: Size of the image in bytes
+        :param image_iter: Iterator the image data is read from
+        """
+        self.image_id = image_id
+        self.expected_size = expected_size
+        self.image_iter = image_iter
+        self.bytes_written = 0
+
+    def end(self, bytes_read):
+        # Account for data the iterator sent to the client itself, see
+        # glance.common.wsgi.FileWrapper
+        self.bytes_written = bytes_read + getattr(self.image_iter,
+                                                  'bytes_sent', 0)
+        if self.expected_size != self.bytes_written:
+            msg = (_LE("Backend storage for image %(image_id)s "
+                       "disconnected after writing only %(bytes_written)d "
+                       "bytes") % {'image_id': self.image_id,
+                                   'bytes_written': self.bytes_written})
+            LOG.error(msg)
+            raise exception.GlanceException(_("Corrupt image download for "
+                                              "image %(image_id)s") %
+                                            {'image_id': self.image_id})
+
+    def error(self, exc, bytes_read):
+        self.bytes_written = bytes_read
+        msg = (_LE("An error occurred reading from backend storage for "
+                   "image %(image_id)s: %(err)s") % {'image_id': self.image_id,
+                                                     'err': exc})
+        LOG.error(msg)
+        return False
+
+    def close(self, bytes_read):
+        self.bytes_written = bytes_read
+
+
 def size_checked_iter(response, image_meta, expected_size, image_iter,
                       notifier):
-    image_id = image_meta['id']
-    bytes_written = 0
+    """
+    Returns an ImageStream over image_iter which fails if it does not
+    send expected_size bytes, and sends an image.send notification once
+    the response is sent.
+    """
+    check = SizeCheck(image_meta['id'], expected_size, image_iter)
 
     def notify_image_sent_hook(env):
-        image_send_notification(bytes_written, expected_size,
+        image_send_notification(check.bytes_written, expected_size,
                                 image_meta, response.request, notifier)
 
     # Add hook to process after response is fully sent
@@ -45,26 +93,7 @@ def size_checked_iter(response, image_meta, expected_size, image_iter,
         response.request.environ['eventlet.posthooks'].append(
             (notify_image_sent_hook, (), {}))
 
-    try:
-        for chunk in image_iter:
-            yield chunk
-            bytes_written += len(chunk)
-    except Exception as err:
-        with excutils.save_and_reraise_exception():
-            msg = (_LE("An error occurred reading from backend storage for "
-                       "image %(image_id)s: %(err)s") % {'image_id': image_id,
-                                                         'err': err})
-            LOG.error(msg)
-
-    if expected_size != bytes_written:
-        msg = (_LE("Backend storage for image %(image_id)s "
-                   "disconnected after writing only %(bytes_written)d "
-                   "bytes") % {'image_id': image_id,
-                               'bytes_written': bytes_written})
-        LOG.error(msg)
-        raise exception.GlanceException(_("Corrupt image download for "
-                                          "image %(image_id)s") %
-                                        {'image_id': image_id})
+    return utils.ImageStream.of(image_iter).add_listener(check)
 
 
 def image_send_notification(bytes_written, expected_size, image_meta, request,
@@ -22,9 +22,13 @@ When subsequent requests for the same image file are received,
 the local cached copy of the image file is returned.
 """
 
+import functools
 import re
+import uuid
 
+from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import units
 import webob
 
 from glance.api.common import size_checked_iter
@@ -33,13 +37,16 @@ from glance.api.v1 import images
 from glance.common import exception
 from glance.common import utils
 from glance.common import wsgi
+from glance import context
 import glance.db
-from glance.i18n import _LE, _LI
+from glance.i18n import _, _LE, _LI, _LW
 from glance import image_cache
+from glance.image_cache import peers as image_cache_peers
 from glance import notifier
 import glance.registry.client.v1.api as registry
 
 LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
 
 PATTERNS = {
     ('v1', 'GET'): re.compile(r'^/v1/images/([^\/]+)$'),
@@ -48,6 +55,132 @@ PATTERNS = {
     ('v2', 'DELETE'): re.compile(r'^/v2/images/([^\/]+)$')
 }
 
+# Requests which change an image or who may download it, after which the
+# snapshot of the image's metadata kept by the cache must not be used
+METADATA_CHANGE_PATTERNS = [
+    re.compile(r'^/v1/images/([^\/]+)(/members(/.*)?)?$'),
+    re.compile(r'^/v2/images/([^\/]+)(/(members|tags|actions)(/.*)?)?$'),
+]
+
+# The attributes of an image kept in the snapshot of its metadata
+SNAPSHOT_ATTRIBUTES = ('image_id', 'name', 'status', 'visibility', 'owner',
+                       'checksum', 'size', 'virtual_size', 'min_disk',
+                       'min_ram', 'protected', 'container_format',
+                       'disk_format')
+
+BYTE_RANGE_PATTERN = re.compile(r'^(\d*)-(\d*)$')
+
+# Requests asking for more ranges than this are served the whole image
+MAX_BYTE_RANGES = 16
+
+RANGE_CHUNKSIZE = 64 * units.Ki
+
+
+def parse_byte_ranges(range_str, image_size):
+    """
+    Parse the value of a `Range` request header into a list of
+    (start, stop) tuples with stop being exclusive.
+
+    :param range_str: Value of the `Range` header
+    :param image_size: Size of the image the ranges apply to
+    :returns: list of (start, stop) tuples, or None if the header is
+              malformed or asks for too many ranges and should be ignored
+    :raises webob.exc.HTTPRequestRangeNotSatisfiable: if none of the ranges
+            overlaps the image
+    """
+    units_, _sep, ranges_str = range_str.partition('=')
+    if units_.strip().lower() != 'bytes' or not ranges_str.strip():
+        return None
+
+    specs = [spec.strip() for spec in ranges_str.split(',')]
+    if len(specs) > MAX_BYTE_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        match = BYTE_RANGE_PATTERN.match(spec)
+        if match is None:
+            return None
+        first, last = match.groups()
+        if not first:
+            if not last:
+                return None
+            # Suffix range, the last N bytes of the image
+            start, stop = max(image_size - int(last), 0), image_size
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            stop = min(int(last) + 1, image_size) if last else image_size
+        if start < stop:
+            ranges.append((start, stop))
+
+    if not ranges:
+        raise webob.exc.HTTPRequestRangeNotSatisfiable(
+            headers={'Content-Range': 'bytes */%d' % image_size})
+    return ranges
+
+
+def _content_range(start, stop, image_size):
+    return 'bytes %d-%d/%d' % (start, stop - 1, image_size)
+
+
+def _read_range(cache_file, start, stop):
+    cache_file.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        chunk = cache_file.read(min(RANGE_CHUNKSIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def take_metadata_snapshot(image, members):
+    """
+    Returns a JSON serializable snapshot of the metadata of an image, which
+    holds everything needed to authorize a download of the image and to
+    serve it.
+
+    :param image: Domain image
+    :param members: IDs of the tenants the image is shared with
+    """
+    snapshot = dict((attr, getattr(image, attr))
+                    for attr in SNAPSHOT_ATTRIBUTES)
+    snapshot['tags'] = sorted(image.tags)
+    snapshot['extra_properties'] = dict(image.extra_properties)
+    snapshot['members'] = sorted(members)
+    return snapshot
+
+
+def is_snapshot_visible(snapshot, context):
+    """
+    Returns True if the image a metadata snapshot was taken of is visible
+    in the supplied context, following the rules of the database API.
+    """
+    if context.is_admin or snapshot['owner'] is None:
+        return True
+    if snapshot['visibility'] == 'public':
+        return True
+    if context.owner is not None:
+        return (context.owner == snapshot['owner'] or
+                context.owner in snapshot['members'])
+    return False
+
+
+class ImageSnapshot(object):
+
+    """
+    Stands in for the domain image a metadata snapshot was taken of when
+    the image is served from the cache.
+    """
+
+    def __init__(self, snapshot):
+        for attr in SNAPSHOT_ATTRIBUTES:
+            setattr(self, attr, snapshot[attr])
+        self.tags = set(snapshot['tags'])
+        self.extra_properties = snapshot['extra_properties']
+
 
 class CacheFilter(wsgi.Middleware):
 
@@ -55,6 +188,7 @@ class CacheFilter(wsgi.Middleware):
         self.cache = image_cache.ImageCache()
         self.serializer = images.ImageSerializer()
         self.policy = policy.Enforcer()
+        self.peers = image_cache_peers.PeerClient()
         LOG.info(_LI("Initialized image cache middleware"))
         super(CacheFilter, self).__init__(app)
 
@@ -118,7 +252,19 @@ class CacheFilter(wsgi.Middleware):
         """
         Retrieves image and for v2 api and creates adapter like object
         to access image core or custom properties on request.
+
+        With image_cache_metadata_ttl set, the image is taken from a recent
+        snapshot of its metadata if there is one, and a snapshot is taken
+        when the image has to be looked up in the database.
         """
+        if CONF.image_cache_metadata_ttl:
+            snapshot = self.cache.get_metadata_snapshot(image_id)
+            if (snapshot is not None and
+                    is_snapshot_visible(snapshot, request.context)):
+                image = ImageSnapshot(snapshot)
+                request.environ['api.cache.image'] = image
+                return policy.ImageTarget(image)
+
         db_api = glance.db.get_api()
         image_repo = glance.db.ImageRepo(request.context, db_api)
         try:
@@ -126,11 +272,37 @@ class CacheFilter(wsgi.Middleware):
             # Storing image object in request as it is required in
             # _process_v2_request call.
             request.environ['api.cache.image'] = image
-
-            return policy.ImageTarget(image)
         except exception.NotFound as e:
             raise webob.exc.HTTPNotFound(explanation=e.msg, request=request)
 
+        if CONF.image_cache_metadata_ttl:
+            members = []
+            if image.visibility != 'public':
+                members = [member['member'] for member in
+                           db_api.image_member_find(
+                               context.get_admin_context(),
+                               image_id=image_id)]
+            self.cache.set_metadata_snapshot(
+                image_id, take_metadata_snapshot(image, members))
+
+        return policy.ImageTarget(image)
+
+    def _drop_metadata_snapshot(self, request):
+        """
+        Drops the snapshot of the metadata of an image a request is about
+        to change, and remembers to drop it again once the change is done.
+        """
+        if (request.method in ('GET', 'HEAD') or
+                not CONF.image_cache_metadata_ttl):
+            return
+        for pattern in METADATA_CHANGE_PATTERNS:
+            match = pattern.match(request.path_info)
+            if match is not None:
+                image_id = match.group(1)
+                self.cache.delete_metadata_snapshot(image_id)
+                request.environ['api.cache.changed_image_id'] = image_id
+                return
+
     def process_request(self, request):
         """
         For requests for an image file, we check the local image
@@ -138,6 +310,8 @@ class CacheFilter(wsgi.Middleware):
         the image metadata in headers. If not present, we pass
         the request on to the next application in the pipeline.
         """
+        self._drop_metadata_snapshot(request)
+
         match = self._match_request(request)
         try:
             (version, method, image_id) = match
@@ -147,8 +321,24 @@ class CacheFilter(wsgi.Middleware):
 
         self._stash_request_info(request, image_id, method, version)
 
-        if request.method != 'GET' or not self.cache.is_cached(image_id):
+        if request.method != 'GET':
             return None
+
+        following = False
+        from_peer = False
+        from_partial = False
+        if not self.cache.is_cached(image_id):
+            if self._may_serve_partial(request, image_id, version):
+                from_partial = True
+            else:
+                following = None
+                if CONF.image_cache_single_flight:
+                    following = self._should_follow_fill(request, image_id)
+                if following is None:
+                    if not CONF.image_cache_peers:
+                        return None
+                    from_peer = True
+
         method = getattr(self, '_get_%s_image_metadata' % version)
         image_metadata = method(request, image_id)
 
@@ -161,18 +351,93 @@ class CacheFilter(wsgi.Middleware):
         except exception.Forbidden:
             return None
 
-        LOG.debug("Cache hit for image '%s'", image_id)
-        image_iterator = self.get_from_cache(image_id)
+        if from_partial:
+            if not self._get_byte_ranges(request, image_id,
+                                         image_metadata['size']):
+                return None
+            LOG.debug("Partial cache hit for image '%s'", image_id)
+            # The byte ranges are read by _process_v2_request
+            image_iterator = None
+        elif from_peer:
+            image_iterator = self.get_from_peers(
+                image_id, image_metadata,
+                relay=request.environ.get('api.cache.fill_claimed', False))
+            if image_iterator is None:
+                return None
+        elif following:
+            # The size of a partially cached image file can't stand in
+            # for missing size metadata, see _verify_metadata
+            if not image_metadata['size']:
+                return None
+            try:
+                image_iterator = self.get_from_cache_fill(image_id)
+            except exception.NotFound:
+                return None
+            LOG.debug("Following cache fill of image '%s'", image_id)
+        else:
+            LOG.debug("Cache hit for image '%s'", image_id)
+            image_iterator = self.get_from_cache(image_id, request)
         method = getattr(self, '_process_%s_request' % version)
 
         try:
-            return method(request, image_id, image_iterator, image_metadata)
+            response = method(request, image_id, image_iterator,
+                              image_metadata)
         except exception.ImageNotFound:
             msg = _LE("Image cache contained image file for image '%s', "
                       "however the registry did not contain metadata for "
                       "that image!") % image_id
             LOG.error(msg)
             self.cache.delete_cached_image(image_id)
+            return None
+
+        if from_peer:
+            self._record_served(response, 'peer_hits', 'bytes_from_peers')
+        elif from_partial:
+            self._record_served(response, 'partial_hits', 'bytes_from_cache')
+        else:
+            self._record_served(response, 'hits', 'bytes_from_cache')
+        return response
+
+    def _record_served(self, response, counter, bytes_counter):
+        """
+        Counts a download in the cache statistics, and the bytes of its
+        response.
+        """
+        self.cache.stats.incr(counter)
+        self.cache.stats.incr(bytes_counter,
+                              getattr(response, 'content_length', None) or 0)
+
+    def _may_serve_partial(self, request, image_id, version):
+        """
+        Returns True if a request for byte ranges of an image that is not
+        cached may be served from the partially cached image file of the
+        image.
+        """
+        return (CONF.image_cache_partial and version == 'v2' and
+                ('Range' in request.headers or
+                 'Content-Range' in request.headers) and
+                self.cache.get_partial_image(image_id) is not None)
+
+    def _should_follow_fill(self, request, image_id):
+        """
+        Decides how a cache miss is served when single-flight caching is
+        enabled. The first request for an image claims the cache fill and
+        goes on to the backend store, while concurrent requests for the same
+        image follow the cache file that request is writing.
+
+        :returns: True if the request should follow a cache fill, False if
+                  the image has been cached in the meantime, or None if the
+                  request should be passed on to the backend store
+        """
+        if not self.cache.is_being_cached(image_id):
+            if self.cache.claim_fill(image_id):
+                request.environ['api.cache.fill_claimed'] = True
+                return None
+            if not self.cache.wait_for_fill(image_id):
+                return None
+            if self.cache.is_cached(image_id):
+                return False
+        return True
 
     @staticmethod
     def _stash_request_info(request, image_id, method, version):
@@ -222,6 +487,10 @@ class CacheFilter(wsgi.Middleware):
         # naturally once caching is part of the domain model.
         image = request.environ['api.cache.image']
         self._verify_metadata(image_meta)
+        ranges = self._get_byte_ranges(request, image_id, image_meta['size'])
+        if ranges:
+            return self._process_v2_range_request(request, image_id,
+                                                  image_meta, ranges)
         response = webob.Response(request=request)
         response.app_iter = size_checked_iter(response, image_meta,
                                               image_meta['size'],
@@ -239,6 +508,101 @@ class CacheFilter(wsgi.Middleware):
         response.headers['Content-Type'] = 'application/octet-stream'
         response.headers['Content-MD5'] = image.checksum
         response.headers['Content-Length'] = str(image.size)
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+
+    def _get_byte_ranges(self, request, image_id, image_size):
+        """
+        Returns the byte ranges of the image requested by a `Range` header,
+        or by the `Content-Range` request header the v2 API honours for
+        partial downloads, as a list of (start, stop) tuples. Returns None
+        if the whole image should be served.
+
+        Ranges are only served from a completely cached image file, or
+        from the partially cached image file of the image if it holds all
+        of them.
+        """
+        range_str = request.headers.get('Range')
+        content_range_str = request.headers.get('Content-Range')
+        if not (range_str or content_range_str):
+            return None
+        if 'If-Range' in request.headers:
+            # We can't validate the condition, so serve the whole image
+            return None
+        cached = self.cache.is_cached(image_id)
+        if not (cached or self._may_serve_partial(request, image_id, 'v2')):
+            return None
+
+        image_size = int(image_size)
+        if range_str:
+            ranges = parse_byte_ranges(range_str, image_size)
+        else:
+            ranges = self._parse_content_range(content_range_str,
+                                               image_size)
+        if (ranges and not cached and
+                not self.cache.has_partial_ranges(image_id, ranges)):
+            return None
+        return ranges
+
+    @staticmethod
+    def _parse_content_range(content_range_str, image_size):
+        """
+        Parses the `Content-Range` request header of a partial download
+        into a list holding a single (start, stop) tuple.
+        """
+        content_range = webob.byterange.ContentRange.parse(content_range_str)
+        if content_range is None:
+            msg = _('Malformed Content-Range header: %s') % content_range_str
+            raise webob.exc.HTTPBadRequest(explanation=msg)
+        start = content_range.start or 0
+        stop = content_range.stop
+        stop = image_size if stop is None else min(stop, image_size)
+        if start >= stop:
+            raise webob.exc.HTTPRequestRangeNotSatisfiable(
+                headers={'Content-Range': 'bytes */%d' % image_size})
+        return [(start, stop)]
+
+    def _process_v2_range_request(self, request, image_id, image_meta,
+                                  ranges):
+        """
+        Serves byte ranges of a cached image file with a 206 response. A
+        single range is returned as is, multiple ranges are returned as a
+        multipart/byteranges body.
+        """
+        image_size = int(image_meta['size'])
+        response = webob.Response(request=request, status=206)
+
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            content_type = 'application/octet-stream'
+            body_size = stop - start
+            image_iterator = self.get_range_from_cache(image_id, start, stop,
+                                                       request)
+            response.headers['Content-Range'] = _content_range(start, stop,
+                                                               image_size)
+        else:
+            boundary = uuid.uuid4().hex
+            content_type = 'multipart/byteranges; boundary=%s' % boundary
+            part_headers = []
+            for index, (start, stop) in enumerate(ranges):
+                part_header = ('%s--%s\r\n'
+                               'Content-Type: application/octet-stream\r\n'
+                               'Content-Range: %s\r\n\r\n' %
+                               ('\r\n' if index else '', boundary,
+                                _content_range(start, stop, image_size)))
+                part_headers.append(part_header.encode('ascii'))
+            trailer = ('\r\n--%s--\r\n' % boundary).encode('ascii')
+            body_size = (sum(len(h) for h in part_headers) + len(trailer) +
+                         sum(stop - start for start, stop in ranges))
+            image_iterator = self.get_ranges_from_cache(
+                image_id, ranges, part_headers, trailer)
+
+        response.app_iter = size_checked_iter(response, image_meta,
+                                              body_size, image_iterator,
+                                              notifier.Notifier())
+        response.headers['Content-Type'] = content_type
+        response.headers['Content-Length'] = str(body_size)
+        response.headers['Accept-Ranges'] = 'bytes'
         return response
 
     def process_response(self, resp):
@@ -247,7 +611,16 @@ class CacheFilter(wsgi.Middleware):
         images Resource, removing image file from the cache
         if necessary
         """
+        changed_image_id = resp.request.environ.get(
+            'api.cache.changed_image_id')
+        if changed_image_id is not None:
+            # A request served while the image was being changed may have
+            # taken a snapshot of the old metadata
+            self.cache.delete_metadata_snapshot(changed_image_id)
+
         status_code = self.get_status_code(resp)
+        if not 200 <= status_code < 300 or status_code == 204:
+            self._release_fill_claim(resp.request)
         if not 200 <= status_code < 300:
             return resp
 
@@ -273,6 +646,14 @@ class CacheFilter(wsgi.Middleware):
         else:
             return process_response_method(resp, image_id, version=version)
 
+    def _release_fill_claim(self, request):
+        """
+        Gives up the cache fill claimed for the request, if any, so that
+        requests waiting on it can go to the backend store themselves.
+        """
+        if request.environ.get('api.cache.fill_claimed'):
+            self.cache.release_fill(request.environ['api.cache.image_id'])
+
     def _process_DELETE_response(self, resp, image_id, version=None):
         if self.cache.is_cached(image_id):
             LOG.debug("Removing image %s from cache", image_id)
@@ -280,6 +661,16 @@ class CacheFilter(wsgi.Middleware):
         return resp
 
     def _process_GET_response(self, resp, image_id, version=None):
+        if (self.get_status_code(resp) == 206 or
+                'Content-Range' in resp.request.headers):
+            # Only part of the image is being sent, which can only be
+            # cached block by block
+            self._release_fill_claim(resp.request)
+            self._record_served(resp, 'misses', 'bytes_from_backend')
+            if CONF.image_cache_partial and version == 'v2':
+                self._process_partial_GET_response(resp, image_id)
+            return resp
+
         image_checksum = resp.headers.get('Content-MD5')
         if not image_checksum:
             # API V1 stores the checksum in a different header:
@@ -300,10 +691,43 @@ class CacheFilter(wsgi.Middleware):
         # return 403 error to client then.
         self._enforce(resp.request, 'download_image', target=image_metadata)
 
+        self._record_served(resp, 'misses', 'bytes_from_backend')
+        if CONF.image_cache_warming_images:
+            self.cache.record_miss(image_id)
+
+        image_size = resp.headers.get('Content-Length')
+        if image_size is not None:
+            image_size = int(image_size)
+
+        # When the admission policy rejects the image, the requests of this
+        # process waiting on our fill claim follow the image as we relay it
+        # instead of all reading it from the backend store at once
+        relay = resp.request.environ.get('api.cache.fill_claimed', False)
         resp.app_iter = self.cache.get_caching_iter(image_id, image_checksum,
-                                                    resp.app_iter)
+                                                    resp.app_iter,
+                                                    image_size=image_size,
+                                                    relay=relay)
         return resp
 
+    def _process_partial_GET_response(self, resp, image_id):
+        """
+        Writes the blocks of the image that a partial download through the
+        v2 API reads from the backend store into the partially cached image
+        file of the image.
+        """
+        content_range = webob.byterange.ContentRange.parse(
+            resp.request.headers.get('Content-Range'))
+        # The v2 API answers partial downloads with the requested part of
+        # the image and a 200 status
+        if content_range is None or self.get_status_code(resp) != 200:
+            return
+
+        image_metadata = self._get_v2_image_metadata(resp.request, image_id)
+        self._enforce(resp.request, 'download_image', target=image_metadata)
+        resp.app_iter = self.cache.get_partial_caching_iter(
+            image_id, image_metadata['checksum'], resp.app_iter,
+            content_range.start or 0, image_metadata['size'])
+
     def get_status_code(self, response):
         """
         Returns the integer status code from the response, which
@@ -313,9 +737,93 @@ class CacheFilter(wsgi.Middleware):
             return response.status_int
         return response.status
 
-    def get_from_cache(self, image_id):
+    def get_from_cache(self, image_id, request=None):
         """Called if cache hit"""
+        if request is not None and CONF.image_cache_sendfile:
+            return self._get_file_wrapper(request, image_id)
+        return self._read_from_cache(image_id)
+
+    def _read_from_cache(self, image_id):
         with self.cache.open_for_read(image_id) as cache_file:
             chunks = utils.chunkiter(cache_file)
             for chunk in chunks:
                 yield chunk
+
+    def get_range_from_cache(self, image_id, start, stop, request=None):
+        """Called if cache hit for a single byte range"""
+        if request is not None and CONF.image_cache_sendfile:
+            return self._get_file_wrapper(request, image_id, start,
+                                          stop - start)
+        return self._read_range_from_cache(image_id, start, stop)
+
+    def _open_for_read(self, image_id):
+        """
+        Opens the cached image file of an image for reading, or its
+        partially cached image file if the image is not cached.
+        """
+        if CONF.image_cache_partial and not self.cache.is_cached(image_id):
+            return self.cache.open_partial_for_read(image_id)
+        return self.cache.open_for_read(image_id)
+
+    def _read_range_from_cache(self, image_id, start, stop):
+        with self._open_for_read(image_id) as cache_file:
+            for chunk in _read_range(cache_file, start, stop):
+                yield chunk
+
+    def _get_file_wrapper(self, request, image_id, offset=0, length=None):
+        """
+        Returns an iterator over the cached image file which the WSGI
+        server sends with sendfile(), if it is able to.
+        """
+        open_file = functools.partial(self._open_for_read, image_id)
+        return wsgi.FileWrapper(request.environ, open_file, offset, length)
+
+    def get_ranges_from_cache(self, image_id, ranges, part_headers, trailer):
+        """Called if cache hit for multiple byte ranges"""
+        with self._open_for_read(image_id) as cache_file:
+            for (start, stop), part_header in zip(ranges, part_headers):
+                yield part_header
+                for chunk in _read_range(cache_file, start, stop):
+                    yield chunk
+            yield trailer
+
+    def get_from_peers(self, image_id, image_metadata, relay=False):
+        """
+        Called if cache miss and cache peers are configured. Returns an
+        iterator over the image fetched from the first peer which has it
+        cached with the right size, which writes the image into the cache
+        as well, or None if none of the peers has it.
+
+        :param relay: See ImageCache.get_caching_iter()
+        """
+        image_checksum = image_metadata['checksum']
+        if not image_checksum:
+            # The image could not be verified
+            return None
+        for conn, image_iter, image_size in self.peers.fetch(image_id):
+            if image_size != image_metadata['size']:
+                LOG.warn(_LW("Cache peer sent %(peer_size)s bytes for image "
+                             "'%(image_id)s' of %(size)s bytes"),
+                         {'peer_size': image_size, 'image_id': image_id,
+                          'size': image_metadata['size']})
+                conn.close()
+                continue
+            LOG.debug("Cache miss for image '%s' served by a cache peer",
+                      image_id)
+            image_iter = image_cache_peers.verified_iter(image_id, image_iter,
+                                                         image_checksum)
+            return self.cache.get_caching_iter(image_id, image_checksum,
+                                               image_iter,
+                                               image_size=image_size,
+                                               relay=relay)
+        return None
+
+    def get_from_cache_fill(self, image_id):
+        """Called if the image is being written into the cache"""
+        try:
+            return self.cache.get_following_iter(image_id)
+        except exception.NotFound:
+            # The fill finished in the meantime
+            if not self.cache.is_cached(image_id):
+                raise
+            return self.get_from_cache(image_id)
@@ -42,11 +42,21 @@ class CacheManageFilter(wsgi.Middleware):
                        action="delete_cached_image",
                        conditions=dict(method=["DELETE"]))
 
+        mapper.connect("/v1/cached_images/delete",
+                       controller=resource,
+                       action="delete_listed_cached_images",
+                       conditions=dict(method=["POST"]))
+
         mapper.connect("/v1/cached_images",
                        controller=resource,
                        action="delete_cached_images",
                        conditions=dict(method=["DELETE"]))
 
+        mapper.connect("/v1/cache_stats",
+                       controller=resource,
+                       action="get_cache_stats",
+                       conditions=dict(method=["GET"]))
+
         mapper.connect("/v1/queued_images/{image_id}",
                        controller=resource,
                        action="queue_image",
@@ -57,6 +67,11 @@ class CacheManageFilter(wsgi.Middleware):
                        action="get_queued_images",
                        conditions=dict(method=["GET"]))
 
+        mapper.connect("/v1/queued_images",
+                       controller=resource,
+                       action="queue_images",
+                       conditions=dict(method=["POST"]))
+
         mapper.connect("/v1/queued_images/{image_id}",
                        controller=resource,
                        action="delete_queued_image",
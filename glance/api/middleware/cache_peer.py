@@ -0,0 +1,79 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Serves cached images to the image caches of peer API servers
+
+This middleware must come before the version negotiation and
+authentication middleware in the pipeline, since peers authenticate with
+image_cache_peer_key alone.
+"""
+
+import re
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import secretutils
+import webob
+
+from glance.common import utils
+from glance.common import wsgi
+from glance.i18n import _LI
+from glance import image_cache
+from glance.image_cache import peers
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+
+PATTERN = re.compile(r'^/cache-peer/images/([^\/]+)$')
+
+
+class CachePeerFilter(wsgi.Middleware):
+
+    def __init__(self, app):
+        self.cache = image_cache.ImageCache()
+        LOG.info(_LI("Initialized image cache peer middleware"))
+        super(CachePeerFilter, self).__init__(app)
+
+    def process_request(self, request):
+        match = PATTERN.match(request.path_info)
+        if match is None or not CONF.image_cache_peer_key:
+            return None
+
+        if request.method != 'GET':
+            return webob.exc.HTTPMethodNotAllowed(allow='GET')
+
+        key = request.headers.get(peers.PEER_KEY_HEADER, '')
+        if not secretutils.constant_time_compare(
+                key, CONF.image_cache_peer_key):
+            return webob.exc.HTTPForbidden()
+
+        image_id = match.group(1)
+        if not self.cache.is_cached(image_id):
+            return webob.exc.HTTPNotFound()
+
+        LOG.debug("Serving image '%s' to a cache peer", image_id)
+        response = webob.Response(request=request)
+        response.headers['Content-Type'] = 'application/octet-stream'
+        response.app_iter = self._read_from_cache(image_id)
+        response.headers['Content-Length'] = str(
+            self.cache.get_image_size(image_id))
+        return response
+
+    def _read_from_cache(self, image_id):
+        with self.cache.open_for_read(image_id) as cache_file:
+            for chunk in utils.chunkiter(cache_file):
+                yield chunk
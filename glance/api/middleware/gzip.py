@@ -59,6 +59,10 @@ class GzipMiddleware(wsgi.Middleware):
             # Webob itself will set the Content-Encoding header.
             response.encode_content(lazy=lazy)
 
+            # NOTE: The response body has to pass through the compressor,
+            # so it mustn't be sent to the client with sendfile().
+            request.environ.pop('glance.sendfile', None)
+
             if checksum:
                 response.headers['Content-MD5'] = checksum
 
@@ -44,6 +44,7 @@ from glance.api.v1 import controller
 from glance.api.v1 import filters
 from glance.api.v1 import upload_utils
 from glance.common import exception
+from glance.common import multihash
 from glance.common import property_utils
 from glance.common import store_utils
 from glance.common import timeutils
@@ -242,6 +243,35 @@ class Controller(controller.BaseController):
                                         request=req,
                                         content_type="text/plain")
 
+    def _enforce_reserved_props(self, image_meta, req, orig_image_meta=None,
+                                purge_props=False):
+        """
+        Check request does not set the properties holding the digests of
+        the image data, which only Glance computes. Sending them back
+        unchanged is allowed, and purging properties keeps them.
+
+        :param image_meta: Mapping of metadata about image
+        :param req: The WSGI/Webob Request object
+        :param orig_image_meta: Mapping of existing metadata about image
+        :param purge_props: Whether properties not in image_meta are removed
+
+        :raises: HTTPForbidden if request sets a reserved property
+        """
+        props = image_meta['properties']
+        orig_props = orig_image_meta['properties'] if orig_image_meta else {}
+        for key, value in props.items():
+            if (key.startswith(multihash.PROPERTY_PREFIX) and
+                    orig_props.get(key) != value):
+                msg = _("Property '%s' is reserved.") % key
+                LOG.warn(msg)
+                raise HTTPForbidden(explanation=msg,
+                                    request=req,
+                                    content_type="text/plain")
+        if purge_props:
+            for key, value in orig_props.items():
+                if key.startswith(multihash.PROPERTY_PREFIX):
+                    props.setdefault(key, value)
+
     def _enforce_read_protected_props(self, image_meta, req):
         """
         Remove entries from metadata properties if they are read protected
@@ -912,6 +942,7 @@ class Controller(controller.BaseController):
 
         self._enforce_create_protected_props(image_meta['properties'].keys(),
                                              req)
+        self._enforce_reserved_props(image_meta, req)
 
         self._enforce_image_property_quota(image_meta, req=req)
 
@@ -1037,6 +1068,8 @@ class Controller(controller.BaseController):
             self._enforce_delete_protected_props(
                 orig_keys.difference(new_keys), image_meta,
                 orig_image_meta, req)
+        self._enforce_reserved_props(image_meta, req, orig_image_meta,
+                                     purge_props)
 
         self._enforce_image_property_quota(image_meta,
                                            orig_image_meta=orig_image_meta,
@@ -20,6 +20,7 @@ from oslo_utils import excutils
 import webob.exc
 
 from glance.common import exception
+from glance.common import multihash
 from glance.common import store_utils
 from glance.common import utils
 import glance.db
@@ -99,15 +100,20 @@ def upload_data_to_store(req, image_meta, image_data, store, notifier):
         if remaining is not None:
             image_data = utils.LimitingReader(image_data, remaining)
 
-        (uri,
-         size,
-         checksum,
-         location_metadata) = store_api.store_add_to_backend(
-             image_meta['id'],
-             image_data,
-             image_meta['size'],
-             store,
-             context=req.context)
+        hasher = multihash.MultiHasher.configured()
+        if hasher is not None:
+            image_data = multihash.HashingReader(image_data, hasher)
+
+        with utils.upload_pipeline(image_data) as image_data:
+            (uri,
+             size,
+             checksum,
+             location_metadata) = store_api.store_add_to_backend(
+                 image_meta['id'],
+                 image_data,
+                 image_meta['size'],
+                 store,
+                 context=req.context)
 
         location_data = {'url': uri,
                          'metadata': location_metadata,
@@ -155,6 +161,8 @@ def upload_data_to_store(req, image_meta, image_data, store, notifier):
                                   'size': size})
         update_data = {'checksum': checksum,
                        'size': size}
+        if hasher is not None:
+            update_data['properties'] = hasher.properties()
         try:
             try:
                 state = 'saving'
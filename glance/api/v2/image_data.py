@@ -298,9 +298,10 @@ class ResponseSerializer(wsgi.JSONResponseSerializer):
         try:
             # NOTE(markwash): filesystem store (and maybe others?) cause a
             # problem with the caching middleware if they are not wrapped in
-            # an iterator very strange
-            response.app_iter = iter(image.get_data(offset=offset,
-                                                    chunk_size=chunk_size))
+            # an iterator very strange. The notifier already returns an
+            # ImageStream, which the caching middleware observes as well.
+            response.app_iter = utils.ImageStream.of(
+                image.get_data(offset=offset, chunk_size=chunk_size))
         except glance_store.NotFound as e:
             raise webob.exc.HTTPNoContent(explanation=e.msg)
         except glance_store.RemoteServiceUnavailable as e:
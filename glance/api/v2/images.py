@@ -27,6 +27,7 @@ import webob.exc
 from glance.api import policy
 from glance.common import exception
 from glance.common import location_strategy
+from glance.common import multihash
 from glance.common import timeutils
 from glance.common import utils
 from glance.common import wsgi
@@ -332,6 +333,8 @@ class RequestDeserializer(wsgi.JSONRequestDeserializer):
                             'size', 'virtual_size', 'direct_url', 'self',
                             'file', 'schema', 'id')
     _reserved_properties = ('location', 'deleted', 'deleted_at')
+    # The digests of the image data are only set by Glance
+    _reserved_prefixes = (multihash.PROPERTY_PREFIX,)
     _base_properties = ('checksum', 'created_at', 'container_format',
                         'disk_format', 'id', 'min_disk', 'min_ram', 'name',
                         'size', 'virtual_size', 'status', 'tags', 'owner',
@@ -366,6 +369,14 @@ class RequestDeserializer(wsgi.JSONRequestDeserializer):
                 msg = _("Attribute '%s' is read-only.") % key
                 raise webob.exc.HTTPForbidden(
                     explanation=six.text_type(msg))
+        for key in image:
+            cls._check_reserved_prefix(key)
+
+    @classmethod
+    def _check_reserved_prefix(cls, key):
+        if key.startswith(cls._reserved_prefixes):
+            msg = _("Attribute '%s' is reserved.") % key
+            raise webob.exc.HTTPForbidden(explanation=six.text_type(msg))
 
     def create(self, request):
         body = self._get_request_body(request)
@@ -482,6 +493,7 @@ class RequestDeserializer(wsgi.JSONRequestDeserializer):
         if path_root in self._reserved_properties:
             msg = _("Attribute '%s' is reserved.") % path_root
             raise webob.exc.HTTPForbidden(explanation=six.text_type(msg))
+        self._check_reserved_prefix(path_root)
 
         if change['op'] == 'remove':
             return
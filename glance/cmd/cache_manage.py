@@ -142,6 +142,40 @@ List all images currently queued for caching.
     print(pretty_table.get_string())
 
 
+@catch_error('show cache statistics')
+def show_stats(options, args):
+    """%(prog)s stats [options]
+
+Show the statistics of the image cache: downloads served from the cache,
+from peers and from the backend store, the bytes they sent, failures to
+cache images, evictions and how long filling the cache with images took.
+    """
+    client = get_client(options)
+    stats = client.get_cache_stats()
+
+    pretty_table = prettytable.PrettyTable(("Statistic", "Value"))
+    pretty_table.align['Statistic'] = "l"
+    pretty_table.align['Value'] = "r"
+    pretty_table.add_row(("hit_ratio", "%.3f" % stats['hit_ratio']))
+    pretty_table.add_row(("size", stats['size']))
+    pretty_table.add_row(("max_size", stats['max_size']))
+    for name, value in sorted(stats['counters'].items()):
+        pretty_table.add_row((name, value))
+    print(pretty_table.get_string())
+
+    for name, histogram in sorted(stats['histograms'].items()):
+        print("\n%s (%d values, sum %s)" % (name, sum(histogram['counts']),
+                                            histogram['sum']))
+        pretty_table = prettytable.PrettyTable(("Bucket", "Count"))
+        pretty_table.align['Bucket'] = "l"
+        pretty_table.align['Count'] = "r"
+        buckets = ["<= %s" % bound for bound in histogram['buckets']]
+        buckets.append("> %s" % histogram['buckets'][-1])
+        for bucket, count in zip(buckets, histogram['counts']):
+            pretty_table.add_row((bucket, count))
+        print(pretty_table.get_string())
+
+
 @catch_error('queue the specified image for caching')
 def queue_image(options, args):
     """%(prog)s queue-image <IMAGE_ID> [options]
@@ -161,7 +195,7 @@ Queues an image for caching
         return SUCCESS
 
     client = get_client(options)
-    client.queue_image_for_caching(image_id)
+    client.queue_image_for_caching(image_id, options.priority)
 
     if options.verbose:
         print("Queued image %(image_id)s for caching" %
@@ -170,6 +204,56 @@ Queues an image for caching
     return SUCCESS
 
 
+def read_image_ids(options, args):
+    """
+    Returns the image IDs given as arguments, or else those listed in the
+    file given with --file, or on standard input if that is '-' or if no
+    file is given. Listed image IDs are separated by whitespace, and lines
+    starting with '#' are ignored.
+    """
+    if args:
+        return list(args)
+    if options.file and options.file != '-':
+        with open(options.file) as ids_file:
+            lines = ids_file.readlines()
+    else:
+        lines = sys.stdin.readlines()
+    image_ids = []
+    for line in lines:
+        if not line.strip().startswith('#'):
+            image_ids.extend(line.split())
+    return image_ids
+
+
+@catch_error('queue the specified images for caching')
+def queue_images(options, args):
+    """%(prog)s queue-images [<IMAGE_ID> ...] [options]
+
+Queues several images for caching in a single request. The image IDs are
+read from the file given with --file, or from standard input, unless they
+are given as arguments.
+"""
+    image_ids = read_image_ids(options, args)
+    if not image_ids:
+        print("Please specify the IDs of the images you wish to queue for ")
+        print("caching")
+        return FAILURE
+
+    if (not options.force and
+        not user_confirm("Queue %(num)d images for caching?" %
+                         {'num': len(image_ids)}, default=False)):
+        return SUCCESS
+
+    client = get_client(options)
+    num_queued = client.queue_images_for_caching(image_ids, options.priority)
+
+    if options.verbose:
+        print("Queued %(num_queued)s images for caching" %
+              {'num_queued': num_queued})
+
+    return SUCCESS
+
+
 @catch_error('delete the specified cached image')
 def delete_cached_image(options, args):
     """
@@ -198,6 +282,35 @@ Deletes an image from the cache
     return SUCCESS
 
 
+@catch_error('delete the specified cached images')
+def delete_cached_images(options, args):
+    """%(prog)s delete-cached-images [<IMAGE_ID> ...] [options]
+
+Deletes several images from the cache in a single request. The image IDs
+are read from the file given with --file, or from standard input, unless
+they are given as arguments.
+"""
+    image_ids = read_image_ids(options, args)
+    if not image_ids:
+        print("Please specify the IDs of the images you wish to delete ")
+        print("from the cache")
+        return FAILURE
+
+    if (not options.force and
+        not user_confirm("Delete %(num)d cached images?" %
+                         {'num': len(image_ids)}, default=False)):
+        return SUCCESS
+
+    client = get_client(options)
+    num_deleted = client.delete_cached_images(image_ids)
+
+    if options.verbose:
+        print("Deleted %(num_deleted)s cached images" %
+              {'num_deleted': num_deleted})
+
+    return SUCCESS
+
+
 @catch_error('Delete all cached images')
 def delete_all_cached_images(options, args):
     """%(prog)s delete-all-cached-images [options]
@@ -326,6 +439,16 @@ def create_options(parser):
                       help="Prevent select actions from requesting "
                            "user confirmation.")
 
+    parser.add_option('--priority', dest="priority", metavar="PRIORITY",
+                      type=int, default=None,
+                      help="Priority of an image queued for caching, images "
+                           "with a higher priority are prefetched first.")
+
+    parser.add_option('--file', dest="file", metavar="FILE", default=None,
+                      help="File listing the IDs of the images to queue or "
+                           "delete with queue-images and "
+                           "delete-cached-images, '-' for standard input.")
+
     parser.add_option('--os-auth-token',
                       dest='os_auth_token',
                       default=env('OS_AUTH_TOKEN'),
@@ -439,10 +562,13 @@ def lookup_command(parser, command_name):
         'list-cached': list_cached,
         'list-queued': list_queued,
         'queue-image': queue_image,
+        'queue-images': queue_images,
         'delete-cached-image': delete_cached_image,
+        'delete-cached-images': delete_cached_images,
         'delete-all-cached-images': delete_all_cached_images,
         'delete-queued-image': delete_queued_image,
         'delete-all-queued-images': delete_all_queued_images,
+        'stats': show_stats,
     }
 
     commands = {}
@@ -493,13 +619,19 @@ Commands:
 
     queue-image                 Queue an image for caching
 
+    queue-images                Queue several images for caching
+
     delete-cached-image         Purges an image from the cache
 
+    delete-cached-images        Purges several images from the cache
+
     delete-all-cached-images    Removes all images from the cache
 
     delete-queued-image         Deletes an image from the cache queue
 
     delete-all-queued-images    Deletes all images from the cache queue
+
+    stats                       Show the statistics of the cache
 """
 
     version_string = version.cached_version_string()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Glance Image Cache Verifier
+
+This is meant to be run periodically from cron, ideally under
+``ionice -c3``, to verify the image files in the cache against their
+checksums and evict those that are corrupt.
+"""
+
+import os
+import sys
+
+# If ../glance/__init__.py exists, add ../ to Python search path, so that
+# it will override what happens to be installed in /usr/(local/)lib/python...
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'glance', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from oslo_log import log as logging
+
+from glance.common import config
+from glance.image_cache import verifier
+
+CONF = config.CONF
+logging.register_options(CONF)
+
+
+def main():
+    try:
+        config.parse_cache_args()
+        logging.setup(CONF, 'glance')
+
+        app = verifier.Verifier()
+        app.run()
+    except RuntimeError as e:
+        sys.exit("ERROR: %s" % e)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Digests of image data computed in worker threads
+"""
+
+import hashlib
+
+from eventlet import greenthread
+from eventlet import tpool
+from oslo_config import cfg
+from oslo_utils import units
+import six
+
+from glance.i18n import _
+
+multihash_opts = [
+    cfg.ListOpt('image_hash_algorithms', default=[],
+                help=_('The digests of the image data computed when an '
+                       'image is uploaded, besides its md5 checksum, such '
+                       'as sha256 or sha512. Each is stored in the '
+                       'os_hash_<algorithm> property of the image, which '
+                       'clients can verify the image data they download '
+                       'against.')),
+    cfg.BoolOpt('image_hash_threaded', default=False,
+                help=_('When enabled, the digests listed in '
+                       'image_hash_algorithms are computed in native '
+                       'threads while the upload goes on, rather than in '
+                       'the green thread reading the upload. This only '
+                       'pays off on hosts with CPUs to spare for them.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(multihash_opts)
+
+# The property of an image the digest computed with an algorithm is stored
+# in is named after the algorithm
+PROPERTY_PREFIX = 'os_hash_'
+
+# The amount of image data handed over to the worker threads at once
+BATCH_SIZE = units.Mi
+
+
+def _update(digest, chunks):
+    for chunk in chunks:
+        digest.update(chunk)
+
+
+class MultiHasher(object):
+
+    """
+    Computes digests of a stream of image data with several algorithms,
+    in the calling green thread, or in worker threads that run in parallel
+    with each other and with the green threads of the process, as hashlib
+    releases the GIL while hashing. Worker threads only pay off with CPUs
+    to spare, otherwise they merely contend with the green threads.
+
+    Chunks are handed over to the worker threads in batches of BATCH_SIZE
+    bytes without being copied, each algorithm hashing one batch while the
+    next one is gathered. Chunks that aren't bytes, such as views of a
+    buffer which is read into again once the chunk was consumed, are
+    hashed before update() returns.
+    """
+
+    def __init__(self, algorithms, threaded=False):
+        """
+        :param algorithms: Names of the hashlib algorithms to compute
+        :param threaded: Whether to hash in worker threads
+        :raises ValueError: if an algorithm is not supported
+        """
+        self.threaded = threaded
+        self.digests = dict((name, hashlib.new(name)) for name in algorithms)
+        self.batch = []
+        self.batch_size = 0
+        self.jobs = []
+
+    @classmethod
+    def configured(cls):
+        """
+        Returns a MultiHasher computing the digests of
+        image_hash_algorithms, in worker threads if image_hash_threaded is
+        set, or None if there are none.
+        """
+        if not CONF.image_hash_algorithms:
+            return None
+        return cls(CONF.image_hash_algorithms, CONF.image_hash_threaded)
+
+    def update(self, chunk):
+        """Hashes a chunk of image data.
+
+        :param chunk: Chunk of image data
+        """
+        if not chunk:
+            return
+        if not self.threaded:
+            for digest in six.itervalues(self.digests):
+                digest.update(chunk)
+            return
+        self.batch.append(chunk)
+        self.batch_size += len(chunk)
+        if not isinstance(chunk, bytes):
+            self._submit()
+            self._wait()
+        elif self.batch_size >= BATCH_SIZE:
+            self._submit()
+
+    def _submit(self):
+        self._wait()
+        batch, self.batch, self.batch_size = self.batch, [], 0
+        self.jobs = [greenthread.spawn(tpool.execute, _update, digest, batch)
+                     for digest in six.itervalues(self.digests)]
+
+    def _wait(self):
+        jobs, self.jobs = self.jobs, []
+        for job in jobs:
+            job.wait()
+
+    def hexdigests(self):
+        """
+        Returns the hexadecimal digests of the image data hashed so far by
+        algorithm.
+        """
+        if self.batch:
+            self._submit()
+        self._wait()
+        return dict((name, digest.hexdigest())
+                    for name, digest in six.iteritems(self.digests))
+
+    def hexdigest(self, name):
+        """
+        Returns the hexadecimal digest of the image data hashed so far
+        with an algorithm.
+
+        :param name: Name of the algorithm
+        """
+        return self.hexdigests()[name]
+
+    def properties(self):
+        """
+        Returns the image properties storing the digests of the image data
+        hashed so far.
+        """
+        return dict((PROPERTY_PREFIX + name, hexdigest)
+                    for name, hexdigest in six.iteritems(self.hexdigests()))
+
+
+class HashingReader(object):
+    """
+    Reader hashing the image data read through it with a MultiHasher.
+    """
+    def __init__(self, data, hasher):
+        """
+        :param data: Underlying image data object
+        :param hasher: MultiHasher the image data is handed to
+        """
+        self.data = data
+        self.hasher = hasher
+
+    def __iter__(self):
+        for chunk in self.data:
+            self.hasher.update(chunk)
+            yield chunk
+
+    def read(self, i):
+        result = self.data.read(i)
+        self.hasher.update(result)
+        return result
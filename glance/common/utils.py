@@ -26,11 +26,17 @@ try:
     from eventlet import sleep
 except ImportError:
     from time import sleep
+from eventlet import greenthread
+from eventlet import queue
 from eventlet.green import socket
 
+import collections
+import contextlib
 import functools
 import os
 import re
+import sys
+import time
 import uuid
 
 from OpenSSL import crypto
@@ -40,13 +46,47 @@ from oslo_utils import encodeutils
 from oslo_utils import excutils
 from oslo_utils import netutils
 from oslo_utils import strutils
+from oslo_utils import units
 import six
 from webob import exc
 
 from glance.common import exception
 from glance.i18n import _, _LE
 
+cooperative_opts = [
+    cfg.IntOpt('cooperative_yield_interval', default=1, min=0,
+               help=_('The number of milliseconds for which a worker streams '
+                      'image data for a request before letting the other '
+                      'requests it serves run. 0 disables this limit.')),
+    cfg.IntOpt('cooperative_yield_bytes', default=256 * units.Ki, min=0,
+               help=_('The number of bytes of image data a worker streams '
+                      'for a request before letting the other requests it '
+                      'serves run. 0 disables this limit. If both '
+                      'cooperative_yield_interval and cooperative_yield_bytes '
+                      'are 0, other requests run after every chunk of image '
+                      'data.')),
+]
+
+upload_pipeline_opts = [
+    cfg.IntOpt('image_upload_pipeline_depth', default=0, min=0,
+               help=_('The number of chunks of image data read ahead from '
+                      'the client while an image upload is written to the '
+                      'backend store, so that reading from the client and '
+                      'writing to a store with a high latency overlap. Each '
+                      'upload holds at most one more chunk than this in '
+                      'memory, and the client is held back when they are all '
+                      'taken. 0 reads from the client and writes to the '
+                      'store in turns.')),
+    cfg.IntOpt('image_upload_pipeline_chunk_size', default=64 * units.Ki,
+               min=1,
+               help=_('The size in bytes of the chunks of image data read '
+                      'ahead from the client when '
+                      'image_upload_pipeline_depth is set.')),
+]
+
 CONF = cfg.CONF
+CONF.register_opts(cooperative_opts)
+CONF.register_opts(upload_pipeline_opts)
 
 LOG = logging.getLogger(__name__)
 
@@ -92,16 +132,48 @@ def chunkiter(fp, chunk_size=65536):
             break
 
 
+class CooperativeYield(object):
+    """
+    Lets the other green threads of the process run once a stream of image
+    data went on for cooperative_yield_interval milliseconds or
+    cooperative_yield_bytes bytes since it last did, rather than after
+    every chunk, which costs a context switch per chunk with fast stores.
+    """
+
+    def __init__(self):
+        self.interval = CONF.cooperative_yield_interval / 1000.0
+        self.max_bytes = CONF.cooperative_yield_bytes
+        self.every_chunk = not (self.interval or self.max_bytes)
+        self.pending = 0
+        self.last_yield = time.time()
+
+    def after(self, size):
+        """Yields to the other green threads if it is time to.
+
+        :param size: Number of bytes streamed since the last call
+        """
+        if not self.every_chunk:
+            self.pending += size
+            if not ((self.max_bytes and self.pending >= self.max_bytes) or
+                    (self.interval and
+                     time.time() - self.last_yield >= self.interval)):
+                return
+        sleep(0)
+        self.pending = 0
+        self.last_yield = time.time()
+
+
 def cooperative_iter(iter):
     """
-    Return an iterator which schedules after each
-    iteration. This can prevent eventlet thread starvation.
+    Return an iterator which schedules every now and then, see
+    CooperativeYield. This can prevent eventlet thread starvation.
 
     :param iter: an iterator to wrap
     """
+    cooperative_yield = CooperativeYield()
     try:
         for chunk in iter:
-            sleep(0)
+            cooperative_yield.after(len(chunk))
             yield chunk
     except Exception as err:
         with excutils.save_and_reraise_exception():
@@ -112,13 +184,16 @@ def cooperative_iter(iter):
 def cooperative_read(fd):
     """
     Wrap a file descriptor's read with a partial function which schedules
-    after each read. This can prevent eventlet thread starvation.
+    every now and then, see CooperativeYield. This can prevent eventlet
+    thread starvation.
 
     :param fd: a file descriptor to wrap
     """
+    cooperative_yield = CooperativeYield()
+
     def readfn(*args):
         result = fd.read(*args)
-        sleep(0)
+        cooperative_yield.after(len(result))
         return result
     return readfn
 
@@ -131,10 +206,15 @@ class CooperativeReader(object):
     An eventlet thread friendly class for reading in image data.
 
     When accessing data either through the iterator or the read method
-    we perform a sleep to allow a co-operative yield. When there is more than
-    one image being uploaded/downloaded this prevents eventlet thread
-    starvation, ie allows all threads to be scheduled periodically rather than
-    having the same thread be continuously active.
+    we perform a sleep now and then to allow a co-operative yield, see
+    CooperativeYield. When there is more than one image being
+    uploaded/downloaded this prevents eventlet thread starvation, ie allows
+    all threads to be scheduled periodically rather than having the same
+    thread be continuously active.
+
+    Chunks of the underlying iterator are handed out as they are when a read
+    asks for exactly a whole chunk, and are otherwise copied once, into the
+    bytes returned by read() or into the buffer given to readinto().
     """
     def __init__(self, fd):
         """
@@ -147,10 +227,70 @@ class CooperativeReader(object):
         # is more straightforward
         if hasattr(fd, 'read'):
             self.read = cooperative_read(fd)
+            self.cooperative_yield = CooperativeYield()
         else:
-            self.iterator = None
-            self.buffer = b''
+            # Chunks of the iterator not read yet, the first one having
+            # been read up to self.position
+            self.chunks = collections.deque()
+            self.position = 0
+            # The number of bytes left in self.chunks
+            self.buffered = 0
+
+    def _fetch(self):
+        """Appends the next non-empty chunk of the underlying iterator to
+        the buffered chunks, returning False once it is exhausted.
+        """
+        if self.iterator is None:
+            self.iterator = self.__iter__()
+        for chunk in self.iterator:
+            if chunk:
+                self.chunks.append(chunk)
+                self.buffered += len(chunk)
+                return True
+        return False
+
+    def _take(self, length):
+        """Removes the given amount of bytes from the buffered chunks and
+        returns them.
+        """
+        if not length:
+            return b''
+        self.buffered -= length
+        chunk = self.chunks[0]
+        end = self.position + length
+        if end <= len(chunk):
+            if end == len(chunk):
+                self.chunks.popleft()
+                if not self.position:
+                    return chunk
+                data = chunk[self.position:]
+                self.position = 0
+            else:
+                data = chunk[self.position:end]
+                self.position = end
+            return data
+
+        # Spanning several chunks, which are copied once by join()
+        parts = []
+        while length:
+            chunk = self.chunks[0]
+            end = self.position + length
+            if end < len(chunk):
+                parts.append(memoryview(chunk)[self.position:end])
+                self.position = end
+                break
+            if self.position:
+                parts.append(memoryview(chunk)[self.position:])
+            else:
+                parts.append(chunk)
+            length -= len(chunk) - self.position
+            self.chunks.popleft()
             self.position = 0
+        if six.PY2:
+            # str.join() only takes strings under Python 2
+            parts = [part.tobytes() if isinstance(part, memoryview) else part
+                     for part in parts]
+        return b''.join(parts)
 
     def read(self, length=None):
         """Return the requested amount of bytes, fetching the next chunk of
@@ -160,55 +300,59 @@ class CooperativeReader(object):
         fd already supports read().
         """
         if length is None:
-            if len(self.buffer) - self.position > 0:
+            if self.buffered:
                 # if no length specified but some data exists in buffer,
                 # return that data and clear the buffer
-                result = self.buffer[self.position:]
-                self.buffer = b''
+                return self._take(self.buffered)
+            # otherwise read the next chunk from the underlying iterator
+            # and return it as a whole
+            if not self._fetch():
+                return b''
+            return self._take(self.buffered)
+
+        while self.buffered < length:
+            # This check is here to prevent potential OOM issues if
+            # this code is called with unreasonably high values of read
+            # size. Currently it is only called from the HTTP clients
+            # of Glance backend stores, which use httplib for data
+            # streaming, which has readsize hardcoded to 8K, so this
+            # check should never fire. Regardless it still worths to
+            # make the check, as the code may be reused somewhere else.
+            if self.buffered >= MAX_COOP_READER_BUFFER_SIZE:
+                raise exception.LimitExceeded()
+            if not self._fetch():
+                break
+        return self._take(min(length, self.buffered))
+
+    def readinto(self, buf):
+        """Read up to len(buf) bytes into buf, copying them only once, and
+        return the number of bytes read, 0 at the end of the data.
+        """
+        view = memoryview(buf)
+        if hasattr(self.fd, 'read'):
+            if hasattr(self.fd, 'readinto'):
+                size = self.fd.readinto(view)
+                self.cooperative_yield.after(size or 0)
+                return size
+            data = self.read(len(view))
+            view[:len(data)] = data
+            return len(data)
+
+        filled = 0
+        while filled < len(view):
+            if not self.buffered and not self._fetch():
+                break
+            chunk = self.chunks[0]
+            size = min(len(view) - filled, len(chunk) - self.position)
+            view[filled:filled + size] = memoryview(chunk)[
+                self.position:self.position + size]
+            filled += size
+            self.buffered -= size
+            self.position += size
+            if self.position == len(chunk):
+                self.chunks.popleft()
                 self.position = 0
-                return str(result)
-            else:
-                # otherwise read the next chunk from the underlying iterator
-                # and return it as a whole. Reset the buffer, as subsequent
-                # calls may specify the length
-                try:
-                    if self.iterator is None:
-                        self.iterator = self.__iter__()
-                    return next(self.iterator)
-                except StopIteration:
-                    return ''
-                finally:
-                    self.buffer = b''
-                    self.position = 0
-        else:
-            result = bytearray()
-            while len(result) < length:
-                if self.position < len(self.buffer):
-                    to_read = length - len(result)
-                    chunk = self.buffer[self.position:self.position + to_read]
-                    result.extend(chunk)
-
-                    # This check is here to prevent potential OOM issues if
-                    # this code is called with unreasonably high values of read
-                    # size. Currently it is only called from the HTTP clients
-                    # of Glance backend stores, which use httplib for data
-                    # streaming, which has readsize hardcoded to 8K, so this
-                    # check should never fire. Regardless it still worths to
-                    # make the check, as the code may be reused somewhere else.
-                    if len(result) >= MAX_COOP_READER_BUFFER_SIZE:
-                        raise exception.LimitExceeded()
-                    self.position += len(chunk)
-                else:
-                    try:
-                        if self.iterator is None:
-                            self.iterator = self.__iter__()
-                        self.buffer = next(self.iterator)
-                        self.position = 0
-                    except StopIteration:
-                        self.buffer = b''
-                        self.position = 0
-                        return bytes(result)
-            return bytes(result)
+        return filled
 
     def __iter__(self):
         return cooperative_iter(self.fd.__iter__())
@@ -244,6 +388,270 @@ class LimitingReader(object):
         return result
 
 
+def _read_ahead(fd, chunk_size, chunks):
+    try:
+        while True:
+            chunk = fd.read(chunk_size)
+            chunks.put(chunk)
+            if not chunk:
+                return
+    except Exception:
+        chunks.put(sys.exc_info())
+
+
+class PipelinedReader(object):
+    """
+    Reads image data ahead of its consumer in a green thread of its own.
+
+    The green thread reads chunks of the underlying file into a queue of at
+    most depth chunks, which the consumer iterates over, so that reading
+    from a client overlaps with writing to a backend store that waits on
+    the network. When the queue is full the green thread stops reading
+    until the consumer catches up, which holds back the client in turn.
+    Errors reading the file are raised to the consumer.
+    """
+
+    def __init__(self, fd, chunk_size, depth):
+        """
+        :param fd: Underlying image file object
+        :param chunk_size: Size of the chunks read from fd
+        :param depth: Maximum number of chunks read ahead
+        """
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.chunks = queue.LightQueue(depth)
+        self.reader = None
+
+    def __iter__(self):
+        if self.reader is None:
+            # NOTE: The green thread doesn't reference self, which would
+            # keep a suspended green thread in a reference cycle
+            self.reader = greenthread.spawn(_read_ahead, self.fd,
+                                            self.chunk_size, self.chunks)
+        try:
+            while True:
+                chunk = self.chunks.get()
+                if isinstance(chunk, tuple):
+                    six.reraise(*chunk)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops reading ahead, if the consumer gave up."""
+        if self.reader is not None:
+            self.reader.kill()
+
+
+@contextlib.contextmanager
+def upload_pipeline(fd):
+    """
+    Yields the reader a backend store writes an image upload from, which
+    reads fd ahead of the store through a PipelinedReader when
+    image_upload_pipeline_depth is set, and is fd itself otherwise.
+
+    :param fd: Image data object
+    """
+    if not CONF.image_upload_pipeline_depth:
+        yield fd
+        return
+    pipeline = PipelinedReader(fd, CONF.image_upload_pipeline_chunk_size,
+                               CONF.image_upload_pipeline_depth)
+    try:
+        yield CooperativeReader(pipeline)
+    finally:
+        pipeline.close()
+
+
+class ImageStreamListener(object):
+    """
+    Observes the image data passing through an ImageStream. Subclasses
+    override the events they are interested in.
+    """
+
+    def start(self):
+        """Called when the first chunk is asked for."""
+
+    def chunk_callbacks(self):
+        """Returns the callables each chunk is handed to before it is
+        handed to the reader, called once the stream started.
+
+        If one of them raises an exception, the listener is told with
+        error() and stops observing the stream, which goes on if error()
+        returns True and fails otherwise.
+        """
+        return []
+
+    def end(self, bytes_read):
+        """Called once all chunks were read. Raising an exception fails
+        the stream.
+
+        :param bytes_read: Total size of the chunks read
+        """
+
+    def error(self, exc, bytes_read):
+        """Called when reading the stream failed with exc. Returns True to
+        end the stream quietly instead of raising exc to the reader.
+
+        :param bytes_read: Total size of the chunks read until then
+        """
+        return False
+
+    def close(self, bytes_read):
+        """Called when the stream is closed, or garbage collected, after it
+        was started but before it ended or failed.
+
+        :param bytes_read: Total size of the chunks read until then
+        """
+
+
+class ImageStream(object):
+    """
+    An iterator over image data which the layers the data passes through
+    observe by registering an ImageStreamListener, rather than each
+    wrapping the data in a generator of their own.
+
+    A single loop reads the chunks of the underlying iterator, counts them
+    and hands them to the chunk callbacks of the listeners, so a layer
+    costs at most a call per chunk, often to a builtin, instead of the
+    resumption of a generator frame. Listeners are to be registered before
+    the stream is read.
+    """
+
+    def __init__(self, chunks):
+        """
+        :param chunks: Underlying iterable of image data
+        """
+        self.source = chunks
+        self.listeners = []
+        self.iterator = None
+
+    @classmethod
+    def of(cls, chunks):
+        """Returns chunks if it is an ImageStream already, or an
+        ImageStream over it.
+        """
+        if isinstance(chunks, cls):
+            return chunks
+        return cls(chunks)
+
+    def add_listener(self, listener):
+        """Registers a listener, after the ones already registered, and
+        returns the stream.
+        """
+        self.listeners.append(listener)
+        return self
+
+    def __iter__(self):
+        # The loop does not refer to the stream, so that dropping the
+        # stream closes the loop, which tells the listeners
+        if self.iterator is None:
+            self.iterator = _read_stream(self.source, self.listeners)
+        return self.iterator
+
+    def next(self):
+        return next(iter(self))
+
+    __next__ = next
+
+    def close(self):
+        if self.iterator is not None:
+            self.iterator.close()
+
+
+def _read_stream(source, listeners):
+    # The listeners still observing the stream
+    listeners = list(listeners)
+    bytes_read = 0
+    try:
+        for listener in listeners:
+            listener.start()
+        callbacks, owners = _chunk_callbacks(listeners)
+        chunks = iter(source)
+        if not callbacks:
+            # Nothing to do but count the chunks
+            for chunk in chunks:
+                bytes_read += len(chunk)
+                yield chunk
+        for chunk in chunks:
+            for callback in callbacks:
+                try:
+                    callback(chunk)
+                except Exception:
+                    callbacks, owners = _detach_listener(
+                        sys.exc_info(), callbacks.index(callback), chunk,
+                        callbacks, owners, listeners, bytes_read)
+                    break
+            bytes_read += len(chunk)
+            yield chunk
+    except GeneratorExit:
+        for listener in listeners:
+            listener.close(bytes_read)
+        raise
+    except Exception:
+        _fail_stream(sys.exc_info(), listeners, bytes_read)
+        return
+
+    for index, listener in enumerate(listeners):
+        try:
+            listener.end(bytes_read)
+        except Exception:
+            _fail_stream(sys.exc_info(), listeners[index + 1:], bytes_read)
+            return
+
+
+def _chunk_callbacks(listeners):
+    """Returns the chunk callbacks of listeners and the listener of each."""
+    callbacks = []
+    owners = []
+    for listener in listeners:
+        for callback in listener.chunk_callbacks():
+            callbacks.append(callback)
+            owners.append(listener)
+    return callbacks, owners
+
+
+def _detach_listener(exc_info, index, chunk, callbacks, owners, listeners,
+                     bytes_read):
+    """Stops the listener of a chunk callback that failed from observing
+    the stream, hands the chunk to the callbacks after it, and returns the
+    callbacks and their owners left.
+    """
+    while True:
+        failed = owners[index]
+        listeners.remove(failed)
+        if not failed.error(exc_info[1], bytes_read):
+            six.reraise(*exc_info)
+        kept = [(callback, owner) for callback, owner in
+                zip(callbacks, owners) if owner is not failed]
+        index = len([owner for owner in owners[:index]
+                     if owner is not failed])
+        callbacks = [callback for callback, owner in kept]
+        owners = [owner for callback, owner in kept]
+        try:
+            while index < len(callbacks):
+                callbacks[index](chunk)
+                index += 1
+        except Exception:
+            exc_info = sys.exc_info()
+        else:
+            return callbacks, owners
+
+
+def _fail_stream(exc_info, listeners, bytes_read):
+    """Tells listeners about an exception, which is raised again unless
+    one of them suppresses it.
+    """
+    suppressed = False
+    for listener in listeners:
+        if listener.error(exc_info[1], bytes_read):
+            suppressed = True
+    if not suppressed:
+        six.reraise(*exc_info)
+
+
 def image_meta_to_http_headers(image_meta):
     """
     Returns a set of image metadata into a dict
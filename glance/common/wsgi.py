@@ -32,6 +32,7 @@ import eventlet
 from eventlet.green import socket
 from eventlet.green import ssl
 import eventlet.greenio
+from eventlet.hubs import trampoline
 import eventlet.wsgi
 import glance_store
 from oslo_concurrency import processutils
@@ -47,6 +48,12 @@ import webob.dec
 import webob.exc
 from webob import multidict
 
+try:
+    import sendfile
+    SENDFILE_SUPPORTED = True
+except ImportError:
+    SENDFILE_SUPPORTED = False
+
 from glance.common import exception
 from glance.common import utils
 from glance import i18n
@@ -124,6 +131,8 @@ CONF.register_opts(profiler_opts, group="profiler")
 
 ASYNC_EVENTLET_THREAD_POOL_LIST = []
 
+FILE_WRAPPER_CHUNKSIZE = 64 * 1024
+
 
 def get_bind_addr(default_port=None):
     """Return the host and port to bind to."""
@@ -454,6 +463,7 @@ class Server(object):
             eventlet.wsgi.server(self.sock,
                                  self.application,
                                  log=self._logger,
+                                 protocol=HttpProtocol,
                                  custom_pool=self.pool,
                                  debug=False,
                                  keepalive=CONF.http_keepalive,
@@ -472,6 +482,7 @@ class Server(object):
         LOG.info(_LI("Starting single process server"))
         eventlet.wsgi.server(sock, application, custom_pool=self.pool,
                              log=self._logger,
+                             protocol=HttpProtocol,
                              debug=False,
                              keepalive=CONF.http_keepalive,
                              socket_timeout=self.client_socket_timeout)
@@ -549,6 +560,109 @@ class Server(object):
             self.sock.listen(CONF.backlog)
 
 
+class HttpProtocol(eventlet.wsgi.HttpProtocol):
+    """
+    HTTP protocol handler which lets applications send the contents of
+    a file straight from the page cache to the client socket with
+    sendfile(), without copying it through Python.
+
+    The capability is exposed to applications as the callable stored in
+    the 'glance.sendfile' key of the WSGI environment. It is not offered
+    on SSL connections or when pysendfile is not installed.
+    """
+
+    def get_environ(self):
+        environ = eventlet.wsgi.HttpProtocol.get_environ(self)
+        if (SENDFILE_SUPPORTED and
+                not isinstance(self.connection, ssl.SSLSocket)):
+            environ['glance.sendfile'] = self.sendfile
+        return environ
+
+    def sendfile(self, fileobj, offset, count):
+        """
+        Sends `count` bytes of `fileobj`, starting at `offset`, to the
+        client. Anything written by the WSGI server so far, like the
+        response headers, is flushed first.
+
+        :returns: The number of bytes sent, which is less than `count`
+                  only if the file is shorter than expected
+        """
+        self.wfile.flush()
+        out_fd = self.connection.fileno()
+        in_fd = fileobj.fileno()
+        sent = 0
+        while sent < count:
+            try:
+                nbytes = sendfile.sendfile(out_fd, in_fd, offset + sent,
+                                           count - sent)
+            except (OSError, IOError) as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                trampoline(self.connection, write=True,
+                           timeout=self.connection.gettimeout(),
+                           timeout_exc=socket.timeout)
+                continue
+            if nbytes == 0:
+                break
+            sent += nbytes
+        return sent
+
+
+class FileWrapper(object):
+    """
+    Response body iterator over a file, or a part of it, which is sent
+    with sendfile() when the application is served by HttpProtocol and
+    read in chunks otherwise.
+
+    Only the first chunk goes through the WSGI server, which then writes
+    out the response headers along with it. The rest of the file is sent
+    by the iterator itself and counted in `bytes_sent`, so the response
+    must carry a Content-Length header and must not be transformed by
+    any middleware on the way out.
+
+    :param environ: The WSGI environment of the request
+    :param open_file: Callable returning a context manager which yields
+                      the file to send
+    :param offset: Offset in the file to start sending from
+    :param length: Number of bytes to send, defaults to the rest of the
+                   file
+    """
+
+    def __init__(self, environ, open_file, offset=0, length=None,
+                 chunk_size=FILE_WRAPPER_CHUNKSIZE):
+        self.environ = environ
+        self.open_file = open_file
+        self.offset = offset
+        self.length = length
+        self.chunk_size = chunk_size
+        self.bytes_sent = 0
+        if environ.get('glance.sendfile') is not None:
+            # Make the server write the headers and first chunk right away,
+            # before the rest bypasses its buffer. The server reads this
+            # once the application returned, before iterating over us.
+            environ['eventlet.minimum_write_chunk_size'] = 0
+
+    def __iter__(self):
+        with self.open_file() as fileobj:
+            length = self.length
+            if length is None:
+                length = os.fstat(fileobj.fileno()).st_size - self.offset
+            fileobj.seek(self.offset)
+
+            send = self.environ.get('glance.sendfile')
+            remaining = length
+            while remaining > 0:
+                chunk = fileobj.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+                if send is not None and remaining > 0:
+                    self.bytes_sent = send(fileobj, self.offset + length -
+                                           remaining, remaining)
+                    return
+
+
 class Middleware(object):
     """
     Base WSGI middleware wrapper. These classes require an application to be
@@ -17,10 +17,19 @@
 LRU Cache for Image Data
 """
 
+import contextlib
+import errno
+import fcntl
 import hashlib
+import os
+import time
+import uuid
 
+import eventlet
+from eventlet import sleep
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import encodeutils
 from oslo_utils import excutils
 from oslo_utils import importutils
@@ -29,6 +38,10 @@ from oslo_utils import units
 from glance.common import exception
 from glance.common import utils
 from glance.i18n import _, _LE, _LI, _LW
+from glance.image_cache import buffers
+from glance.image_cache import partial
+from glance.image_cache import stats
+from glance.image_cache import write_behind
 
 LOG = logging.getLogger(__name__)
 
@@ -45,11 +58,385 @@ image_cache_opts = [
                       'will remove the incomplete image.')),
     cfg.StrOpt('image_cache_dir',
                help=_('Base directory that the image cache uses.')),
+    cfg.StrOpt('image_cache_eviction_policy', default='lru',
+               choices=('lru', 'lfu', 'gdsf', 'arc'),
+               help=_('The policy the cache pruner uses to choose the images '
+                      'to remove from the image cache: "lru" removes the '
+                      'least recently used images, "lfu" the least '
+                      'frequently used ones, "gdsf" (Greedy Dual Size '
+                      'Frequency) the least frequently used ones relative to '
+                      'their size and "arc" (Adaptive Replacement Cache) '
+                      'balances between recently and frequently used '
+                      'images.')),
+    cfg.StrOpt('image_cache_admission_policy', default='always',
+               choices=('always', 'nth_request', 'tinylfu'),
+               help=_('The policy deciding whether an image downloaded '
+                      'while it is not cached is written into the image '
+                      'cache: "always" caches every image, "nth_request" '
+                      'caches an image once it has been downloaded '
+                      'image_cache_admission_requests times within '
+                      'image_cache_admission_window seconds and "tinylfu" '
+                      'does the same with an approximate count which uses '
+                      'a fixed amount of memory. Images that fit into the '
+                      'cache without exceeding image_cache_max_size are '
+                      'always cached.')),
+    cfg.IntOpt('image_cache_admission_requests', default=2,
+               help=_('The number of downloads of an image after which the '
+                      '"nth_request" and "tinylfu" admission policies cache '
+                      'the image.')),
+    cfg.IntOpt('image_cache_admission_window', default=3600, min=1,
+               help=_('The number of seconds over which the "nth_request" '
+                      'and "tinylfu" admission policies count the downloads '
+                      'of an image.')),
+    cfg.IntOpt('image_cache_admission_min_size', default=0,
+               help=_('Images smaller than this number of bytes are always '
+                      'cached, whatever the admission policy.')),
+    cfg.IntOpt('image_cache_admission_max_size', default=0,
+               help=_('Images larger than this number of bytes are never '
+                      'cached when they are downloaded, whatever the '
+                      'admission policy. They can still be cached by '
+                      'queueing them for prefetching. 0 means there is no '
+                      'limit.')),
+    cfg.IntOpt('image_cache_prefetch_workers', default=4,
+               help=_('The maximum number of images the cache prefetcher '
+                      'fetches from the backend stores at the same time.')),
+    cfg.IntOpt('image_cache_prefetch_max_bandwidth', default=0,
+               help=_('The maximum number of bytes per second the cache '
+                      'prefetcher reads from the backend stores, across all '
+                      'the images it fetches at the same time. 0 means '
+                      'there is no limit.')),
+    cfg.IntOpt('image_cache_warming_images', default=0,
+               help=_('The maximum number of the most requested images '
+                      'that are not cached which the cache warmer fetches '
+                      'into the image cache per run. Requests for images '
+                      'served from the backend stores are only counted when '
+                      'this is set. 0 disables cache warming.')),
+    cfg.IntOpt('image_cache_warming_max_bytes', default=0,
+               help=_('The maximum total size in bytes of the images the '
+                      'cache warmer fetches into the image cache per run. 0 '
+                      'means there is no limit.')),
+    cfg.IntOpt('image_cache_warming_workers', default=2,
+               help=_('The number of images the cache warmer fetches into '
+                      'the image cache at the same time.')),
+    cfg.StrOpt('image_cache_warming_window',
+               help=_('The off-peak hours, in local time, during which the '
+                      'cache warmer fetches images into the image cache, '
+                      'for instance "01:00-05:30". The cache warmer does '
+                      'nothing when run outside of them. By default it may '
+                      'run at any time.')),
+    cfg.BoolOpt('image_cache_single_flight', default=False,
+                help=_('When enabled, requests for an image that is being '
+                       'written into the cache by another request are '
+                       'served from the partially written cache file as it '
+                       'grows, instead of each request reading the image '
+                       'from the backend store.')),
+    cfg.IntOpt('image_cache_single_flight_timeout', default=30,
+               help=_('The number of seconds a request following an image '
+                      'that is being written into the cache waits for new '
+                      'data before giving up.')),
+    cfg.BoolOpt('image_cache_write_behind', default=False,
+                help=_('When enabled, images downloaded through the API are '
+                       'written into the image cache by native threads in '
+                       'the background, so that a busy cache disk does not '
+                       'slow the downloads down. Caching an image is given '
+                       'up when writing it falls behind by more than '
+                       'image_cache_write_behind_buffer bytes.')),
+    cfg.IntOpt('image_cache_write_behind_buffer', default=16 * units.Mi,
+               help=_('The maximum number of bytes of an image downloaded '
+                      'through the API that may be waiting to be written '
+                      'into the image cache when image_cache_write_behind '
+                      'is enabled.')),
+    cfg.BoolOpt('image_cache_partial', default=False,
+                help=_('When enabled, the blocks of an image that is not '
+                       'cached which a partial download through the v2 API '
+                       'reads completely are kept in a sparse file, and '
+                       'partial downloads of those blocks are served from '
+                       'it. Once all its blocks were read, the image is '
+                       'verified and cached as a whole.')),
+    cfg.IntOpt('image_cache_partial_block_size', default=4 * units.Mi,
+               help=_('The size in bytes of the blocks in which partially '
+                      'cached images are kept when image_cache_partial is '
+                      'enabled.')),
+    cfg.IntOpt('image_cache_metadata_ttl', default=0,
+               help=_('The number of seconds for which a snapshot of the '
+                      'metadata of a cached image, taken when the image is '
+                      'served from the cache through the v2 API, is used to '
+                      'serve further requests for the image from the cache '
+                      'without looking the image up in the database. The '
+                      'snapshot is dropped when the image is changed '
+                      'through this API node, but changes made through other '
+                      'nodes are only noticed once it expires. 0 disables '
+                      'metadata snapshots.')),
+    cfg.BoolOpt('image_cache_sendfile', default=False,
+                help=_('When enabled, image files served from the cache are '
+                       'sent to the client with sendfile() instead of being '
+                       'read into the API process. This requires the '
+                       'pysendfile library and only applies to connections '
+                       'that do not use SSL.')),
+    cfg.IntOpt('image_cache_verify_max_bytes', default=10 * units.Gi,
+               help=_('The maximum number of bytes of cached image files '
+                      'the cache verifier reads per run. Images that were '
+                      'never verified come first, then those verified the '
+                      'longest time ago. At least one image is verified per '
+                      'run. 0 means there is no limit.')),
+    cfg.IntOpt('image_cache_verify_max_bandwidth', default=10 * units.Mi,
+               help=_('The maximum number of bytes per second the cache '
+                      'verifier reads cached image files at. 0 means there '
+                      'is no limit.')),
+    cfg.IntOpt('image_cache_prune_high_watermark', default=0, min=0,
+               max=100,
+               help=_('The percentage of image_cache_max_size above which '
+                      'an API server prunes the image cache in the '
+                      'background as soon as an image written into the '
+                      'cache takes it there, rather than waiting for '
+                      'glance-cache-pruner to run. Only one process using '
+                      'the cache prunes it at a time. 0 disables pruning '
+                      'in the background.')),
+    cfg.IntOpt('image_cache_prune_low_watermark', default=80, min=0,
+               max=100,
+               help=_('The percentage of image_cache_max_size the image '
+                      'cache is pruned down to once it went above '
+                      'image_cache_prune_high_watermark.')),
+    cfg.IntOpt('image_cache_buffer_size', default=units.Mi,
+               help=_('The size in bytes of the buffers image files are '
+                      'read into when they are written into the image '
+                      'cache.')),
+    cfg.IntOpt('image_cache_buffer_memory', default=64 * units.Mi,
+               help=_('The maximum number of bytes of buffers a process '
+                      'uses to write image files and prefetched images into '
+                      'the image cache, across all the images it writes at '
+                      'the same time. Writing more images at once waits for '
+                      'buffers to be released. At least one buffer is '
+                      'always used.')),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(image_cache_opts)
 
+FOLLOW_CHUNKSIZE = 64 * units.Ki
+FOLLOW_POLL_INTERVAL = 0.1
+
+
+class CacheTee(utils.ImageStreamListener):
+    """
+    Writes the image data read through an ImageStream into the cache, and
+    commits the image file once the stream ended with data matching the
+    expected checksum.
+
+    Failing to write the image into the cache does not fail the stream,
+    which goes on without being cached, except for data that does not
+    match the checksum or a GlanceException raised by the stream.
+    """
+
+    def __init__(self, cache, image_id, image_checksum, resume_offset=None):
+        """
+        :param cache: ImageCache the image is written into
+        :param image_id: Image ID
+        :param image_checksum: checksum expected to be generated while
+                               iterating over image data
+        :param resume_offset: See ImageCache.cache_tee_iter()
+        """
+        self.cache = cache
+        self.image_id = image_id
+        self.image_checksum = image_checksum
+        self.resume_offset = resume_offset
+        self.checksum = hashlib.md5()
+        self.started = None
+        self.writer = None
+        self.cache_file = None
+        self.done = False
+
+    def start(self):
+        try:
+            self.started = time.time()
+            if self.resume_offset is None:
+                writer = self.cache.driver.open_for_write(self.image_id)
+            else:
+                self.cache._checksum_incomplete(self.image_id,
+                                                self.resume_offset,
+                                                self.checksum)
+                writer = self.cache.driver.open_for_write(self.image_id,
+                                                          resume=True)
+            self.cache_file = writer.__enter__()
+            self.writer = writer
+            if self.resume_offset is not None:
+                self.cache_file.truncate(self.resume_offset)
+            # The incomplete cache file now exists, so requests waiting
+            # on our claim can follow it from here on
+            self.cache.release_fill(self.image_id)
+        except Exception as e:
+            self._give_up(e)
+
+    def chunk_callbacks(self):
+        if self.done:
+            return []
+        return [self.checksum.update, self.cache_file.write]
+
+    def end(self, bytes_read):
+        if self.done:
+            return
+        try:
+            self.cache_file.flush()
+        except Exception as e:
+            self._give_up(e)
+            return
+
+        if (self.image_checksum and
+                self.image_checksum != self.checksum.hexdigest()):
+            self.cache.stats.incr('checksum_rejections')
+            msg = _("Checksum verification failed. Aborted "
+                    "caching of image '%s'.") % self.image_id
+            LOG.error(msg)
+            error = exception.GlanceException(msg)
+            self._exit(error)
+            raise error
+
+        self.done = True
+        writer, self.writer = self.writer, None
+        try:
+            writer.__exit__(None, None, None)
+            self.cache.stats.record_fill(time.time() - self.started,
+                                         bytes_read)
+            self.cache.driver.set_image_checksum(self.image_id,
+                                                 self.checksum.hexdigest())
+            self.cache.maybe_prune()
+        except Exception as e:
+            self._give_up(e)
+
+    def error(self, exc, bytes_read):
+        if self.done:
+            return False
+        if isinstance(exc, exception.GlanceException):
+            # The stream has given us bad, (size_checked_iter has found a
+            # bad length), or corrupt data (checksum is wrong).
+            LOG.error(encodeutils.exception_to_unicode(exc))
+            self._exit(exc)
+            return False
+        self._give_up(exc)
+        # If no checksum provided continue responding even if
+        # caching failed.
+        return True
+
+    def close(self, bytes_read):
+        if not self.done:
+            self._exit(GeneratorExit())
+
+    def _exit(self, exc):
+        """Rolls the incomplete image file back, unless resuming."""
+        self.done = True
+        if self.writer is None:
+            return
+        writer, self.writer = self.writer, None
+        try:
+            writer.__exit__(type(exc), exc, None)
+        except Exception as e:
+            if e is not exc:
+                LOG.warn(_LW("Failed to roll back caching of image "
+                             "'%(image_id)s': %(error)s"),
+                         {'image_id': self.image_id,
+                          'error': encodeutils.exception_to_unicode(e)})
+
+    def _give_up(self, exc):
+        self._exit(exc)
+        self.cache.release_fill(self.image_id)
+        self.cache.stats.incr('tee_failures')
+        LOG.error(_LE("Exception encountered while tee'ing "
+                      "image '%(image_id)s' into cache: %(error)s. "
+                      "Continuing with response.") %
+                  {'image_id': self.image_id,
+                   'error': encodeutils.exception_to_unicode(exc)})
+
+
+class RelayTee(utils.ImageStreamListener):
+    """
+    Writes the image data read through an ImageStream into a relay file,
+    which the requests of this process waiting on the fill claim of the
+    reading request follow, for an image the admission policy rejected.
+
+    The reading request keeps its fill claim until the stream is over, and
+    the relay file is then removed, so the image is read from the backend
+    store once for all of them without being written into the cache.
+    Failing to write the relay file does not fail the stream.
+    """
+
+    def __init__(self, cache, image_id):
+        """
+        :param cache: ImageCache of the requests following the relay file
+        :param image_id: Image ID
+        """
+        self.cache = cache
+        self.image_id = image_id
+        self.path = os.path.join(cache.driver.relay_dir,
+                                 '%s.%s' % (image_id, uuid.uuid4().hex))
+        self.relay_file = None
+        self.completed = False
+        self.done = False
+
+    def start(self):
+        try:
+            self.relay_file = open(self.path, 'wb')
+        except (IOError, OSError) as e:
+            self._give_up(e)
+            return
+        self.cache._relays[self.image_id] = self
+
+    def chunk_callbacks(self):
+        if self.done:
+            return []
+        return [self._write]
+
+    def _write(self, chunk):
+        if self.done:
+            return
+        try:
+            self.relay_file.write(chunk)
+        except (IOError, OSError) as e:
+            self._give_up(e)
+
+    def end(self, bytes_read):
+        if self.done:
+            return
+        try:
+            self.relay_file.flush()
+        except (IOError, OSError) as e:
+            self._give_up(e)
+            return
+        self.completed = True
+        self._finish()
+
+    def error(self, exc, bytes_read):
+        if not self.done:
+            self._finish()
+        return False
+
+    def close(self, bytes_read):
+        if not self.done:
+            self._finish()
+
+    def _give_up(self, exc):
+        LOG.warn(_LW("Failed to relay image '%(image_id)s' to the requests "
+                     "waiting for it: %(error)s"),
+                 {'image_id': self.image_id,
+                  'error': encodeutils.exception_to_unicode(exc)})
+        self._finish()
+
+    def _finish(self):
+        """
+        Removes the relay file and releases the fill claim. The requests
+        following the relay file have it open, and read the rest of it if
+        the stream completed.
+        """
+        self.done = True
+        if self.relay_file is not None:
+            try:
+                self.relay_file.close()
+                os.unlink(self.path)
+            except (IOError, OSError):
+                pass
+        if self.cache._relays.get(self.image_id) is self:
+            del self.cache._relays[self.image_id]
+        self.cache.release_fill(self.image_id)
+
 
 class ImageCache(object):
 
@@ -57,6 +444,16 @@ class ImageCache(object):
 
     def __init__(self):
         self.init_driver()
+        self.init_policy()
+        self.init_admission()
+        # Image IDs mapped to the time a request of this process claimed
+        # the job of writing them into the cache, see claim_fill()
+        self._pending_fills = {}
+        # Image IDs mapped to the RelayTee of the rejected images a request
+        # of this process relays to the others, see get_caching_iter()
+        self._relays = {}
+        # Whether this instance is pruning the cache in the background
+        self._pruning = False
 
     def init_driver(self):
         """
@@ -79,10 +476,30 @@ class ImageCache(object):
             self.driver_class = importutils.import_class(driver_module)
         self.configure_driver()
 
+    def init_policy(self):
+        """
+        Create the eviction policy for the cache
+        """
+        policy_name = CONF.image_cache_eviction_policy
+        policy_class = importutils.import_class(
+            __name__ + '.policies.' + policy_name + '.Policy')
+        self.policy = policy_class()
+
+    def init_admission(self):
+        """
+        Create the admission policy for the cache
+        """
+        policy_name = CONF.image_cache_admission_policy
+        policy_class = importutils.import_class(
+            __name__ + '.admission.' + policy_name + '.Policy')
+        self.admission = policy_class()
+
     def configure_driver(self):
         """
         Configure the driver for the cache and, if it fails to configure,
-        fall back to using the SQLite driver which has no odd dependencies
+        fall back to using the SQLite driver which has no odd dependencies.
+        The statistics of the cache are kept under the directory of the
+        driver.
         """
         try:
             self.driver = self.driver_class()
@@ -99,6 +516,7 @@ class ImageCache(object):
             self.driver_class = importutils.import_class(default_module)
             self.driver = self.driver_class()
             self.driver.configure()
+        self.stats = stats.CacheStats(self.driver.stats_dir)
 
     def is_cached(self, image_id):
         """
@@ -109,6 +527,15 @@ class ImageCache(object):
         """
         return self.driver.is_cached(image_id)
 
+    def is_being_cached(self, image_id):
+        """
+        Returns True if the image with supplied id is currently
+        in the process of having its image file cached.
+
+        :param image_id: Image ID
+        """
+        return self.driver.is_being_cached(image_id)
+
     def is_queued(self, image_id):
         """
         Returns True if the image identifier is in our cache queue.
@@ -142,7 +569,13 @@ class ImageCache(object):
         Removes all cached image files and any attributes about the images
         and returns the number of cached image files that were deleted.
         """
-        return self.driver.delete_all_cached_images()
+        deleted = self.driver.delete_all_cached_images()
+        self.stats.incr('evictions_deleted', deleted)
+        for name in os.listdir(self.driver.metadata_dir):
+            self.delete_metadata_snapshot(name)
+        for name in os.listdir(self.driver.partial_dir):
+            self.delete_partial_image(name)
+        return deleted
 
     def delete_cached_image(self, image_id):
         """
@@ -150,7 +583,264 @@ class ImageCache(object):
 
         :param image_id: Image ID
         """
+        if self.driver.is_cached(image_id):
+            self.stats.incr('evictions_deleted')
+        self.driver.delete_cached_image(image_id)
+        self.delete_metadata_snapshot(image_id)
+        self.delete_partial_image(image_id)
+
+    def delete_cached_images(self, image_ids):
+        """
+        Removes the cached image files of the images with the supplied IDs
+        and any attributes about them, and returns the number of cached
+        image files that were deleted.
+
+        :param image_ids: Image IDs
+        """
+        cached = [image_id for image_id in image_ids
+                  if self.driver.is_cached(image_id)]
+        self.stats.incr('evictions_deleted', len(cached))
+        self.driver.delete_cached_images(cached)
+        for image_id in image_ids:
+            self.delete_metadata_snapshot(image_id)
+            self.delete_partial_image(image_id)
+        return len(cached)
+
+    def delete_corrupt_image(self, image_id):
+        """
+        Removes the image file of a cached image that no longer matches its
+        checksum and any attributes about the image
+
+        :param image_id: Image ID
+        """
+        self.stats.incr('evictions_corrupt')
         self.driver.delete_cached_image(image_id)
+        self.delete_metadata_snapshot(image_id)
+        self.delete_partial_image(image_id)
+
+    def get_metadata_snapshot(self, image_id):
+        """
+        Returns the snapshot of the metadata of an image stored with
+        set_metadata_snapshot(), or None if there is none or it is older
+        than image_cache_metadata_ttl seconds.
+
+        :param image_id: Image ID
+        """
+        path = self.driver.get_image_filepath(image_id, 'metadata')
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if age >= CONF.image_cache_metadata_ttl:
+                return None
+            with open(path) as snapshot_file:
+                return jsonutils.load(snapshot_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set_metadata_snapshot(self, image_id, snapshot):
+        """
+        Stores a snapshot of the metadata of an image next to the image.
+
+        :param image_id: Image ID
+        :param snapshot: JSON serializable snapshot of the metadata
+        """
+        path = self.driver.get_image_filepath(image_id, 'metadata')
+        # Readers must never see a partially written snapshot
+        tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'w') as snapshot_file:
+                jsonutils.dump(snapshot, snapshot_file)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            LOG.warn(_LW("Failed to store metadata snapshot of image "
+                         "'%(image_id)s': %(error)s"),
+                     {'image_id': image_id,
+                      'error': encodeutils.exception_to_unicode(e)})
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def delete_metadata_snapshot(self, image_id):
+        """
+        Drops the snapshot of the metadata of an image, if there is one.
+
+        :param image_id: Image ID
+        """
+        path = self.driver.get_image_filepath(image_id, 'metadata')
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def get_partial_image(self, image_id):
+        """
+        Returns the PartialImage holding the blocks of an image cached
+        so far, or None if no blocks of the image are cached.
+
+        :param image_id: Image ID
+        """
+        return partial.PartialImage.open(
+            self.driver.get_image_filepath(image_id, 'partial'))
+
+    def has_partial_ranges(self, image_id, ranges):
+        """
+        Returns True if the byte ranges of an image are all held by its
+        partially cached image file.
+
+        :param image_id: Image ID
+        :param ranges: List of (start, stop) tuples, stop being exclusive
+        """
+        partial_image = self.get_partial_image(image_id)
+        return partial_image is not None and all(
+            partial_image.has_range(start, stop) for start, stop in ranges)
+
+    @contextlib.contextmanager
+    def open_partial_for_read(self, image_id):
+        """
+        Opens the partially cached image file of an image for reading, the
+        blocks of the image being at their offsets in the image.
+
+        :param image_id: Image ID
+        """
+        path = self.driver.get_image_filepath(image_id, 'partial')
+        with open(path, 'rb') as partial_file:
+            yield partial_file
+
+    def get_partial_caching_iter(self, image_id, image_checksum, image_iter,
+                                 start, image_size):
+        """
+        Returns an iterator that writes the blocks of an image it reads
+        completely into the partially cached image file of the image while
+        part of the image contents, starting at offset start, are read
+        through the supplied iterator. The image is cached as a whole once
+        all its blocks were written.
+
+        :param image_id: Image ID
+        :param image_checksum: checksum of the whole image
+        :param image_iter: Iterator that will read image contents
+        :param start: Offset in the image of the data read by image_iter
+        :param image_size: Size of the image in bytes
+        """
+        if not image_size or not self.driver.is_cacheable(image_id):
+            return image_iter
+        path = self.driver.get_image_filepath(image_id, 'partial')
+        try:
+            partial_image = partial.PartialImage.create(
+                path, image_size, CONF.image_cache_partial_block_size)
+        except (IOError, OSError) as e:
+            LOG.warn(_LW("Failed to create partially cached image file of "
+                         "image '%(image_id)s': %(error)s"),
+                     {'image_id': image_id,
+                      'error': encodeutils.exception_to_unicode(e)})
+            return image_iter
+        if partial_image is None:
+            return image_iter
+        return self._partial_caching_iter(image_id, image_checksum,
+                                          partial_image, image_iter, start)
+
+    def _partial_caching_iter(self, image_id, image_checksum, partial_image,
+                              image_iter, start):
+        for chunk in partial_image.write_iter(image_iter, start):
+            yield chunk
+        if partial_image.is_complete():
+            # Reading the whole image back must not hold up the response
+            eventlet.spawn_n(self._promote_in_background, image_id,
+                             image_checksum)
+
+    def _promote_in_background(self, image_id, image_checksum):
+        try:
+            self.promote_partial_image(image_id, image_checksum)
+        except Exception as e:
+            LOG.error(_LE("Failed to cache partially cached image "
+                          "'%(image_id)s' as a whole: %(error)s"),
+                      {'image_id': image_id,
+                       'error': encodeutils.exception_to_unicode(e)})
+
+    def promote_partial_image(self, image_id, image_checksum):
+        """
+        Caches an image whose blocks are all held by its partially cached
+        image file as a whole, verifying its checksum, and removes the
+        partially cached image file. Returns True if the image was cached.
+
+        :param image_id: Image ID
+        :param image_checksum: checksum of the image
+        """
+        partial_image = self.get_partial_image(image_id)
+        if partial_image is None or not self.driver.is_cacheable(image_id):
+            return False
+        if not self.claim_fill(image_id):
+            # A download of the image caches it already
+            return False
+        LOG.debug("Caching partially cached image '%s' as a whole",
+                  image_id)
+        image_iter = partial_image.read_buffered(buffers.get_pool())
+        try:
+            for chunk in self.cache_tee_iter(image_id, image_iter,
+                                             image_checksum):
+                pass
+        except exception.GlanceException:
+            # The blocks can't be trusted any more
+            LOG.warn(_LW("Discarding partially cached image '%s'"),
+                     image_id)
+        finally:
+            self.release_fill(image_id)
+            self.delete_partial_image(image_id)
+        return self.driver.is_cached(image_id)
+
+    def delete_partial_image(self, image_id):
+        """
+        Removes the partially cached image file of an image, if there is
+        one.
+
+        :param image_id: Image ID
+        """
+        path = self.driver.get_image_filepath(image_id, 'partial')
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def delete_stale_partial_images(self, stall_time=None):
+        """
+        Removes the partially cached image files of cached images, and those
+        which were not written to for stall_time seconds.
+
+        :param stall_time: Seconds, image_cache_stall_time by default
+        """
+        if stall_time is None:
+            stall_time = CONF.image_cache_stall_time
+        older_than = time.time() - stall_time
+        partial_dir = self.driver.partial_dir
+        for name in os.listdir(partial_dir):
+            path = os.path.join(partial_dir, name)
+            try:
+                if (os.path.getmtime(path) < older_than or
+                        self.driver.is_cached(name)):
+                    os.unlink(path)
+            except OSError:
+                # Removed by another process in the meantime
+                pass
+
+    def delete_stale_relay_files(self, stall_time=None):
+        """
+        Removes the relay files which were not written to for stall_time
+        seconds, left behind by processes that stopped while relaying an
+        image.
+
+        :param stall_time: Seconds, image_cache_stall_time by default
+        """
+        if stall_time is None:
+            stall_time = CONF.image_cache_stall_time
+        older_than = time.time() - stall_time
+        relay_dir = self.driver.relay_dir
+        for name in os.listdir(relay_dir):
+            path = os.path.join(relay_dir, name)
+            try:
+                if os.path.getmtime(path) < older_than:
+                    os.unlink(path)
+            except OSError:
+                # Removed by another process in the meantime
+                pass
 
     def delete_all_queued_images(self):
         """
@@ -167,13 +857,79 @@ class ImageCache(object):
         """
         self.driver.delete_queued_image(image_id)
 
-    def prune(self):
+    @contextlib.contextmanager
+    def _prune_lock(self, blocking=True):
+        """
+        Serializes pruning between the processes using the cache
+        directory. Yields True once the lock is held, or False right away
+        if blocking is False and another process holds the lock.
+        """
+        path = os.path.join(self.driver.locks_dir, 'prune')
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            flags = fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(fd, flags)
+                locked = True
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                locked = False
+            yield locked
+        finally:
+            os.close(fd)
+
+    def prune(self, max_size=None):
         """
         Removes all cached image files above the cache's maximum
         size. Returns a tuple containing the total number of cached
         files removed and the total size of all pruned image files.
+
+        :param max_size: Size to bring the cache down to, by default
+                         image_cache_max_size
+        """
+        with self._prune_lock():
+            return self._prune(max_size)
+
+    def maybe_prune(self):
+        """
+        Starts pruning the cache down to image_cache_prune_low_watermark
+        in the background if it is above image_cache_prune_high_watermark,
+        unless this or another process is pruning it already.
         """
+        high_watermark = CONF.image_cache_prune_high_watermark
+        if not high_watermark or self._pruning:
+            return
         max_size = CONF.image_cache_max_size
+        if self.driver.get_cache_size() <= max_size * high_watermark / 100:
+            return
+        self._pruning = True
+        eventlet.spawn_n(self._prune_in_background)
+
+    def _prune_in_background(self):
+        try:
+            with self._prune_lock(blocking=False) as locked:
+                if not locked:
+                    LOG.debug("Another process is pruning the image cache.")
+                    return
+                low_watermark = min(CONF.image_cache_prune_low_watermark,
+                                    CONF.image_cache_prune_high_watermark)
+                max_size = CONF.image_cache_max_size * low_watermark // 100
+                files, size = self._prune(max_size)
+                LOG.info(_LI("Pruned %(files)d images, %(size)d bytes, "
+                             "from the image cache."),
+                         {'files': files, 'size': size})
+        except Exception as e:
+            LOG.error(_LE("Failed to prune the image cache: %s"),
+                      encodeutils.exception_to_unicode(e))
+        finally:
+            self._pruning = False
+
+    def _prune(self, max_size=None):
+        if max_size is None:
+            max_size = CONF.image_cache_max_size
         current_size = self.driver.get_cache_size()
         if max_size > current_size:
             LOG.debug("Image cache has free space, skipping prune...")
@@ -186,16 +942,21 @@ class ImageCache(object):
 
         total_bytes_pruned = 0
         total_files_pruned = 0
-        entry = self.driver.get_least_recently_accessed()
-        while entry and current_size > max_size:
-            image_id, size = entry
+        self._load_policy_state()
+        victims = self.policy.select_victims(self.driver.get_cached_images(),
+                                             max_size, overage)
+        self._save_policy_state()
+        for entry in victims:
+            image_id, size = entry['image_id'], entry['size']
             LOG.debug("Pruning '%(image_id)s' to free %(size)d bytes",
                       {'image_id': image_id, 'size': size})
             self.driver.delete_cached_image(image_id)
+            self.delete_metadata_snapshot(image_id)
             total_bytes_pruned = total_bytes_pruned + size
             total_files_pruned = total_files_pruned + 1
-            current_size = current_size - size
-            entry = self.driver.get_least_recently_accessed()
+        self.stats.incr('evictions_pruned', total_files_pruned)
+        # The pruner may exit right away
+        self.stats.flush()
 
         LOG.debug("Pruning finished pruning. "
                   "Pruned %(total_files_pruned)d and "
@@ -204,14 +965,84 @@ class ImageCache(object):
                    'total_bytes_pruned': total_bytes_pruned})
         return total_files_pruned, total_bytes_pruned
 
+    def _policy_state_path(self):
+        return os.path.join(self.driver.policy_dir,
+                            CONF.image_cache_eviction_policy + '.json')
+
+    def _load_policy_state(self):
+        """
+        Restores what the eviction policy remembered as of the last prune,
+        by whichever process, which holds the prune lock.
+        """
+        try:
+            with open(self._policy_state_path()) as state_file:
+                state = jsonutils.load(state_file)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        except ValueError:
+            LOG.warn(_LW("Ignoring the corrupt state of the image cache "
+                         "eviction policy."))
+            return
+        self.policy.set_state(state)
+
+    def _save_policy_state(self):
+        state = self.policy.get_state()
+        if state is None:
+            return
+        path = self._policy_state_path()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as state_file:
+            jsonutils.dump(state, state_file)
+        os.rename(tmp_path, path)
+
     def clean(self, stall_time=None):
         """
         Cleans up any invalid or incomplete cached images. The cache driver
-        decides what that means...
+        decides what that means... Expired metadata snapshots and stale
+        partially cached images are removed as well, and the statistics of
+        the processes that are gone are merged.
         """
         self.driver.clean(stall_time)
+        self.delete_expired_metadata_snapshots()
+        self.delete_stale_partial_images(stall_time)
+        self.delete_stale_relay_files(stall_time)
+        self.stats.compact()
+
+    def get_stats(self):
+        """
+        Returns the statistics of the cache as returned by
+        `stats.CacheStats.get_stats`, with the size of the cache in bytes
+        in 'size', its maximum size in 'max_size', and the share of the
+        downloads served from the cache in 'hit_ratio'.
+        """
+        cache_stats = self.stats.get_stats()
+        counters = cache_stats['counters']
+        hits = counters['hits'] + counters['partial_hits']
+        requests = hits + counters['peer_hits'] + counters['misses']
+        cache_stats['hit_ratio'] = float(hits) / requests if requests else 0.0
+        cache_stats['size'] = self.driver.get_cache_size()
+        cache_stats['max_size'] = CONF.image_cache_max_size
+        return cache_stats
 
-    def queue_image(self, image_id):
+    def delete_expired_metadata_snapshots(self):
+        """
+        Removes the metadata snapshots older than image_cache_metadata_ttl
+        seconds, and those left behind by an interrupted write.
+        """
+        older_than = time.time() - CONF.image_cache_metadata_ttl
+        metadata_dir = self.driver.metadata_dir
+        for name in os.listdir(metadata_dir):
+            path = os.path.join(metadata_dir, name)
+            try:
+                if os.path.getmtime(path) <= older_than:
+                    os.unlink(path)
+            except OSError:
+                # Removed or replaced by another process in the meantime
+                pass
+
+    def queue_image(self, image_id, priority=0):
         """
         This adds a image to be cache to the queue.
 
@@ -219,62 +1050,392 @@ class ImageCache(object):
         cached, we return False, True otherwise
 
         :param image_id: Image ID
+        :param priority: Images with a higher priority are prefetched first
+        """
+        return self.driver.queue_image(image_id, priority)
+
+    def queue_images(self, image_ids, priority=0):
+        """
+        Adds the images to the queue of images to cache and returns the
+        number of images that were queued, leaving out those that are
+        already queued or cached.
+
+        :param image_ids: Image IDs
+        :param priority: Images with a higher priority are prefetched first
+        """
+        return self.driver.queue_images(image_ids, priority)
+
+    def get_queue_priority(self, image_id):
+        """
+        Returns the priority the image with the supplied ID was queued
+        with.
+
+        :param image_id: Image ID
+        """
+        return self.driver.get_queue_priority(image_id)
+
+    def record_miss(self, image_id):
+        """
+        Counts a download of an image that was served from the backend
+        store rather than from the cache, for the cache warmer.
+
+        :param image_id: Image ID
+        """
+        path = os.path.join(self.driver.misses_dir, str(image_id))
+        try:
+            # Appending a byte is atomic, so concurrent workers never lose
+            # each other's counts
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, b'.')
+            finally:
+                os.close(fd)
+        except OSError as e:
+            LOG.warn(_LW("Failed to count a cache miss of image "
+                         "'%(image_id)s': %(error)s"),
+                     {'image_id': image_id,
+                      'error': encodeutils.exception_to_unicode(e)})
+
+    def get_miss_counts(self):
+        """
+        Returns a dict of the number of downloads of each image counted by
+        record_miss(), by image ID.
+        """
+        counts = {}
+        for name in os.listdir(self.driver.misses_dir):
+            try:
+                counts[name] = os.path.getsize(
+                    os.path.join(self.driver.misses_dir, name))
+            except OSError:
+                # Forgotten by another process in the meantime
+                pass
+        return counts
+
+    def forget_misses(self, image_id):
+        """
+        Drops the count of downloads of an image kept by record_miss().
+
+        :param image_id: Image ID
+        """
+        try:
+            os.unlink(os.path.join(self.driver.misses_dir, str(image_id)))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def decay_miss_counts(self):
+        """
+        Halves the counts of downloads kept by record_miss(), so that
+        images which are no longer requested are eventually forgotten.
         """
-        return self.driver.queue_image(image_id)
+        for image_id, count in self.get_miss_counts().items():
+            if count < 2:
+                self.forget_misses(image_id)
+                continue
+            path = os.path.join(self.driver.misses_dir, image_id)
+            try:
+                with open(path, 'r+b') as misses_file:
+                    misses_file.truncate(count // 2)
+            except IOError:
+                pass
 
-    def get_caching_iter(self, image_id, image_checksum, image_iter):
+    def get_resume_offset(self, image_id):
+        """
+        Returns the size of the incomplete image file an interrupted
+        attempt to cache the image left behind, which caching the image
+        can resume from, or 0 if there is no such file. Returns None if
+        the incomplete image file is still being written to by a live
+        request or process, which holds a lock on it.
+
+        :param image_id: Image ID
+        """
+        path = self.driver.get_image_filepath(image_id, 'incomplete')
+        try:
+            incomplete_file = open(path, 'rb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return 0
+            raise
+        with incomplete_file:
+            try:
+                fcntl.flock(incomplete_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                return None
+            return os.fstat(incomplete_file.fileno()).st_size
+
+    def get_caching_iter(self, image_id, image_checksum, image_iter,
+                         image_size=None, relay=False):
         """
         Returns an iterator that caches the contents of an image
         while the image contents are read through the supplied
-        iterator.
+        iterator, if the admission policy of the cache admits the image.
 
         :param image_id: Image ID
         :param image_checksum: checksum expected to be generated while
                                iterating over image data
         :param image_iter: Iterator that will read image contents
+        :param image_size: Size of the image in bytes, if known
+        :param relay: Whether the calling request holds the fill claim on
+                      the image. If the admission policy rejects the image,
+                      the claim is then kept until the image contents have
+                      been read, and the requests waiting on it follow them
+                      through a relay file instead of all going to the
+                      backend store at once.
         """
         if not self.driver.is_cacheable(image_id):
+            self.release_fill(image_id)
+            return image_iter
+
+        if not self.admit(image_id, image_size):
+            if relay:
+                stream = utils.ImageStream.of(image_iter)
+                return stream.add_listener(RelayTee(self, image_id))
+            self.release_fill(image_id)
             return image_iter
 
         LOG.debug("Tee'ing image '%s' into cache", image_id)
 
+        if CONF.image_cache_write_behind:
+            return self.cache_write_behind_iter(image_id, image_iter,
+                                                image_checksum)
         return self.cache_tee_iter(image_id, image_iter, image_checksum)
 
-    def cache_tee_iter(self, image_id, image_iter, image_checksum):
+    def admit(self, image_id, image_size=None):
+        """
+        Returns True if an image downloaded while it is not cached should be
+        written into the cache, False otherwise.
+
+        Images outside of the configured size thresholds are decided upon
+        by their size alone. Other images are submitted to the admission
+        policy, and those it rejects are still cached while the cache has
+        room for them.
+
+        :param image_id: Image ID
+        :param image_size: Size of the image in bytes, if known
+        """
+        if image_size is not None:
+            max_size = CONF.image_cache_admission_max_size
+            if max_size and image_size > max_size:
+                LOG.debug("Not caching image '%(image_id)s' of %(size)d "
+                          "bytes, it is larger than %(max_size)d bytes",
+                          {'image_id': image_id, 'size': image_size,
+                           'max_size': max_size})
+                return False
+            if image_size < CONF.image_cache_admission_min_size:
+                return True
+
+        if self.admission.admit(image_id):
+            return True
+
+        if (image_size is not None and
+                self.driver.get_cache_size() + image_size <=
+                CONF.image_cache_max_size):
+            return True
+
+        LOG.debug("Not caching image '%s', the admission policy rejected it",
+                  image_id)
+        return False
+
+    def cache_tee_iter(self, image_id, image_iter, image_checksum,
+                       resume_offset=None):
+        """
+        Returns an ImageStream that writes the contents of an image into the
+        cache while the image contents are read through the supplied
+        iterator.
+
+        :param image_id: Image ID
+        :param image_iter: Iterator that will read image contents
+        :param image_checksum: checksum expected to be generated while
+                               iterating over image data
+        :param resume_offset: If not None, the number of bytes at the start
+                              of the incomplete image file, as returned by
+                              get_resume_offset(), that image_iter skips.
+                              The incomplete image file is then kept if
+                              caching the image is interrupted.
+        """
+        stream = utils.ImageStream.of(image_iter)
+        return stream.add_listener(
+            CacheTee(self, image_id, image_checksum, resume_offset))
+
+    def cache_write_behind_iter(self, image_id, image_iter, image_checksum,
+                                writer=None):
+        """
+        Returns an ImageStream that hands the contents of an image to a
+        background writer, which writes them into the cache, while the
+        image contents are read through the supplied iterator.
+
+        :param image_id: Image ID
+        :param image_iter: Iterator that will read image contents
+        :param image_checksum: checksum expected to be generated while
+                               iterating over image data
+        :param writer: CacheWriter to use, a new one by default
+        """
+        if writer is None:
+            writer = write_behind.CacheWriter(
+                self, image_id, CONF.image_cache_write_behind_buffer)
+        stream = utils.ImageStream.of(image_iter)
+        return stream.add_listener(
+            write_behind.WriteBehindTee(writer, image_checksum))
+
+    def _checksum_incomplete(self, image_id, length, checksum):
+        if not length:
+            return
+        LOG.debug("Resuming caching of image '%(image_id)s' after "
+                  "%(length)d bytes", {'image_id': image_id,
+                                       'length': length})
+        path = self.driver.get_image_filepath(image_id, 'incomplete')
+        with open(path, 'rb') as incomplete_file:
+            while length > 0:
+                chunk = incomplete_file.read(min(length, FOLLOW_CHUNKSIZE))
+                if not chunk:
+                    break
+                checksum.update(chunk)
+                length -= len(chunk)
+
+    def claim_fill(self, image_id):
+        """
+        Claims the job of writing an image into the cache for the calling
+        request. Returns True if the claim was granted, False if another
+        request of this process already holds an unexpired claim.
+
+        A claim is released once the caching iterator has created the
+        incomplete cache file, or once the image has been relayed if the
+        admission policy rejected it, see get_caching_iter(). Otherwise it
+        expires after `image_cache_single_flight_timeout` seconds.
+
+        :param image_id: Image ID
+        """
+        if image_id in self._relays:
+            return False
+        now = time.time()
+        claimed_at = self._pending_fills.get(image_id)
+        if (claimed_at is not None and
+                now - claimed_at < CONF.image_cache_single_flight_timeout):
+            return False
+        self._pending_fills[image_id] = now
+        return True
+
+    def release_fill(self, image_id):
+        """
+        Releases a claim made with claim_fill(), if any.
+
+        :param image_id: Image ID
+        """
+        self._pending_fills.pop(image_id, None)
+
+    def wait_for_fill(self, image_id):
+        """
+        Waits for the request holding the fill claim on an image to start
+        writing it into the cache, or relaying it. Returns True if the image
+        is then cached, being cached or relayed, False if the claim went
+        away without that happening.
+
+        :param image_id: Image ID
+        """
+        while image_id in self._pending_fills:
+            if self._fill_started(image_id):
+                return True
+            claimed_at = self._pending_fills.get(image_id)
+            if (claimed_at is None or time.time() - claimed_at >=
+                    CONF.image_cache_single_flight_timeout):
+                break
+            sleep(FOLLOW_POLL_INTERVAL)
+        return self._fill_started(image_id)
+
+    def _fill_started(self, image_id):
+        return (image_id in self._relays or self.is_cached(image_id) or
+                self.is_being_cached(image_id))
+
+    def get_following_iter(self, image_id):
+        """
+        Returns an iterator over the image file of an image that is being
+        written into the cache by another request, or relayed by it. Data
+        is yielded as it lands in the incomplete cache file or relay file,
+        and the iterator completes once the fill has been committed or the
+        relay has completed.
+
+        :param image_id: Image ID
+        :raises exception.NotFound: if no fill of the image is in progress
+        """
+        relay = self._relays.get(image_id)
+        if relay is not None:
+            try:
+                relay_file = open(relay.path, 'rb')
+            except IOError:
+                raise exception.NotFound()
+            return self._follow_relay_iter(image_id, relay, relay_file)
+
+        incomplete_path = self.driver.get_image_filepath(image_id,
+                                                         'incomplete')
         try:
-            current_checksum = hashlib.md5()
-
-            with self.driver.open_for_write(image_id) as cache_file:
-                for chunk in image_iter:
-                    try:
-                        cache_file.write(chunk)
-                    finally:
-                        current_checksum.update(chunk)
+            cache_file = open(incomplete_path, 'rb')
+        except IOError:
+            raise exception.NotFound()
+
+        return self._follow_iter(image_id, incomplete_path, cache_file)
+
+    def _follow_relay_iter(self, image_id, relay, relay_file):
+        timeout = CONF.image_cache_single_flight_timeout
+        last_progress = time.time()
+        with relay_file:
+            while True:
+                chunk = relay_file.read(FOLLOW_CHUNKSIZE)
+                if chunk:
+                    last_progress = time.time()
+                    yield chunk
+                    continue
+
+                if relay.done:
+                    # The rest of the data was flushed before the relay
+                    # file was removed, unless the relay failed
+                    if not relay.completed:
+                        msg = _("Relaying image '%s' failed while it was "
+                                "being followed.") % image_id
+                        raise exception.GlanceException(msg)
+                    for chunk in utils.chunkiter(relay_file):
                         yield chunk
-                cache_file.flush()
+                    return
 
-                if (image_checksum and
-                        image_checksum != current_checksum.hexdigest()):
-                    msg = _("Checksum verification failed. Aborted "
-                            "caching of image '%s'.") % image_id
+                if time.time() - last_progress > timeout:
+                    msg = _("Relaying image '%(image_id)s' stalled for "
+                            "more than %(timeout)d seconds while it was "
+                            "being followed.") % {'image_id': image_id,
+                                                  'timeout': timeout}
                     raise exception.GlanceException(msg)
+                sleep(FOLLOW_POLL_INTERVAL)
 
-        except exception.GlanceException as e:
-            with excutils.save_and_reraise_exception():
-                # image_iter has given us bad, (size_checked_iter has found a
-                # bad length), or corrupt data (checksum is wrong).
-                LOG.exception(encodeutils.exception_to_unicode(e))
-        except Exception as e:
-            LOG.exception(_LE("Exception encountered while tee'ing "
-                              "image '%(image_id)s' into cache: %(error)s. "
-                              "Continuing with response.") %
-                          {'image_id': image_id,
-                           'error': encodeutils.exception_to_unicode(e)})
+    def _follow_iter(self, image_id, incomplete_path, cache_file):
+        timeout = CONF.image_cache_single_flight_timeout
+        last_progress = time.time()
+        with cache_file:
+            while True:
+                chunk = cache_file.read(FOLLOW_CHUNKSIZE)
+                if chunk:
+                    last_progress = time.time()
+                    yield chunk
+                    continue
+
+                if not os.path.exists(incomplete_path):
+                    # The fill is over. If it was committed, the rest of
+                    # the data is already on disk, otherwise it was rolled
+                    # back and what we have sent is not to be trusted.
+                    if not self.is_cached(image_id):
+                        msg = _("Caching of image '%s' failed while it was "
+                                "being followed.") % image_id
+                        raise exception.GlanceException(msg)
+                    for chunk in utils.chunkiter(cache_file):
+                        yield chunk
+                    return
 
-            # If no checksum provided continue responding even if
-            # caching failed.
-            for chunk in image_iter:
-                yield chunk
+                if time.time() - last_progress > timeout:
+                    msg = _("Caching of image '%(image_id)s' stalled for "
+                            "more than %(timeout)d seconds while it was "
+                            "being followed.") % {'image_id': image_id,
+                                                  'timeout': timeout}
+                    raise exception.GlanceException(msg)
+                sleep(FOLLOW_POLL_INTERVAL)
 
     def cache_image_iter(self, image_id, image_iter, image_checksum=None):
         """
@@ -289,8 +1450,9 @@ class ImageCache(object):
         if not self.driver.is_cacheable(image_id):
             return False
 
-        for chunk in self.get_caching_iter(image_id, image_checksum,
-                                           image_iter):
+        # Images cached on purpose bypass the admission policy
+        for chunk in self.cache_tee_iter(image_id, image_iter,
+                                         image_checksum):
             pass
         return True
 
@@ -303,10 +1465,8 @@ class ImageCache(object):
 
         :retval True if image file was cached, False otherwise
         """
-        CHUNKSIZE = 64 * units.Mi
-
-        return self.cache_image_iter(image_id,
-                                     utils.chunkiter(image_file, CHUNKSIZE))
+        return self.cache_image_iter(
+            image_id, buffers.get_pool().read_iter(image_file))
 
     def open_for_read(self, image_id):
         """
@@ -329,6 +1489,25 @@ class ImageCache(object):
         """
         return self.driver.get_image_size(image_id)
 
+    def get_image_checksum(self, image_id):
+        """
+        Return the MD5 checksum of the image file of a cached image
+        recorded when it was written into the cache, or None if none was
+        recorded.
+
+        :param image_id: Image ID
+        """
+        return self.driver.get_image_checksum(image_id)
+
+    def set_image_checksum(self, image_id, checksum):
+        """
+        Records the MD5 checksum of the image file of a cached image.
+
+        :param image_id: Image ID
+        :param checksum: MD5 checksum of the image file
+        """
+        self.driver.set_image_checksum(image_id, checksum)
+
     def get_queued_images(self):
         """
         Returns a list of image IDs that are in the queue. The
@@ -0,0 +1,39 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Base admission policy class
+"""
+
+
+class Policy(object):
+
+    """
+    An admission policy decides whether an image that is downloaded while
+    it is not cached is worth writing into the image cache.
+
+    The policy is consulted once for every such download and may remember
+    the downloads it has seen for as long as the ImageCache it belongs to
+    lives. This base policy admits every image.
+    """
+
+    def admit(self, image_id):
+        """
+        Records a download of an image that is not cached and returns True
+        if the image should be written into the cache, False otherwise.
+
+        :param image_id: Image ID
+        """
+        return True
@@ -0,0 +1,64 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Admission policy that caches images requested several times in a window
+"""
+
+import time
+
+from oslo_config import cfg
+
+from glance.image_cache.admission import base
+
+CONF = cfg.CONF
+
+
+class Policy(base.Policy):
+
+    """
+    Admits an image into the cache on its Nth download within a window of
+    time, where N is image_cache_admission_requests and the window is
+    image_cache_admission_window seconds long.
+
+    The times of the downloads of every image not yet admitted are kept
+    until they fall out of the window.
+    """
+
+    def __init__(self):
+        # Image IDs mapped to the times of their downloads within the window
+        self.requests = {}
+        self._last_expiry = time.time()
+
+    def admit(self, image_id):
+        now = time.time()
+        window_start = now - CONF.image_cache_admission_window
+        if self._last_expiry < window_start:
+            self._expire(window_start)
+            self._last_expiry = now
+
+        times = [t for t in self.requests.get(image_id, ()) if
+                 t > window_start]
+        times.append(now)
+        if len(times) >= CONF.image_cache_admission_requests:
+            self.requests.pop(image_id, None)
+            return True
+        self.requests[image_id] = times
+        return False
+
+    def _expire(self, window_start):
+        for image_id, times in list(self.requests.items()):
+            if times[-1] <= window_start:
+                del self.requests[image_id]
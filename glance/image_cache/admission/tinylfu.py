@@ -0,0 +1,87 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+TinyLFU admission policy
+"""
+
+import hashlib
+import struct
+import time
+
+from oslo_config import cfg
+from oslo_utils import encodeutils
+
+from glance.image_cache.admission import base
+
+CONF = cfg.CONF
+
+# Number of counters in each row of the frequency sketch
+SKETCH_WIDTH = 4096
+SKETCH_DEPTH = 4
+
+
+class Policy(base.Policy):
+
+    """
+    Admits an image into the cache once the estimated number of its recent
+    downloads reaches image_cache_admission_requests.
+
+    Downloads are counted in a count-min sketch, as in TinyLFU, so the
+    memory used does not grow with the number of distinct images seen. The
+    estimate may be too high, but never too low. Every
+    image_cache_admission_window seconds all the counters are halved, so
+    images which are no longer downloaded are forgotten over time.
+    """
+
+    def __init__(self):
+        self.counters = [[0] * SKETCH_WIDTH for row in range(SKETCH_DEPTH)]
+        self._last_aging = time.time()
+
+    def admit(self, image_id):
+        self._age(time.time())
+        indexes = self._indexes(image_id)
+        estimate = min(row[index] for row, index in
+                       zip(self.counters, indexes)) + 1
+        # Conservative update: only the counters equal to the minimum grow,
+        # which keeps the estimates of other images more accurate
+        for row, index in zip(self.counters, indexes):
+            row[index] = max(row[index], estimate)
+        return estimate >= CONF.image_cache_admission_requests
+
+    def estimate(self, image_id):
+        """
+        Returns the estimated number of recent downloads of an image.
+
+        :param image_id: Image ID
+        """
+        return min(row[index] for row, index in
+                   zip(self.counters, self._indexes(image_id)))
+
+    def _indexes(self, image_id):
+        digest = hashlib.md5(encodeutils.safe_encode(image_id)).digest()
+        return [value % SKETCH_WIDTH for value in
+                struct.unpack('>%dI' % SKETCH_DEPTH, digest)]
+
+    def _age(self, now):
+        periods = int((now - self._last_aging) //
+                      CONF.image_cache_admission_window)
+        if periods <= 0:
+            return
+        self._last_aging += periods * CONF.image_cache_admission_window
+        for row in self.counters:
+            for index, count in enumerate(row):
+                if count:
+                    row[index] = count >> periods
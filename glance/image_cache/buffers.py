@@ -0,0 +1,129 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Reusable buffers bounding the memory used to write images into the Image
+Cache
+"""
+
+from contextlib import contextmanager
+
+from eventlet import semaphore
+from oslo_config import cfg
+
+CONF = cfg.CONF
+
+_POOL = None
+
+
+def get_pool():
+    """
+    Returns the buffer pool of the process, sized after
+    image_cache_buffer_size and image_cache_buffer_memory.
+    """
+    global _POOL
+    if (_POOL is None or
+            _POOL.buffer_size != CONF.image_cache_buffer_size or
+            _POOL.max_memory != CONF.image_cache_buffer_memory):
+        _POOL = BufferPool(CONF.image_cache_buffer_size,
+                           CONF.image_cache_buffer_memory)
+    return _POOL
+
+
+class BufferPool(object):
+
+    """
+    A fixed number of buffers of a fixed size shared by all the images
+    being written into the cache by a process.
+
+    Each image being written holds one slot of the pool while it is read,
+    either with a buffer of the pool that its data is read into, or with
+    a chunk of the same size it reads by other means. When all slots are
+    taken, writing another image waits for one to be released, so the
+    memory the image data takes up never exceeds the ceiling of the pool
+    however many images are written at the same time.
+    """
+
+    def __init__(self, buffer_size, max_memory):
+        """
+        :param buffer_size: Size of each buffer in bytes
+        :param max_memory: Total size of the buffers in bytes, the pool
+                           having at least one buffer
+        """
+        self.buffer_size = buffer_size
+        self.max_memory = max_memory
+        self.num_slots = max(1, max_memory // buffer_size)
+        self._slots = semaphore.Semaphore(self.num_slots)
+        self._free = []
+        # The number of slots taken at most so far
+        self.peak_slots = 0
+
+    @contextmanager
+    def slot(self):
+        """
+        Holds a slot of the pool for a chunk of at most buffer_size bytes
+        the caller reads by other means than a buffer of the pool.
+        """
+        self._slots.acquire()
+        try:
+            self.peak_slots = max(self.peak_slots,
+                                  self.num_slots - self._slots.counter)
+            yield
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def buffer(self):
+        """
+        Holds a slot of the pool and yields a buffer of buffer_size bytes,
+        which is handed to the next caller once released.
+        """
+        with self.slot():
+            buf = self._free.pop() if self._free else bytearray(
+                self.buffer_size)
+            try:
+                yield buf
+            finally:
+                self._free.append(buf)
+
+    def read_iter(self, image_file):
+        """
+        Returns an iterator over the contents of a file read into a buffer
+        of the pool. Each chunk is a view of the buffer, which is only
+        valid until the next chunk is read, so consumers must not keep
+        references to the chunks.
+
+        :param image_file: File-like object to read from
+        """
+        if not hasattr(image_file, 'readinto'):
+            return self._read_iter(image_file)
+        return self._readinto_iter(image_file)
+
+    def _readinto_iter(self, image_file):
+        with self.buffer() as buf:
+            view = memoryview(buf)
+            while True:
+                size = image_file.readinto(buf)
+                if not size:
+                    break
+                yield view[:size]
+
+    def _read_iter(self, image_file):
+        with self.slot():
+            while True:
+                chunk = image_file.read(self.buffer_size)
+                if not chunk:
+                    break
+                yield chunk
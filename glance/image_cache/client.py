@@ -34,6 +34,19 @@ class CacheClient(base_client.BaseClient):
         self.do_request("DELETE", "/cached_images/%s" % image_id)
         return True
 
+    def delete_cached_images(self, image_ids):
+        """
+        Delete the specified images from the cache in a single request
+
+        :param image_ids: IDs of the images to delete
+        :returns: The number of cached images that were deleted
+        """
+        res = self.do_request("POST", "/cached_images/delete",
+                              body=json.dumps({'image_ids': image_ids}),
+                              headers={'Content-Type': 'application/json'})
+        data = json.loads(res.read())
+        return data['num_deleted']
+
     def get_cached_images(self, **kwargs):
         """
         Returns a list of images stored in the image cache.
@@ -42,6 +55,14 @@ class CacheClient(base_client.BaseClient):
         data = json.loads(res.read())['cached_images']
         return data
 
+    def get_cache_stats(self):
+        """
+        Returns the statistics of the image cache.
+        """
+        res = self.do_request("GET", "/cache_stats")
+        data = json.loads(res.read())['cache_stats']
+        return data
+
     def get_queued_images(self, **kwargs):
         """
         Returns a list of images queued for caching
@@ -59,13 +80,37 @@ class CacheClient(base_client.BaseClient):
         num_deleted = data['num_deleted']
         return num_deleted
 
-    def queue_image_for_caching(self, image_id):
+    def queue_image_for_caching(self, image_id, priority=None):
         """
         Queue an image for prefetching into cache
+
+        :param priority: Images with a higher priority are prefetched first
         """
-        self.do_request("PUT", "/queued_images/%s" % image_id)
+        path = "/queued_images/%s" % image_id
+        if priority is None:
+            self.do_request("PUT", path)
+        else:
+            self.do_request("PUT", path, params={'priority': priority})
         return True
 
+    def queue_images_for_caching(self, image_ids, priority=None):
+        """
+        Queue images for prefetching into cache in a single request
+
+        :param image_ids: IDs of the images to queue
+        :param priority: Images with a higher priority are prefetched first
+        :returns: The number of images that were queued, leaving out those
+                  that were already queued or cached
+        """
+        body = {'image_ids': image_ids}
+        if priority is not None:
+            body['priority'] = priority
+        res = self.do_request("POST", "/queued_images",
+                              body=json.dumps(body),
+                              headers={'Content-Type': 'application/json'})
+        data = json.loads(res.read())
+        return data['num_queued']
+
     def delete_queued_image(self, image_id):
         """
         Delete a specified image from the cache queue
@@ -17,6 +17,8 @@
 Base attribute driver class
 """
 
+import errno
+import fcntl
 import os.path
 
 from oslo_config import cfg
@@ -61,8 +63,20 @@ class Driver(object):
         self.incomplete_dir = os.path.join(self.base_dir, 'incomplete')
         self.invalid_dir = os.path.join(self.base_dir, 'invalid')
         self.queue_dir = os.path.join(self.base_dir, 'queue')
-
-        dirs = [self.incomplete_dir, self.invalid_dir, self.queue_dir]
+        self.metadata_dir = os.path.join(self.base_dir, 'metadata')
+        self.partial_dir = os.path.join(self.base_dir, 'partial')
+        self.warming_dir = os.path.join(self.base_dir, 'warming')
+        self.misses_dir = os.path.join(self.warming_dir, 'misses')
+        self.stats_dir = os.path.join(self.base_dir, 'stats')
+        self.verifier_dir = os.path.join(self.base_dir, 'verifier')
+        self.locks_dir = os.path.join(self.base_dir, 'locks')
+        self.policy_dir = os.path.join(self.base_dir, 'policy')
+        self.relay_dir = os.path.join(self.base_dir, 'relay')
+
+        dirs = [self.incomplete_dir, self.invalid_dir, self.queue_dir,
+                self.metadata_dir, self.partial_dir, self.misses_dir,
+                self.stats_dir, self.verifier_dir, self.locks_dir,
+                self.policy_dir, self.relay_dir]
 
         for path in dirs:
             utils.safe_mkdirs(path)
@@ -73,6 +87,13 @@ class Driver(object):
         """
         raise NotImplementedError
 
+    def reconcile_cache_size(self):
+        """
+        Recomputes the total size of the image cache from the image files
+        in the cache and returns it.
+        """
+        raise NotImplementedError
+
     def get_cached_images(self):
         """
         Returns a list of records about cached images.
@@ -110,6 +131,30 @@ class Driver(object):
         """
         raise NotImplementedError
 
+    def is_being_cached(self, image_id):
+        """
+        Returns True if the image with supplied id is currently
+        in the process of having its image file cached.
+
+        :param image_id: Image ID
+        """
+        raise NotImplementedError
+
+    def lock_incomplete_file(self, cache_file):
+        """
+        Marks an incomplete image file as being written to until it is
+        closed, even should the process die, so that
+        ImageCache.get_resume_offset() does not resume from it meanwhile.
+
+        :param cache_file: Incomplete image file opened for writing
+        """
+        try:
+            fcntl.flock(cache_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            # Another writer holds the file, as before there was a lock
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+
     def is_queued(self, image_id):
         """
         Returns True if the image identifier is in our cache queue.
@@ -133,6 +178,17 @@ class Driver(object):
         """
         raise NotImplementedError
 
+    def delete_cached_images(self, image_ids):
+        """
+        Removes the cached image files of the images with the supplied IDs
+        and any attributes about them. Drivers that keep the attributes in
+        a database override this to remove them in a single transaction.
+
+        :param image_ids: Image IDs
+        """
+        for image_id in image_ids:
+            self.delete_cached_image(image_id)
+
     def delete_all_queued_images(self):
         """
         Removes all queued image files and any attributes about the images
@@ -148,14 +204,40 @@ class Driver(object):
         """
         raise NotImplementedError
 
-    def queue_image(self, image_id):
+    def queue_image(self, image_id, priority=0):
         """
         Puts an image identifier in a queue for caching. Return True
         on successful add to the queue, False otherwise...
 
         :param image_id: Image ID
+        :param priority: Images with a higher priority are prefetched first
         """
 
+    def queue_images(self, image_ids, priority=0):
+        """
+        Puts the image identifiers in a queue for caching and returns the
+        number of images that were added to the queue.
+
+        :param image_ids: Image IDs
+        :param priority: Images with a higher priority are prefetched first
+        """
+        return len([image_id for image_id in image_ids
+                    if self.queue_image(image_id, priority)])
+
+    def get_queue_priority(self, image_id):
+        """
+        Returns the priority the image with the supplied ID was queued
+        with, 0 if it was queued without one or is not queued.
+
+        :param image_id: Image ID
+        """
+        path = self.get_image_filepath(image_id, 'queue')
+        try:
+            with open(path) as queue_file:
+                return int(queue_file.read() or 0)
+        except (IOError, ValueError):
+            return 0
+
     def clean(self, stall_time=None):
         """
         Dependent on the driver, clean up and destroy any invalid or incomplete
@@ -170,12 +252,16 @@ class Driver(object):
         """
         raise NotImplementedError
 
-    def open_for_write(self, image_id):
+    def open_for_write(self, image_id, resume=False):
         """
         Open a file for writing the image file for an image
         with supplied identifier.
 
         :param image_id: Image ID
+        :param resume: If True, append to the incomplete image file left
+                       behind by an earlier attempt, and leave the file in
+                       place for a later attempt if this one is interrupted
+                       by anything other than invalid image data
         """
         raise NotImplementedError
 
@@ -209,6 +295,26 @@ class Driver(object):
         path = self.get_image_filepath(image_id)
         return os.path.getsize(path)
 
+    def get_image_checksum(self, image_id):
+        """
+        Return the MD5 checksum of the image file of a cached image
+        recorded with set_image_checksum(), or None if none was recorded.
+
+        :param image_id: Image ID
+        """
+        return None
+
+    def set_image_checksum(self, image_id, checksum):
+        """
+        Records the MD5 checksum of the image file of a cached image, which
+        the cache verifier checks the image file against. Drivers that
+        can't record checksums ignore them.
+
+        :param image_id: Image ID
+        :param checksum: MD5 checksum of the image file
+        """
+        pass
+
     def get_queued_images(self):
         """
         Returns a list of image IDs that are in the queue. The
@@ -18,12 +18,15 @@ Cache driver that uses SQLite to store information about cached images
 """
 
 from __future__ import absolute_import
+import atexit
 from contextlib import contextmanager
 import os
 import sqlite3
 import stat
 import time
+import weakref
 
+from eventlet import greenthread
 from eventlet import sleep
 from eventlet import timeout
 from oslo_config import cfg
@@ -40,6 +43,22 @@ sqlite_opts = [
     cfg.StrOpt('image_cache_sqlite_db', default='cache.db',
                help=_('The path to the sqlite file database that will be '
                       'used for image cache management.')),
+    cfg.BoolOpt('image_cache_sqlite_wal', default=True,
+                help=_('Use write-ahead logging for the image cache '
+                       'database, so that reading the database does not '
+                       'block writing to it and the other way round. '
+                       'Disable this if the image cache directory is on a '
+                       'network filesystem, where write-ahead logging does '
+                       'not work.')),
+    cfg.IntOpt('image_cache_sqlite_flush_interval', default=5,
+               help=_('The number of seconds for which the hit counts and '
+                      'access times of cached images served by an API '
+                      'worker are collected in memory before they are '
+                      'written to the image cache database in a single '
+                      'transaction, whether or not the worker serves other '
+                      'images meanwhile. They are also written when the '
+                      'worker exits. A value of 0 writes them on every '
+                      'cache hit.')),
 ]
 
 CONF = cfg.CONF
@@ -47,6 +66,23 @@ CONF.register_opts(sqlite_opts)
 
 DEFAULT_SQL_CALL_TIMEOUT = 2
 
+# The number of idle database connections a process keeps around
+MAX_IDLE_CONNECTIONS = 8
+
+# The drivers of this process, whose collected hits are written to the
+# database when it exits
+_DRIVERS = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all_hits():
+    for driver in list(_DRIVERS):
+        try:
+            driver.flush_hits()
+        except Exception:
+            LOG.exception(_LE("Failed to write the hits of cached images "
+                              "to the image cache database"))
+
 
 class SqliteConnection(sqlite3.Connection):
 
@@ -74,6 +110,14 @@ class SqliteConnection(sqlite3.Connection):
         return self._timeout(lambda: sqlite3.Connection.execute(
             self, *args, **kwargs))
 
+    def executemany(self, *args, **kwargs):
+        return self._timeout(lambda: sqlite3.Connection.executemany(
+            self, *args, **kwargs))
+
+    def executescript(self, *args, **kwargs):
+        return self._timeout(lambda: sqlite3.Connection.executescript(
+            self, *args, **kwargs))
+
     def commit(self):
         return self._timeout(lambda: sqlite3.Connection.commit(self))
 
@@ -98,6 +142,19 @@ class Driver(base.Driver):
         """
         super(Driver, self).configure()
 
+        # Idle database connections of this process, see get_db()
+        self._connections = []
+        self._connections_pid = os.getpid()
+
+        # Image IDs mapped to the number of hits and the last access time
+        # not yet written to the database, see open_for_read()
+        self._pending_hits = {}
+        self._last_flush = 0
+        # Writes the collected hits once flush_interval elapsed, even if
+        # no other image is served meanwhile
+        self._flush_timer = None
+        _DRIVERS.add(self)
+
         # Create the SQLite database that will hold our cache attributes
         self.initialize_db()
 
@@ -116,7 +173,36 @@ class Driver(base.Driver):
                     hits INTEGER DEFAULT 0,
                     checksum TEXT
                 );
+                CREATE TABLE IF NOT EXISTS cache_size (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    size INTEGER DEFAULT 0
+                );
+                INSERT OR IGNORE INTO cache_size (id, size)
+                    SELECT 0, COALESCE(SUM(size), 0) FROM cached_images;
+                CREATE TRIGGER IF NOT EXISTS cache_size_insert
+                    AFTER INSERT ON cached_images
+                    BEGIN
+                        UPDATE cache_size SET size = size + NEW.size;
+                    END;
+                CREATE TRIGGER IF NOT EXISTS cache_size_update
+                    AFTER UPDATE OF size ON cached_images
+                    BEGIN
+                        UPDATE cache_size SET size = size - OLD.size +
+                                                     NEW.size;
+                    END;
+                CREATE TRIGGER IF NOT EXISTS cache_size_delete
+                    AFTER DELETE ON cached_images
+                    BEGIN
+                        UPDATE cache_size SET size = size - OLD.size;
+                    END;
             """)
+            # The journal mode is stored in the database file, so it only
+            # has to be set once rather than for every connection. Changing
+            # it locks the database, which other processes may be using.
+            journal_mode = 'wal' if CONF.image_cache_sqlite_wal else 'delete'
+            cur = conn.execute('PRAGMA journal_mode')
+            if cur.fetchone()[0].lower() != journal_mode:
+                conn.execute('PRAGMA journal_mode = %s' % journal_mode)
             conn.close()
         except sqlite3.DatabaseError as e:
             msg = _("Failed to initialize the image cache database. "
@@ -128,14 +214,53 @@ class Driver(base.Driver):
     def get_cache_size(self):
         """
         Returns the total size in bytes of the image cache.
+
+        The total is kept up to date by triggers on the cached_images
+        table, see reconcile_cache_size().
         """
-        sizes = []
-        for path in self.get_cache_files(self.base_dir):
-            if path == self.db_path:
-                continue
-            file_info = os.stat(path)
-            sizes.append(file_info[stat.ST_SIZE])
-        return sum(sizes)
+        with self.get_db() as db:
+            cur = db.execute("""SELECT size FROM cache_size""")
+            return cur.fetchone()[0]
+
+    def reconcile_cache_size(self):
+        """
+        Brings the records of cached images in line with the image files
+        in the cache, which may have been removed, replaced or left behind
+        by something other than this driver, and recomputes the total size
+        of the cache. Returns the total size in bytes of the image cache.
+        """
+        files = {}
+        for path in self.get_cached_image_files():
+            files[os.path.basename(path)] = os.stat(path)[stat.ST_SIZE]
+
+        now = time.time()
+        with self.get_db() as db:
+            cur = db.execute("""SELECT image_id, size FROM cached_images""")
+            records = dict((row[0], row[1]) for row in cur)
+            for image_id, size in records.items():
+                if image_id not in files:
+                    LOG.info(_LI("Removing record of missing cache file "
+                                 "for image %s"), image_id)
+                    db.execute("""DELETE FROM cached_images
+                               WHERE image_id = ?""", (image_id,))
+                elif files[image_id] != size:
+                    db.execute("""UPDATE cached_images SET size = ?
+                               WHERE image_id = ?""",
+                               (files[image_id], image_id))
+            for image_id, size in files.items():
+                if image_id not in records:
+                    LOG.info(_LI("Adding record of untracked cache file "
+                                 "for image %s"), image_id)
+                    db.execute("""INSERT OR IGNORE INTO cached_images
+                               (image_id, last_accessed, last_modified,
+                                hits, size)
+                               VALUES (?, ?, ?, 0, ?)""",
+                               (image_id, now, now, size))
+            db.execute("""UPDATE cache_size SET size =
+                       (SELECT COALESCE(SUM(size), 0) FROM cached_images)""")
+            db.commit()
+            cur = db.execute("""SELECT size FROM cache_size""")
+            return cur.fetchone()[0]
 
     def get_hit_count(self, image_id):
         """
@@ -146,6 +271,7 @@ class Driver(base.Driver):
         if not self.is_cached(image_id):
             return 0
 
+        self.flush_hits()
         hits = 0
         with self.get_db() as db:
             cur = db.execute("""SELECT hits FROM cached_images
@@ -159,6 +285,7 @@ class Driver(base.Driver):
         Returns a list of records about cached images.
         """
         LOG.debug("Gathering cached image entries.")
+        self.flush_hits()
         with self.get_db() as db:
             cur = db.execute("""SELECT
                              image_id, hits, last_accessed, last_modified, size
@@ -211,8 +338,9 @@ class Driver(base.Driver):
         Removes all cached image files and any attributes about the images
         """
         deleted = 0
+        self._pending_hits = {}
         with self.get_db() as db:
-            for path in self.get_cache_files(self.base_dir):
+            for path in self.get_cached_image_files():
                 delete_cached_file(path)
                 deleted += 1
             db.execute("""DELETE FROM cached_images""")
@@ -226,12 +354,28 @@ class Driver(base.Driver):
         :param image_id: Image ID
         """
         path = self.get_image_filepath(image_id)
+        self._pending_hits.pop(image_id, None)
         with self.get_db() as db:
             delete_cached_file(path)
             db.execute("""DELETE FROM cached_images WHERE image_id = ?""",
                        (image_id, ))
             db.commit()
 
+    def delete_cached_images(self, image_ids):
+        """
+        Removes the cached image files of the images with the supplied IDs
+        and any attributes about them
+
+        :param image_ids: Image IDs
+        """
+        with self.get_db() as db:
+            for image_id in image_ids:
+                self._pending_hits.pop(image_id, None)
+                delete_cached_file(self.get_image_filepath(image_id))
+            db.executemany("""DELETE FROM cached_images WHERE image_id = ?""",
+                           [(image_id, ) for image_id in image_ids])
+            db.commit()
+
     def delete_all_queued_images(self):
         """
         Removes all queued image files and any attributes about the images
@@ -266,11 +410,14 @@ class Driver(base.Driver):
         older_than = now - stall_time
         self.delete_stalled_files(older_than)
 
+        self.reconcile_cache_size()
+
     def get_least_recently_accessed(self):
         """
         Return a tuple containing the image_id and size of the least recently
         accessed cached file, or None if no cached files.
         """
+        self.flush_hits()
         with self.get_db() as db:
             cur = db.execute("""SELECT image_id FROM cached_images
                              ORDER BY last_accessed LIMIT 1""")
@@ -288,13 +435,43 @@ class Driver(base.Driver):
             size = 0
         return image_id, size
 
+    def get_image_checksum(self, image_id):
+        """
+        Return the MD5 checksum of the image file of a cached image
+        recorded with set_image_checksum(), or None if none was recorded.
+
+        :param image_id: Image ID
+        """
+        with self.get_db() as db:
+            cur = db.execute("""SELECT checksum FROM cached_images
+                             WHERE image_id = ?""", (image_id,))
+            row = cur.fetchone()
+        return row[0] if row is not None else None
+
+    def set_image_checksum(self, image_id, checksum):
+        """
+        Records the MD5 checksum of the image file of a cached image, which
+        the cache verifier checks the image file against.
+
+        :param image_id: Image ID
+        :param checksum: MD5 checksum of the image file
+        """
+        with self.get_db() as db:
+            db.execute("""UPDATE cached_images SET checksum = ?
+                       WHERE image_id = ?""", (checksum, image_id))
+            db.commit()
+
     @contextmanager
-    def open_for_write(self, image_id):
+    def open_for_write(self, image_id, resume=False):
         """
         Open a file for writing the image file for an image
         with supplied identifier.
 
         :param image_id: Image ID
+        :param resume: If True, append to the incomplete image file left
+                       behind by an earlier attempt, and leave the file in
+                       place for a later attempt if this one is interrupted
+                       by anything other than invalid image data
         """
         incomplete_path = self.get_image_filepath(image_id, 'incomplete')
 
@@ -338,11 +515,16 @@ class Driver(base.Driver):
                 db.commit()
 
         try:
-            with open(incomplete_path, 'wb') as cache_file:
+            with open(incomplete_path, 'ab' if resume else 'wb') as cache_file:
+                self.lock_incomplete_file(cache_file)
                 yield cache_file
-        except Exception as e:
+        except exception.GlanceException as e:
             with excutils.save_and_reraise_exception():
                 rollback(e)
+        except Exception as e:
+            with excutils.save_and_reraise_exception():
+                if not resume:
+                    rollback(e)
         else:
             commit()
         finally:
@@ -351,7 +533,7 @@ class Driver(base.Driver):
             # nor commit will have been called, so the incomplete file
             # will persist - in that case remove it as it is unusable
             # example: ^c from client fetch
-            if os.path.exists(incomplete_path):
+            if not resume and os.path.exists(incomplete_path):
                 rollback('incomplete fetch')
 
     @contextmanager
@@ -362,41 +544,97 @@ class Driver(base.Driver):
 
         :param image_id: Image ID
         """
-        path = self.get_image_filepath(image_id)
-        with open(path, 'rb') as cache_file:
+        with self._open_image_file(image_id) as cache_file:
             yield cache_file
         now = time.time()
+        hits = self._pending_hits.get(image_id, (0, now))[0]
+        self._pending_hits[image_id] = (hits + 1, now)
+        interval = CONF.image_cache_sqlite_flush_interval
+        if now - self._last_flush >= interval:
+            self.flush_hits()
+        elif self._flush_timer is None:
+            self._flush_timer = greenthread.spawn_after(
+                self._last_flush + interval - now, self._timed_flush)
+
+    def _timed_flush(self):
+        self._flush_timer = None
+        try:
+            self.flush_hits()
+        except Exception:
+            LOG.exception(_LE("Failed to write the hits of cached images "
+                              "to the image cache database"))
+
+    def _open_image_file(self, image_id):
+        return open(self.get_image_filepath(image_id), 'rb')
+
+    def flush_hits(self):
+        """
+        Writes the hit counts and access times collected by open_for_read
+        to the database.
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        self._last_flush = time.time()
+        if not self._pending_hits:
+            return
+
+        pending = self._pending_hits
+        self._pending_hits = {}
         with self.get_db() as db:
-            db.execute("""UPDATE cached_images
-                       SET hits = hits + 1, last_accessed = ?
-                       WHERE image_id = ?""",
-                       (now, image_id))
+            db.executemany("""UPDATE cached_images
+                           SET hits = hits + ?, last_accessed = ?
+                           WHERE image_id = ?""",
+                           [(hits, last_accessed, image_id)
+                            for image_id, (hits, last_accessed)
+                            in pending.items()])
             db.commit()
 
     @contextmanager
     def get_db(self):
         """
         Returns a context manager that produces a database connection that
-        self-closes and calls rollback if an error occurs while using the
-        database connection
+        goes back to the pool of connections of this process when done
+        with, and calls rollback and closes it if an error occurs while
+        using the database connection
         """
-        conn = sqlite3.connect(self.db_path, check_same_thread=False,
-                               factory=SqliteConnection)
-        conn.row_factory = sqlite3.Row
-        conn.text_factory = str
-        conn.execute('PRAGMA synchronous = NORMAL')
-        conn.execute('PRAGMA count_changes = OFF')
-        conn.execute('PRAGMA temp_store = MEMORY')
+        if self._connections_pid != os.getpid():
+            # SQLite connections must not be carried across a fork
+            self._connections = []
+            self._connections_pid = os.getpid()
+
+        try:
+            conn = self._connections.pop()
+        except IndexError:
+            conn = self._connect()
+
+        reusable = False
         try:
             yield conn
+            reusable = True
         except sqlite3.DatabaseError as e:
             msg = _LE("Error executing SQLite call. Got error: %s") % e
             LOG.error(msg)
             conn.rollback()
         finally:
-            conn.close()
+            if reusable and len(self._connections) < MAX_IDLE_CONNECTIONS:
+                # Don't hand over a transaction left open by the caller
+                conn.rollback()
+                self._connections.append(conn)
+            else:
+                conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               factory=SqliteConnection)
+        conn.row_factory = sqlite3.Row
+        conn.text_factory = str
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA count_changes = OFF')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
 
-    def queue_image(self, image_id):
+    def queue_image(self, image_id, priority=0):
         """
         This adds a image to be cache to the queue.
 
@@ -404,6 +642,7 @@ class Driver(base.Driver):
         cached, we return False, True otherwise
 
         :param image_id: Image ID
+        :param priority: Images with a higher priority are prefetched first
         """
         if self.is_cached(image_id):
             LOG.info(_LI("Not queueing image '%s'. Already cached."), image_id)
@@ -420,9 +659,11 @@ class Driver(base.Driver):
 
         path = self.get_image_filepath(image_id, 'queue')
 
-        # Touch the file to add it to the queue
-        with open(path, "w"):
-            pass
+        # Touch the file to add it to the queue, it holds the priority of
+        # the image if there is one
+        with open(path, "w") as queue_file:
+            if priority:
+                queue_file.write(str(priority))
 
         return True
 
@@ -468,15 +709,25 @@ class Driver(base.Driver):
         items.sort()
         return [image_id for (modtime, image_id) in items]
 
+    def get_cached_image_files(self):
+        """
+        Returns the paths of the image files of cached images
+        """
+        return self.get_cache_files(self.base_dir)
+
     def get_cache_files(self, basepath):
         """
         Returns cache files in the supplied directory
 
         :param basepath: Directory to look in for cache files
         """
+        # The database may be accompanied by a rollback journal or by
+        # the write-ahead log and its index
+        db_files = [self.db_path + suffix
+                    for suffix in ('', '-journal', '-wal', '-shm')]
         for fname in os.listdir(basepath):
             path = os.path.join(basepath, fname)
-            if path != self.db_path and os.path.isfile(path):
+            if path not in db_files and os.path.isfile(path):
                 yield path
 
 
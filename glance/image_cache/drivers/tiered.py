@@ -0,0 +1,259 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache driver that spreads cached images across tiers of storage, using
+SQLite to store information about cached images
+"""
+
+from __future__ import absolute_import
+import errno
+import os
+import shutil
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import strutils
+
+from glance.common import exception
+from glance.common import utils
+from glance.i18n import _, _LI, _LW
+from glance.image_cache.drivers import sqlite
+
+LOG = logging.getLogger(__name__)
+
+tiered_opts = [
+    cfg.ListOpt('image_cache_tiers', default=[],
+                help=_('The directories of the fast tiers of the tiered '
+                       'image cache driver, fastest first, each followed by '
+                       'a colon and the maximum size of the images it holds, '
+                       'for instance "/mnt/nvme/glance:100G". Images not in '
+                       'any of these tiers are kept in image_cache_dir.')),
+    cfg.IntOpt('image_cache_tier_promote_hits', default=2,
+               help=_('The number of cache hits an image needs before the '
+                      'tiered image cache driver moves it to a fast '
+                      'tier.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(tiered_opts)
+
+
+class Driver(sqlite.Driver):
+
+    """
+    Cache driver that keeps the images with the most cache hits in a
+    number of fast tiers, such as directories on solid state drives, and
+    the other cached images in the image cache directory.
+
+    Images are written into the image cache directory when they are
+    cached. The cleaner then moves them between the tiers, so that each
+    fast tier holds the images with the most hits that the faster tiers had
+    no room for. Information about cached images is kept in the SQLite
+    database of the image cache directory, as with the sqlite driver.
+    """
+
+    def configure(self):
+        """
+        Configure the driver to use the stored configuration options
+        Any store that needs special configuration should implement
+        this method. If the store was not able to successfully configure
+        itself, it should raise `exception.BadDriverConfiguration`
+        """
+        super(Driver, self).configure()
+
+        # The (directory, maximum size) of the fast tiers, fastest first
+        self.tiers = []
+        for tier in CONF.image_cache_tiers:
+            path, sep, max_size = tier.rpartition(':')
+            try:
+                max_size = strutils.string_to_bytes(max_size + 'B',
+                                                    return_int=True)
+            except ValueError:
+                path = None
+            if not path or os.path.abspath(path) == os.path.abspath(
+                    self.base_dir):
+                msg = (_('Invalid image cache tier "%s", expected a '
+                         'directory other than image_cache_dir followed by '
+                         'a colon and a size.') % tier)
+                LOG.error(msg)
+                raise exception.BadDriverConfiguration(
+                    driver_name='tiered', reason=msg)
+            self.tiers.append((path, max_size))
+
+        for path in self.get_tier_dirs():
+            utils.safe_mkdirs(os.path.join(path, 'moving'))
+
+    def get_tier_dirs(self):
+        """
+        Returns the directories of all the tiers, fastest first, the last
+        one being the image cache directory.
+        """
+        return [path for path, max_size in self.tiers] + [self.base_dir]
+
+    def get_image_tier(self, image_id):
+        """
+        Returns the index in get_tier_dirs() of the tier holding the image
+        file of a cached image, or None if the image is not cached.
+
+        :param image_id: Image ID
+        """
+        for index, path in enumerate(self.get_tier_dirs()):
+            if os.path.exists(os.path.join(path, str(image_id))):
+                return index
+        return None
+
+    def get_image_filepath(self, image_id, cache_status='active'):
+        """
+        This crafts an absolute path to a specific entry. Active images
+        are looked for in every tier, and placed in the image cache
+        directory when in none.
+
+        :param image_id: Image ID
+        :param cache_status: Status of the image in the cache
+        """
+        if cache_status != 'active':
+            return super(Driver, self).get_image_filepath(image_id,
+                                                          cache_status)
+        tier_dirs = self.get_tier_dirs()
+        tier = self.get_image_tier(image_id)
+        if tier is None:
+            tier = len(tier_dirs) - 1
+        return os.path.join(tier_dirs[tier], str(image_id))
+
+    def get_cached_image_files(self):
+        """
+        Returns the paths of the image files of cached images
+        """
+        for path in self.get_tier_dirs():
+            for file_path in self.get_cache_files(path):
+                yield file_path
+
+    def delete_cached_image(self, image_id):
+        """
+        Removes a specific cached image file and any attributes about the image
+
+        :param image_id: Image ID
+        """
+        super(Driver, self).delete_cached_image(image_id)
+        # The image may have been copied to another tier by the cleaner
+        # while it was deleted
+        for path in self.get_tier_dirs():
+            path = os.path.join(path, str(image_id))
+            if os.path.exists(path):
+                sqlite.delete_cached_file(path)
+
+    def delete_cached_images(self, image_ids):
+        """
+        Removes the cached image files of the images with the supplied IDs
+        and any attributes about them
+
+        :param image_ids: Image IDs
+        """
+        super(Driver, self).delete_cached_images(image_ids)
+        for image_id in image_ids:
+            for path in self.get_tier_dirs():
+                path = os.path.join(path, str(image_id))
+                if os.path.exists(path):
+                    sqlite.delete_cached_file(path)
+
+    def clean(self, stall_time=None):
+        """
+        Delete any image files in the invalid directory and any
+        files in the incomplete directory that are older than a
+        configurable amount of time, then move the cached images
+        between the tiers.
+        """
+        super(Driver, self).clean(stall_time)
+        self.rebalance()
+
+    def rebalance(self):
+        """
+        Moves the cached images with at least image_cache_tier_promote_hits
+        hits, most hits first, to the fastest tier with room for them, and
+        the other cached images to the image cache directory. Returns the
+        number of images moved.
+        """
+        tier_dirs = self.get_tier_dirs()
+        for path in tier_dirs:
+            # Copies left behind by an interrupted move
+            for file_path in self.get_cache_files(os.path.join(path,
+                                                               'moving')):
+                os.unlink(file_path)
+
+        free = [max_size for path, max_size in self.tiers]
+        entries = sorted(self.get_cached_images(),
+                         key=lambda e: (e['hits'], e['last_accessed']),
+                         reverse=True)
+        moves = []
+        for entry in entries:
+            target = len(tier_dirs) - 1
+            if entry['hits'] >= CONF.image_cache_tier_promote_hits:
+                for index, room in enumerate(free):
+                    if entry['size'] <= room:
+                        free[index] -= entry['size']
+                        target = index
+                        break
+            current = self.get_image_tier(entry['image_id'])
+            if current is not None and current != target:
+                moves.append((current, target, entry['image_id']))
+
+        # Move images to slower tiers first, which makes room for the
+        # images moved to faster tiers
+        moves.sort(key=lambda move: (move[1] < move[0], -move[1]))
+        moved = 0
+        for current, target, image_id in moves:
+            if self._move_image(image_id, tier_dirs[current],
+                                tier_dirs[target]):
+                moved += 1
+        return moved
+
+    def _move_image(self, image_id, source_dir, target_dir):
+        source_path = os.path.join(source_dir, str(image_id))
+        moving_path = os.path.join(target_dir, 'moving', str(image_id))
+        target_path = os.path.join(target_dir, str(image_id))
+        LOG.debug("Moving cached image '%(image_id)s' from %(source)s to "
+                  "%(target)s", {'image_id': image_id, 'source': source_dir,
+                                 'target': target_dir})
+        try:
+            # Readers find the image in one of the tiers throughout the
+            # move, and those that opened it before keep reading it
+            shutil.copyfile(source_path, moving_path)
+            os.rename(moving_path, target_path)
+            os.unlink(source_path)
+        except (IOError, OSError) as e:
+            LOG.warn(_LW("Failed to move cached image '%(image_id)s' to "
+                         "%(target)s: %(error)s"),
+                     {'image_id': image_id, 'target': target_dir,
+                      'error': e})
+            if os.path.exists(moving_path):
+                os.unlink(moving_path)
+            if not os.path.exists(source_path) and os.path.exists(
+                    target_path):
+                # The image was deleted while it was being moved
+                os.unlink(target_path)
+            return False
+        LOG.info(_LI("Moved cached image '%(image_id)s' to %(target)s"),
+                 {'image_id': image_id, 'target': target_dir})
+        return True
+
+    def _open_image_file(self, image_id):
+        try:
+            return super(Driver, self)._open_image_file(image_id)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # The image was moved to another tier after it was looked for
+            return super(Driver, self)._open_image_file(image_id)
@@ -54,6 +54,7 @@ $image_cache_dir/
 from __future__ import absolute_import
 from contextlib import contextmanager
 import errno
+import fcntl
 import os
 import stat
 import time
@@ -121,12 +122,57 @@ class Driver(base.Driver):
     def get_cache_size(self):
         """
         Returns the total size in bytes of the image cache.
+
+        The total is kept in the 'cache_size' xattr of the cache directory,
+        which is updated as image files are added to and removed from the
+        cache, see reconcile_cache_size().
+        """
+        size = get_xattr(self.base_dir, 'cache_size', default=None)
+        if size is None:
+            return self.reconcile_cache_size()
+        return int(size)
+
+    def reconcile_cache_size(self):
         """
+        Recomputes the total size of the image cache from the image files
+        in the cache, which may have been removed or replaced by something
+        other than this driver. Returns the total size in bytes of the image
+        cache.
+        """
+        with self._cache_size_lock():
+            return self._reconcile_cache_size()
+
+    def _reconcile_cache_size(self):
         sizes = []
         for path in get_all_regular_files(self.base_dir):
             file_info = os.stat(path)
             sizes.append(file_info[stat.ST_SIZE])
-        return sum(sizes)
+        size = sum(sizes)
+        set_xattr(self.base_dir, 'cache_size', size)
+        return size
+
+    def _update_cache_size(self, delta):
+        with self._cache_size_lock():
+            size = get_xattr(self.base_dir, 'cache_size', default=None)
+            if size is None:
+                # The change has already been made to the cache files
+                self._reconcile_cache_size()
+            else:
+                set_xattr(self.base_dir, 'cache_size',
+                          max(int(size) + delta, 0))
+
+    @contextmanager
+    def _cache_size_lock(self):
+        """
+        Serializes updates of the cache size between the processes using
+        the cache directory.
+        """
+        fd = os.open(self.base_dir, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
 
     def get_hit_count(self, image_id):
         """
@@ -205,6 +251,7 @@ class Driver(base.Driver):
         for path in get_all_regular_files(self.base_dir):
             delete_cached_file(path)
             deleted += 1
+        self.reconcile_cache_size()
         return deleted
 
     def delete_cached_image(self, image_id):
@@ -214,7 +261,14 @@ class Driver(base.Driver):
         :param image_id: Image ID
         """
         path = self.get_image_filepath(image_id)
-        delete_cached_file(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        # The size is only taken off the total by the request which
+        # removed the file, when several delete the image at once
+        if delete_cached_file(path) and size:
+            self._update_cache_size(-size)
 
     def delete_all_queued_images(self):
         """
@@ -253,13 +307,47 @@ class Driver(base.Driver):
         stats.sort()
         return os.path.basename(stats[0][2]), stats[0][1]
 
+    def get_image_checksum(self, image_id):
+        """
+        Return the MD5 checksum of the image file of a cached image
+        recorded with set_image_checksum(), or None if none was recorded.
+
+        :param image_id: Image ID
+        """
+        path = self.get_image_filepath(image_id)
+        checksum = get_xattr(path, 'checksum', default=None)
+        if checksum is not None:
+            checksum = encodeutils.safe_decode(checksum)
+        return checksum
+
+    def set_image_checksum(self, image_id, checksum):
+        """
+        Records the MD5 checksum of the image file of a cached image, which
+        the cache verifier checks the image file against.
+
+        :param image_id: Image ID
+        :param checksum: MD5 checksum of the image file
+        """
+        path = self.get_image_filepath(image_id)
+        try:
+            set_xattr(path, 'checksum', checksum)
+        except IOError as e:
+            LOG.warn(_LW("Failed to record the checksum of cached image "
+                         "'%(image_id)s': %(error)s"),
+                     {'image_id': image_id,
+                      'error': encodeutils.exception_to_unicode(e)})
+
     @contextmanager
-    def open_for_write(self, image_id):
+    def open_for_write(self, image_id, resume=False):
         """
         Open a file for writing the image file for an image
         with supplied identifier.
 
         :param image_id: Image ID
+        :param resume: If True, append to the incomplete image file left
+                       behind by an earlier attempt, and leave the file in
+                       place for a later attempt if this one is interrupted
+                       by anything other than invalid image data
         """
         incomplete_path = self.get_image_filepath(image_id, 'incomplete')
 
@@ -274,7 +362,12 @@ class Driver(base.Driver):
                       "'%(incomplete_path)s' to '%(final_path)s'",
                       dict(incomplete_path=incomplete_path,
                            final_path=final_path))
+            try:
+                replaced = os.path.getsize(final_path)
+            except OSError:
+                replaced = 0
             os.rename(incomplete_path, final_path)
+            self._update_cache_size(os.path.getsize(final_path) - replaced)
 
             # Make sure that we "pop" the image from the queue...
             if self.is_queued(image_id):
@@ -295,11 +388,16 @@ class Driver(base.Driver):
             os.rename(incomplete_path, invalid_path)
 
         try:
-            with open(incomplete_path, 'wb') as cache_file:
+            with open(incomplete_path, 'ab' if resume else 'wb') as cache_file:
+                self.lock_incomplete_file(cache_file)
                 yield cache_file
-        except Exception as e:
+        except exception.GlanceException as e:
             with excutils.save_and_reraise_exception():
                 rollback(e)
+        except Exception as e:
+            with excutils.save_and_reraise_exception():
+                if not resume:
+                    rollback(e)
         else:
             commit()
         finally:
@@ -308,7 +406,7 @@ class Driver(base.Driver):
             # nor commit will have been called, so the incomplete file
             # will persist - in that case remove it as it is unusable
             # example: ^c from client fetch
-            if os.path.exists(incomplete_path):
+            if not resume and os.path.exists(incomplete_path):
                 rollback('incomplete fetch')
 
     @contextmanager
@@ -325,7 +423,7 @@ class Driver(base.Driver):
         path = self.get_image_filepath(image_id)
         inc_xattr(path, 'hits', 1)
 
-    def queue_image(self, image_id):
+    def queue_image(self, image_id, priority=0):
         """
         This adds a image to be cache to the queue.
 
@@ -333,6 +431,7 @@ class Driver(base.Driver):
         cached, we return False, True otherwise
 
         :param image_id: Image ID
+        :param priority: Images with a higher priority are prefetched first
         """
         if self.is_cached(image_id):
             LOG.info(_LI("Not queueing image '%s'. Already cached."), image_id)
@@ -350,9 +449,11 @@ class Driver(base.Driver):
         path = self.get_image_filepath(image_id, 'queue')
         LOG.debug("Queueing image '%s'.", image_id)
 
-        # Touch the file to add it to the queue
-        with open(path, "w"):
-            pass
+        # Touch the file to add it to the queue, it holds the priority of
+        # the image if there is one
+        with open(path, "w") as queue_file:
+            if priority:
+                queue_file.write(str(priority))
 
         return True
 
@@ -423,6 +524,8 @@ class Driver(base.Driver):
 
         self.reap_stalled(stall_time)
 
+        self.reconcile_cache_size()
+
 
 def get_all_regular_files(basepath):
     for fname in os.listdir(basepath):
@@ -432,12 +535,20 @@ def get_all_regular_files(basepath):
 
 
 def delete_cached_file(path):
-    if os.path.exists(path):
-        LOG.debug("Deleting image cache file '%s'", path)
+    """
+    Removes a cached image file. Returns True if the file was removed,
+    False if it did not exist.
+    """
+    LOG.debug("Deleting image cache file '%s'", path)
+    try:
         os.unlink(path)
-    else:
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
         LOG.warn(_LW("Cached image file '%s' doesn't exist, unable to"
                      " delete") % path)
+        return False
+    return True
 
 
 def _make_namespaced_xattr_key(key, namespace='user'):
@@ -0,0 +1,227 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache driver that uses xattr file tags, like the xattr driver, and keeps
+an index of the cached images in memory so that listing and pruning the
+cache don't scan the cache directory every time.
+"""
+
+from __future__ import absolute_import
+from contextlib import contextmanager
+import os
+import stat
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from glance.i18n import _
+from glance.image_cache.drivers import xattr
+
+LOG = logging.getLogger(__name__)
+
+xattr_indexed_opts = [
+    cfg.IntOpt('image_cache_index_refresh_interval', default=300,
+               help=_('The number of seconds after which the xattr_indexed '
+                      'image cache driver reads the hit counts and access '
+                      'times of all cached images from their files again, '
+                      'which brings in the cache hits served by other '
+                      'processes.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(xattr_indexed_opts)
+
+# Seconds within which two changes of a directory may leave it with the
+# same modification time
+MTIME_GRANULARITY = 1
+
+
+class Driver(xattr.Driver):
+
+    """
+    Cache driver that uses xattr file tags and requires a filesystem
+    that has atimes set, and keeps the records about cached images in
+    memory.
+
+    The files and their xattrs remain the source of truth. The index is
+    built from them when it is first needed, and then only brought up to
+    date with the image files other processes added or removed, which is
+    told by the modification time of the cache directory and costs a
+    single listing of the directory. Changes made by this process are
+    applied to the index as they are made.
+    """
+
+    def configure(self):
+        """
+        Configure the driver to use the stored configuration options
+        Any store that needs special configuration should implement
+        this method. If the store was not able to successfully configure
+        itself, it should raise `exception.BadDriverConfiguration`
+        """
+        super(Driver, self).configure()
+        self.reset_index()
+
+    def reset_index(self):
+        """
+        Drops the index, so that it is built anew when it is next needed.
+        """
+        # Records about cached images by image ID
+        self._index = None
+        # Names of the entries of the cache directory that aren't images
+        self._not_images = set()
+        # Modification time of the cache directory the index matches, None
+        # if the index may miss changes made at that time
+        self._index_mtime = None
+        self._index_built_at = 0
+
+    def _get_index(self):
+        if (self._index is None or time.time() - self._index_built_at >=
+                CONF.image_cache_index_refresh_interval):
+            self._build_index()
+        elif os.stat(self.base_dir).st_mtime != self._index_mtime:
+            self._sync_index()
+        return self._index
+
+    def _build_index(self):
+        LOG.debug("Building the index of cached images.")
+        self._index = {}
+        self._not_images = set()
+        self._index_built_at = time.time()
+        self._sync_index()
+
+    def _sync_index(self):
+        """
+        Adds the image files missing from the index and drops those that
+        are gone.
+        """
+        started = time.time()
+        mtime = os.stat(self.base_dir).st_mtime
+        names = set(os.listdir(self.base_dir)) - self._not_images
+        for image_id in set(self._index) - names:
+            del self._index[image_id]
+        for name in names - set(self._index):
+            entry = self._read_entry(name)
+            if entry is not None:
+                self._index[name] = entry
+        # A change made in the same tick as the one the directory was last
+        # changed in may have been missed, and would leave the modification
+        # time as it is, so the directory is listed again next time
+        if started - mtime > MTIME_GRANULARITY:
+            self._index_mtime = mtime
+        else:
+            self._index_mtime = None
+
+    def _read_entry(self, name):
+        path = os.path.join(self.base_dir, name)
+        try:
+            file_info = os.stat(path)
+            if not stat.S_ISREG(file_info.st_mode):
+                self._not_images.add(name)
+                return None
+            hits = int(xattr.get_xattr(path, 'hits', default=0))
+        except (IOError, OSError):
+            # Removed in the meantime
+            return None
+        return {'image_id': name,
+                'last_modified': file_info[stat.ST_MTIME],
+                'last_accessed': file_info[stat.ST_ATIME],
+                'size': file_info[stat.ST_SIZE],
+                'hits': hits}
+
+    def get_hit_count(self, image_id):
+        """
+        Return the number of hits that an image has.
+
+        :param image_id: Opaque image identifier
+        """
+        entry = self._get_index().get(str(image_id))
+        return entry['hits'] if entry is not None else 0
+
+    def get_cached_images(self):
+        """
+        Returns a list of records about cached images.
+        """
+        index = self._get_index()
+        return [dict(index[image_id]) for image_id in sorted(index)]
+
+    def get_least_recently_accessed(self):
+        """
+        Return a tuple containing the image_id and size of the least recently
+        accessed cached file, or None if no cached files.
+        """
+        index = self._get_index()
+        if not index:
+            return None
+        entry = min(index.values(),
+                    key=lambda e: (e['last_accessed'], e['size'],
+                                   e['image_id']))
+        return entry['image_id'], entry['size']
+
+    def delete_all_cached_images(self):
+        """
+        Removes all cached image files and any attributes about the images
+        """
+        try:
+            return super(Driver, self).delete_all_cached_images()
+        finally:
+            self.reset_index()
+
+    def delete_cached_image(self, image_id):
+        """
+        Removes a specific cached image file and any attributes about the image
+
+        :param image_id: Image ID
+        """
+        super(Driver, self).delete_cached_image(image_id)
+        if self._index is not None:
+            self._index.pop(str(image_id), None)
+
+    @contextmanager
+    def open_for_write(self, image_id, resume=False):
+        """
+        Open a file for writing the image file for an image
+        with supplied identifier.
+
+        :param image_id: Image ID
+        :param resume: If True, append to the incomplete image file left
+                       behind by an earlier attempt, and leave the file in
+                       place for a later attempt if this one is interrupted
+                       by anything other than invalid image data
+        """
+        with super(Driver, self).open_for_write(image_id,
+                                                resume) as cache_file:
+            yield cache_file
+        # Committed
+        if self._index is not None:
+            entry = self._read_entry(str(image_id))
+            if entry is not None:
+                self._index[entry['image_id']] = entry
+
+    @contextmanager
+    def open_for_read(self, image_id):
+        """
+        Open and yield file for reading the image file for an image
+        with supplied identifier.
+
+        :param image_id: Image ID
+        """
+        with super(Driver, self).open_for_read(image_id) as cache_file:
+            yield cache_file
+        entry = (self._index or {}).get(str(image_id))
+        if entry is not None:
+            entry['hits'] += 1
+            entry['last_accessed'] = int(time.time())
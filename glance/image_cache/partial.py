@@ -0,0 +1,253 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Sparse image files holding the blocks of an image read so far
+"""
+
+import errno
+import io
+import os
+import struct
+import uuid
+
+from oslo_log import log as logging
+from oslo_utils import encodeutils
+
+from glance.i18n import _LW
+
+LOG = logging.getLogger(__name__)
+
+# The trailer at the end of a partial image file: a magic string, the size
+# of the image and the size of its blocks
+TRAILER = struct.Struct('>8sQQ')
+MAGIC = b'GLNCPRT1'
+
+PRESENT = b'\x01'
+
+
+class PartialImage(object):
+
+    """
+    A sparse file holding some of the fixed size blocks of an image, at
+    their offsets in the image, followed by a block map with one byte per
+    block telling whether the block is present, and by a trailer.
+
+    A block is written before it is marked present, and a block map entry
+    is a single byte, so concurrent readers and writers in any number of
+    processes never need a lock. Since the block map lives in the same file
+    as the blocks, a partial image file that is deleted and created anew
+    never appears to hold the blocks of the old one.
+    """
+
+    def __init__(self, path, image_size, block_size):
+        """
+        :param path: Path of the partial image file
+        :param image_size: Size of the image in bytes
+        :param block_size: Size of the blocks in bytes
+        """
+        self.path = path
+        self.image_size = image_size
+        self.block_size = block_size
+        self.num_blocks = (image_size + block_size - 1) // block_size
+
+    @classmethod
+    def open(cls, path):
+        """
+        Returns the partial image file at the supplied path, or None if
+        there is none or it is not a valid partial image file.
+
+        :param path: Path of the partial image file
+        """
+        try:
+            with open(path, 'rb') as partial_file:
+                partial_file.seek(-TRAILER.size, os.SEEK_END)
+                file_size = partial_file.tell() + TRAILER.size
+                magic, image_size, block_size = TRAILER.unpack(
+                    partial_file.read(TRAILER.size))
+        except (IOError, OSError, struct.error):
+            return None
+        if magic != MAGIC or not block_size:
+            return None
+        partial = cls(path, image_size, block_size)
+        if file_size != partial._get_trailer_offset() + TRAILER.size:
+            return None
+        return partial
+
+    @classmethod
+    def create(cls, path, image_size, block_size):
+        """
+        Creates an empty partial image file at the supplied path, unless
+        there already is one for an image of the same size, and returns it.
+
+        :param path: Path of the partial image file
+        :param image_size: Size of the image in bytes
+        :param block_size: Size of the blocks in bytes
+        """
+        partial = cls.open(path)
+        if partial is not None and partial.image_size == image_size:
+            return partial
+
+        partial = cls(path, image_size, block_size)
+        tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'wb') as partial_file:
+                # Seeking past the end leaves the blocks and the block map
+                # as holes in the file
+                partial_file.seek(partial._get_trailer_offset())
+                partial_file.write(TRAILER.pack(MAGIC, image_size,
+                                                block_size))
+            if os.path.exists(path):
+                # The image changed size, which only a broken file does
+                os.rename(tmp_path, path)
+                return partial
+            try:
+                os.link(tmp_path, path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                # Created by another request in the meantime
+                return cls.open(path)
+            return partial
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def _get_trailer_offset(self):
+        return self.image_size + self.num_blocks
+
+    def get_present_blocks(self):
+        """
+        Returns the indexes of the blocks present in the file.
+        """
+        with open(self.path, 'rb') as partial_file:
+            partial_file.seek(self.image_size)
+            block_map = partial_file.read(self.num_blocks)
+        return set(index for index, present in enumerate(bytearray(block_map))
+                   if present)
+
+    def has_range(self, start, stop):
+        """
+        Returns True if all the bytes of the image from start up to but
+        excluding stop are present in the file.
+        """
+        if stop <= start:
+            return True
+        present = self.get_present_blocks()
+        blocks = range(start // self.block_size,
+                       (stop - 1) // self.block_size + 1)
+        return all(index in present for index in blocks)
+
+    def is_complete(self):
+        """
+        Returns True if all the blocks of the image are present.
+        """
+        return len(self.get_present_blocks()) == self.num_blocks
+
+    def write_iter(self, image_iter, start):
+        """
+        Returns an iterator over the image data read through image_iter,
+        starting at offset start of the image, which writes the blocks
+        the data covers completely into the file.
+
+        :param image_iter: Iterator that will read image contents
+        :param start: Offset in the image of the data
+        """
+        # Unbuffered, so that each block reaches the file before it is
+        # marked present
+        with open(self.path, 'r+b', 0) as partial_file:
+            # The offset in the image of the next byte read
+            offset = start
+            # The offset of the block being read and its data so far, the
+            # offset being None until the start of a block is reached
+            block_start = None if start % self.block_size else start
+            block = []
+            failed = False
+            for chunk in image_iter:
+                pos = 0
+                while (not failed and pos < len(chunk) and
+                       offset < self.image_size):
+                    if block_start is None:
+                        skip = min(-offset % self.block_size,
+                                   len(chunk) - pos)
+                        pos += skip
+                        offset += skip
+                        if not offset % self.block_size:
+                            block_start = offset
+                        continue
+                    block_stop = min(block_start + self.block_size,
+                                     self.image_size)
+                    size = min(block_stop - offset, len(chunk) - pos)
+                    block.append(chunk[pos:pos + size])
+                    pos += size
+                    offset += size
+                    if offset == block_stop:
+                        try:
+                            self._write_block(partial_file, block_start,
+                                              b''.join(block))
+                        except (IOError, OSError) as e:
+                            # Keep serving the data without caching it
+                            LOG.warn(_LW("Failed to write block of "
+                                         "partially cached image file "
+                                         "%(path)s: %(error)s"),
+                                     {'path': self.path,
+                                      'error':
+                                      encodeutils.exception_to_unicode(e)})
+                            failed = True
+                        block_start = offset
+                        block = []
+                yield chunk
+
+    def _write_block(self, partial_file, block_start, data):
+        partial_file.seek(block_start)
+        partial_file.write(data)
+        partial_file.seek(self.image_size + block_start // self.block_size)
+        partial_file.write(PRESENT)
+
+    def read_buffered(self, pool):
+        """
+        Returns an iterator over the bytes of the whole image, which must
+        all be present in the file, read into a buffer of a BufferPool.
+        Each chunk is a view of the buffer, which is only valid until the
+        next chunk is read.
+
+        :param pool: BufferPool to read through
+        """
+        with io.open(self.path, 'rb') as partial_file:
+            with pool.buffer() as buf:
+                view = memoryview(buf)
+                remaining = self.image_size
+                while remaining > 0:
+                    size = partial_file.readinto(
+                        view[:min(len(buf), remaining)])
+                    if not size:
+                        break
+                    remaining -= size
+                    yield view[:size]
+
+    def read(self, start, stop, chunk_size=65536):
+        """
+        Returns an iterator over the bytes of the image from start up to
+        but excluding stop, which must be present in the file.
+        """
+        with open(self.path, 'rb') as partial_file:
+            partial_file.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = partial_file.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
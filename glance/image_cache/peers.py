@@ -0,0 +1,222 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Fetches cached images from the image caches of peer API servers
+"""
+
+import bisect
+import hashlib
+import socket
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import encodeutils
+from six.moves import http_client
+from six.moves import urllib
+
+from glance.common import exception
+from glance.i18n import _, _LW
+
+LOG = logging.getLogger(__name__)
+
+peer_opts = [
+    cfg.ListOpt('image_cache_peers', default=[],
+                help=_('The URLs of the API servers, for instance '
+                       '"http://10.0.0.2:9292", whose image caches are asked '
+                       'for an image that is not cached before it is read '
+                       'from the backend store. All the API servers sharing '
+                       'their caches should be given the same list, which '
+                       'may include this API server.')),
+    cfg.StrOpt('image_cache_peer_self',
+               help=_('The URL of this API server in image_cache_peers, '
+                      'which is never asked for an image.')),
+    cfg.StrOpt('image_cache_peer_key', secret=True,
+               help=_('The key API servers present to fetch cached images '
+                      'from each other. An API server only serves its '
+                      'cached images to peers when this is set, and only '
+                      'to peers presenting the same key.')),
+    cfg.IntOpt('image_cache_peer_attempts', default=1,
+               help=_('The number of peers asked for an image that is not '
+                      'cached, in the order given by consistent hashing of '
+                      'the image ID. With 1, only the peer owning the image '
+                      'is asked.')),
+    cfg.IntOpt('image_cache_peer_timeout', default=10,
+               help=_('The number of seconds to wait for a peer to respond '
+                      'when fetching an image from its cache.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(peer_opts)
+
+# The path under which API servers serve cached images to their peers
+PEER_PATH = '/cache-peer/images/%s'
+
+# The header holding image_cache_peer_key in requests from peers
+PEER_KEY_HEADER = 'X-Image-Cache-Peer-Key'
+
+CHUNKSIZE = 65536
+
+
+class HashRing(object):
+
+    """
+    Consistent hash ring spreading image IDs across a number of nodes, so
+    that adding or removing a node only moves the images of that node.
+    """
+
+    # Points each node takes up on the ring, which even out the share of
+    # the images each node gets
+    REPLICAS = 100
+
+    def __init__(self, nodes):
+        """
+        :param nodes: Names of the nodes
+        """
+        self.ring = sorted((self._hash('%s-%d' % (node, replica)), node)
+                           for node in set(nodes)
+                           for replica in range(self.REPLICAS))
+        self.hashes = [point for point, node in self.ring]
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.md5(encodeutils.safe_encode(key)).hexdigest()
+
+    def get_nodes(self, key):
+        """
+        Returns all the nodes, the node owning the key first, then in the
+        order in which they take the key over when the nodes before them
+        are removed.
+
+        :param key: Key to look up
+        """
+        nodes = []
+        start = bisect.bisect(self.hashes, self._hash(key))
+        for index in range(len(self.ring)):
+            point, node = self.ring[(start + index) % len(self.ring)]
+            if node not in nodes:
+                nodes.append(node)
+        return nodes
+
+
+class PeerClient(object):
+
+    """
+    Fetches cached images from the image caches of the peers configured
+    with image_cache_peers.
+    """
+
+    def __init__(self):
+        self.ring = HashRing(CONF.image_cache_peers)
+
+    def get_peers(self, image_id):
+        """
+        Returns the URLs of the peers to ask for an image, in order.
+
+        :param image_id: Image ID
+        """
+        peers = [peer for peer in self.ring.get_nodes(image_id)
+                 if peer != CONF.image_cache_peer_self]
+        return peers[:CONF.image_cache_peer_attempts]
+
+    def fetch(self, image_id):
+        """
+        Asks the peers for an image in turn, yielding the connection to,
+        an iterator over the image data from and the size of the image
+        according to each peer which has the image cached. The caller
+        stops once it got the image, and closes the connection of a
+        response it does not read.
+
+        :param image_id: Image ID
+        """
+        for peer in self.get_peers(image_id):
+            try:
+                conn, resp = self._request(peer, image_id)
+            except (socket.error, http_client.HTTPException) as e:
+                LOG.warn(_LW("Failed to ask cache peer %(peer)s for image "
+                             "'%(image_id)s': %(error)s"),
+                         {'peer': peer, 'image_id': image_id,
+                          'error': encodeutils.exception_to_unicode(e)})
+                continue
+            if resp.status == http_client.OK:
+                LOG.debug("Fetching image '%(image_id)s' from cache peer "
+                          "%(peer)s", {'image_id': image_id, 'peer': peer})
+                size = resp.getheader('Content-Length')
+                yield (conn, self._read(conn, resp),
+                       int(size) if size is not None else None)
+                continue
+            if resp.status != http_client.NOT_FOUND:
+                LOG.warn(_LW("Cache peer %(peer)s responded %(status)d for "
+                             "image '%(image_id)s'"),
+                         {'peer': peer, 'status': resp.status,
+                          'image_id': image_id})
+            conn.close()
+
+    def _request(self, peer, image_id):
+        url = urllib.parse.urlparse(peer)
+        if url.scheme == 'https':
+            conn_class = http_client.HTTPSConnection
+        else:
+            conn_class = http_client.HTTPConnection
+        conn = conn_class(url.hostname, url.port,
+                          timeout=CONF.image_cache_peer_timeout)
+        try:
+            conn.request('GET', url.path.rstrip('/') + PEER_PATH % image_id,
+                         headers={PEER_KEY_HEADER: CONF.image_cache_peer_key})
+            return conn, conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+
+    @staticmethod
+    def _read(conn, resp):
+        try:
+            while True:
+                chunk = resp.read(CHUNKSIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            conn.close()
+
+
+def verified_iter(image_id, image_iter, image_checksum):
+    """
+    Returns an iterator over the image data read through image_iter which
+    holds the last chunk back until the checksum of the data was verified,
+    so that a client never receives the whole of an image a peer corrupted.
+
+    :param image_id: Image ID
+    :param image_iter: Iterator that will read image contents
+    :param image_checksum: Expected MD5 checksum of the image
+    :raises: `exception.GlanceException` if the checksum does not match
+    """
+    checksum = hashlib.md5()
+    previous = None
+    for chunk in image_iter:
+        checksum.update(chunk)
+        if previous is not None:
+            yield previous
+        previous = chunk
+    if image_checksum and checksum.hexdigest() != image_checksum:
+        msg = (_("Checksum verification failed for image '%(image_id)s' "
+                 "fetched from a cache peer. Expected checksum "
+                 "'%(expected)s', got '%(actual)s'.") %
+               {'image_id': image_id, 'expected': image_checksum,
+                'actual': checksum.hexdigest()})
+        LOG.error(msg)
+        raise exception.GlanceException(msg)
+    if previous is not None:
+        yield previous
@@ -0,0 +1,128 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Adaptive Replacement Cache eviction policy
+"""
+
+import collections
+
+from glance.image_cache.policies import base
+
+
+class Policy(base.Policy):
+
+    """
+    Splits the cached images into recent ones, which have not been hit since
+    they were cached, and frequent ones, which have, and removes the least
+    recently used image of either group depending on whether the recent
+    images take up more than a target share of the cache.
+
+    The policy remembers the images it removed from either group. When one
+    of them gets cached again the target is adapted in favour of the group
+    it was removed from: towards keeping recent images for a workload
+    scanning through new images, and towards keeping frequent images for a
+    workload going back to the same images. Sizes are accounted in bytes.
+    """
+
+    def __init__(self):
+        # Number of bytes of recent images to aim for
+        self.target = 0
+        # IDs mapped to the sizes of images removed from either group, the
+        # least recently removed first
+        self.recent_ghosts = collections.OrderedDict()
+        self.frequent_ghosts = collections.OrderedDict()
+        # IDs of the images cached when the policy last looked
+        self.known = set()
+
+    def select_victims(self, entries, max_size, overage=None):
+        self._adapt(entries, max_size)
+
+        if overage is None:
+            overage = sum(entry['size'] for entry in entries) - max_size
+        # Both lists are ordered most recently used first, so that
+        # pop() returns the least recently used image
+        recent = sorted((entry for entry in entries if not entry['hits']),
+                        key=self.sort_key, reverse=True)
+        frequent = sorted((entry for entry in entries if entry['hits']),
+                          key=self.sort_key, reverse=True)
+        recent_size = sum(entry['size'] for entry in recent)
+
+        victims = []
+        while overage > 0 and (recent or frequent):
+            if recent and (recent_size > self.target or not frequent):
+                victim = recent.pop()
+                recent_size -= victim['size']
+                ghosts = self.recent_ghosts
+            else:
+                victim = frequent.pop()
+                ghosts = self.frequent_ghosts
+            ghosts[victim['image_id']] = victim['size']
+            self.known.discard(victim['image_id'])
+            victims.append(victim)
+            overage -= victim['size']
+
+        # Remember no more removed images than fit in the cache
+        for ghosts in (self.recent_ghosts, self.frequent_ghosts):
+            ghosts_size = sum(ghosts.values())
+            while ghosts_size > max_size:
+                ghosts_size -= ghosts.popitem(last=False)[1]
+        return victims
+
+    def _adapt(self, entries, max_size):
+        """
+        Adapts the target size of the recent images to the images that have
+        been cached again since they were removed.
+        """
+        cached = set()
+        for entry in entries:
+            image_id = entry['image_id']
+            cached.add(image_id)
+            if image_id in self.known:
+                continue
+            if image_id in self.recent_ghosts:
+                ratio = self._ghosts_ratio(self.frequent_ghosts,
+                                           self.recent_ghosts)
+                self.target = min(self.target + ratio * entry['size'],
+                                  max_size)
+                del self.recent_ghosts[image_id]
+            elif image_id in self.frequent_ghosts:
+                ratio = self._ghosts_ratio(self.recent_ghosts,
+                                           self.frequent_ghosts)
+                self.target = max(self.target - ratio * entry['size'], 0)
+                del self.frequent_ghosts[image_id]
+        self.known = cached
+
+    @staticmethod
+    def _ghosts_ratio(ghosts, other_ghosts):
+        ratio = sum(ghosts.values()) / float(max(sum(other_ghosts.values()),
+                                                 1))
+        return max(ratio, 1)
+
+    def sort_key(self, entry):
+        return entry['last_accessed'], entry['image_id']
+
+    def get_state(self):
+        return {'target': self.target,
+                'recent_ghosts': list(self.recent_ghosts.items()),
+                'frequent_ghosts': list(self.frequent_ghosts.items()),
+                'known': list(self.known)}
+
+    def set_state(self, state):
+        self.target = state['target']
+        self.recent_ghosts = collections.OrderedDict(state['recent_ghosts'])
+        self.frequent_ghosts = collections.OrderedDict(
+            state['frequent_ghosts'])
+        self.known = set(state['known'])
@@ -0,0 +1,85 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Base eviction policy class
+"""
+
+
+class Policy(object):
+
+    """
+    An eviction policy picks the images to remove from the image cache
+    once it has grown beyond its maximum size.
+
+    The policy is handed the records of all cached images, as returned by
+    the get_cached_images() method of the cache drivers, and picks the
+    whole set of images to remove in one pass. A policy may remember what
+    it has seen. The ImageCache stores that in the cache directory between
+    prunes, see get_state(), so that it outlives the process pruning the
+    cache.
+    """
+
+    def select_victims(self, entries, max_size, overage=None):
+        """
+        Returns the records of the images to remove from the cache, in
+        the order they should be removed in, to bring the total size of
+        the cached images down to at most max_size bytes.
+
+        :param entries: List of records about cached images
+        :param max_size: Maximum size of the cache in bytes
+        :param overage: Number of bytes to free, by default the sizes of
+                        the entries in excess of max_size
+        """
+        if overage is None:
+            overage = sum(entry['size'] for entry in entries) - max_size
+        return take(sorted(entries, key=self.sort_key), overage)
+
+    def get_state(self):
+        """
+        Returns what the policy remembers as an object that can be
+        serialized to JSON, or None if it remembers nothing.
+        """
+        return None
+
+    def set_state(self, state):
+        """
+        Restores what the policy remembered.
+
+        :param state: Object returned by get_state()
+        """
+
+    def sort_key(self, entry):
+        """
+        Returns the key to sort the records of cached images by, such that
+        the images to remove first come first.
+
+        :param entry: Record about a cached image
+        """
+        raise NotImplementedError
+
+
+def take(entries, overage):
+    """
+    Returns the shortest prefix of entries whose sizes add up to at least
+    overage bytes.
+    """
+    victims = []
+    for entry in entries:
+        if overage <= 0:
+            break
+        victims.append(entry)
+        overage -= entry['size']
+    return victims
@@ -0,0 +1,87 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Greedy Dual Size Frequency eviction policy
+"""
+
+from glance.image_cache.policies import base
+
+
+class Policy(base.Policy):
+
+    """
+    Removes the images with the lowest priority, where the priority of an
+    image is the number of times it has been requested divided by its size,
+    plus an inflation value that ages images which have not been requested
+    for a while.
+
+    Small, popular images are kept in favour of large ones that are
+    rarely requested, which maximises the number of requests served from
+    the cache. The inflation value is raised to the priority of each image
+    removed, and an image's priority is recomputed with the current
+    inflation value whenever it has been requested since the last time the
+    policy looked at it.
+    """
+
+    def __init__(self):
+        self.inflation = 0.0
+        # Image IDs mapped to the (hits, last_accessed) of the image at the
+        # time its priority was computed, and the priority
+        self.priorities = {}
+
+    def priority(self, entry):
+        image_id = entry['image_id']
+        state = (entry['hits'], entry['last_accessed'])
+        try:
+            known_state, priority = self.priorities[image_id]
+        except KeyError:
+            known_state = None
+        if known_state != state:
+            # The request that cached the image counts as well
+            frequency = entry['hits'] + 1
+            priority = self.inflation + frequency / float(max(entry['size'],
+                                                              1))
+            self.priorities[image_id] = (state, priority)
+        return priority
+
+    def select_victims(self, entries, max_size, overage=None):
+        if overage is None:
+            overage = sum(entry['size'] for entry in entries) - max_size
+        cached = set(entry['image_id'] for entry in entries)
+        for image_id in list(self.priorities):
+            if image_id not in cached:
+                del self.priorities[image_id]
+
+        victims = base.take(sorted(entries, key=self.sort_key), overage)
+        for entry in victims:
+            self.inflation = max(self.inflation, self.priority(entry))
+            del self.priorities[entry['image_id']]
+        return victims
+
+    def sort_key(self, entry):
+        return (self.priority(entry), entry['last_accessed'],
+                entry['image_id'])
+
+    def get_state(self):
+        return {'inflation': self.inflation,
+                'priorities': self.priorities}
+
+    def set_state(self, state):
+        self.inflation = state['inflation']
+        self.priorities = dict(
+            (image_id, (tuple(known_state), priority))
+            for image_id, (known_state, priority)
+            in state['priorities'].items())
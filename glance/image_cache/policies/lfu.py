@@ -0,0 +1,31 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Least frequently used eviction policy
+"""
+
+from glance.image_cache.policies import base
+
+
+class Policy(base.Policy):
+
+    """
+    Removes the images with the fewest cache hits, the least recently
+    used first among images with as many hits.
+    """
+
+    def sort_key(self, entry):
+        return entry['hits'], entry['last_accessed'], entry['image_id']
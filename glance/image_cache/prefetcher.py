@@ -17,18 +17,62 @@
 Prefetches images into the Image Cache
 """
 
+import time
+
 import eventlet
 import glance_store
+from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import encodeutils
 
 from glance.common import exception
 from glance import context
-from glance.i18n import _LI, _LW
+from glance.i18n import _LE, _LI, _LW
 from glance.image_cache import base
+from glance.image_cache import buffers
 import glance.registry.client.v1.api as registry
 
 LOG = logging.getLogger(__name__)
 
+CONF = cfg.CONF
+
+
+class BandwidthLimiter(object):
+
+    """
+    Limits the aggregate rate at which data is read through the iterators
+    it wraps, by sleeping after each chunk read until the time the chunk
+    takes up at the allowed rate has passed.
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: Maximum number of bytes per second, 0 for no limit
+        """
+        self.rate = rate
+        # The time until which the data read so far takes up the bandwidth
+        self._busy_until = 0
+
+    def limit(self, image_iter):
+        """
+        Returns an iterator reading the chunks of image_iter no faster
+        than the allowed rate, shared with all the other iterators this
+        limiter has returned.
+
+        :param image_iter: Iterator that will read image contents
+        """
+        if not self.rate:
+            return image_iter
+        return self._limit(image_iter)
+
+    def _limit(self, image_iter):
+        for chunk in image_iter:
+            now = time.time()
+            self._busy_until = (max(now, self._busy_until) +
+                                len(chunk) / float(self.rate))
+            eventlet.sleep(self._busy_until - now)
+            yield chunk
+
 
 class Prefetcher(base.CacheApp):
 
@@ -36,6 +80,8 @@ class Prefetcher(base.CacheApp):
         super(Prefetcher, self).__init__()
         registry.configure_registry_client()
         registry.configure_registry_admin_creds()
+        self.limiter = BandwidthLimiter(
+            CONF.image_cache_prefetch_max_bandwidth)
 
     def fetch_image_into_cache(self, image_id):
         ctx = context.RequestContext(is_admin=True, show_deleted=True)
@@ -51,16 +97,50 @@ class Prefetcher(base.CacheApp):
             LOG.warn(_LW("No metadata found for image '%s'") % image_id)
             return False
 
-        location = image_meta['location']
-        image_data, image_size = glance_store.get_from_backend(location,
-                                                               context=ctx)
-        LOG.debug("Caching image '%s'", image_id)
-        cache_tee_iter = self.cache.cache_tee_iter(image_id, image_data,
-                                                   image_meta['checksum'])
-        # Image is tee'd into cache and checksum verified
-        # as we iterate
-        list(cache_tee_iter)
-        return True
+        offset = self.cache.get_resume_offset(image_id)
+        if offset is None:
+            LOG.info(_LI("Image '%s' is being written into the cache by "
+                         "another process. Not caching."), image_id)
+            return False
+
+        pool = buffers.get_pool()
+        try:
+            # The image takes up a slot of the pool while it is fetched.
+            # The chunk_size argument of the store is the number of bytes
+            # to read, not the size of the chunks, so it is left out.
+            with pool.slot():
+                location = image_meta['location']
+                image_data, image_size = glance_store.get_from_backend(
+                    location, offset=offset, context=ctx)
+                expected_size = image_meta.get('size')
+                if offset and (expected_size is None or
+                               image_size != expected_size - offset):
+                    # Some stores ignore the offset and return the whole
+                    # image, or report its whole size, so what they return
+                    # can't be appended to the incomplete image file
+                    LOG.debug("Backend store did not resume image "
+                              "'%(image_id)s' after %(offset)d bytes, "
+                              "fetching it from the start",
+                              {'image_id': image_id, 'offset': offset})
+                    if hasattr(image_data, 'close'):
+                        image_data.close()
+                    offset = 0
+                    image_data, image_size = glance_store.get_from_backend(
+                        location, context=ctx)
+                LOG.debug("Caching image '%s'", image_id)
+                cache_tee_iter = self.cache.cache_tee_iter(
+                    image_id, self.limiter.limit(image_data),
+                    image_meta['checksum'], resume_offset=offset)
+                # Image is tee'd into cache and checksum verified
+                # as we iterate
+                for chunk in cache_tee_iter:
+                    pass
+        except Exception as e:
+            LOG.error(_LE("Failed to cache image '%(image_id)s': %(error)s"),
+                      {'image_id': image_id,
+                       'error': encodeutils.exception_to_unicode(e)})
+            return False
+        return self.cache.is_cached(image_id)
 
     def run(self):
 
@@ -72,7 +152,13 @@ class Prefetcher(base.CacheApp):
         num_images = len(images)
         LOG.debug("Found %d images to prefetch", num_images)
 
-        pool = eventlet.GreenPool(num_images)
+        # Images queued with a higher priority come first, the others stay
+        # in the order they were queued in
+        images.sort(key=lambda image_id: -self.cache.get_queue_priority(
+            image_id))
+
+        pool = eventlet.GreenPool(min(num_images,
+                                      CONF.image_cache_prefetch_workers))
         results = pool.imap(self.fetch_image_into_cache, images)
         successes = sum([1 for r in results if r is True])
         if successes != num_images:
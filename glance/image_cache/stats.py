@@ -0,0 +1,282 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Counters and histograms about the activity of the Image Cache
+"""
+
+import atexit
+import bisect
+import errno
+import os
+import socket
+import time
+import uuid
+import weakref
+
+from eventlet import greenthread
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import encodeutils
+from oslo_utils import units
+
+from glance.i18n import _LW
+
+LOG = logging.getLogger(__name__)
+
+COUNTERS = (
+    # Downloads served from the image file of a cached image, including
+    # those following an image being written into the cache
+    'hits',
+    # Downloads of byte ranges served from a partially cached image file
+    'partial_hits',
+    # Downloads served from the image cache of a peer API server
+    'peer_hits',
+    # Downloads served from the backend store
+    'misses',
+    'bytes_from_cache',
+    'bytes_from_peers',
+    'bytes_from_backend',
+    # Images that failed to be written into the cache for any other reason
+    # than their data not matching their checksum
+    'tee_failures',
+    'checksum_rejections',
+    # Cached images removed to bring the cache back under its maximum size
+    'evictions_pruned',
+    # Cached images removed on request, or because the image was deleted
+    'evictions_deleted',
+    # Cached images removed because the verifier found them corrupt
+    'evictions_corrupt',
+)
+
+# The upper bounds of the buckets of each histogram, the last bucket of a
+# histogram holding the values above its last bound
+HISTOGRAMS = {
+    # Seconds taken to write an image into the cache
+    'fill_seconds': (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800),
+    # Bytes per second an image was written into the cache at
+    'fill_bytes_per_second': (units.Mi, 10 * units.Mi, 50 * units.Mi,
+                              100 * units.Mi, 250 * units.Mi, 500 * units.Mi,
+                              units.Gi),
+}
+
+# Seconds between two writes of the statistics of a process to disk
+FLUSH_INTERVAL = 5
+
+# The statistics of processes that are gone, merged by compact()
+TOTALS_NAME = 'totals.json'
+
+_INSTANCES = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all():
+    for cache_stats in list(_INSTANCES):
+        cache_stats.flush()
+
+
+def _empty_stats():
+    return {
+        'counters': dict((name, 0) for name in COUNTERS),
+        'histograms': dict((name, {'counts': [0] * (len(bounds) + 1),
+                                   'sum': 0})
+                           for name, bounds in HISTOGRAMS.items()),
+    }
+
+
+def _merge(total, stats):
+    for name, value in stats.get('counters', {}).items():
+        if name in total['counters']:
+            total['counters'][name] += value
+    for name, histogram in stats.get('histograms', {}).items():
+        total_histogram = total['histograms'].get(name)
+        # Histograms whose buckets have changed since they were written
+        # can't be added up
+        if (total_histogram is None or
+                len(histogram['counts']) != len(total_histogram['counts'])):
+            continue
+        total_histogram['counts'] = [
+            a + b for a, b in zip(total_histogram['counts'],
+                                  histogram['counts'])]
+        total_histogram['sum'] += histogram['sum']
+
+
+class CacheStats(object):
+
+    """
+    Counts what the Image Cache does in the process it runs in.
+
+    Each instance keeps its statistics in memory and writes them to a file
+    of its own under the stats directory of the cache at most every
+    FLUSH_INTERVAL seconds after they changed, and when the process exits,
+    so that recording them costs no disk access and the workers of an API
+    server never contend for a file. The statistics
+    of the whole cache are those of all the files added up.
+    """
+
+    def __init__(self, stats_dir):
+        """
+        :param stats_dir: Directory holding the statistics files
+        """
+        self.stats_dir = stats_dir
+        self.hostname = socket.gethostname()
+        self.path = os.path.join(stats_dir, '%s-%d-%s.json' % (
+            self.hostname, os.getpid(), uuid.uuid4().hex))
+        self.stats = _empty_stats()
+        self.dirty = False
+        self.last_flush = time.time()
+        self._flush_timer = None
+        _INSTANCES.add(self)
+
+    def incr(self, name, value=1):
+        """
+        Adds a value to a counter.
+
+        :param name: Name of the counter, one of COUNTERS
+        :param value: Value to add
+        """
+        self.stats['counters'][name] += value
+        self._changed()
+
+    def observe(self, name, value):
+        """
+        Records a value in a histogram.
+
+        :param name: Name of the histogram, one of HISTOGRAMS
+        :param value: Value to record
+        """
+        histogram = self.stats['histograms'][name]
+        histogram['counts'][bisect.bisect_left(HISTOGRAMS[name], value)] += 1
+        histogram['sum'] += value
+        self._changed()
+
+    def record_fill(self, seconds, size):
+        """
+        Records how long writing an image into the cache took.
+
+        :param seconds: Seconds taken to write the image
+        :param size: Number of bytes written
+        """
+        self.observe('fill_seconds', seconds)
+        if seconds > 0:
+            self.observe('fill_bytes_per_second', size / float(seconds))
+
+    def _changed(self):
+        self.dirty = True
+        now = time.time()
+        if now - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+        elif self._flush_timer is None:
+            # Nothing else may be recorded for a while
+            self._flush_timer = greenthread.spawn_after(
+                self.last_flush + FLUSH_INTERVAL - now, self._timed_flush)
+
+    def _timed_flush(self):
+        self._flush_timer = None
+        self.flush()
+
+    def flush(self):
+        """
+        Writes the statistics of this instance to disk, if they changed
+        since they were last written.
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        self.last_flush = time.time()
+        if not self.dirty:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as stats_file:
+                jsonutils.dump(self.stats, stats_file)
+            os.rename(tmp_path, self.path)
+            self.dirty = False
+        except (IOError, OSError) as e:
+            LOG.warn(_LW("Failed to write image cache statistics to "
+                         "%(path)s: %(error)s"),
+                     {'path': self.path,
+                      'error': encodeutils.exception_to_unicode(e)})
+
+    def _load(self, name):
+        try:
+            with open(os.path.join(self.stats_dir, name)) as stats_file:
+                return jsonutils.load(stats_file)
+        except (IOError, ValueError):
+            # Merged by compact() or being replaced in the meantime
+            return None
+
+    def get_stats(self):
+        """
+        Returns the statistics of the whole cache, added up from those of
+        all the processes that have used it, as a dict with a 'counters'
+        dict and a 'histograms' dict. Each histogram has the upper bounds
+        of its buckets in 'buckets', the number of values in each bucket
+        in 'counts', which has one more entry for the values above the last
+        bound, and the sum of the values in 'sum'.
+        """
+        self.flush()
+        total = _empty_stats()
+        for name in os.listdir(self.stats_dir):
+            if not name.endswith('.json'):
+                continue
+            stats = self._load(name)
+            if stats is not None:
+                _merge(total, stats)
+        for name, histogram in total['histograms'].items():
+            histogram['buckets'] = list(HISTOGRAMS[name])
+        return total
+
+    def _is_running(self, name):
+        try:
+            hostname, pid, token = name[:-len('.json')].rsplit('-', 2)
+            pid = int(pid)
+        except ValueError:
+            return True
+        if hostname != self.hostname:
+            # Can't tell, another host shares the cache directory
+            return True
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno != errno.ESRCH
+        return True
+
+    def compact(self):
+        """
+        Merges the statistics files of the processes that are no longer
+        running into a single file, so that the number of files does not
+        grow with every run of the cache management tools.
+        """
+        names = [name for name in os.listdir(self.stats_dir)
+                 if name.endswith('.json') and name != TOTALS_NAME and
+                 not self._is_running(name)]
+        if not names:
+            return
+        total = _empty_stats()
+        for name in [TOTALS_NAME] + names:
+            stats = self._load(name)
+            if stats is not None:
+                _merge(total, stats)
+        totals_path = os.path.join(self.stats_dir, TOTALS_NAME)
+        tmp_path = '%s.%s.tmp' % (totals_path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as stats_file:
+            jsonutils.dump(total, stats_file)
+        os.rename(tmp_path, totals_path)
+        for name in names:
+            try:
+                os.unlink(os.path.join(self.stats_dir, name))
+            except OSError:
+                pass
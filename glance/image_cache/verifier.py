@@ -0,0 +1,217 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Verifies the image files in the Image Cache against their checksums
+"""
+
+import hashlib
+import os
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import units
+
+from glance.common import exception
+from glance import context
+from glance.i18n import _LE, _LI, _LW
+from glance.image_cache import base
+from glance.image_cache import prefetcher
+import glance.registry.client.v1.api as registry
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+
+CHUNKSIZE = 64 * units.Ki
+
+# Outcomes of verifying a cached image
+INTACT = 'intact'
+CORRUPT = 'corrupt'
+SKIPPED = 'skipped'
+
+
+class Verifier(base.CacheApp):
+
+    """
+    Reads the image files of cached images back and compares them with the
+    checksums recorded when they were written into the cache, evicting
+    those that no longer match, so that an image file damaged on disk is
+    not served again and again until it happens to be pruned.
+
+    Each run verifies the images that were never verified first, then those
+    verified the longest time ago, reading at most
+    image_cache_verify_max_bytes at no more than
+    image_cache_verify_max_bandwidth bytes per second, so that the
+    verifier can run from cron without starving the API servers of disk
+    bandwidth.
+    """
+
+    def __init__(self):
+        super(Verifier, self).__init__()
+        registry.configure_registry_client()
+        registry.configure_registry_admin_creds()
+        self.limiter = prefetcher.BandwidthLimiter(
+            CONF.image_cache_verify_max_bandwidth)
+        self.verified_path = os.path.join(self.cache.driver.verifier_dir,
+                                          'verified.json')
+
+    def load_verified(self):
+        """
+        Returns the time each image was last verified at by image ID.
+        """
+        try:
+            with open(self.verified_path) as verified_file:
+                return jsonutils.load(verified_file)
+        except (IOError, ValueError):
+            return {}
+
+    def save_verified(self, verified):
+        """
+        Stores the time each image was last verified at.
+
+        :param verified: Times by image ID
+        """
+        tmp_path = self.verified_path + '.tmp'
+        with open(tmp_path, 'w') as verified_file:
+            jsonutils.dump(verified, verified_file)
+        os.rename(tmp_path, self.verified_path)
+
+    def get_expected_checksum(self, image_id):
+        """
+        Returns the checksum the image file of a cached image should match
+        and whether it was recorded by the cache, or (None, False) if there
+        is nothing to verify the image file against.
+
+        Images cached before checksums were recorded are verified against
+        the checksum of the image in the registry instead.
+
+        :param image_id: Image ID
+        """
+        checksum = self.cache.get_image_checksum(image_id)
+        if checksum is not None:
+            return checksum, True
+        ctx = context.RequestContext(is_admin=True, show_deleted=True)
+        try:
+            image_meta = registry.get_image_metadata(ctx, image_id)
+        except exception.NotFound:
+            return None, False
+        return image_meta.get('checksum'), False
+
+    def verify_image(self, image_id):
+        """
+        Verifies the image file of a cached image, evicting it if it does
+        not match its checksum, and returns INTACT, CORRUPT, or SKIPPED if
+        the image could not be verified.
+
+        :param image_id: Image ID
+        """
+        path = self.cache.driver.get_image_filepath(image_id)
+        checksum = hashlib.md5()
+        try:
+            # Read directly rather than through the cache driver, which
+            # would count a hit and refresh the access time of the image
+            with open(path, 'rb') as image_file:
+                inode = os.fstat(image_file.fileno()).st_ino
+                chunks = iter(lambda: image_file.read(CHUNKSIZE), b'')
+                for chunk in self.limiter.limit(chunks):
+                    checksum.update(chunk)
+        except (IOError, OSError):
+            # Removed in the meantime
+            return SKIPPED
+
+        # Looked up once the file is read, so that a checksum recorded for
+        # an image file written in the meantime is the one compared
+        expected, recorded = self.get_expected_checksum(image_id)
+        if expected is None:
+            LOG.debug("No checksum to verify cached image '%s' against.",
+                      image_id)
+            return SKIPPED
+        if checksum.hexdigest() == expected:
+            if not recorded:
+                self.cache.set_image_checksum(image_id, expected)
+            return INTACT
+
+        try:
+            replaced = os.stat(path).st_ino != inode
+        except OSError:
+            replaced = True
+        if replaced:
+            # The file read is not the one cached any more
+            return SKIPPED
+
+        LOG.error(_LE("Cached image '%(image_id)s' is corrupt, its checksum "
+                      "is %(actual)s instead of %(expected)s. Evicting it."),
+                  {'image_id': image_id, 'actual': checksum.hexdigest(),
+                   'expected': expected})
+        self.cache.delete_corrupt_image(image_id)
+        return CORRUPT
+
+    def select_images(self, entries, verified):
+        """
+        Returns the IDs of the cached images to verify this run, at most
+        image_cache_verify_max_bytes of them in total and at least one.
+
+        :param entries: Records about the cached images
+        :param verified: Times the images were last verified at by image ID
+        """
+        entries = sorted(entries,
+                         key=lambda e: (verified.get(e['image_id'], 0),
+                                        e['image_id']))
+        max_bytes = CONF.image_cache_verify_max_bytes
+        images = []
+        total = 0
+        for entry in entries:
+            total += entry['size']
+            if max_bytes and images and total > max_bytes:
+                break
+            images.append(entry['image_id'])
+        return images
+
+    def run(self):
+        entries = self.cache.get_cached_images()
+        # Images that are no longer cached are forgotten
+        cached = set(entry['image_id'] for entry in entries)
+        verified = dict((image_id, when) for image_id, when in
+                        self.load_verified().items() if image_id in cached)
+        images = self.select_images(entries, verified)
+        if not images:
+            LOG.debug("Nothing to verify.")
+            return True
+
+        results = {}
+        for image_id in images:
+            result = self.verify_image(image_id)
+            results[result] = results.get(result, 0) + 1
+            if result == INTACT:
+                verified[image_id] = time.time()
+            else:
+                verified.pop(image_id, None)
+        self.save_verified(verified)
+        self.cache.stats.flush()
+
+        if results.get(CORRUPT):
+            LOG.warn(_LW("Evicted %(corrupt)d corrupt images out of %(num)d "
+                         "cached images verified."),
+                     {'corrupt': results[CORRUPT], 'num': len(images)})
+            return False
+
+        LOG.info(_LI("Verified %(intact)d cached images, %(skipped)d could "
+                     "not be verified."),
+                 {'intact': results.get(INTACT, 0),
+                  'skipped': results.get(SKIPPED, 0)})
+        return True
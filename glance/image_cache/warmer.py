@@ -0,0 +1,198 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Warms the Image Cache up with the most requested images
+"""
+
+import datetime
+import os
+
+import eventlet
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+
+from glance.common import exception
+from glance import context
+from glance.i18n import _, _LI, _LW
+from glance.image_cache import prefetcher
+import glance.registry.client.v1.api as registry
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+
+
+def parse_window(window):
+    """
+    Returns the start and end of an "HH:MM-HH:MM" window as minutes past
+    midnight. The window wraps around midnight if it ends before it starts.
+
+    :param window: Window to parse
+    :raises: ValueError if the window is malformed
+    """
+    def _minutes(value):
+        hours, minutes = value.strip().split(':')
+        hours, minutes = int(hours), int(minutes)
+        if not (0 <= hours < 24 and 0 <= minutes < 60):
+            raise ValueError(value)
+        return hours * 60 + minutes
+
+    start, end = window.split('-')
+    return _minutes(start), _minutes(end)
+
+
+class Warmer(prefetcher.Prefetcher):
+
+    """
+    Fetches the images requested most often that are not cached into the
+    cache, so that the cache holds its hot set again soon after it was
+    wiped or the images were evicted.
+
+    How often an image was requested is told by the hits the cache driver
+    counted while the image was cached, which the warmer remembers from one
+    run to the next, and by the downloads served from the backend stores
+    that the cache middleware counted. Both are halved on every run, so
+    images that are no longer requested are eventually forgotten.
+    """
+
+    def __init__(self):
+        super(Warmer, self).__init__()
+        self.hot_set_path = os.path.join(self.cache.driver.warming_dir,
+                                         'hot_set.json')
+
+    def is_off_peak(self, now=None):
+        """
+        Returns True if the time is within image_cache_warming_window.
+
+        :param now: Time to check, the current local time by default
+        """
+        if not CONF.image_cache_warming_window:
+            return True
+        try:
+            start, end = parse_window(CONF.image_cache_warming_window)
+        except ValueError:
+            raise RuntimeError(_('Invalid image_cache_warming_window "%s", '
+                                 'expected a window such as '
+                                 '"01:00-05:30".') %
+                               CONF.image_cache_warming_window)
+        now = now or datetime.datetime.now()
+        minutes = now.hour * 60 + now.minute
+        if start <= end:
+            return start <= minutes < end
+        return minutes >= start or minutes < end
+
+    def update_hot_set(self):
+        """
+        Updates the hits remembered for each image with those of the cached
+        images, halving the hits of the images that are no longer cached,
+        and returns them by image ID.
+        """
+        hot_set = {}
+        try:
+            with open(self.hot_set_path) as hot_set_file:
+                hot_set = jsonutils.load(hot_set_file)
+        except (IOError, ValueError):
+            pass
+
+        hot_set = dict((image_id, hits // 2)
+                       for image_id, hits in hot_set.items())
+        for entry in self.cache.get_cached_images():
+            hot_set[entry['image_id']] = entry['hits']
+        hot_set = dict((image_id, hits)
+                       for image_id, hits in hot_set.items() if hits > 0)
+
+        tmp_path = self.hot_set_path + '.tmp'
+        with open(tmp_path, 'w') as hot_set_file:
+            jsonutils.dump(hot_set, hot_set_file)
+        os.rename(tmp_path, self.hot_set_path)
+        return hot_set
+
+    def select_images(self, hot_set, miss_counts):
+        """
+        Returns the IDs of the active images that are not cached with the
+        most requests, most requests first, at most
+        image_cache_warming_images of them and at most
+        image_cache_warming_max_bytes in total.
+
+        :param hot_set: Hits remembered by update_hot_set()
+        :param miss_counts: Downloads counted by the cache middleware
+        """
+        requests = dict(hot_set)
+        for image_id, count in miss_counts.items():
+            requests[image_id] = requests.get(image_id, 0) + count
+
+        ctx = context.RequestContext(is_admin=True, show_deleted=True)
+        budget = CONF.image_cache_warming_max_bytes
+        images = []
+        for image_id in sorted(requests,
+                               key=lambda i: (-requests[i], i)):
+            if len(images) == CONF.image_cache_warming_images:
+                break
+            if (self.cache.is_cached(image_id) or
+                    self.cache.is_being_cached(image_id)):
+                continue
+            try:
+                image_meta = registry.get_image_metadata(ctx, image_id)
+            except exception.NotFound:
+                image_meta = None
+            if image_meta is None or image_meta['status'] != 'active':
+                # Not worth warming up
+                self.cache.forget_misses(image_id)
+                continue
+            size = image_meta['size'] or 0
+            if budget:
+                if size > budget:
+                    continue
+                budget -= size
+            images.append(image_id)
+        return images
+
+    def run(self):
+        if not CONF.image_cache_warming_images:
+            LOG.debug("Cache warming is disabled.")
+            return True
+        if not self.is_off_peak():
+            LOG.info(_LI("Not warming the cache up outside of the off-peak "
+                         "hours %s."), CONF.image_cache_warming_window)
+            return True
+
+        hot_set = self.update_hot_set()
+        images = self.select_images(hot_set, self.cache.get_miss_counts())
+        self.cache.decay_miss_counts()
+        if not images:
+            LOG.debug("Nothing to warm the cache up with.")
+            return True
+
+        LOG.info(_LI("Warming the cache up with %d images"), len(images))
+        # Queued images that fail to be fetched are left for the prefetcher
+        for image_id in images:
+            self.cache.queue_image(image_id)
+
+        pool = eventlet.GreenPool(min(len(images),
+                                      CONF.image_cache_warming_workers))
+        results = list(pool.imap(self.fetch_image_into_cache, images))
+        for image_id, cached in zip(images, results):
+            if cached:
+                self.cache.forget_misses(image_id)
+        if not all(results):
+            LOG.warn(_LW("Failed to warm the cache up with all %d images."),
+                     len(images))
+            return False
+
+        LOG.info(_LI("Successfully warmed the cache up with %d images"),
+                 len(images))
+        return True
@@ -0,0 +1,200 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Writes images into the Image Cache behind the requests reading them
+"""
+
+import hashlib
+import time
+
+import eventlet
+from eventlet import queue
+from eventlet import tpool
+from oslo_log import log as logging
+from oslo_utils import encodeutils
+
+from glance.common import exception
+from glance.common import utils
+from glance.i18n import _, _LW
+
+LOG = logging.getLogger(__name__)
+
+# Queued after the last chunk of an image, or to wake the writer up when
+# caching the image is aborted
+_END = object()
+
+
+class CacheWriter(object):
+
+    """
+    Writes the chunks of an image handed to it into the cache from a green
+    thread of its own, which runs each write in a native thread, so that
+    the request reading the image never waits for the cache disk.
+
+    At most max_pending bytes handed to the writer may wait to be written.
+    If the writer falls further behind, caching the image is aborted
+    rather than slowing the request down.
+    """
+
+    def __init__(self, cache, image_id, max_pending):
+        """
+        :param cache: ImageCache the image is written into
+        :param image_id: Image ID
+        :param max_pending: Maximum number of bytes waiting to be written
+        """
+        self.cache = cache
+        self.image_id = image_id
+        self.max_pending = max_pending
+        self.pending = 0
+        self.error = None
+        self.checksum = None
+        self.chunks = queue.LightQueue()
+        self.thread = None
+
+    def start(self):
+        self.thread = eventlet.spawn(self._run)
+
+    def wait(self):
+        """
+        Waits for the image to be written into the cache, or for caching it
+        to be aborted, and returns True if it was cached.
+        """
+        self.thread.wait()
+        return self.error is None
+
+    def write(self, chunk):
+        """
+        Hands a chunk of the image to the writer, unless caching the image
+        was aborted.
+
+        :param chunk: Chunk of image data
+        """
+        if self.error is not None:
+            return
+        if self.pending + len(chunk) > self.max_pending:
+            self.cache.stats.incr('tee_failures')
+            self.abort(_("Writing the image into the cache fell behind by "
+                         "more than %d bytes.") % self.max_pending)
+            return
+        self.pending += len(chunk)
+        self.chunks.put(chunk)
+
+    def close(self, checksum=None):
+        """
+        Tells the writer all chunks of the image were handed to it, so
+        that it commits the image into the cache once it has written them.
+
+        :param checksum: MD5 checksum of the image, recorded once the image
+                         is committed
+        """
+        self.checksum = checksum
+        self.chunks.put(_END)
+
+    def abort(self, reason):
+        """
+        Aborts caching the image, so that the writer rolls the incomplete
+        image file back instead of committing it.
+
+        :param reason: Why caching the image was aborted
+        """
+        if self.error is None:
+            self.error = reason
+            self.chunks.put(_END)
+
+    def _run(self):
+        started = time.time()
+        written = 0
+        try:
+            with self.cache.driver.open_for_write(self.image_id) as cache_file:
+                # The incomplete cache file now exists, so requests waiting
+                # on our claim can follow it from here on
+                self.cache.release_fill(self.image_id)
+                while True:
+                    chunk = self.chunks.get()
+                    if self.error is not None:
+                        raise exception.GlanceException(self.error)
+                    if chunk is _END:
+                        break
+                    tpool.execute(cache_file.write, chunk)
+                    self.pending -= len(chunk)
+                    written += len(chunk)
+                tpool.execute(cache_file.flush)
+            self.cache.stats.record_fill(time.time() - started, written)
+            if self.checksum is not None:
+                self.cache.set_image_checksum(self.image_id, self.checksum)
+            self.cache.maybe_prune()
+        except Exception as e:
+            self.cache.release_fill(self.image_id)
+            if self.error is None:
+                # Not aborted, but failed to write the image
+                self.cache.stats.incr('tee_failures')
+            self.error = self.error or encodeutils.exception_to_unicode(e)
+            LOG.warn(_LW("Aborted caching of image '%(image_id)s': "
+                         "%(error)s"), {'image_id': self.image_id,
+                                        'error': self.error})
+
+
+class WriteBehindTee(utils.ImageStreamListener):
+
+    """
+    Hands the image data read through an ImageStream to a CacheWriter,
+    which commits the image once the stream ended with data matching the
+    expected checksum, and rolls it back otherwise.
+    """
+
+    def __init__(self, writer, image_checksum):
+        """
+        :param writer: CacheWriter writing the image into the cache
+        :param image_checksum: checksum expected to be generated while
+                               iterating over image data
+        """
+        self.writer = writer
+        self.image_checksum = image_checksum
+        self.checksum = hashlib.md5()
+        self.done = False
+
+    def start(self):
+        self.writer.start()
+
+    def chunk_callbacks(self):
+        return [self.checksum.update, self.writer.write]
+
+    def end(self, bytes_read):
+        self.done = True
+        if (self.image_checksum and
+                self.image_checksum != self.checksum.hexdigest()):
+            self.writer.cache.stats.incr('checksum_rejections')
+            msg = _("Checksum verification failed. Aborted "
+                    "caching of image '%s'.") % self.writer.image_id
+            LOG.error(msg)
+            self.writer.abort(msg)
+            raise exception.GlanceException(msg)
+        self.writer.close(self.checksum.hexdigest())
+
+    def error(self, exc, bytes_read):
+        if isinstance(exc, exception.GlanceException):
+            LOG.error(encodeutils.exception_to_unicode(exc))
+        self._abort()
+        return False
+
+    def close(self, bytes_read):
+        self._abort()
+
+    def _abort(self):
+        if not self.done:
+            self.done = True
+            self.writer.abort(_("Incomplete fetch of image '%s'.") %
+                              self.writer.image_id)
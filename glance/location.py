@@ -24,6 +24,7 @@ from oslo_utils import encodeutils
 from oslo_utils import excutils
 
 from glance.common import exception
+from glance.common import multihash
 from glance.common import signature_utils
 from glance.common import utils
 import glance.domain.proxy
@@ -391,13 +392,18 @@ class ImageProxy(glance.domain.proxy.Image):
     def set_data(self, data, size=None):
         if size is None:
             size = 0  # NOTE(markwash): zero -> unknown size
-        location, size, checksum, loc_meta = self.store_api.add_to_backend(
-            CONF,
-            self.image.image_id,
-            utils.LimitingReader(utils.CooperativeReader(data),
-                                 CONF.image_size_cap),
-            size,
-            context=self.context)
+        data = utils.LimitingReader(utils.CooperativeReader(data),
+                                    CONF.image_size_cap)
+        hasher = multihash.MultiHasher.configured()
+        if hasher is not None:
+            data = multihash.HashingReader(data, hasher)
+        with utils.upload_pipeline(data) as data:
+            location, size, checksum, loc_meta = (
+                self.store_api.add_to_backend(CONF,
+                                              self.image.image_id,
+                                              data,
+                                              size,
+                                              context=self.context))
 
         self._verify_signature_if_needed(checksum)
 
@@ -405,6 +411,8 @@ class ImageProxy(glance.domain.proxy.Image):
                                  'status': 'active'}]
         self.image.size = size
         self.image.checksum = checksum
+        if hasher is not None:
+            self.image.extra_properties.update(hasher.properties())
         self.image.status = 'active'
 
     @debtcollector.removals.remove(
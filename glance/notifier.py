@@ -27,6 +27,7 @@ import webob
 
 from glance.common import exception
 from glance.common import timeutils
+from glance.common import utils
 from glance.domain import proxy as domain_proxy
 from glance.i18n import _, _LE
 
@@ -345,6 +346,33 @@ class NotificationFactoryProxy(object):
         pass
 
 
+class ImageSendNotification(utils.ImageStreamListener):
+    """Sends an image.send notification once image data was read."""
+
+    def __init__(self, image_proxy, expected_size):
+        """
+        :param image_proxy: ImageProxy of the image read
+        :param expected_size: Number of bytes expected to be read
+        """
+        self.image_proxy = image_proxy
+        self.expected_size = expected_size
+
+    def end(self, bytes_read):
+        image_proxy = self.image_proxy
+        if bytes_read != self.expected_size:
+            notify = image_proxy.notifier.error
+        else:
+            notify = image_proxy.notifier.info
+
+        try:
+            _send_notification(notify, 'image.send',
+                               image_proxy._format_image_send(bytes_read))
+        except Exception as err:
+            msg = (_LE("An error occurred during image.send"
+                       " notification: %(err)s") % {'err': err})
+            LOG.error(msg)
+
+
 class ImageProxy(NotificationProxy, domain_proxy.Image):
     def get_super_class(self):
         return domain_proxy.Image
@@ -361,31 +389,10 @@ class ImageProxy(NotificationProxy, domain_proxy.Image):
             'receiver_user_id': self.context.user,
         }
 
-    def _get_chunk_data_iterator(self, data, chunk_size=None):
-        sent = 0
-        for chunk in data:
-            yield chunk
-            sent += len(chunk)
-
-        if sent != (chunk_size or self.repo.size):
-            notify = self.notifier.error
-        else:
-            notify = self.notifier.info
-
-        try:
-            _send_notification(notify, 'image.send',
-                               self._format_image_send(sent))
-        except Exception as err:
-            msg = (_LE("An error occurred during image.send"
-                       " notification: %(err)s") % {'err': err})
-            LOG.error(msg)
-
     def get_data(self, offset=0, chunk_size=None):
-        # Due to the need of evaluating subsequent proxies, this one
-        # should return a generator, the call should be done before
-        # generator creation
         data = self.repo.get_data(offset=offset, chunk_size=chunk_size)
-        return self._get_chunk_data_iterator(data, chunk_size=chunk_size)
+        return utils.ImageStream.of(data).add_listener(
+            ImageSendNotification(self, chunk_size or self.repo.size))
 
     def set_data(self, data, size=None):
         self.send_notification('image.prepare', self.repo)
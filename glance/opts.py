@@ -30,11 +30,16 @@ import glance.async.taskflow_executor
 import glance.common.config
 import glance.common.location_strategy
 import glance.common.location_strategy.store_type
+import glance.common.multihash
 import glance.common.property_utils
 import glance.common.rpc
+import glance.common.utils
 import glance.common.wsgi
 import glance.image_cache
 import glance.image_cache.drivers.sqlite
+import glance.image_cache.drivers.tiered
+import glance.image_cache.drivers.xattr_indexed
+import glance.image_cache.peers
 import glance.notifier
 import glance.registry
 import glance.registry.client
@@ -48,13 +53,19 @@ _api_opts = [
         glance.api.versions.versions_opts,
         glance.common.config.common_opts,
         glance.common.location_strategy.location_strategy_opts,
+        glance.common.multihash.multihash_opts,
         glance.common.property_utils.property_opts,
         glance.common.rpc.rpc_opts,
+        glance.common.utils.cooperative_opts,
+        glance.common.utils.upload_pipeline_opts,
         glance.common.wsgi.bind_opts,
         glance.common.wsgi.eventlet_opts,
         glance.common.wsgi.socket_opts,
         glance.image_cache.drivers.sqlite.sqlite_opts,
+        glance.image_cache.drivers.tiered.tiered_opts,
+        glance.image_cache.drivers.xattr_indexed.xattr_indexed_opts,
         glance.image_cache.image_cache_opts,
+        glance.image_cache.peers.peer_opts,
         glance.notifier.notifier_opts,
         glance.registry.registry_addr_opts,
         glance.registry.client.registry_client_ctx_opts,
@@ -93,6 +104,8 @@ _cache_opts = [
     (None, list(itertools.chain(
         glance.common.config.common_opts,
         glance.image_cache.drivers.sqlite.sqlite_opts,
+        glance.image_cache.drivers.tiered.tiered_opts,
+        glance.image_cache.drivers.xattr_indexed.xattr_indexed_opts,
         glance.image_cache.image_cache_opts,
         glance.registry.registry_addr_opts,
         glance.registry.client.registry_client_ctx_opts))),
@@ -98,6 +98,49 @@ class TestCacheManageFilter(test_utils.BaseTestCase):
         self.assertEqual('"' + self.stub_value + '"',
                          resource.body.decode('utf-8'))
 
+    @mock.patch.object(cached_images.Controller,
+                       "delete_listed_cached_images")
+    def test_post_cached_images_delete(self,
+                                       mock_delete_listed_cached_images):
+        # setup
+        mock_delete_listed_cached_images.return_value = self.stub_value
+
+        # prepare
+        request = webob.Request.blank("/v1/cached_images/delete",
+                                      environ={'REQUEST_METHOD': "POST"})
+        request.content_type = 'application/json'
+        request.body = b'{"image_ids": ["image_id_stub"]}'
+
+        # call
+        resource = self.cache_manage_filter.process_request(request)
+
+        # check
+        mock_delete_listed_cached_images.assert_called_with(
+            request, body={'image_ids': [self.image_id]})
+        self.assertEqual('"' + self.stub_value + '"',
+                         resource.body.decode('utf-8'))
+
+    @mock.patch.object(cached_images.Controller, "queue_images")
+    def test_post_queued_images(self,
+                                mock_queue_images):
+        # setup
+        mock_queue_images.return_value = self.stub_value
+
+        # prepare
+        request = webob.Request.blank("/v1/queued_images",
+                                      environ={'REQUEST_METHOD': "POST"})
+        request.content_type = 'application/json'
+        request.body = b'{"image_ids": ["image_id_stub"], "priority": 5}'
+
+        # call
+        resource = self.cache_manage_filter.process_request(request)
+
+        # check
+        mock_queue_images.assert_called_with(
+            request, body={'image_ids': [self.image_id], 'priority': 5})
+        self.assertEqual('"' + self.stub_value + '"',
+                         resource.body.decode('utf-8'))
+
     @mock.patch.object(cached_images.Controller, "queue_image")
     def test_put_queued_image(self,
                               mock_queue_image):
@@ -169,3 +212,19 @@ class TestCacheManageFilter(test_utils.BaseTestCase):
         mock_delete_queued_images.assert_called_with(request)
         self.assertEqual('"' + self.stub_value + '"',
                          resource.body.decode('utf-8'))
+
+    @mock.patch.object(cached_images.Controller, "get_cache_stats")
+    def test_get_cache_stats(self, mock_get_cache_stats):
+        # setup
+        mock_get_cache_stats.return_value = self.stub_value
+
+        # prepare
+        request = webob.Request.blank("/v1/cache_stats")
+
+        # call
+        resource = self.cache_manage_filter.process_request(request)
+
+        # check
+        mock_get_cache_stats.assert_called_with(request)
+        self.assertEqual('"' + self.stub_value + '"',
+                         resource.body.decode('utf-8'))
@@ -13,6 +13,7 @@
 import optparse
 import sys
 
+import fixtures
 import mock
 import prettytable
 from six.moves import StringIO
@@ -120,6 +121,24 @@ class TestGlanceCmdManage(test_utils.BaseTestCase):
         self.assertEqual(cache_manage.SUCCESS,
                          cache_manage.list_queued(mock.Mock(), ''))
 
+    @mock.patch.object(glance.image_cache.client.CacheClient,
+                       'get_cache_stats')
+    @mock.patch.object(prettytable.PrettyTable, 'add_row')
+    def test_show_stats(self, mock_row_create, mock_stats):
+        mock_stats.return_value = {
+            'hit_ratio': 0.5, 'size': 1024, 'max_size': 2048,
+            'counters': {'hits': 1, 'misses': 1},
+            'histograms': {'fill_seconds': {'buckets': [1, 10],
+                                            'counts': [1, 0, 2],
+                                            'sum': 61}}}
+        self.assertEqual(cache_manage.SUCCESS,
+                         cache_manage.show_stats(mock.Mock(), []))
+
+        rows = [args[0] for args, kwargs in mock_row_create.call_args_list]
+        self.assertEqual([('hit_ratio', '0.500'), ('size', 1024),
+                          ('max_size', 2048), ('hits', 1), ('misses', 1),
+                          ('<= 1', 1), ('<= 10', 0), ('> 10', 2)], rows)
+
     def test_queue_image_without_index(self):
         self.assertEqual(cache_manage.FAILURE,
                          cache_manage.queue_image(mock.Mock(), []))
@@ -146,6 +165,7 @@ class TestGlanceCmdManage(test_utils.BaseTestCase):
         mock_options = mock.Mock()
         mock_options.force = False
         mock_options.verbose = True  # to cover additional condition and line
+        mock_options.priority = None
         manager = mock.MagicMock()
         manager.attach_mock(mock_client, 'mock_client')
 
@@ -153,9 +173,89 @@ class TestGlanceCmdManage(test_utils.BaseTestCase):
                          cache_manage.queue_image(mock_options, ['img_id']))
         self.assertTrue(mock_client.called)
         self.assertIn(
-            mock.call.mock_client().queue_image_for_caching('img_id'),
+            mock.call.mock_client().queue_image_for_caching('img_id', None),
             manager.mock_calls)
 
+    def test_read_image_ids_from_args(self):
+        mock_options = mock.Mock()
+        self.assertEqual(['id1', 'id2'],
+                         cache_manage.read_image_ids(mock_options,
+                                                     ['id1', 'id2']))
+
+    def test_read_image_ids_from_file(self):
+        path = self.useFixture(fixtures.TempDir()).path + '/ids.txt'
+        with open(path, 'w') as ids_file:
+            ids_file.write('# Golden images\nid1 id2\n\n  id3\n')
+        mock_options = mock.Mock()
+        mock_options.file = path
+        self.assertEqual(['id1', 'id2', 'id3'],
+                         cache_manage.read_image_ids(mock_options, []))
+
+    def test_read_image_ids_from_stdin(self):
+        mock_options = mock.Mock()
+        for file_option in (None, '-'):
+            mock_options.file = file_option
+            with mock.patch('sys.stdin', new=StringIO('id1\nid2\n')):
+                self.assertEqual(['id1', 'id2'],
+                                 cache_manage.read_image_ids(mock_options,
+                                                             []))
+
+    @mock.patch.object(glance.cmd.cache_manage, 'read_image_ids',
+                       return_value=[])
+    def test_queue_images_without_index(self, mock_read_image_ids):
+        self.assertEqual(cache_manage.FAILURE,
+                         cache_manage.queue_images(mock.Mock(), []))
+
+    @mock.patch.object(glance.cmd.cache_manage, 'user_confirm')
+    @mock.patch.object(glance.cmd.cache_manage, 'get_client')
+    def test_queue_images_not_forced_not_confirmed(self, mock_client,
+                                                   mock_confirm):
+        mock_confirm.return_value = False
+        mock_options = mock.Mock()
+        mock_options.force = False
+        self.assertEqual(cache_manage.SUCCESS,
+                         cache_manage.queue_images(mock_options,
+                                                   ['id1', 'id2']))
+        self.assertFalse(mock_client.called)
+
+    @mock.patch.object(glance.cmd.cache_manage, 'get_client')
+    def test_queue_images_forced(self, mock_client):
+        mock_options = mock.Mock()
+        mock_options.force = True
+        mock_options.verbose = True
+        mock_options.priority = 5
+        mock_client.return_value.queue_images_for_caching.return_value = 2
+
+        self.assertEqual(cache_manage.SUCCESS,
+                         cache_manage.queue_images(mock_options,
+                                                   ['id1', 'id2']))
+        mock_client.return_value.queue_images_for_caching.\
+            assert_called_once_with(['id1', 'id2'], 5)
+
+    @mock.patch.object(glance.cmd.cache_manage, 'read_image_ids',
+                       return_value=[])
+    def test_delete_listed_cached_images_without_index(self,
+                                                       mock_read_image_ids):
+        self.assertEqual(cache_manage.FAILURE,
+                         cache_manage.delete_cached_images(mock.Mock(), []))
+
+    @mock.patch.object(glance.cmd.cache_manage, 'user_confirm')
+    @mock.patch.object(glance.cmd.cache_manage, 'get_client')
+    def test_delete_listed_cached_images_not_forced_confirmed(self,
+                                                              mock_client,
+                                                              mock_confirm):
+        mock_confirm.return_value = True
+        mock_options = mock.Mock()
+        mock_options.force = False
+        mock_options.verbose = True
+        mock_client.return_value.delete_cached_images.return_value = 2
+
+        self.assertEqual(cache_manage.SUCCESS,
+                         cache_manage.delete_cached_images(mock_options,
+                                                           ['id1', 'id2']))
+        mock_client.return_value.delete_cached_images.\
+            assert_called_once_with(['id1', 'id2'])
+
     def test_delete_cached_image_without_index(self):
         self.assertEqual(cache_manage.FAILURE,
                          cache_manage.delete_cached_image(mock.Mock(), []))
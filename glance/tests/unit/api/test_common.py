@@ -127,6 +127,22 @@ class TestSizeCheckedIter(testtools.TestCase):
         self.assertEqual('E', next(checked_image))
         self.assertRaises(exception.GlanceException, next, checked_image)
 
+    def test_data_sent_by_iterator(self):
+        class SendingIterator(object):
+            bytes_sent = 0
+
+            def __iter__(self):
+                yield 'AB'
+                self.bytes_sent = 4
+
+        resp = self._get_webob_response()
+        meta = self._get_image_metadata()
+        checked_image = glance.api.common.size_checked_iter(
+            resp, meta, 6, SendingIterator(), None)
+
+        self.assertEqual('AB', next(checked_image))
+        self.assertRaises(StopIteration, next, checked_image)
+
 
 class TestMalformedRequest(test_utils.BaseTestCase):
     def setUp(self):
@@ -0,0 +1,91 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+
+import mock
+import six
+
+from glance.common import multihash
+from glance.tests import utils as test_utils
+
+
+class TestMultiHasher(test_utils.BaseTestCase):
+
+    def _test_hexdigests(self, threaded):
+        data = b'0123456789' * 10
+        hasher = multihash.MultiHasher(['md5', 'sha256', 'sha512'], threaded)
+        for i in range(0, len(data), 7):
+            hasher.update(data[i:i + 7])
+        self.assertEqual({'md5': hashlib.md5(data).hexdigest(),
+                          'sha256': hashlib.sha256(data).hexdigest(),
+                          'sha512': hashlib.sha512(data).hexdigest()},
+                         hasher.hexdigests())
+        self.assertEqual(hashlib.md5(data).hexdigest(),
+                         hasher.hexdigest('md5'))
+
+    @mock.patch.object(multihash, 'BATCH_SIZE', 16)
+    def test_hexdigests_threaded(self):
+        self._test_hexdigests(True)
+
+    def test_hexdigests_inline(self):
+        self._test_hexdigests(False)
+
+    @mock.patch.object(multihash, 'BATCH_SIZE', 16)
+    def test_reused_buffer(self):
+        hasher = multihash.MultiHasher(['sha256'], threaded=True)
+        buf = bytearray(8)
+        for byte in (b'a', b'b', b'c'):
+            buf[:] = byte * 8
+            hasher.update(memoryview(buf))
+        self.assertEqual(hashlib.sha256(b'a' * 8 + b'b' * 8 +
+                                        b'c' * 8).hexdigest(),
+                         hasher.hexdigest('sha256'))
+
+    def test_properties(self):
+        hasher = multihash.MultiHasher(['sha256'])
+        hasher.update(b'*')
+        self.assertEqual(
+            {'os_hash_sha256': hashlib.sha256(b'*').hexdigest()},
+            hasher.properties())
+
+    def test_unknown_algorithm(self):
+        self.assertRaises(ValueError, multihash.MultiHasher, ['foo'])
+
+    def test_configured(self):
+        self.assertIsNone(multihash.MultiHasher.configured())
+        self.config(image_hash_algorithms=['sha256', 'sha512'])
+        hasher = multihash.MultiHasher.configured()
+        self.assertEqual(['sha256', 'sha512'], sorted(hasher.digests))
+        self.assertFalse(hasher.threaded)
+        self.config(image_hash_threaded=True)
+        self.assertTrue(multihash.MultiHasher.configured().threaded)
+
+    def test_hashing_reader(self):
+        data = b'0123456789' * 5
+        hasher = multihash.MultiHasher(['sha256'])
+        reader = multihash.HashingReader(six.BytesIO(data), hasher)
+        self.assertEqual(data[:16], reader.read(16))
+        self.assertEqual(data[16:], reader.read(64))
+        self.assertEqual(b'', reader.read(64))
+        self.assertEqual(hashlib.sha256(data).hexdigest(),
+                         hasher.hexdigest('sha256'))
+
+        hasher = multihash.MultiHasher(['sha256'])
+        reader = multihash.HashingReader(iter([data[:16], data[16:]]),
+                                         hasher)
+        self.assertEqual(data, b''.join(reader))
+        self.assertEqual(hashlib.sha256(data).hexdigest(),
+                         hasher.hexdigest('sha256'))
@@ -17,6 +17,8 @@
 import os
 import tempfile
 
+import eventlet
+import mock
 import six
 import webob
 
@@ -115,6 +117,219 @@ class TestUtils(test_utils.BaseTestCase):
         read_size = 8 * 1024           # 8k, as in httplib
         self._test_reader_chunked(chunk_size, read_size)
 
+    def test_cooperative_reader_whole_chunks_not_copied(self):
+        chunks = [b'a' * 4, b'b' * 4]
+        reader = utils.CooperativeReader(chunks)
+        self.assertIs(chunks[0], reader.read(4))
+        self.assertEqual(b'bb', reader.read(2))
+        self.assertEqual(b'bb', reader.read(4))
+        self.assertEqual(b'', reader.read(4))
+
+    def test_cooperative_reader_read_without_length(self):
+        reader = utils.CooperativeReader([b'abcd', b'efgh'])
+        self.assertEqual(b'a', reader.read(1))
+        self.assertEqual(b'bcd', reader.read())
+        self.assertEqual(b'efgh', reader.read())
+        self.assertEqual(b'', reader.read())
+
+    def test_cooperative_reader_readinto(self):
+        generator = self._create_generator(43, 5)
+        reader = utils.CooperativeReader(generator)
+        buf = bytearray(101)
+        result = bytearray()
+        self.assertEqual(2, reader.read(2).count(b'a'))
+        while True:
+            size = reader.readinto(buf)
+            if not size:
+                break
+            result += buf[:size]
+        self.assertEqual(b'a' * 41 + b'b' * 43 + b'c' * 43 + b'a' * 43 +
+                         b'b' * 43, bytes(result))
+
+    def test_cooperative_reader_readinto_file(self):
+        with tempfile.TemporaryFile('w+b') as tmp_fd:
+            tmp_fd.write(b'*' * 10)
+            tmp_fd.seek(0)
+            reader = utils.CooperativeReader(tmp_fd)
+            buf = bytearray(8)
+            self.assertEqual(8, reader.readinto(buf))
+            self.assertEqual(2, reader.readinto(buf))
+            self.assertEqual(b'**', bytes(buf[:2]))
+            self.assertEqual(0, reader.readinto(buf))
+
+    @mock.patch.object(utils, 'sleep')
+    def test_cooperative_iter_yields_by_bytes(self, mock_sleep):
+        self.config(cooperative_yield_interval=0, cooperative_yield_bytes=25)
+        chunks = list(utils.cooperative_iter(iter([b'*' * 10] * 10)))
+        self.assertEqual([b'*' * 10] * 10, chunks)
+        # After the 3rd, 6th and 9th chunks
+        self.assertEqual(3, mock_sleep.call_count)
+
+    @mock.patch.object(utils.time, 'time')
+    @mock.patch.object(utils, 'sleep')
+    def test_cooperative_iter_yields_by_time(self, mock_sleep, mock_time):
+        self.config(cooperative_yield_interval=10, cooperative_yield_bytes=0)
+        # The first value is the start of the stream, then one is read
+        # after each chunk and one more after each yield
+        mock_time.side_effect = [0, 0.004, 0.008, 0.012, 0.012, 0.02, 0.03,
+                                 0.03]
+        list(utils.cooperative_iter(iter([b'*'] * 5)))
+        self.assertEqual(2, mock_sleep.call_count)
+
+    @mock.patch.object(utils, 'sleep')
+    def test_cooperative_iter_yields_every_chunk(self, mock_sleep):
+        self.config(cooperative_yield_interval=0, cooperative_yield_bytes=0)
+        list(utils.cooperative_iter(iter([b'*'] * 5)))
+        self.assertEqual(5, mock_sleep.call_count)
+
+    @mock.patch.object(utils, 'sleep')
+    def test_cooperative_reader_yields_by_bytes(self, mock_sleep):
+        self.config(cooperative_yield_interval=0, cooperative_yield_bytes=16)
+        reader = utils.CooperativeReader(six.BytesIO(b'*' * 40))
+        while reader.read(8):
+            pass
+        self.assertEqual(2, mock_sleep.call_count)
+
+    def test_pipelined_reader(self):
+        data = b'0123456789' * 5
+        pipeline = utils.PipelinedReader(six.BytesIO(data), 16, 2)
+        self.assertEqual([data[:16], data[16:32], data[32:48], data[48:]],
+                         list(pipeline))
+
+    def test_pipelined_reader_bounded(self):
+        reads = []
+
+        class Reader(object):
+            def read(self, size):
+                reads.append(size)
+                return b'*' * size
+
+        pipeline = iter(utils.PipelinedReader(Reader(), 16, 2))
+        self.assertEqual(b'*' * 16, next(pipeline))
+        eventlet.sleep(0)
+        # Two chunks in the queue and one waiting to be put into it
+        self.assertEqual(4, len(reads))
+        self.assertEqual(b'*' * 16, next(pipeline))
+        eventlet.sleep(0)
+        self.assertEqual(5, len(reads))
+        pipeline.close()
+        eventlet.sleep(0)
+        self.assertEqual(5, len(reads))
+
+    def test_pipelined_reader_error(self):
+        reader = utils.LimitingReader(six.BytesIO(b'*' * 40), 20)
+        pipeline = utils.PipelinedReader(reader, 16, 2)
+        chunks = iter(pipeline)
+        self.assertEqual(b'*' * 16, next(chunks))
+        self.assertRaises(exception.ImageSizeLimitExceeded, next, chunks)
+
+    def test_upload_pipeline(self):
+        data = six.BytesIO(b'*' * 40)
+        with utils.upload_pipeline(data) as reader:
+            self.assertIs(data, reader)
+
+        self.config(image_upload_pipeline_depth=2,
+                    image_upload_pipeline_chunk_size=16)
+        with utils.upload_pipeline(data) as reader:
+            self.assertEqual(b'*' * 24, reader.read(24))
+            self.assertEqual(b'*' * 16, reader.read(24))
+            self.assertEqual(b'', reader.read(24))
+
+    def _recording_listener(self, events, name, suppress=False,
+                            fail_end=False):
+        class Listener(utils.ImageStreamListener):
+            def start(self):
+                events.append((name, 'start'))
+
+            def chunk_callbacks(self):
+                return [lambda chunk: events.append((name, chunk))]
+
+            def end(self, bytes_read):
+                events.append((name, 'end', bytes_read))
+                if fail_end:
+                    raise exception.GlanceException('bad')
+
+            def error(self, exc, bytes_read):
+                events.append((name, 'error', type(exc)))
+                return suppress
+
+            def close(self, bytes_read):
+                events.append((name, 'close', bytes_read))
+
+        return Listener()
+
+    def test_image_stream(self):
+        events = []
+        stream = utils.ImageStream([b'ab', b'cde'])
+        self.assertIs(stream, utils.ImageStream.of(stream))
+        stream.add_listener(self._recording_listener(events, 'a'))
+        stream.add_listener(self._recording_listener(events, 'b'))
+        self.assertEqual([], events)
+        self.assertEqual([b'ab', b'cde'], list(stream))
+        self.assertEqual([('a', 'start'), ('b', 'start'),
+                          ('a', b'ab'), ('b', b'ab'),
+                          ('a', b'cde'), ('b', b'cde'),
+                          ('a', 'end', 5), ('b', 'end', 5)], events)
+        stream.close()
+        self.assertEqual(8, len(events))
+
+    def test_image_stream_error(self):
+        def failing_iter():
+            yield b'ab'
+            raise IOError()
+
+        events = []
+        stream = utils.ImageStream(failing_iter())
+        stream.add_listener(self._recording_listener(events, 'a'))
+        self.assertEqual(b'ab', next(stream))
+        self.assertRaises(IOError, next, stream)
+        self.assertEqual(('a', 'error', IOError), events[-1])
+        self.assertRaises(StopIteration, next, stream)
+
+    def test_image_stream_error_suppressed(self):
+        def failing_iter():
+            yield b'ab'
+            raise IOError()
+
+        events = []
+        stream = utils.ImageStream(failing_iter())
+        stream.add_listener(self._recording_listener(events, 'a'))
+        stream.add_listener(self._recording_listener(events, 'b',
+                                                     suppress=True))
+        self.assertEqual([b'ab'], list(stream))
+        self.assertEqual([('a', 'error', IOError), ('b', 'error', IOError)],
+                         events[-2:])
+
+    def test_image_stream_end_fails(self):
+        events = []
+        stream = utils.ImageStream([b'ab'])
+        stream.add_listener(self._recording_listener(events, 'a',
+                                                     fail_end=True))
+        stream.add_listener(self._recording_listener(events, 'b'))
+        self.assertRaises(exception.GlanceException, list, stream)
+        self.assertEqual([('a', 'end', 2),
+                          ('b', 'error', exception.GlanceException)],
+                         events[-2:])
+
+    def test_image_stream_closed(self):
+        closed = []
+
+        def image_iter():
+            try:
+                yield b'ab'
+                yield b'cd'
+            finally:
+                closed.append(True)
+
+        events = []
+        stream = utils.ImageStream(image_iter())
+        stream.add_listener(self._recording_listener(events, 'a'))
+        next(stream)
+        # Garbage collected without being read through
+        del stream
+        self.assertEqual(('a', 'close', 2), events[-1])
+        self.assertEqual([True], closed)
+
     def test_limiting_reader(self):
         """Ensure limiting reader class accesses all bytes of file"""
         BYTES = 1024
@@ -14,7 +14,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from contextlib import contextmanager
 import datetime
+import errno
 import gettext
 import socket
 
@@ -525,12 +527,114 @@ class ServerTest(test_utils.BaseTestCase):
             mock_server.assert_called_once_with('fake_socket',
                                                 fake_application,
                                                 log=server._logger,
+                                                protocol=wsgi.HttpProtocol,
                                                 debug=False,
                                                 custom_pool=server.pool,
                                                 keepalive=False,
                                                 socket_timeout=900)
 
 
+class HttpProtocolTest(test_utils.BaseTestCase):
+
+    def _make_protocol(self):
+        with mock.patch.object(wsgi.HttpProtocol, '__init__',
+                               return_value=None):
+            protocol = wsgi.HttpProtocol()
+        protocol.connection = mock.Mock()
+        protocol.connection.fileno.return_value = 10
+        protocol.wfile = mock.Mock()
+        return protocol
+
+    def test_sendfile(self):
+        protocol = self._make_protocol()
+        fileobj = mock.Mock()
+        fileobj.fileno.return_value = 20
+        with mock.patch.object(wsgi, 'sendfile', create=True) as sendfile:
+            sendfile.sendfile.side_effect = [6, 4]
+            sent = protocol.sendfile(fileobj, 5, 10)
+
+        self.assertEqual(10, sent)
+        protocol.wfile.flush.assert_called_once_with()
+        sendfile.sendfile.assert_has_calls([mock.call(10, 20, 5, 10),
+                                            mock.call(10, 20, 11, 4)])
+
+    def test_sendfile_waits_for_socket(self):
+        protocol = self._make_protocol()
+        fileobj = mock.Mock()
+        fileobj.fileno.return_value = 20
+        with mock.patch.object(wsgi, 'sendfile', create=True) as sendfile:
+            sendfile.sendfile.side_effect = [OSError(errno.EAGAIN, 'again'),
+                                             10]
+            with mock.patch.object(wsgi, 'trampoline') as trampoline:
+                sent = protocol.sendfile(fileobj, 0, 10)
+
+        self.assertEqual(10, sent)
+        self.assertEqual(1, trampoline.call_count)
+
+    def test_sendfile_short_file(self):
+        protocol = self._make_protocol()
+        fileobj = mock.Mock()
+        with mock.patch.object(wsgi, 'sendfile', create=True) as sendfile:
+            sendfile.sendfile.side_effect = [4, 0]
+            sent = protocol.sendfile(fileobj, 0, 10)
+
+        self.assertEqual(4, sent)
+
+
+class FileWrapperTest(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(FileWrapperTest, self).setUp()
+        self.path = self.useFixture(fixtures.TempDir()).join('image')
+        with open(self.path, 'wb') as f:
+            f.write(b'0123456789' * 10)
+
+    @contextmanager
+    def _open_file(self):
+        with open(self.path, 'rb') as f:
+            yield f
+
+    def test_read_without_sendfile(self):
+        wrapper = wsgi.FileWrapper({}, self._open_file, chunk_size=30)
+
+        chunks = list(wrapper)
+        self.assertEqual([30, 30, 30, 10], [len(c) for c in chunks])
+        self.assertEqual(b'0123456789' * 10, b''.join(chunks))
+        self.assertEqual(0, wrapper.bytes_sent)
+
+    def test_read_range_without_sendfile(self):
+        wrapper = wsgi.FileWrapper({}, self._open_file, 15, 20,
+                                   chunk_size=8)
+
+        self.assertEqual(b'56789012345678901234', b''.join(wrapper))
+
+    def test_sendfile(self):
+        sent = []
+
+        def fake_sendfile(fileobj, offset, count):
+            fileobj.seek(offset)
+            sent.append(fileobj.read(count))
+            return len(sent[-1])
+
+        environ = {'glance.sendfile': fake_sendfile}
+        wrapper = wsgi.FileWrapper(environ, self._open_file, 5, 90,
+                                   chunk_size=10)
+        # Set before the server starts iterating over the response
+        self.assertEqual(0, environ['eventlet.minimum_write_chunk_size'])
+
+        self.assertEqual([b'5678901234'], list(wrapper))
+        self.assertEqual(80, wrapper.bytes_sent)
+        self.assertEqual([(b'0123456789' * 10)[15:95]], sent)
+
+    def test_sendfile_not_needed_for_small_file(self):
+        send = mock.Mock()
+        wrapper = wsgi.FileWrapper({'glance.sendfile': send},
+                                   self._open_file, chunk_size=100)
+
+        self.assertEqual([b'0123456789' * 10], list(wrapper))
+        self.assertFalse(send.called)
+
+
 class TestHelpers(test_utils.BaseTestCase):
 
     def test_headers_are_unicode(self):
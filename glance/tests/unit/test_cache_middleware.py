@@ -13,7 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+from contextlib import contextmanager
+import hashlib
+import os
+
 from oslo_policy import policy
+import six
 # NOTE(jokke): simplified transition to py3, behaves like py2 xrange
 from six.moves import range
 import testtools
@@ -21,6 +27,7 @@ import webob
 
 import glance.api.middleware.cache
 import glance.api.policy
+import glance.db
 from glance.common import exception
 from glance import context
 import glance.registry.client.v1.api as registry
@@ -99,13 +106,30 @@ class TestCacheMiddlewareRequestStashCacheInfo(testtools.TestCase):
         self.assertIsNone(out)
 
 
+class DummyStats(object):
+    def __init__(self):
+        self.counters = collections.Counter()
+
+    def incr(self, name, value=1):
+        self.counters[name] += value
+
+
 class ChecksumTestCacheFilter(glance.api.middleware.cache.CacheFilter):
     def __init__(self):
         class DummyCache(object):
-            def get_caching_iter(self, image_id, image_checksum, app_iter):
+            def __init__(self):
+                self.misses = []
+
+            def get_caching_iter(self, image_id, image_checksum, app_iter,
+                                 image_size=None, relay=False):
                 self.image_checksum = image_checksum
+                self.image_size = image_size
+
+            def record_miss(self, image_id):
+                self.misses.append(image_id)
 
         self.cache = DummyCache()
+        self.cache.stats = DummyStats()
         self.policy = unit_test_utils.FakePolicyEnforcer()
 
 
@@ -142,6 +166,30 @@ class TestCacheMiddlewareChecksumVerification(base.IsolatedUnitTest):
 
         self.assertIsNone(cache_filter.cache.image_checksum)
 
+    def test_image_size_passed_to_cache(self):
+        cache_filter = ChecksumTestCacheFilter()
+        resp = webob.Response(request=self.request, body=b'*' * 10)
+        cache_filter._process_GET_response(resp, None)
+
+        self.assertEqual(10, cache_filter.cache.image_size)
+
+    def test_miss_recorded_for_warming(self):
+        cache_filter = ChecksumTestCacheFilter()
+        resp = webob.Response(request=self.request)
+        cache_filter._process_GET_response(resp, 'test1')
+        self.assertEqual([], cache_filter.cache.misses)
+
+        self.config(image_cache_warming_images=10)
+        cache_filter._process_GET_response(resp, 'test1')
+        self.assertEqual(['test1'], cache_filter.cache.misses)
+
+    def test_miss_counted_in_stats(self):
+        cache_filter = ChecksumTestCacheFilter()
+        resp = webob.Response(request=self.request, body=b'*' * 10)
+        cache_filter._process_GET_response(resp, 'test1')
+        self.assertEqual({'misses': 1, 'bytes_from_backend': 10},
+                         cache_filter.cache.stats.counters)
+
 
 class FakeImageSerializer(object):
     def show(self, response, raw_response):
@@ -159,7 +207,8 @@ class ProcessRequestTestCacheFilter(glance.api.middleware.cache.CacheFilter):
             def is_cached(self, image_id):
                 return True
 
-            def get_caching_iter(self, image_id, image_checksum, app_iter):
+            def get_caching_iter(self, image_id, image_checksum, app_iter,
+                                 image_size=None, relay=False):
                 pass
 
             def delete_cached_image(self, image_id):
@@ -169,6 +218,7 @@ class ProcessRequestTestCacheFilter(glance.api.middleware.cache.CacheFilter):
                 pass
 
         self.cache = DummyCache()
+        self.cache.stats = DummyStats()
         self.policy = unit_test_utils.FakePolicyEnforcer()
 
 
@@ -574,6 +624,678 @@ class TestCacheMiddlewareProcessRequest(base.IsolatedUnitTest):
         self.assertTrue(actual)
 
 
+class RangeTestCacheFilter(glance.api.middleware.cache.CacheFilter):
+    def __init__(self, data):
+        class DummyCache(object):
+            @contextmanager
+            def open_for_read(self, image_id):
+                yield six.BytesIO(data)
+
+            def is_cached(self, image_id):
+                return True
+
+            def get_caching_iter(self, image_id, image_checksum, app_iter,
+                                 image_size=None, relay=False):
+                self.caching = True
+                return app_iter
+
+        self.cache = DummyCache()
+        self.cache.stats = DummyStats()
+        self.policy = unit_test_utils.FakePolicyEnforcer()
+
+
+class TestCacheMiddlewareByteRanges(base.IsolatedUnitTest):
+    def setUp(self):
+        super(TestCacheMiddlewareByteRanges, self).setUp()
+        self.data = b''.join(six.int2byte(i) for i in range(256))
+        self.image_meta = {'id': 'test1', 'status': 'active',
+                           'deleted': False, 'size': len(self.data),
+                           'owner': ''}
+
+    def _process_v2_request(self, headers):
+        request = webob.Request.blank('/v2/images/test1/file',
+                                      headers=headers)
+        request.context = context.RequestContext()
+        request.environ['api.cache.image'] = ImageStub('test1')
+        cache_filter = RangeTestCacheFilter(self.data)
+        return cache_filter._process_v2_request(
+            request, 'test1', cache_filter.get_from_cache('test1'),
+            self.image_meta)
+
+    def test_parse_byte_ranges(self):
+        parse = glance.api.middleware.cache.parse_byte_ranges
+        self.assertEqual([(0, 10)], parse('bytes=0-9', 100))
+        self.assertEqual([(90, 100)], parse('bytes=90-', 100))
+        self.assertEqual([(70, 100)], parse('bytes=-30', 100))
+        self.assertEqual([(0, 100)], parse('bytes=-300', 100))
+        self.assertEqual([(50, 100)], parse('bytes=50-500', 100))
+        self.assertEqual([(0, 1), (5, 7)], parse('bytes=0-0, 5-6', 100))
+        # Unsatisfiable ranges are dropped when others can be served
+        self.assertEqual([(0, 1)], parse('bytes=0-0,200-300', 100))
+
+    def test_parse_byte_ranges_ignored(self):
+        parse = glance.api.middleware.cache.parse_byte_ranges
+        self.assertIsNone(parse('items=0-9', 100))
+        self.assertIsNone(parse('bytes=', 100))
+        self.assertIsNone(parse('bytes=9-0', 100))
+        self.assertIsNone(parse('bytes=a-b', 100))
+        self.assertIsNone(parse('bytes=-', 100))
+        self.assertIsNone(parse('bytes=' + ','.join(['0-0'] * 17), 100))
+
+    def test_parse_byte_ranges_unsatisfiable(self):
+        parse = glance.api.middleware.cache.parse_byte_ranges
+        self.assertRaises(webob.exc.HTTPRequestRangeNotSatisfiable,
+                          parse, 'bytes=100-', 100)
+        self.assertRaises(webob.exc.HTTPRequestRangeNotSatisfiable,
+                          parse, 'bytes=-10', 0)
+
+    def test_v2_single_range(self):
+        response = self._process_v2_request({'Range': 'bytes=10-19'})
+        self.assertEqual(206, response.status_int)
+        self.assertEqual('bytes 10-19/256', response.headers['Content-Range'])
+        self.assertEqual('10', response.headers['Content-Length'])
+        self.assertNotIn('Content-MD5', response.headers)
+        self.assertEqual(self.data[10:20], b''.join(response.app_iter))
+
+    def test_v2_suffix_range(self):
+        response = self._process_v2_request({'Range': 'bytes=-6'})
+        self.assertEqual(206, response.status_int)
+        self.assertEqual('bytes 250-255/256',
+                         response.headers['Content-Range'])
+        self.assertEqual(self.data[250:], b''.join(response.app_iter))
+
+    def test_v2_multiple_ranges(self):
+        response = self._process_v2_request({'Range': 'bytes=0-3,100-103'})
+        self.assertEqual(206, response.status_int)
+        content_type = response.headers['Content-Type']
+        self.assertTrue(content_type.startswith('multipart/byteranges; '
+                                                'boundary='))
+        boundary = content_type.split('=', 1)[1].encode('ascii')
+        body = b''.join(response.app_iter)
+        self.assertEqual(int(response.headers['Content-Length']), len(body))
+        expected = (b'--' + boundary + b'\r\n'
+                    b'Content-Type: application/octet-stream\r\n'
+                    b'Content-Range: bytes 0-3/256\r\n\r\n' +
+                    self.data[0:4] +
+                    b'\r\n--' + boundary + b'\r\n'
+                    b'Content-Type: application/octet-stream\r\n'
+                    b'Content-Range: bytes 100-103/256\r\n\r\n' +
+                    self.data[100:104] +
+                    b'\r\n--' + boundary + b'--\r\n')
+        self.assertEqual(expected, body)
+
+    def test_v2_content_range_request_header(self):
+        response = self._process_v2_request(
+            {'Content-Range': 'bytes 200-299/*'})
+        self.assertEqual(206, response.status_int)
+        self.assertEqual('bytes 200-255/256',
+                         response.headers['Content-Range'])
+        self.assertEqual(self.data[200:], b''.join(response.app_iter))
+
+    def test_v2_range_not_satisfiable(self):
+        self.assertRaises(webob.exc.HTTPRequestRangeNotSatisfiable,
+                          self._process_v2_request,
+                          {'Range': 'bytes=256-'})
+
+    def test_v2_if_range_serves_whole_image(self):
+        response = self._process_v2_request({'Range': 'bytes=0-9',
+                                             'If-Range': 'c1234'})
+        self.assertEqual(200, response.status_int)
+        self.assertEqual('bytes', response.headers['Accept-Ranges'])
+        self.assertEqual(self.data, b''.join(response.app_iter))
+
+    def test_partial_response_not_cached(self):
+        request = webob.Request.blank(
+            '/v2/images/test1/file',
+            headers={'Content-Range': 'bytes 0-9/*'})
+        request.context = context.RequestContext()
+        cache_filter = RangeTestCacheFilter(self.data)
+        resp = webob.Response(request=request)
+        cache_filter._process_GET_response(resp, 'test1')
+        self.assertFalse(getattr(cache_filter.cache, 'caching', False))
+
+
+class PartialTestCacheFilter(glance.api.middleware.cache.CacheFilter):
+    def __init__(self, data, held=(0, 128)):
+        class DummyCache(object):
+            def __init__(self):
+                self.partial_caching = []
+
+            def is_cached(self, image_id):
+                return False
+
+            def get_partial_image(self, image_id):
+                return object()
+
+            def has_partial_ranges(self, image_id, ranges):
+                return all(held[0] <= start and stop <= held[1]
+                           for start, stop in ranges)
+
+            @contextmanager
+            def open_partial_for_read(self, image_id):
+                yield six.BytesIO(data)
+
+            def get_partial_caching_iter(self, image_id, image_checksum,
+                                         image_iter, start, image_size):
+                self.partial_caching.append((image_id, image_checksum,
+                                             start, image_size))
+                return image_iter
+
+        self.cache = DummyCache()
+        self.cache.stats = DummyStats()
+        self.policy = unit_test_utils.FakePolicyEnforcer()
+
+
+class TestCacheMiddlewarePartial(base.IsolatedUnitTest):
+    def setUp(self):
+        super(TestCacheMiddlewarePartial, self).setUp()
+        self.config(image_cache_partial=True)
+        self.data = b''.join(six.int2byte(i) for i in range(256))
+        self.image_meta = {'id': 'test1', 'status': 'active',
+                           'deleted': False, 'size': len(self.data),
+                           'checksum': 'c1234', 'owner': ''}
+
+    def _fake_get_v2_image_metadata(self, request, image_id):
+        request.environ['api.cache.image'] = ImageStub(image_id)
+        return self.image_meta
+
+    def _process_request(self, headers):
+        request = webob.Request.blank('/v2/images/test1/file',
+                                      headers=headers)
+        request.context = context.RequestContext()
+        cache_filter = PartialTestCacheFilter(self.data)
+        cache_filter._get_v2_image_metadata = self._fake_get_v2_image_metadata
+        return cache_filter.process_request(request)
+
+    def test_range_served_from_partial(self):
+        response = self._process_request({'Range': 'bytes=10-19'})
+        self.assertEqual(206, response.status_int)
+        self.assertEqual('bytes 10-19/256', response.headers['Content-Range'])
+        self.assertEqual(self.data[10:20], b''.join(response.app_iter))
+
+    def test_partial_hit_counted_in_stats(self):
+        request = webob.Request.blank('/v2/images/test1/file',
+                                      headers={'Range': 'bytes=10-19'})
+        request.context = context.RequestContext()
+        cache_filter = PartialTestCacheFilter(self.data)
+        cache_filter._get_v2_image_metadata = self._fake_get_v2_image_metadata
+        cache_filter.process_request(request)
+        self.assertEqual({'partial_hits': 1, 'bytes_from_cache': 10},
+                         cache_filter.cache.stats.counters)
+
+    def test_content_range_served_from_partial(self):
+        response = self._process_request(
+            {'Content-Range': 'bytes 100-109/*'})
+        self.assertEqual(206, response.status_int)
+        self.assertEqual(self.data[100:110], b''.join(response.app_iter))
+
+    def test_range_not_held_by_partial(self):
+        self.assertIsNone(self._process_request({'Range': 'bytes=100-199'}))
+
+    def test_partial_disabled(self):
+        self.config(image_cache_partial=False)
+        self.assertIsNone(self._process_request({'Range': 'bytes=10-19'}))
+
+    def test_partial_response_cached_by_blocks(self):
+        request = webob.Request.blank(
+            '/v2/images/test1/file',
+            headers={'Content-Range': 'bytes 100-199/*'})
+        request.context = context.RequestContext()
+        cache_filter = PartialTestCacheFilter(self.data)
+        cache_filter._get_v2_image_metadata = self._fake_get_v2_image_metadata
+        resp = webob.Response(request=request)
+        cache_filter._process_GET_response(resp, 'test1', version='v2')
+        self.assertEqual([('test1', 'c1234', 100, 256)],
+                         cache_filter.cache.partial_caching)
+
+        # Only v2 serves partial downloads from the backend store
+        cache_filter._process_GET_response(resp, 'test1', version='v1')
+        self.assertEqual(1, len(cache_filter.cache.partial_caching))
+
+
+class SendfileTestCacheFilter(glance.api.middleware.cache.CacheFilter):
+    def __init__(self, path):
+        class DummyCache(object):
+            @contextmanager
+            def open_for_read(self, image_id):
+                with open(path, 'rb') as cache_file:
+                    yield cache_file
+
+            def is_cached(self, image_id):
+                return True
+
+        self.cache = DummyCache()
+        self.cache.stats = DummyStats()
+        self.policy = unit_test_utils.FakePolicyEnforcer()
+
+
+class TestCacheMiddlewareSendfile(base.IsolatedUnitTest):
+    def setUp(self):
+        super(TestCacheMiddlewareSendfile, self).setUp()
+        self.config(image_cache_sendfile=True)
+        self.data = b''.join(six.int2byte(i) for i in range(256)) * 1024
+        path = os.path.join(self.test_dir, 'test1')
+        with open(path, 'wb') as cache_file:
+            cache_file.write(self.data)
+        self.cache_filter = SendfileTestCacheFilter(path)
+        self.image_meta = {'id': 'test1', 'status': 'active',
+                           'deleted': False, 'size': len(self.data),
+                           'owner': ''}
+        self.sent = []
+
+    def _fake_sendfile(self, fileobj, offset, count):
+        fileobj.seek(offset)
+        self.sent.append(fileobj.read(count))
+        return len(self.sent[-1])
+
+    def _process_v2_request(self, headers=None, sendfile=True):
+        request = webob.Request.blank('/v2/images/test1/file',
+                                      headers=headers)
+        request.context = context.RequestContext()
+        request.environ['api.cache.image'] = ImageStub('test1')
+        if sendfile:
+            request.environ['glance.sendfile'] = self._fake_sendfile
+        return self.cache_filter._process_v2_request(
+            request, 'test1', self.cache_filter.get_from_cache('test1',
+                                                               request),
+            self.image_meta)
+
+    def test_v2_sendfile(self):
+        response = self._process_v2_request()
+        self.assertEqual(200, response.status_int)
+        body = b''.join(response.app_iter)
+        self.assertEqual(1, len(self.sent))
+        self.assertEqual(self.data, body + self.sent[0])
+
+    def test_v2_sendfile_range(self):
+        response = self._process_v2_request({'Range': 'bytes=1000-199999'})
+        self.assertEqual(206, response.status_int)
+        body = b''.join(response.app_iter)
+        self.assertEqual(self.data[1000:200000], body + self.sent[0])
+
+    def test_v2_sendfile_unavailable(self):
+        response = self._process_v2_request(sendfile=False)
+        self.assertEqual(self.data, b''.join(response.app_iter))
+
+    def test_v2_sendfile_disabled(self):
+        self.config(image_cache_sendfile=False)
+        response = self._process_v2_request()
+        self.assertEqual(self.data, b''.join(response.app_iter))
+        self.assertEqual([], self.sent)
+
+
+class SingleFlightTestCacheFilter(glance.api.middleware.cache.CacheFilter):
+    def __init__(self, being_cached=False, claimed=False):
+        self.serializer = FakeImageSerializer()
+
+        class DummyCache(object):
+            def __init__(self):
+                self.claims = set(['test1']) if claimed else set()
+                self.followed = []
+                self.relayed = []
+
+            def is_cached(self, image_id):
+                return False
+
+            def is_being_cached(self, image_id):
+                return being_cached
+
+            def claim_fill(self, image_id):
+                if image_id in self.claims:
+                    return False
+                self.claims.add(image_id)
+                return True
+
+            def release_fill(self, image_id):
+                self.claims.discard(image_id)
+
+            def wait_for_fill(self, image_id):
+                return False
+
+            def get_following_iter(self, image_id):
+                self.followed.append(image_id)
+                return iter([b'data'])
+
+            def get_caching_iter(self, image_id, image_checksum, app_iter,
+                                 image_size=None, relay=False):
+                self.relayed.append(relay)
+                return app_iter
+
+        self.cache = DummyCache()
+        self.cache.stats = DummyStats()
+        self.policy = unit_test_utils.FakePolicyEnforcer()
+
+
+class TestCacheMiddlewareSingleFlight(base.IsolatedUnitTest):
+    def setUp(self):
+        super(TestCacheMiddlewareSingleFlight, self).setUp()
+        self.config(image_cache_single_flight=True)
+        self.request = webob.Request.blank('/v1/images/test1')
+        self.request.context = context.RequestContext()
+
+    def _fake_get_v1_image_metadata(self, request, image_id):
+        return {'id': image_id, 'status': 'active', 'deleted': False,
+                'size': 4, 'properties': {}}
+
+    def test_miss_without_single_flight(self):
+        self.config(image_cache_single_flight=False)
+        cache_filter = SingleFlightTestCacheFilter(being_cached=True)
+        self.assertIsNone(cache_filter.process_request(self.request))
+        self.assertEqual([], cache_filter.cache.followed)
+
+    def test_first_miss_claims_fill(self):
+        cache_filter = SingleFlightTestCacheFilter()
+        self.assertIsNone(cache_filter.process_request(self.request))
+        self.assertIn('test1', cache_filter.cache.claims)
+        self.assertTrue(self.request.environ['api.cache.fill_claimed'])
+
+    def test_miss_follows_fill(self):
+        cache_filter = SingleFlightTestCacheFilter(being_cached=True)
+        cache_filter._get_v1_image_metadata = self._fake_get_v1_image_metadata
+        self.assertTrue(cache_filter.process_request(self.request))
+        self.assertEqual(['test1'], cache_filter.cache.followed)
+
+    def test_miss_does_not_follow_without_size(self):
+        def fake_get_v1_image_metadata(request, image_id):
+            return {'id': image_id, 'status': 'active', 'deleted': False,
+                    'size': 0, 'properties': {}}
+
+        cache_filter = SingleFlightTestCacheFilter(being_cached=True)
+        cache_filter._get_v1_image_metadata = fake_get_v1_image_metadata
+        self.assertIsNone(cache_filter.process_request(self.request))
+        self.assertEqual([], cache_filter.cache.followed)
+
+    def test_miss_goes_to_backend_when_claimed_fill_fails(self):
+        cache_filter = SingleFlightTestCacheFilter(claimed=True)
+        self.assertIsNone(cache_filter.process_request(self.request))
+        self.assertNotIn('api.cache.fill_claimed', self.request.environ)
+        self.assertEqual([], cache_filter.cache.followed)
+
+    def test_failed_response_releases_claim(self):
+        cache_filter = SingleFlightTestCacheFilter()
+        cache_filter.process_request(self.request)
+        resp = webob.Response(request=self.request, status=404)
+        cache_filter.process_response(resp)
+        self.assertNotIn('test1', cache_filter.cache.claims)
+
+    def test_claimed_response_relays(self):
+        """
+        Test that a response to the request holding the fill claim keeps
+        the claim, so that the image is relayed to the requests waiting on
+        it if the admission policy rejects the image.
+        """
+        cache_filter = SingleFlightTestCacheFilter()
+        cache_filter._get_v1_image_metadata = self._fake_get_v1_image_metadata
+        cache_filter.process_request(self.request)
+        resp = webob.Response(request=self.request, app_iter=[b'data'])
+        cache_filter.process_response(resp)
+        self.assertEqual([True], cache_filter.cache.relayed)
+        self.assertIn('test1', cache_filter.cache.claims)
+
+    def test_unclaimed_response_does_not_relay(self):
+        cache_filter = SingleFlightTestCacheFilter(claimed=True)
+        cache_filter._get_v1_image_metadata = self._fake_get_v1_image_metadata
+        cache_filter.process_request(self.request)
+        resp = webob.Response(request=self.request, app_iter=[b'data'])
+        cache_filter.process_response(resp)
+        self.assertEqual([False], cache_filter.cache.relayed)
+
+
+class MetadataSnapshotTestCacheFilter(glance.api.middleware.cache.CacheFilter):
+    def __init__(self, snapshot=None):
+        self.serializer = FakeImageSerializer()
+
+        class DummyCache(object):
+            def __init__(self):
+                self.snapshots = {}
+                if snapshot is not None:
+                    self.snapshots['test1'] = snapshot
+
+            def is_cached(self, image_id):
+                return False
+
+            def get_metadata_snapshot(self, image_id):
+                return self.snapshots.get(image_id)
+
+            def set_metadata_snapshot(self, image_id, snapshot):
+                self.snapshots[image_id] = snapshot
+
+            def delete_metadata_snapshot(self, image_id):
+                self.snapshots.pop(image_id, None)
+
+        self.cache = DummyCache()
+        self.cache.stats = DummyStats()
+        self.policy = unit_test_utils.FakePolicyEnforcer()
+
+
+class TestCacheMiddlewareMetadataSnapshot(base.IsolatedUnitTest):
+    def setUp(self):
+        super(TestCacheMiddlewareMetadataSnapshot, self).setUp()
+        self.config(image_cache_metadata_ttl=60)
+        self.request = webob.Request.blank('/v2/images/test1/file')
+        self.request.context = context.RequestContext(tenant='tenant1')
+
+    def _snapshot(self, **kwargs):
+        snapshot = dict((attr, None) for attr in
+                        glance.api.middleware.cache.SNAPSHOT_ATTRIBUTES)
+        snapshot.update({'image_id': 'test1', 'status': 'active',
+                         'visibility': 'private', 'owner': 'tenant1',
+                         'checksum': 'c1234', 'size': 4, 'tags': ['a'],
+                         'extra_properties': {'foo': 'bar'},
+                         'members': []})
+        snapshot.update(kwargs)
+        return snapshot
+
+    def _fake_image_repo(self, image=None):
+        test = self
+
+        class FakeImageRepo(object):
+            def __init__(self, context, db_api):
+                pass
+
+            def get(self, image_id):
+                if image is None:
+                    test.fail('Image looked up in the database')
+                return image
+
+        self.stubs.Set(glance.db, 'ImageRepo', FakeImageRepo)
+
+    def test_snapshot_served_without_database(self):
+        self._fake_image_repo()
+        cache_filter = MetadataSnapshotTestCacheFilter(self._snapshot())
+        target = cache_filter._get_v2_image_metadata(self.request, 'test1')
+        self.assertEqual('bar', target['foo'])
+        image = self.request.environ['api.cache.image']
+        self.assertEqual('c1234', image.checksum)
+        self.assertEqual(set(['a']), image.tags)
+
+    def test_snapshot_visible_to_members(self):
+        self._fake_image_repo()
+        snapshot = self._snapshot(owner='tenant2', members=['tenant1'])
+        cache_filter = MetadataSnapshotTestCacheFilter(snapshot)
+        cache_filter._get_v2_image_metadata(self.request, 'test1')
+        self.assertEqual('tenant2',
+                         self.request.environ['api.cache.image'].owner)
+
+    def test_snapshot_not_visible_falls_back_to_database(self):
+        image = ImageStub('test1', visibility='public')
+        image.owner = 'tenant2'
+        image.tags = set()
+        for attr in glance.api.middleware.cache.SNAPSHOT_ATTRIBUTES:
+            if not hasattr(image, attr):
+                setattr(image, attr, None)
+        self._fake_image_repo(image)
+        snapshot = self._snapshot(owner='tenant2')
+        cache_filter = MetadataSnapshotTestCacheFilter(snapshot)
+        cache_filter._get_v2_image_metadata(self.request, 'test1')
+        self.assertIs(image, self.request.environ['api.cache.image'])
+        # The snapshot is replaced with one of the current metadata
+        snapshot = cache_filter.cache.snapshots['test1']
+        self.assertEqual('public', snapshot['visibility'])
+        self.assertEqual([], snapshot['members'])
+
+    def test_snapshots_disabled(self):
+        self.config(image_cache_metadata_ttl=0)
+        image = ImageStub('test1')
+        self._fake_image_repo(image)
+        cache_filter = MetadataSnapshotTestCacheFilter(self._snapshot())
+        cache_filter.cache.snapshots.clear()
+        cache_filter._get_v2_image_metadata(self.request, 'test1')
+        self.assertIs(image, self.request.environ['api.cache.image'])
+        self.assertEqual({}, cache_filter.cache.snapshots)
+
+    def test_is_snapshot_visible(self):
+        is_visible = glance.api.middleware.cache.is_snapshot_visible
+        snapshot = self._snapshot(owner='tenant2', members=['tenant3'])
+        self.assertFalse(is_visible(snapshot, self.request.context))
+        self.assertFalse(is_visible(snapshot, context.RequestContext()))
+        self.assertTrue(is_visible(snapshot,
+                                   context.RequestContext(tenant='tenant3')))
+        self.assertTrue(is_visible(snapshot,
+                                   context.RequestContext(is_admin=True)))
+        snapshot['owner'] = None
+        self.assertTrue(is_visible(snapshot, self.request.context))
+
+    def test_change_drops_snapshot(self):
+        for method, path in [('PATCH', '/v2/images/test1'),
+                             ('DELETE', '/v2/images/test1'),
+                             ('PUT', '/v2/images/test1/tags/a'),
+                             ('POST', '/v2/images/test1/members'),
+                             ('POST', '/v2/images/test1/actions/deactivate'),
+                             ('PUT', '/v1/images/test1'),
+                             ('PUT', '/v1/images/test1/members/tenant2')]:
+            cache_filter = MetadataSnapshotTestCacheFilter(self._snapshot())
+            request = webob.Request.blank(path, method=method)
+            request.context = self.request.context
+            self.assertIsNone(cache_filter.process_request(request))
+            self.assertEqual({}, cache_filter.cache.snapshots)
+            self.assertEqual(
+                'test1', request.environ['api.cache.changed_image_id'])
+
+            # Dropped again once the change is done
+            cache_filter.cache.snapshots['test1'] = self._snapshot()
+            resp = webob.Response(request=request, status=200)
+            cache_filter.process_response(resp)
+            self.assertEqual({}, cache_filter.cache.snapshots)
+
+    def test_read_keeps_snapshot(self):
+        cache_filter = MetadataSnapshotTestCacheFilter(self._snapshot())
+        request = webob.Request.blank('/v2/images/test1')
+        request.context = self.request.context
+        self.assertIsNone(cache_filter.process_request(request))
+        self.assertIn('test1', cache_filter.cache.snapshots)
+        self.assertNotIn('api.cache.changed_image_id', request.environ)
+
+
+class DummyConnection(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class PeerTestCacheFilter(glance.api.middleware.cache.CacheFilter):
+    def __init__(self, *peer_data):
+        self.serializer = FakeImageSerializer()
+
+        class DummyCache(object):
+            def __init__(self):
+                self.cached = []
+
+            def is_cached(self, image_id):
+                return False
+
+            def get_caching_iter(self, image_id, image_checksum, app_iter,
+                                 image_size=None, relay=False):
+                self.cached.append((image_id, image_checksum, image_size))
+                return app_iter
+
+        class DummyPeers(object):
+            def __init__(self):
+                self.fetched = []
+                self.connections = []
+
+            def fetch(self, image_id):
+                self.fetched.append(image_id)
+                for data in peer_data:
+                    conn = DummyConnection()
+                    self.connections.append(conn)
+                    yield conn, (chunk for chunk in [data]), len(data)
+
+        self.cache = DummyCache()
+        self.cache.stats = DummyStats()
+        self.peers = DummyPeers()
+        self.policy = unit_test_utils.FakePolicyEnforcer()
+
+
+class TestCacheMiddlewarePeers(base.IsolatedUnitTest):
+    def setUp(self):
+        super(TestCacheMiddlewarePeers, self).setUp()
+        self.config(image_cache_peers=['http://10.0.0.2:9292'])
+        self.request = webob.Request.blank('/v1/images/test1')
+        self.request.context = context.RequestContext()
+        self.checksum = hashlib.md5(b'data').hexdigest()
+
+    def _fake_get_v1_image_metadata(self, request, image_id):
+        return {'id': image_id, 'status': 'active', 'deleted': False,
+                'size': 4, 'checksum': self.checksum, 'properties': {}}
+
+    def _fake_process_v1_request(self, request, image_id, image_iterator,
+                                 image_meta):
+        return b''.join(image_iterator)
+
+    def _process_request(self, cache_filter):
+        cache_filter._get_v1_image_metadata = self._fake_get_v1_image_metadata
+        cache_filter._process_v1_request = self._fake_process_v1_request
+        return cache_filter.process_request(self.request)
+
+    def test_miss_served_by_peer(self):
+        cache_filter = PeerTestCacheFilter(b'data')
+        self.assertEqual(b'data', self._process_request(cache_filter))
+        self.assertEqual(['test1'], cache_filter.peers.fetched)
+        self.assertEqual([('test1', self.checksum, 4)],
+                         cache_filter.cache.cached)
+        self.assertEqual(1, cache_filter.cache.stats.counters['peer_hits'])
+
+    def test_miss_not_cached_by_peers(self):
+        cache_filter = PeerTestCacheFilter()
+        self.assertIsNone(self._process_request(cache_filter))
+        self.assertEqual(['test1'], cache_filter.peers.fetched)
+
+    def test_miss_without_peers(self):
+        self.config(image_cache_peers=[])
+        cache_filter = PeerTestCacheFilter(b'data')
+        self.assertIsNone(self._process_request(cache_filter))
+        self.assertEqual([], cache_filter.peers.fetched)
+
+    def test_peer_size_mismatch(self):
+        cache_filter = PeerTestCacheFilter(b'more data')
+        self.assertIsNone(self._process_request(cache_filter))
+        self.assertEqual([], cache_filter.cache.cached)
+        self.assertTrue(cache_filter.peers.connections[0].closed)
+
+    def test_peer_size_mismatch_next_peer(self):
+        cache_filter = PeerTestCacheFilter(b'more data', b'data')
+        self.assertEqual(b'data', self._process_request(cache_filter))
+        self.assertEqual([('test1', self.checksum, 4)],
+                         cache_filter.cache.cached)
+        self.assertEqual([True, False], [conn.closed for conn in
+                                         cache_filter.peers.connections])
+
+    def test_peer_data_verified(self):
+        self.checksum = hashlib.md5(b'good').hexdigest()
+        cache_filter = PeerTestCacheFilter(b'data')
+        self.assertRaises(exception.GlanceException,
+                          self._process_request, cache_filter)
+
+    def test_image_without_checksum_not_fetched_from_peers(self):
+        self.checksum = None
+        cache_filter = PeerTestCacheFilter(b'data')
+        self.assertIsNone(self._process_request(cache_filter))
+        self.assertEqual([], cache_filter.peers.fetched)
+
+
 class TestCacheMiddlewareProcessResponse(base.IsolatedUnitTest):
     def test_process_v1_DELETE_response(self):
         image_id = 'test1'
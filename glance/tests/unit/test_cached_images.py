@@ -43,6 +43,7 @@ class FakeCache(image_cache.ImageCache):
     def __init__(self):
         self.init_driver()
         self.deleted_images = []
+        self.queued_images = []
 
     def init_driver(self):
         pass
@@ -57,12 +58,22 @@ class FakeCache(image_cache.ImageCache):
         self.delete_cached_image(self.get_cached_images().get('id'))
         return 1
 
+    def delete_cached_images(self, image_ids):
+        self.deleted_images.extend(image_ids)
+        return len(image_ids)
+
     def get_queued_images(self):
         return {'test': 'passed'}
 
-    def queue_image(self, image_id):
+    def queue_image(self, image_id, priority=0):
+        self.queued_images.append((image_id, priority))
         return 'pass'
 
+    def queue_images(self, image_ids, priority=0):
+        self.queued_images.extend((image_id, priority)
+                                  for image_id in image_ids)
+        return len(image_ids)
+
     def delete_queued_image(self, image_id):
         self.deleted_images.append(image_id)
 
@@ -70,6 +81,9 @@ class FakeCache(image_cache.ImageCache):
         self.delete_queued_image('deleted_img')
         return 1
 
+    def get_stats(self):
+        return {'hit_ratio': 0.5}
+
 
 class FakeController(cached_images.Controller):
     def __init__(self):
@@ -108,6 +122,25 @@ class TestCachedImages(testtools.TestCase):
                          self.controller.delete_cached_images(req))
         self.assertEqual(['test'], self.controller.cache.deleted_images)
 
+    def test_delete_listed_cached_images(self):
+        req = webob.Request.blank('')
+        req.context = 'test'
+        self.assertEqual({'num_deleted': 2},
+                         self.controller.delete_listed_cached_images(
+                             req, body={'image_ids': ['test1', 'test2']}))
+        self.assertEqual(['test1', 'test2'],
+                         self.controller.cache.deleted_images)
+
+    def test_delete_listed_cached_images_invalid_body(self):
+        req = webob.Request.blank('')
+        req.context = 'test'
+        for body in (None, [], {}, {'image_ids': 'test1'},
+                     {'image_ids': ['test1', 2]}):
+            self.assertRaises(webob.exc.HTTPBadRequest,
+                              self.controller.delete_listed_cached_images,
+                              req, body=body)
+        self.assertEqual([], self.controller.cache.deleted_images)
+
     def test_policy_enforce_forbidden(self):
         def fake_enforce(context, action, target):
             raise exception.Forbidden()
@@ -118,6 +151,12 @@ class TestCachedImages(testtools.TestCase):
         self.assertRaises(webob.exc.HTTPForbidden,
                           self.controller.get_cached_images, req)
 
+    def test_get_cache_stats(self):
+        req = webob.Request.blank('')
+        req.context = 'test'
+        result = self.controller.get_cache_stats(req)
+        self.assertEqual({'cache_stats': {'hit_ratio': 0.5}}, result)
+
     def test_get_queued_images(self):
         req = webob.Request.blank('')
         req.context = 'test'
@@ -128,6 +167,45 @@ class TestCachedImages(testtools.TestCase):
         req = webob.Request.blank('')
         req.context = 'test'
         self.controller.queue_image(req, image_id='test1')
+        self.assertEqual([('test1', 0)], self.controller.cache.queued_images)
+
+    def test_queue_image_with_priority(self):
+        req = webob.Request.blank('/queued_images/test1?priority=5')
+        req.context = 'test'
+        self.controller.queue_image(req, image_id='test1')
+        self.assertEqual([('test1', 5)], self.controller.cache.queued_images)
+
+    def test_queue_image_with_invalid_priority(self):
+        req = webob.Request.blank('/queued_images/test1?priority=high')
+        req.context = 'test'
+        self.assertRaises(webob.exc.HTTPBadRequest,
+                          self.controller.queue_image, req, image_id='test1')
+
+    def test_queue_images(self):
+        req = webob.Request.blank('')
+        req.context = 'test'
+        self.assertEqual({'num_queued': 2},
+                         self.controller.queue_images(
+                             req, body={'image_ids': ['test1', 'test2']}))
+        self.assertEqual([('test1', 0), ('test2', 0)],
+                         self.controller.cache.queued_images)
+
+    def test_queue_images_with_priority(self):
+        req = webob.Request.blank('')
+        req.context = 'test'
+        self.controller.queue_images(req, body={'image_ids': ['test1'],
+                                                'priority': 5})
+        self.assertEqual([('test1', 5)], self.controller.cache.queued_images)
+
+    def test_queue_images_invalid_body(self):
+        req = webob.Request.blank('')
+        req.context = 'test'
+        for body in (None, {'image_ids': None},
+                     {'image_ids': ['test1'], 'priority': 'high'},
+                     {'image_ids': ['test1'], 'priority': True}):
+            self.assertRaises(webob.exc.HTTPBadRequest,
+                              self.controller.queue_images, req, body=body)
+        self.assertEqual([], self.controller.cache.queued_images)
 
     def test_delete_queued_image(self):
         req = webob.Request.blank('')
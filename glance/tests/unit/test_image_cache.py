@@ -19,7 +19,9 @@ import hashlib
 import os
 import time
 
+import eventlet
 import fixtures
+import mock
 from oslo_utils import units
 from oslotest import moxstubout
 import six
@@ -27,7 +29,13 @@ import six
 from six.moves import range
 
 from glance.common import exception
+from glance.common import utils
 from glance import image_cache
+# NOTE: This is imported to load the tiered driver config options
+import glance.image_cache.drivers.tiered  # noqa
+from glance.image_cache.drivers import sqlite
+from glance.image_cache import stats
+from glance.image_cache import write_behind
 # NOTE(bcwaldon): This is imported to load the registry config options
 import glance.registry  # noqa
 from glance.tests import utils as test_utils
@@ -124,6 +132,58 @@ class ImageCacheTestCase(object):
         for image_id in (1, 2):
             self.assertFalse(self.cache.is_cached(image_id))
 
+    @skip_if_disabled
+    def test_delete_listed(self):
+        """Test removing several images from the cache at once."""
+        for image_id in ('1', '2', '3'):
+            self.assertTrue(self.cache.cache_image_file(
+                image_id, six.BytesIO(FIXTURE_DATA)))
+
+        self.assertEqual(2, self.cache.delete_cached_images(['1', '3', '4']))
+
+        self.assertFalse(self.cache.is_cached('1'))
+        self.assertTrue(self.cache.is_cached('2'))
+        self.assertFalse(self.cache.is_cached('3'))
+        self.assertEqual(FIXTURE_LENGTH, self.cache.get_cache_size())
+        self.assertEqual(
+            2, self.cache.get_stats()['counters']['evictions_deleted'])
+
+    @skip_if_disabled
+    def test_cache_size(self):
+        """Test the cache size follows images being added and removed."""
+        self.assertEqual(0, self.cache.get_cache_size())
+
+        for image_id in (1, 2):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_image_file(image_id,
+                                                        FIXTURE_FILE))
+        self.assertEqual(2 * FIXTURE_LENGTH, self.cache.get_cache_size())
+
+        self.cache.delete_cached_image(1)
+        self.assertEqual(FIXTURE_LENGTH, self.cache.get_cache_size())
+
+        self.cache.delete_all_cached_images()
+        self.assertEqual(0, self.cache.get_cache_size())
+
+    @skip_if_disabled
+    def test_reconcile_cache_size(self):
+        """
+        Test cleaning the cache corrects its size after cache files have
+        been changed behind the cache's back.
+        """
+        for image_id in (1, 2):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_image_file(image_id,
+                                                        FIXTURE_FILE))
+        os.unlink(os.path.join(self.cache_dir, '1'))
+        with open(os.path.join(self.cache_dir, '2'), 'ab') as cache_file:
+            cache_file.write(b'*')
+        self.assertEqual(2 * FIXTURE_LENGTH, self.cache.get_cache_size())
+
+        self.cache.clean()
+
+        self.assertEqual(FIXTURE_LENGTH + 1, self.cache.get_cache_size())
+
     @skip_if_disabled
     def test_clean_stalled(self):
         """Test the clean method removes expected images."""
@@ -201,6 +261,9 @@ class ImageCacheTestCase(object):
         self.cache.prune()
 
         self.assertEqual(5 * units.Ki, self.cache.get_cache_size())
+        stats = self.cache.get_stats()
+        self.assertEqual(6, stats['counters']['evictions_pruned'])
+        self.assertEqual(5 * units.Ki, stats['size'])
 
         # Ensure images 0, 1, 2, 3, 4 & 5 are not cached anymore
         for x in range(0, 6):
@@ -215,6 +278,311 @@ class ImageCacheTestCase(object):
         # Ensure the newly added image, 99, is still cached
         self.assertTrue(self.cache.is_cached(99), "Image 99 was not cached!")
 
+    @skip_if_disabled
+    def test_prune_lfu(self):
+        """
+        Test that pruning the cache with the LFU policy removes the least
+        frequently used images.
+        """
+        self.config(image_cache_eviction_policy='lfu')
+        self.cache = image_cache.ImageCache()
+
+        for x in range(10):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_image_file(x, FIXTURE_FILE))
+
+        # Hit the even images twice and the odd images once
+        for x in list(range(10)) + list(range(0, 10, 2)):
+            with self.cache.open_for_read(x) as cache_file:
+                cache_file.read()
+
+        self.cache.prune()
+
+        self.assertEqual(5 * units.Ki, self.cache.get_cache_size())
+        for x in range(10):
+            self.assertEqual(x % 2 == 0, self.cache.is_cached(x))
+
+    @skip_if_disabled
+    def test_prune_keeps_policy_state(self):
+        """
+        Test that what the eviction policy learnt while pruning is kept for
+        the next prune, even by another process.
+        """
+        self.config(image_cache_eviction_policy='arc')
+        self.cache = image_cache.ImageCache()
+
+        for x in range(10):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_image_file(x, FIXTURE_FILE))
+        self.cache.prune()
+        ghosts = list(self.cache.policy.recent_ghosts)
+        self.assertEqual(5, len(ghosts))
+
+        cache = image_cache.ImageCache()
+        cache._load_policy_state()
+        self.assertEqual(ghosts, list(cache.policy.recent_ghosts))
+
+    @skip_if_disabled
+    def test_admission_nth_request(self):
+        """
+        Test that with the nth_request admission policy, images are only
+        cached on their second download once the cache is full.
+        """
+        self.config(image_cache_admission_policy='nth_request',
+                    image_cache_max_size=FIXTURE_LENGTH)
+        self.cache = image_cache.ImageCache()
+
+        def download(image_id):
+            caching_iter = self.cache.get_caching_iter(
+                image_id, None, [FIXTURE_DATA], image_size=FIXTURE_LENGTH)
+            self.assertEqual([FIXTURE_DATA], list(caching_iter))
+            return self.cache.is_cached(image_id)
+
+        # The cache has room for the first image
+        self.assertTrue(download('first'))
+        self.assertFalse(download('second'))
+        self.assertTrue(download('second'))
+
+    @skip_if_disabled
+    def test_admission_size_thresholds(self):
+        """
+        Test that images outside of the admission size thresholds are
+        decided upon by their size alone.
+        """
+        self.config(image_cache_admission_policy='nth_request',
+                    image_cache_admission_requests=10,
+                    image_cache_admission_min_size=FIXTURE_LENGTH,
+                    image_cache_admission_max_size=2 * FIXTURE_LENGTH,
+                    image_cache_max_size=0)
+        self.cache = image_cache.ImageCache()
+
+        for image_id, size, admitted in (('small', FIXTURE_LENGTH - 1, True),
+                                         ('medium', FIXTURE_LENGTH, False),
+                                         ('large', 3 * FIXTURE_LENGTH, False)):
+            caching_iter = self.cache.get_caching_iter(
+                image_id, None, [b'*' * size], image_size=size)
+            list(caching_iter)
+            self.assertEqual(admitted, self.cache.is_cached(image_id))
+
+        # Images cached on purpose are not subject to admission
+        self.assertTrue(self.cache.cache_image_file(
+            'large', six.BytesIO(b'*' * 3 * FIXTURE_LENGTH)))
+        self.assertTrue(self.cache.is_cached('large'))
+
+    @skip_if_disabled
+    def test_write_behind(self):
+        """
+        Test that images are cached by a background writer when write
+        behind is enabled
+        """
+        self.config(image_cache_write_behind=True)
+        data = [FIXTURE_DATA[:512], FIXTURE_DATA[512:]]
+        checksum = hashlib.md5(FIXTURE_DATA).hexdigest()
+
+        caching_iter = self.cache.get_caching_iter('1', checksum, iter(data))
+        self.assertEqual(data, list(caching_iter))
+        for i in range(100):
+            if self.cache.is_cached('1'):
+                break
+            eventlet.sleep(0.01)
+        with self.cache.open_for_read('1') as cache_file:
+            self.assertEqual(FIXTURE_DATA, cache_file.read())
+
+    @skip_if_disabled
+    def test_image_checksum_recorded(self):
+        """
+        Test that the checksum of an image file is recorded when the image
+        is cached
+        """
+        self.assertIsNone(self.cache.get_image_checksum('1'))
+        self.assertTrue(self.cache.cache_image_file(
+            '1', six.BytesIO(FIXTURE_DATA)))
+        self.assertEqual(hashlib.md5(FIXTURE_DATA).hexdigest(),
+                         self.cache.get_image_checksum('1'))
+
+    @skip_if_disabled
+    def test_write_behind_image_checksum_recorded(self):
+        """
+        Test that the background writer records the checksum of the image
+        file once it is committed
+        """
+        writer = write_behind.CacheWriter(self.cache, '1', units.Mi)
+        checksum = hashlib.md5(FIXTURE_DATA).hexdigest()
+        list(self.cache.cache_write_behind_iter(
+            '1', iter([FIXTURE_DATA]), checksum, writer=writer))
+        self.assertTrue(writer.wait())
+        self.assertEqual(checksum, self.cache.get_image_checksum('1'))
+
+    @skip_if_disabled
+    def test_write_behind_bad_checksum(self):
+        """
+        Test that the background writer rolls back an image with a bad
+        checksum
+        """
+        writer = write_behind.CacheWriter(self.cache, '1', units.Mi)
+        caching_iter = self.cache.cache_write_behind_iter(
+            '1', iter([FIXTURE_DATA]), 'foobar', writer=writer)
+        self.assertRaises(exception.GlanceException, list, caching_iter)
+        self.assertFalse(writer.wait())
+        self.assertFalse(self.cache.is_cached('1'))
+        self.assertFalse(self.cache.is_being_cached('1'))
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir,
+                                                    'invalid', '1')))
+
+    @skip_if_disabled
+    def test_write_behind_falls_behind(self):
+        """
+        Test that caching an image is given up, and the image still read
+        through, when the background writer falls behind
+        """
+        writer = write_behind.CacheWriter(self.cache, '1', FIXTURE_LENGTH)
+        data = [FIXTURE_DATA] * 3
+        caching_iter = self.cache.cache_write_behind_iter(
+            '1', iter(data), None, writer=writer)
+        # The writer gets no chance to run before all chunks are read
+        self.assertEqual(data, list(caching_iter))
+        self.assertFalse(writer.wait())
+        self.assertFalse(self.cache.is_cached('1'))
+        self.assertFalse(self.cache.is_being_cached('1'))
+
+    @skip_if_disabled
+    def test_write_behind_interrupted(self):
+        """
+        Test that the background writer rolls back an image whose download
+        was interrupted
+        """
+        writer = write_behind.CacheWriter(self.cache, '1', units.Mi)
+        caching_iter = self.cache.cache_write_behind_iter(
+            '1', iter([FIXTURE_DATA] * 3), None, writer=writer)
+        next(caching_iter)
+        caching_iter.close()
+        self.assertFalse(writer.wait())
+        self.assertFalse(self.cache.is_cached('1'))
+
+    @skip_if_disabled
+    def test_metadata_snapshot(self):
+        """Test storing, expiring and dropping image metadata snapshots"""
+        self.config(image_cache_metadata_ttl=60)
+        self.assertIsNone(self.cache.get_metadata_snapshot('1'))
+
+        self.cache.set_metadata_snapshot('1', {'checksum': 'c1234'})
+        self.assertEqual({'checksum': 'c1234'},
+                         self.cache.get_metadata_snapshot('1'))
+
+        path = self.cache.driver.get_image_filepath('1', 'metadata')
+        os.utime(path, (time.time() - 60, time.time() - 60))
+        self.assertIsNone(self.cache.get_metadata_snapshot('1'))
+        self.cache.clean()
+        self.assertFalse(os.path.exists(path))
+
+        self.cache.set_metadata_snapshot('1', {'checksum': 'c1234'})
+        self.cache.delete_metadata_snapshot('1')
+        self.assertIsNone(self.cache.get_metadata_snapshot('1'))
+        # Dropping a snapshot which does not exist is fine
+        self.cache.delete_metadata_snapshot('1')
+
+    @skip_if_disabled
+    def test_delete_drops_metadata_snapshot(self):
+        """Test that deleting a cached image drops its metadata snapshot"""
+        self.config(image_cache_metadata_ttl=60)
+        self._setup_fixture_file()
+        self.cache.set_metadata_snapshot(1, {'checksum': 'c1234'})
+        self.cache.delete_cached_image(1)
+        self.assertIsNone(self.cache.get_metadata_snapshot(1))
+
+        self.cache.set_metadata_snapshot(2, {'checksum': 'c1234'})
+        self.cache.delete_all_cached_images()
+        self.assertIsNone(self.cache.get_metadata_snapshot(2))
+
+    @skip_if_disabled
+    def test_partial_caching(self):
+        """
+        Test that partial reads cache the blocks they read, and that the
+        image is cached as a whole once all its blocks were read
+        """
+        self.config(image_cache_partial_block_size=256)
+        checksum = hashlib.md5(FIXTURE_DATA).hexdigest()
+
+        caching_iter = self.cache.get_partial_caching_iter(
+            '1', checksum, iter([FIXTURE_DATA[100:600]]), 100, FIXTURE_LENGTH)
+        self.assertEqual(FIXTURE_DATA[100:600], b''.join(caching_iter))
+        self.assertFalse(self.cache.is_cached('1'))
+        self.assertTrue(self.cache.has_partial_ranges('1', [(256, 512)]))
+        self.assertFalse(self.cache.has_partial_ranges('1', [(0, 512)]))
+        with self.cache.open_partial_for_read('1') as partial_file:
+            partial_file.seek(300)
+            self.assertEqual(FIXTURE_DATA[300:400], partial_file.read(100))
+
+        with mock.patch.object(eventlet, 'spawn_n') as mock_spawn_n:
+            for start, stop in ((0, 256), (512, FIXTURE_LENGTH)):
+                list(self.cache.get_partial_caching_iter(
+                    '1', checksum, iter([FIXTURE_DATA[start:stop]]), start,
+                    FIXTURE_LENGTH))
+        # The image is cached as a whole after the response
+        self.assertFalse(self.cache.is_cached('1'))
+        mock_spawn_n.assert_called_once_with(
+            self.cache._promote_in_background, '1', checksum)
+        self.cache._promote_in_background('1', checksum)
+        self.assertTrue(self.cache.is_cached('1'))
+        self.assertIsNone(self.cache.get_partial_image('1'))
+
+        # Nothing is written once the image is cached
+        image_iter = iter([FIXTURE_DATA])
+        self.assertIs(image_iter, self.cache.get_partial_caching_iter(
+            '1', checksum, image_iter, 0, FIXTURE_LENGTH))
+
+    @skip_if_disabled
+    def test_partial_caching_bad_checksum(self):
+        """
+        Test that a partially cached image is discarded if it does not
+        match its checksum once all its blocks were read
+        """
+        list(self.cache.get_partial_caching_iter(
+            '1', 'bad', iter([FIXTURE_DATA]), 0, FIXTURE_LENGTH))
+        eventlet.sleep(0)
+        self.assertFalse(self.cache.is_cached('1'))
+        self.assertIsNone(self.cache.get_partial_image('1'))
+
+    @skip_if_disabled
+    def test_promote_partial_image_being_cached(self):
+        """
+        Test that a partially cached image is not cached as a whole while a
+        download of the image caches it
+        """
+        self.config(image_cache_partial_block_size=256)
+        with mock.patch.object(eventlet, 'spawn_n'):
+            list(self.cache.get_partial_caching_iter(
+                '1', None, iter([FIXTURE_DATA]), 0, FIXTURE_LENGTH))
+        self.assertTrue(self.cache.claim_fill('1'))
+        self.assertFalse(self.cache.promote_partial_image('1', None))
+        self.assertIsNotNone(self.cache.get_partial_image('1'))
+
+        self.cache.release_fill('1')
+        self.assertTrue(self.cache.promote_partial_image('1', None))
+        self.assertIsNone(self.cache.get_partial_image('1'))
+
+    @skip_if_disabled
+    def test_delete_partial_images(self):
+        """Test that partially cached images are deleted and cleaned up"""
+        self.config(image_cache_partial_block_size=256)
+        for image_id in ('1', '2', '3'):
+            list(self.cache.get_partial_caching_iter(
+                image_id, None, iter([FIXTURE_DATA[:256]]), 0,
+                FIXTURE_LENGTH))
+            self.assertIsNotNone(self.cache.get_partial_image(image_id))
+
+        self.cache.delete_cached_image('1')
+        self.assertIsNone(self.cache.get_partial_image('1'))
+
+        path = self.cache.driver.get_image_filepath('2', 'partial')
+        os.utime(path, (0, 0))
+        self.cache.clean()
+        self.assertIsNone(self.cache.get_partial_image('2'))
+        self.assertIsNotNone(self.cache.get_partial_image('3'))
+
+        self.cache.delete_all_cached_images()
+        self.assertIsNone(self.cache.get_partial_image('3'))
+
     @skip_if_disabled
     def test_prune_to_zero(self):
         """Test that an image_cache_max_size of 0 doesn't kill the pruner
@@ -240,6 +608,57 @@ class ImageCacheTestCase(object):
         self.assertEqual(0, self.cache.get_cache_size())
         self.assertFalse(self.cache.is_cached('xxx'))
 
+    def _wait_for_pruning(self):
+        for i in range(100):
+            if not self.cache._pruning:
+                return
+            eventlet.sleep(0.01)
+        self.fail("Pruning in the background did not finish")
+
+    @skip_if_disabled
+    def test_prune_in_background_disabled(self):
+        for x in range(10):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_image_file(x, FIXTURE_FILE))
+        self.assertFalse(self.cache._pruning)
+        self.assertEqual(10 * units.Ki, self.cache.get_cache_size())
+
+    @skip_if_disabled
+    def test_prune_in_background(self):
+        # The cache is pruned down to 3KB once it holds more than 5KB
+        self.config(image_cache_prune_high_watermark=100,
+                    image_cache_prune_low_watermark=60)
+        for x in range(5):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_image_file(x, FIXTURE_FILE))
+        self.assertFalse(self.cache._pruning)
+
+        FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+        self.assertTrue(self.cache.cache_image_file(5, FIXTURE_FILE))
+        self.assertTrue(self.cache._pruning)
+        self._wait_for_pruning()
+
+        self.assertEqual(3 * units.Ki, self.cache.get_cache_size())
+        stats = self.cache.get_stats()
+        self.assertEqual(3, stats['counters']['evictions_pruned'])
+
+    @skip_if_disabled
+    def test_prune_in_background_locked(self):
+        self.config(image_cache_prune_high_watermark=100,
+                    image_cache_prune_low_watermark=60)
+        for x in range(5):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_image_file(x, FIXTURE_FILE))
+
+        # Another process is pruning the cache
+        other = image_cache.ImageCache()
+        with other._prune_lock() as locked:
+            self.assertTrue(locked)
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_image_file(5, FIXTURE_FILE))
+            self._wait_for_pruning()
+        self.assertEqual(6 * units.Ki, self.cache.get_cache_size())
+
     @skip_if_disabled
     def test_queue(self):
         """
@@ -280,6 +699,108 @@ class ImageCacheTestCase(object):
         self.assertEqual(['0', '1', '2'],
                          self.cache.get_queued_images())
 
+    @skip_if_disabled
+    def test_queue_priority(self):
+        """
+        Test that the priority an image was queued with is kept
+        """
+        self.assertTrue(self.cache.queue_image('high', 10))
+        self.assertTrue(self.cache.queue_image('default'))
+
+        self.assertEqual(10, self.cache.get_queue_priority('high'))
+        self.assertEqual(0, self.cache.get_queue_priority('default'))
+        self.assertEqual(0, self.cache.get_queue_priority('unknown'))
+
+    @skip_if_disabled
+    def test_queue_images(self):
+        """
+        Test that several images can be queued at once, leaving out those
+        already queued or cached
+        """
+        self.assertTrue(self.cache.cache_image_file(
+            'cached', six.BytesIO(FIXTURE_DATA)))
+        self.assertTrue(self.cache.queue_image('queued'))
+
+        self.assertEqual(2, self.cache.queue_images(
+            ['cached', 'queued', 'new1', 'new2'], 5))
+        self.assertEqual(['new1', 'new2', 'queued'],
+                         sorted(self.cache.get_queued_images()))
+        self.assertEqual(5, self.cache.get_queue_priority('new1'))
+        self.assertEqual(0, self.cache.get_queue_priority('queued'))
+
+    def _interrupt_caching(self, image_id, data):
+        """
+        Writes data into the cache for image_id with the driver's resume
+        mode, after which the backend stream fails.
+        """
+        def failing_iter():
+            yield data
+            raise IOError('backend connection lost')
+
+        self.assertEqual(0, self.cache.get_resume_offset(image_id))
+        list(self.cache.cache_tee_iter(image_id, failing_iter(), None,
+                                       resume_offset=0))
+
+    @skip_if_disabled
+    def test_resume_caching(self):
+        """
+        Test that caching an image can resume from the incomplete image
+        file an interrupted attempt left behind
+        """
+        image_id = '1'
+        data = b'0123456789' * 100
+        checksum = hashlib.md5(data).hexdigest()
+
+        self._interrupt_caching(image_id, data[:300])
+        self.assertFalse(self.cache.is_cached(image_id))
+        self.assertTrue(self.cache.is_being_cached(image_id))
+
+        self.assertEqual(300, self.cache.get_resume_offset(image_id))
+
+        list(self.cache.cache_tee_iter(image_id, [data[300:]], checksum,
+                                       resume_offset=300))
+        self.assertTrue(self.cache.is_cached(image_id))
+        with self.cache.open_for_read(image_id) as cache_file:
+            self.assertEqual(data, cache_file.read())
+
+    @skip_if_disabled
+    def test_resume_offset_while_written(self):
+        """
+        Test that an incomplete image file is not resumed from while it is
+        being written to, however long it has not grown
+        """
+        image_id = '1'
+        self._interrupt_caching(image_id, b'*' * 300)
+        self.config(image_cache_single_flight_timeout=0)
+
+        def write():
+            with self.cache.driver.open_for_write(image_id, resume=True):
+                self.assertIsNone(self.cache.get_resume_offset(image_id))
+                raise IOError('backend connection lost')
+
+        self.assertRaises(IOError, write)
+        # The lock went away with the writer
+        self.assertEqual(300, self.cache.get_resume_offset(image_id))
+
+    @skip_if_disabled
+    def test_resume_caching_bad_checksum(self):
+        """
+        Test that resuming caching an image whose incomplete image file
+        does not match the image invalidates the file
+        """
+        image_id = '1'
+        data = b'0123456789' * 100
+        checksum = hashlib.md5(data).hexdigest()
+
+        self._interrupt_caching(image_id, b'*' * 300)
+        self.assertRaises(exception.GlanceException, list,
+                          self.cache.cache_tee_iter(image_id, [data[300:]],
+                                                    checksum,
+                                                    resume_offset=300))
+        self.assertFalse(self.cache.is_cached(image_id))
+        self.assertFalse(self.cache.is_being_cached(image_id))
+        self.assertEqual(0, self.cache.get_resume_offset(image_id))
+
     def test_open_for_write_good(self):
         """
         Test to see if open_for_write works in normal case
@@ -350,6 +871,18 @@ class ImageCacheTestCase(object):
         self.assertFalse(os.path.exists(incomplete_file_path))
         self.assertFalse(os.path.exists(invalid_file_path))
 
+    def test_caching_iterator_joins_stream(self):
+        """
+        Test that the caching iterator observes an ImageStream it is given
+        rather than wrapping it in another iterator
+        """
+        data = [b'a', b'b', b'c']
+        stream = utils.ImageStream(iter(data))
+        caching_iter = self.cache.get_caching_iter('1', None, stream)
+        self.assertIs(stream, caching_iter)
+        self.assertEqual(data, list(caching_iter))
+        self.assertTrue(self.cache.is_cached('1'))
+
     def test_caching_iterator_handles_backend_failure(self):
         """
         Test that when the backend fails, caching_iter does not continue trying
@@ -430,6 +963,210 @@ class ImageCacheTestCase(object):
         self.assertRaises(exception.GlanceException, reader)
         # checksum is invalid, caching will fail:
         self.assertFalse(cache.is_cached(image_id))
+        counters = cache.get_stats()['counters']
+        self.assertEqual(1, counters['checksum_rejections'])
+        self.assertEqual(0, counters['tee_failures'])
+
+    @skip_if_disabled
+    def test_stats_fill_and_deletions(self):
+        """
+        Test that writing images into the cache and deleting them is
+        counted in the statistics of the cache.
+        """
+        for image_id in (1, 2, 3):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_image_file(image_id,
+                                                        FIXTURE_FILE))
+
+        stats = self.cache.get_stats()
+        fill_seconds = stats['histograms']['fill_seconds']
+        self.assertEqual(3, sum(fill_seconds['counts']))
+        self.assertEqual(len(fill_seconds['buckets']) + 1,
+                         len(fill_seconds['counts']))
+        self.assertEqual(3 * FIXTURE_LENGTH, stats['size'])
+        self.assertEqual(0.0, stats['hit_ratio'])
+
+        self.cache.delete_cached_image(1)
+        # Deleting an image that is not cached evicts nothing
+        self.cache.delete_cached_image(1)
+        self.assertEqual(2, self.cache.delete_all_cached_images())
+        self.assertEqual(
+            3, self.cache.get_stats()['counters']['evictions_deleted'])
+
+        # A new instance, as in another worker, sees the same statistics
+        self.assertEqual(
+            3, image_cache.ImageCache().get_stats()['counters'][
+                'evictions_deleted'])
+
+    def test_following_iter(self):
+        """
+        Test that a request following a cache fill receives the image data
+        as it is written, and completes once the fill is committed.
+        """
+        image_id = '1'
+        data = [b'a' * 10, b'b' * 10, b'c' * 10]
+        self.assertRaises(exception.NotFound,
+                          self.cache.get_following_iter, image_id)
+
+        def fill():
+            with self.cache.driver.open_for_write(image_id) as cache_file:
+                for chunk in data:
+                    cache_file.write(chunk)
+                    cache_file.flush()
+                    eventlet.sleep(0.2)
+
+        filler = eventlet.spawn(fill)
+        while not self.cache.is_being_cached(image_id):
+            eventlet.sleep(0)
+
+        following_iter = self.cache.get_following_iter(image_id)
+        self.assertEqual(b''.join(data), b''.join(following_iter))
+        filler.wait()
+        self.assertTrue(self.cache.is_cached(image_id))
+
+    def test_following_iter_fill_fails(self):
+        """
+        Test that a request following a cache fill fails if the fill is
+        rolled back.
+        """
+        image_id = '1'
+
+        def fill():
+            with self.cache.driver.open_for_write(image_id) as cache_file:
+                cache_file.write(b'a' * 10)
+                cache_file.flush()
+                eventlet.sleep(0.2)
+                raise IOError
+
+        filler = eventlet.spawn(fill)
+        while not self.cache.is_being_cached(image_id):
+            eventlet.sleep(0)
+
+        following_iter = self.cache.get_following_iter(image_id)
+        self.assertRaises(exception.GlanceException, list, following_iter)
+        self.assertRaises(IOError, filler.wait)
+        self.assertFalse(self.cache.is_cached(image_id))
+
+    def test_following_iter_fill_stalls(self):
+        """
+        Test that a request following a cache fill gives up when no data is
+        written for longer than the single flight timeout.
+        """
+        self.config(image_cache_single_flight_timeout=0)
+        image_id = '1'
+        incomplete_file_path = os.path.join(self.cache_dir,
+                                            'incomplete', image_id)
+        with open(incomplete_file_path, 'wb') as incomplete_file:
+            incomplete_file.write(FIXTURE_DATA)
+
+        following_iter = self.cache.get_following_iter(image_id)
+        self.assertEqual(FIXTURE_DATA, next(following_iter))
+        self.assertRaises(exception.GlanceException, next, following_iter)
+
+    def test_claim_fill(self):
+        image_id = '1'
+        self.assertTrue(self.cache.claim_fill(image_id))
+        self.assertFalse(self.cache.claim_fill(image_id))
+        self.cache.release_fill(image_id)
+        self.assertTrue(self.cache.claim_fill(image_id))
+
+        # An expired claim is handed over to the next request
+        self.config(image_cache_single_flight_timeout=0)
+        self.assertTrue(self.cache.claim_fill(image_id))
+
+    def test_wait_for_fill(self):
+        image_id = '1'
+        self.assertFalse(self.cache.wait_for_fill(image_id))
+
+        self.assertTrue(self.cache.claim_fill(image_id))
+
+        def fill():
+            caching_iter = self.cache.get_caching_iter(image_id, None,
+                                                       iter([b'a']))
+            self.assertEqual(b'a', next(caching_iter))
+            list(caching_iter)
+
+        filler = eventlet.spawn_after(0.2, fill)
+        self.assertTrue(self.cache.wait_for_fill(image_id))
+        # The claim is released once the cache file has been created
+        self.assertTrue(self.cache.claim_fill(image_id))
+        filler.wait()
+
+    def test_wait_for_fill_claim_expires(self):
+        self.config(image_cache_single_flight_timeout=0)
+        image_id = '1'
+        self.assertTrue(self.cache.claim_fill(image_id))
+        self.assertFalse(self.cache.wait_for_fill(image_id))
+
+    def test_relay_rejected_image(self):
+        """
+        Test that the request holding the fill claim on an image which the
+        admission policy rejects keeps the claim while it reads the image,
+        and that the requests waiting on it follow the image without it
+        being cached.
+        """
+        self.config(image_cache_admission_max_size=1)
+        image_id = '1'
+        data = [b'a' * 10, b'b' * 10, b'c' * 10]
+        self.assertTrue(self.cache.claim_fill(image_id))
+
+        def read():
+            caching_iter = self.cache.get_caching_iter(
+                image_id, None, iter(data), image_size=30, relay=True)
+            chunks = []
+            for chunk in caching_iter:
+                chunks.append(chunk)
+                eventlet.sleep(0.2)
+            return b''.join(chunks)
+
+        reader = eventlet.spawn(read)
+        self.assertTrue(self.cache.wait_for_fill(image_id))
+        self.assertFalse(self.cache.claim_fill(image_id))
+        following_iter = self.cache.get_following_iter(image_id)
+        self.assertEqual(b''.join(data), b''.join(following_iter))
+        self.assertEqual(b''.join(data), reader.wait())
+
+        self.assertFalse(self.cache.is_cached(image_id))
+        self.assertFalse(self.cache.is_being_cached(image_id))
+        self.assertEqual([], os.listdir(self.cache.driver.relay_dir))
+        # The claim is released once the image has been relayed
+        self.assertTrue(self.cache.claim_fill(image_id))
+
+    def test_relay_rejected_image_fails(self):
+        """
+        Test that the requests following a relayed image fail if reading
+        the image fails.
+        """
+        self.config(image_cache_admission_max_size=1)
+        image_id = '1'
+        self.assertTrue(self.cache.claim_fill(image_id))
+
+        def image_iter():
+            yield b'a' * 10
+            eventlet.sleep(0.2)
+            raise IOError()
+
+        def read():
+            list(self.cache.get_caching_iter(image_id, None, image_iter(),
+                                             image_size=10, relay=True))
+
+        reader = eventlet.spawn(read)
+        self.assertTrue(self.cache.wait_for_fill(image_id))
+        following_iter = self.cache.get_following_iter(image_id)
+        self.assertRaises(exception.GlanceException, list, following_iter)
+        self.assertRaises(IOError, reader.wait)
+        self.assertEqual([], os.listdir(self.cache.driver.relay_dir))
+        self.assertTrue(self.cache.claim_fill(image_id))
+
+    def test_rejected_image_releases_claim_without_relay(self):
+        self.config(image_cache_admission_max_size=1)
+        image_id = '1'
+        self.assertTrue(self.cache.claim_fill(image_id))
+        caching_iter = self.cache.get_caching_iter(
+            image_id, None, iter([b'a' * 10]), image_size=10)
+        self.assertTrue(self.cache.claim_fill(image_id))
+        self.assertEqual([b'a' * 10], list(caching_iter))
+        self.assertFalse(self.cache.is_cached(image_id))
 
 
 class TestImageCacheXattr(test_utils.BaseTestCase,
@@ -473,6 +1210,124 @@ class TestImageCacheXattr(test_utils.BaseTestCase,
             return
 
 
+    @skip_if_disabled
+    def test_cache_size_of_recached_image(self):
+        for data in (b'*' * 10, b'*' * 20):
+            with self.cache.driver.open_for_write('1') as cache_file:
+                cache_file.write(data)
+        # The image file replaced was taken off the total
+        self.assertEqual(20, self.cache.get_cache_size())
+
+    @skip_if_disabled
+    def test_cache_size_of_concurrently_deleted_image(self):
+        for image_id, data in (('1', b'*' * 10), ('2', b'*' * 20)):
+            with self.cache.driver.open_for_write(image_id) as cache_file:
+                cache_file.write(data)
+
+        getsize = os.path.getsize
+        raced = []
+
+        def racing_getsize(path):
+            size = getsize(path)
+            if not raced:
+                raced.append(path)
+                # Another request deletes the image in the meantime
+                self.cache.delete_cached_image('1')
+            return size
+
+        with mock.patch.object(os.path, 'getsize',
+                               side_effect=racing_getsize):
+            self.cache.delete_cached_image('1')
+        self.assertFalse(self.cache.is_cached('1'))
+        # The size of the image was taken off the total only once
+        self.assertEqual(20, self.cache.get_cache_size())
+
+
+class TestImageCacheXattrIndexed(TestImageCacheXattr):
+
+    """Tests image caching when xattr is used in an indexed cache"""
+
+    def setUp(self):
+        super(TestImageCacheXattrIndexed, self).setUp()
+
+        if getattr(self, 'disabled', False):
+            return
+
+        self.config(image_cache_driver='xattr_indexed')
+        self.cache = image_cache.ImageCache()
+
+    def _age_cache_dir(self):
+        # Leave the time the cache directory was last changed behind, as
+        # if the index had been built a while ago
+        old = time.time() - 60
+        os.utime(self.cache_dir, (old, old))
+        self.cache.driver.reset_index()
+
+    @skip_if_disabled
+    def test_index_sees_other_processes(self):
+        """
+        Test that images cached and removed by another process show up in
+        the index.
+        """
+        self.assertTrue(self.cache.cache_image_file(
+            1, six.BytesIO(FIXTURE_DATA)))
+        self.assertEqual(['1'], [entry['image_id'] for entry in
+                                 self.cache.get_cached_images()])
+
+        other = image_cache.ImageCache()
+        self.assertTrue(other.cache_image_file(2, six.BytesIO(FIXTURE_DATA)))
+        other.delete_cached_image(1)
+
+        entries = self.cache.get_cached_images()
+        self.assertEqual(['2'], [entry['image_id'] for entry in entries])
+        self.assertEqual(FIXTURE_LENGTH, entries[0]['size'])
+        self.assertEqual(('2', FIXTURE_LENGTH),
+                         self.cache.driver.get_least_recently_accessed())
+
+    @skip_if_disabled
+    def test_index_not_rebuilt_when_unchanged(self):
+        """
+        Test that listing the cache only reads the files once the index is
+        built, unless the cache directory changed.
+        """
+        for image_id in (1, 2, 3):
+            self.assertTrue(self.cache.cache_image_file(
+                image_id, six.BytesIO(FIXTURE_DATA)))
+        self._age_cache_dir()
+        self.assertEqual(3, len(self.cache.get_cached_images()))
+
+        with mock.patch('os.stat', side_effect=os.stat) as mock_stat:
+            with mock.patch('os.listdir',
+                            side_effect=os.listdir) as mock_listdir:
+                self.assertEqual(3, len(self.cache.get_cached_images()))
+                self.assertEqual('1', self.cache.driver.
+                                 get_least_recently_accessed()[0])
+        # The cache directory alone
+        self.assertEqual([mock.call(self.cache_dir)] * 2,
+                         mock_stat.call_args_list)
+        self.assertFalse(mock_listdir.called)
+
+    @skip_if_disabled
+    def test_index_counts_hits(self):
+        """
+        Test that hits of this process are counted in the index right away
+        and those of other processes once the index is refreshed.
+        """
+        self.assertTrue(self.cache.cache_image_file(
+            1, six.BytesIO(FIXTURE_DATA)))
+        self.assertEqual(0, self.cache.get_hit_count(1))
+        with self.cache.open_for_read(1):
+            pass
+        self.assertEqual(1, self.cache.get_hit_count(1))
+
+        other = image_cache.ImageCache()
+        with other.open_for_read(1):
+            pass
+        self.assertEqual(1, self.cache.get_hit_count(1))
+        self.config(image_cache_index_refresh_interval=0)
+        self.assertEqual(2, self.cache.get_hit_count(1))
+
+
 class TestImageCacheSqlite(test_utils.BaseTestCase,
                            ImageCacheTestCase):
 
@@ -505,6 +1360,208 @@ class TestImageCacheSqlite(test_utils.BaseTestCase,
                     image_cache_max_size=5 * units.Ki)
         self.cache = image_cache.ImageCache()
 
+    def _read_hits_from_db(self, image_id):
+        with self.cache.driver.get_db() as db:
+            cur = db.execute("""SELECT hits FROM cached_images
+                             WHERE image_id = ?""", (image_id,))
+            return cur.fetchone()[0]
+
+    @skip_if_disabled
+    def test_hits_are_buffered(self):
+        self.config(image_cache_sqlite_flush_interval=3600)
+        self._setup_fixture_file()
+
+        for i in range(3):
+            with self.cache.open_for_read(1):
+                pass
+
+        # The first hit is written out at once, the others are buffered
+        self.assertEqual(1, self._read_hits_from_db('1'))
+        self.assertEqual(3, self.cache.driver.get_hit_count('1'))
+        self.assertEqual(3, self._read_hits_from_db('1'))
+
+    @skip_if_disabled
+    def test_buffered_hits_flushed_when_idle(self):
+        self.config(image_cache_sqlite_flush_interval=3600)
+        self._setup_fixture_file()
+
+        with mock.patch.object(sqlite.greenthread,
+                               'spawn_after') as spawn_after:
+            for i in range(3):
+                with self.cache.open_for_read(1):
+                    pass
+        # A single flush is scheduled for the hits buffered after the first
+        self.assertEqual(1, spawn_after.call_count)
+        self.assertEqual(1, self._read_hits_from_db('1'))
+        spawn_after.call_args[0][1]()
+        self.assertEqual(3, self._read_hits_from_db('1'))
+
+    @skip_if_disabled
+    def test_buffered_hits_flushed_at_exit(self):
+        self.config(image_cache_sqlite_flush_interval=3600)
+        self._setup_fixture_file()
+
+        for i in range(3):
+            with self.cache.open_for_read(1):
+                pass
+        sqlite._flush_all_hits()
+        self.assertEqual(3, self._read_hits_from_db('1'))
+
+    @skip_if_disabled
+    def test_hits_written_without_flush_interval(self):
+        self.config(image_cache_sqlite_flush_interval=0)
+        self._setup_fixture_file()
+
+        for i in range(3):
+            with self.cache.open_for_read(1):
+                pass
+
+        self.assertEqual(3, self._read_hits_from_db('1'))
+
+    @skip_if_disabled
+    def test_buffered_hits_dropped_on_delete(self):
+        self.config(image_cache_sqlite_flush_interval=3600)
+        self._setup_fixture_file()
+
+        for i in range(3):
+            with self.cache.open_for_read(1):
+                pass
+        self.cache.delete_cached_image(1)
+        self._setup_fixture_file()
+
+        self.assertEqual(0, self.cache.driver.get_hit_count('1'))
+
+    @skip_if_disabled
+    def test_connections_are_reused(self):
+        with self.cache.driver.get_db() as db:
+            conn = db
+        with self.cache.driver.get_db() as db:
+            self.assertIs(conn, db)
+
+    @skip_if_disabled
+    def test_write_ahead_log(self):
+        self._setup_fixture_file()
+        with self.cache.driver.get_db() as db:
+            journal_mode = db.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual('wal', journal_mode.lower())
+        # Neither the database nor its log count as cached images
+        self.assertEqual(['1'], [os.path.basename(path) for path in
+                                 self.cache.driver.get_cache_files(
+                                     self.cache_dir)])
+        self.assertEqual(FIXTURE_LENGTH, self.cache.get_cache_size())
+
+    @skip_if_disabled
+    def test_reconcile_cache_size_records(self):
+        for image_id in (1, 2):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_image_file(image_id,
+                                                        FIXTURE_FILE))
+        os.unlink(os.path.join(self.cache_dir, '1'))
+        with open(os.path.join(self.cache_dir, '3'), 'wb') as cache_file:
+            cache_file.write(FIXTURE_DATA)
+
+        self.assertEqual(2 * FIXTURE_LENGTH,
+                         self.cache.driver.reconcile_cache_size())
+        self.assertEqual(['2', '3'],
+                         [image['image_id'] for image in
+                          self.cache.get_cached_images()])
+
+    @skip_if_disabled
+    def test_rollback_journal(self):
+        self.config(image_cache_sqlite_wal=False)
+        cache = image_cache.ImageCache()
+        with cache.driver.get_db() as db:
+            journal_mode = db.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual('delete', journal_mode.lower())
+
+
+class TestImageCacheTiered(test_utils.BaseTestCase,
+                           ImageCacheTestCase):
+
+    """Tests image caching when the tiered driver is used in cache"""
+
+    def setUp(self):
+        super(TestImageCacheTiered, self).setUp()
+        self.inited = True
+        self.disabled = False
+        self.cache_dir = self.useFixture(fixtures.TempDir()).path
+        self.fast_dir = self.useFixture(fixtures.TempDir()).path
+        self.config(image_cache_dir=self.cache_dir,
+                    image_cache_driver='tiered',
+                    image_cache_max_size=5 * units.Ki,
+                    image_cache_tiers=['%s:2K' % self.fast_dir],
+                    image_cache_sqlite_flush_interval=0)
+        self.cache = image_cache.ImageCache()
+
+    def _cache_images(self, hits):
+        for image_id, image_hits in enumerate(hits):
+            FIXTURE_FILE = six.BytesIO(FIXTURE_DATA)
+            self.assertTrue(self.cache.cache_image_file(image_id,
+                                                        FIXTURE_FILE))
+            for i in range(image_hits):
+                with self.cache.open_for_read(image_id) as cache_file:
+                    cache_file.read()
+
+    def _tiers(self):
+        return [self.cache.driver.get_image_tier(image['image_id'])
+                for image in self.cache.get_cached_images()]
+
+    def test_driver_loaded(self):
+        self.assertEqual('glance.image_cache.drivers.tiered',
+                         self.cache.driver.__module__)
+        self.assertEqual([(self.fast_dir, 2 * units.Ki)],
+                         self.cache.driver.tiers)
+
+    def test_invalid_tiers(self):
+        for tiers in (['%s' % self.fast_dir], ['%s:lots' % self.fast_dir],
+                      ['%s:1G' % self.cache_dir]):
+            self.config(image_cache_tiers=tiers)
+            cache = image_cache.ImageCache()
+            self.assertEqual('glance.image_cache.drivers.sqlite',
+                             cache.driver.__module__)
+
+    def test_rebalance(self):
+        """
+        Test that the images with the most hits are moved to the fast tier,
+        as far as it has room for them
+        """
+        self._cache_images([2, 5, 1, 3])
+        self.assertEqual([1, 1, 1, 1], self._tiers())
+
+        self.assertEqual(2, self.cache.driver.rebalance())
+        self.assertEqual([1, 0, 1, 0], self._tiers())
+        self.assertTrue(os.path.exists(os.path.join(self.fast_dir, '1')))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, '1')))
+
+        # Image 0 gets more hits than image 3, and takes its place
+        for i in range(3):
+            with self.cache.open_for_read(0) as cache_file:
+                self.assertEqual(FIXTURE_DATA, cache_file.read())
+        self.cache.clean()
+        self.assertEqual([0, 0, 1, 1], self._tiers())
+        self.assertEqual(4 * FIXTURE_LENGTH, self.cache.get_cache_size())
+
+    def test_images_in_fast_tier(self):
+        """
+        Test that images moved to the fast tier are still found, counted
+        and deleted
+        """
+        self._cache_images([2, 2])
+        self.cache.driver.rebalance()
+        self.assertEqual([0, 0], self._tiers())
+
+        self.assertTrue(self.cache.is_cached(0))
+        self.assertEqual(FIXTURE_LENGTH, self.cache.driver.get_image_size(0))
+        self.assertEqual(2 * FIXTURE_LENGTH,
+                         self.cache.driver.reconcile_cache_size())
+
+        self.cache.delete_cached_image(0)
+        self.assertFalse(self.cache.is_cached(0))
+        self.assertFalse(os.path.exists(os.path.join(self.fast_dir, '0')))
+        self.assertEqual(1, self.cache.delete_all_cached_images())
+        self.assertEqual([], os.listdir(self.fast_dir + '/moving'))
+        self.assertEqual(0, self.cache.get_cache_size())
+
 
 class TestImageCacheNoDep(test_utils.BaseTestCase):
 
@@ -512,9 +1569,11 @@ class TestImageCacheNoDep(test_utils.BaseTestCase):
         super(TestImageCacheNoDep, self).setUp()
 
         self.driver = None
+        self.stats_dir = self.useFixture(fixtures.TempDir()).path
 
         def init_driver(self2):
             self2.driver = self.driver
+            self2.stats = stats.CacheStats(self.stats_dir)
 
         mox_fixture = self.useFixture(moxstubout.MoxStubout())
         self.stubs = mox_fixture.stubs
@@ -543,6 +1602,8 @@ class TestImageCacheNoDep(test_utils.BaseTestCase):
 
         caching_iter = cache.get_caching_iter('dummy_id', None, iter(data))
         self.assertEqual(data, list(caching_iter))
+        self.assertEqual(
+            1, cache.stats.get_stats()['counters']['tee_failures'])
 
     def test_get_caching_iter_when_open_fails(self):
 
@@ -561,3 +1622,5 @@ class TestImageCacheNoDep(test_utils.BaseTestCase):
 
         caching_iter = cache.get_caching_iter('dummy_id', None, iter(data))
         self.assertEqual(data, list(caching_iter))
+        self.assertEqual(
+            1, cache.stats.get_stats()['counters']['tee_failures'])
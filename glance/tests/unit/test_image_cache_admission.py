@@ -0,0 +1,106 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+import mock
+
+from glance.image_cache.admission import always
+from glance.image_cache.admission import nth_request
+from glance.image_cache.admission import tinylfu
+from glance.tests import utils
+
+
+class TestAlwaysPolicy(utils.BaseTestCase):
+
+    def test_admit(self):
+        self.assertTrue(always.Policy().admit('image'))
+
+
+class TestNthRequestPolicy(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestNthRequestPolicy, self).setUp()
+        self.config(image_cache_admission_requests=3,
+                    image_cache_admission_window=100)
+        self.now = 1000.0
+        patcher = mock.patch.object(time, 'time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_admit_on_nth_request(self):
+        policy = nth_request.Policy()
+        self.assertFalse(policy.admit('a'))
+        self.assertFalse(policy.admit('b'))
+        self.assertFalse(policy.admit('a'))
+        self.assertTrue(policy.admit('a'))
+        self.assertNotIn('a', policy.requests)
+        self.assertFalse(policy.admit('b'))
+
+    def test_requests_outside_window_ignored(self):
+        policy = nth_request.Policy()
+        self.assertFalse(policy.admit('a'))
+        self.now += 60
+        self.assertFalse(policy.admit('a'))
+        self.now += 60
+        # The first request has fallen out of the window
+        self.assertFalse(policy.admit('a'))
+        self.assertTrue(policy.admit('a'))
+
+    def test_expired_images_forgotten(self):
+        policy = nth_request.Policy()
+        policy.admit('a')
+        self.now += 150
+        policy.admit('b')
+        self.assertEqual(['b'], list(policy.requests))
+
+
+class TestTinyLFUPolicy(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestTinyLFUPolicy, self).setUp()
+        self.config(image_cache_admission_requests=2,
+                    image_cache_admission_window=100)
+
+    @mock.patch.object(time, 'time', return_value=1000.0)
+    def test_admit_on_nth_request(self, mock_time):
+        policy = tinylfu.Policy()
+        self.assertFalse(policy.admit('a'))
+        self.assertFalse(policy.admit('b'))
+        self.assertTrue(policy.admit('a'))
+        self.assertEqual(2, policy.estimate('a'))
+        self.assertEqual(1, policy.estimate('b'))
+        self.assertEqual(0, policy.estimate('c'))
+
+    @mock.patch.object(time, 'time')
+    def test_counters_aged(self, mock_time):
+        mock_time.return_value = 1000.0
+        policy = tinylfu.Policy()
+        for i in range(4):
+            policy.admit('a')
+        self.assertEqual(4, policy.estimate('a'))
+
+        mock_time.return_value = 1150.0
+        self.assertTrue(policy.admit('a'))
+        self.assertEqual(3, policy.estimate('a'))
+
+        mock_time.return_value = 1350.0
+        self.assertFalse(policy.admit('a'))
+        self.assertEqual(1, policy.estimate('a'))
+
+    def test_window_must_be_positive(self):
+        # The counters are aged once per window
+        self.assertRaises(ValueError, self.config,
+                          image_cache_admission_window=0)
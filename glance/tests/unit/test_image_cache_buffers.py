@@ -0,0 +1,143 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import io
+import os
+import subprocess
+import sys
+import textwrap
+
+import eventlet
+import fixtures
+from oslo_utils import units
+import six
+
+from glance.image_cache import buffers
+from glance.tests import utils
+
+# Caches an image of the size given on the command line from a file-like
+# object that takes up no memory, and prints how many KiB the peak RSS of
+# the process grew by meanwhile
+RSS_SCRIPT = textwrap.dedent("""
+    import resource
+    import sys
+
+    from oslo_config import cfg
+
+    from glance import image_cache
+
+    class Zeros(object):
+        def __init__(self, size):
+            self.remaining = size
+
+        def readinto(self, buf):
+            size = min(len(buf), self.remaining)
+            self.remaining -= size
+            return size
+
+    cfg.CONF([], project='glance', default_config_files=[])
+    cfg.CONF.set_override('image_cache_dir', sys.argv[1])
+    cfg.CONF.set_override('image_cache_driver', 'sqlite')
+    cache = image_cache.ImageCache()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cache.cache_image_file('1', Zeros(int(sys.argv[2])))
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert cache.get_image_size('1') == int(sys.argv[2])
+    print(after - before)
+""")
+
+
+class TestBufferPool(utils.BaseTestCase):
+
+    def test_buffers_reused(self):
+        pool = buffers.BufferPool(16, 32)
+        self.assertEqual(2, pool.num_slots)
+        with pool.buffer() as first:
+            with pool.buffer() as second:
+                self.assertEqual(16, len(first))
+                self.assertIsNot(first, second)
+        with pool.buffer() as third:
+            self.assertIn(third, (first, second))
+        self.assertEqual(2, pool.peak_slots)
+
+    def test_at_least_one_slot(self):
+        self.assertEqual(1, buffers.BufferPool(16, 8).num_slots)
+
+    def test_ceiling(self):
+        pool = buffers.BufferPool(16, 32)
+        active = []
+        peak = []
+
+        def fill(image_id):
+            with pool.buffer():
+                active.append(image_id)
+                peak.append(len(active))
+                eventlet.sleep(0)
+                active.remove(image_id)
+
+        greenpool = eventlet.GreenPool(4)
+        for image_id in range(4):
+            greenpool.spawn_n(fill, image_id)
+        greenpool.waitall()
+        self.assertEqual(2, max(peak))
+        self.assertEqual(2, pool.peak_slots)
+
+    def test_read_iter(self):
+        data = b'0123456789' * 5
+        pool = buffers.BufferPool(16, 16)
+        chunks = [chunk.tobytes()
+                  for chunk in pool.read_iter(io.BytesIO(data))]
+        self.assertEqual([data[:16], data[16:32], data[32:48], data[48:]],
+                         chunks)
+
+    def test_read_iter_without_readinto(self):
+        data = b'0123456789' * 5
+        pool = buffers.BufferPool(16, 16)
+
+        class Reader(object):
+            def __init__(self):
+                self.image_file = six.BytesIO(data)
+
+            def read(self, size):
+                return self.image_file.read(size)
+
+        self.assertEqual(data, b''.join(pool.read_iter(Reader())))
+
+    def test_get_pool(self):
+        self.config(image_cache_buffer_size=16,
+                    image_cache_buffer_memory=64)
+        pool = buffers.get_pool()
+        self.assertIs(pool, buffers.get_pool())
+        self.assertEqual(4, pool.num_slots)
+
+        self.config(image_cache_buffer_memory=32)
+        self.assertEqual(2, buffers.get_pool().num_slots)
+
+
+class TestCacheImageFileMemory(utils.BaseTestCase):
+
+    def test_peak_rss_bounded(self):
+        cache_dir = self.useFixture(fixtures.TempDir()).path
+        image_size = 256 * units.Mi
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.getcwd()] + sys.path)
+        output = subprocess.check_output(
+            [sys.executable, '-c', RSS_SCRIPT, cache_dir, str(image_size)],
+            env=env, stderr=subprocess.STDOUT)
+        growth = int(output.split()[-1]) * units.Ki
+        # Caching the image used a buffer of image_cache_buffer_size, not
+        # memory in proportion to the size of the image
+        self.assertLess(growth, 16 * units.Mi)
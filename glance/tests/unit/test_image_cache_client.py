@@ -15,6 +15,7 @@
 import os
 
 import mock
+from oslo_serialization import jsonutils as json
 
 from glance.common import exception
 from glance.image_cache import client
@@ -33,6 +34,16 @@ class CacheClientTestCase(utils.BaseTestCase):
         self.client.do_request.assert_called_with("DELETE",
                                                   "/cached_images/test_id")
 
+    def test_delete_cached_images(self):
+        expected_data = b'{"num_deleted": 2}'
+        self.client.do_request.return_value = utils.FakeHTTPResponse(
+            data=expected_data)
+        self.assertEqual(2, self.client.delete_cached_images(['id1', 'id2']))
+        self.client.do_request.assert_called_with(
+            "POST", "/cached_images/delete",
+            body='{"image_ids": ["id1", "id2"]}',
+            headers={'Content-Type': 'application/json'})
+
     def test_get_cached_images(self):
         expected_data = b'{"cached_images": "some_images"}'
         self.client.do_request.return_value = utils.FakeHTTPResponse(
@@ -47,6 +58,13 @@ class CacheClientTestCase(utils.BaseTestCase):
         self.assertEqual("some_images", self.client.get_queued_images())
         self.client.do_request.assert_called_with("GET", "/queued_images")
 
+    def test_get_cache_stats(self):
+        expected_data = b'{"cache_stats": {"hit_ratio": 0.5}}'
+        self.client.do_request.return_value = utils.FakeHTTPResponse(
+            data=expected_data)
+        self.assertEqual({"hit_ratio": 0.5}, self.client.get_cache_stats())
+        self.client.do_request.assert_called_with("GET", "/cache_stats")
+
     def test_delete_all_cached_images(self):
         expected_data = b'{"num_deleted": 4}'
         self.client.do_request.return_value = utils.FakeHTTPResponse(
@@ -60,6 +78,33 @@ class CacheClientTestCase(utils.BaseTestCase):
         self.client.do_request.assert_called_with("PUT",
                                                   "/queued_images/test_id")
 
+    def test_queue_image_for_caching_with_priority(self):
+        self.client.do_request.return_value = utils.FakeHTTPResponse()
+        self.assertTrue(self.client.queue_image_for_caching('test_id', 5))
+        self.client.do_request.assert_called_with("PUT",
+                                                  "/queued_images/test_id",
+                                                  params={'priority': 5})
+
+    def test_queue_images_for_caching(self):
+        expected_data = b'{"num_queued": 2}'
+        self.client.do_request.return_value = utils.FakeHTTPResponse(
+            data=expected_data)
+        self.assertEqual(2, self.client.queue_images_for_caching(
+            ['id1', 'id2']))
+        self.client.do_request.assert_called_with(
+            "POST", "/queued_images",
+            body='{"image_ids": ["id1", "id2"]}',
+            headers={'Content-Type': 'application/json'})
+
+    def test_queue_images_for_caching_with_priority(self):
+        expected_data = b'{"num_queued": 1}'
+        self.client.do_request.return_value = utils.FakeHTTPResponse(
+            data=expected_data)
+        self.assertEqual(1, self.client.queue_images_for_caching(['id1'], 5))
+        body = self.client.do_request.call_args[1]['body']
+        self.assertEqual({'image_ids': ['id1'], 'priority': 5},
+                         json.loads(body))
+
     def test_delete_queued_image(self):
         self.client.do_request.return_value = utils.FakeHTTPResponse()
         self.assertTrue(self.client.delete_queued_image('test_id'))
@@ -0,0 +1,105 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import fixtures
+
+from glance.image_cache import buffers
+from glance.image_cache import partial
+from glance.tests import utils
+
+# 4 blocks of 10 bytes and a last one of 5
+DATA = b''.join(b'%d' % (i % 10) for i in range(45))
+
+
+def _chunks(data, size=7):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestPartialImage(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestPartialImage, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'image')
+        self.partial = partial.PartialImage.create(self.path, len(DATA), 10)
+
+    def _write(self, start, stop):
+        chunks = _chunks(DATA[start:stop])
+        self.assertEqual(chunks,
+                         list(self.partial.write_iter(iter(chunks), start)))
+
+    def test_create(self):
+        self.assertEqual(5, self.partial.num_blocks)
+        self.assertEqual(set(), self.partial.get_present_blocks())
+        self.assertFalse(self.partial.is_complete())
+        self.assertTrue(self.partial.has_range(3, 3))
+        self.assertFalse(self.partial.has_range(0, 1))
+        # The file only holds the trailer so far
+        self.assertEqual(len(DATA) + 5 + partial.TRAILER.size,
+                         os.path.getsize(self.path))
+
+    def test_create_existing(self):
+        self._write(0, 10)
+        existing = partial.PartialImage.create(self.path, len(DATA), 20)
+        self.assertEqual(10, existing.block_size)
+        self.assertEqual(set([0]), existing.get_present_blocks())
+
+        # An image of another size replaces the file
+        other = partial.PartialImage.create(self.path, 100, 10)
+        self.assertEqual(set(), other.get_present_blocks())
+        self.assertEqual(100, partial.PartialImage.open(self.path).image_size)
+
+    def test_open_invalid(self):
+        self.assertIsNone(partial.PartialImage.open(self.path + '.missing'))
+        with open(self.path, 'r+b') as partial_file:
+            partial_file.truncate(10)
+        self.assertIsNone(partial.PartialImage.open(self.path))
+
+    def test_only_complete_blocks_written(self):
+        self._write(5, 33)
+        self.assertEqual(set([1, 2]), self.partial.get_present_blocks())
+        self.assertTrue(self.partial.has_range(10, 30))
+        self.assertTrue(self.partial.has_range(12, 25))
+        self.assertFalse(self.partial.has_range(5, 30))
+        self.assertFalse(self.partial.has_range(10, 31))
+        self.assertEqual(DATA[12:25], b''.join(self.partial.read(12, 25)))
+
+    def test_last_block(self):
+        self._write(38, 45)
+        self.assertEqual(set([4]), self.partial.get_present_blocks())
+        self.assertTrue(self.partial.has_range(40, 45))
+
+    def test_interrupted_read(self):
+        image_iter = self.partial.write_iter(iter(_chunks(DATA)), 0)
+        self.assertEqual(DATA[:7], next(image_iter))
+        self.assertEqual(DATA[7:14], next(image_iter))
+        image_iter.close()
+        self.assertEqual(set([0]), self.partial.get_present_blocks())
+
+    def test_complete(self):
+        self._write(20, 45)
+        self._write(0, 20)
+        self.assertTrue(self.partial.is_complete())
+        self.assertEqual(DATA, b''.join(self.partial.read(0, len(DATA))))
+
+    def test_read_buffered(self):
+        self._write(0, 45)
+        pool = buffers.BufferPool(16, 16)
+        chunks = [chunk.tobytes()
+                  for chunk in self.partial.read_buffered(pool)]
+        self.assertEqual([16, 16, 13], [len(chunk) for chunk in chunks])
+        self.assertEqual(DATA, b''.join(chunks))
@@ -0,0 +1,163 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import socket
+import threading
+from wsgiref import simple_server
+
+import fixtures
+import six
+import webob
+
+from glance.api.middleware import cache_peer
+from glance.common import exception
+from glance.image_cache import peers
+from glance.tests import utils
+
+DATA = b'0123456789' * 1000
+
+
+class TestHashRing(utils.BaseTestCase):
+
+    def test_get_nodes(self):
+        ring = peers.HashRing(['a', 'b', 'c'])
+        nodes = ring.get_nodes('image')
+        self.assertEqual(['a', 'b', 'c'], sorted(nodes))
+        self.assertEqual(nodes, peers.HashRing(['c', 'b', 'a']).get_nodes(
+            'image'))
+        self.assertEqual([], peers.HashRing([]).get_nodes('image'))
+
+    def test_removing_node_only_moves_its_images(self):
+        ring = peers.HashRing(['a', 'b', 'c'])
+        smaller_ring = peers.HashRing(['a', 'b'])
+        owners = set()
+        for i in range(100):
+            image_id = 'image%d' % i
+            owner = ring.get_nodes(image_id)[0]
+            owners.add(owner)
+            if owner != 'c':
+                self.assertEqual(owner, smaller_ring.get_nodes(image_id)[0])
+            else:
+                self.assertEqual(ring.get_nodes(image_id)[1],
+                                 smaller_ring.get_nodes(image_id)[0])
+        self.assertEqual(set(['a', 'b', 'c']), owners)
+
+
+class TestVerifiedIter(utils.BaseTestCase):
+
+    def test_verified(self):
+        checksum = hashlib.md5(DATA).hexdigest()
+        chunks = [DATA[:10], DATA[10:]]
+        self.assertEqual(chunks, list(peers.verified_iter('a', iter(chunks),
+                                                          checksum)))
+
+    def test_last_chunk_held_back(self):
+        image_iter = peers.verified_iter('a', iter([b'a', b'b']), 'bad')
+        self.assertEqual(b'a', next(image_iter))
+        self.assertRaises(exception.GlanceException, next, image_iter)
+
+
+class QuietHandler(simple_server.WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class TestCachePeers(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestCachePeers, self).setUp()
+        self.cache_dir = self.useFixture(fixtures.TempDir()).path
+        self.config(image_cache_dir=self.cache_dir,
+                    image_cache_driver='sqlite',
+                    image_cache_peer_key='secret')
+        self.peer_filter = cache_peer.CachePeerFilter(
+            webob.exc.HTTPNotFound())
+        self.cache = self.peer_filter.cache
+
+        server = simple_server.make_server('127.0.0.1', 0, self.peer_filter,
+                                           handler_class=QuietHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.peer = 'http://127.0.0.1:%d' % server.server_port
+        self.config(image_cache_peers=[self.peer])
+
+    def test_fetch(self):
+        self.cache.cache_image_file('a', six.BytesIO(DATA))
+        conn, image_iter, image_size = next(peers.PeerClient().fetch('a'))
+        self.assertEqual(len(DATA), image_size)
+        self.assertEqual(DATA, b''.join(image_iter))
+
+    def test_fetch_not_cached(self):
+        self.assertEqual([], list(peers.PeerClient().fetch('a')))
+
+    def test_fetch_next_peer(self):
+        self.cache.cache_image_file('a', six.BytesIO(DATA))
+        self.config(image_cache_peers=[self.peer, self.peer + '/'],
+                    image_cache_peer_attempts=2)
+        fetched = peers.PeerClient().fetch('a')
+        conn, image_iter, image_size = next(fetched)
+        # The caller rejects the response without reading it
+        conn.close()
+        conn, image_iter, image_size = next(fetched)
+        self.assertEqual(DATA, b''.join(image_iter))
+        self.assertRaises(StopIteration, next, fetched)
+
+    def test_filter_rejects_wrong_key(self):
+        self.cache.cache_image_file('a', six.BytesIO(DATA))
+        request = webob.Request.blank('/cache-peer/images/a')
+        response = self.peer_filter.process_request(request)
+        self.assertEqual(403, response.status_int)
+        request.headers[peers.PEER_KEY_HEADER] = 'wrong'
+        response = self.peer_filter.process_request(request)
+        self.assertEqual(403, response.status_int)
+
+    def test_fetch_peer_unreachable(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.cache.cache_image_file('a', six.BytesIO(DATA))
+        self.config(image_cache_peers=['http://127.0.0.1:%d' % port,
+                                       self.peer],
+                    image_cache_peer_attempts=2)
+        conn, image_iter, image_size = next(peers.PeerClient().fetch('a'))
+        self.assertEqual(DATA, b''.join(image_iter))
+
+    def test_get_peers(self):
+        self.config(image_cache_peers=['http://a', 'http://b', 'http://c'],
+                    image_cache_peer_self='http://b')
+        client = peers.PeerClient()
+        self.assertEqual(1, len(client.get_peers('a')))
+        self.config(image_cache_peer_attempts=3)
+        self.assertEqual(['http://a', 'http://c'],
+                         sorted(client.get_peers('a')))
+
+    def test_filter_passes_other_requests_on(self):
+        request = webob.Request.blank('/v2/images/a/file')
+        self.assertIsNone(self.peer_filter.process_request(request))
+        # Serving peers is disabled without a key
+        self.config(image_cache_peer_key=None)
+        request = webob.Request.blank('/cache-peer/images/a')
+        self.assertIsNone(self.peer_filter.process_request(request))
+
+    def test_filter_rejects_other_methods(self):
+        request = webob.Request.blank('/cache-peer/images/a', method='PUT')
+        request.headers[peers.PEER_KEY_HEADER] = 'secret'
+        response = self.peer_filter.process_request(request)
+        self.assertEqual(405, response.status_int)
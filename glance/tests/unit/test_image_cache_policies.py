@@ -0,0 +1,185 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_serialization import jsonutils
+
+from glance.image_cache.policies import arc
+from glance.image_cache.policies import gdsf
+from glance.image_cache.policies import lfu
+from glance.image_cache.policies import lru
+from glance.tests import utils
+
+
+def _entry(image_id, size=10, hits=0, last_accessed=0):
+    return {'image_id': image_id, 'size': size, 'hits': hits,
+            'last_accessed': last_accessed, 'last_modified': 0}
+
+
+def _ids(entries):
+    return [entry['image_id'] for entry in entries]
+
+
+class TestLRUPolicy(utils.BaseTestCase):
+
+    def test_select_victims(self):
+        entries = [_entry('a', last_accessed=3), _entry('b', last_accessed=1),
+                   _entry('c', last_accessed=2), _entry('d', last_accessed=4)]
+        policy = lru.Policy()
+        self.assertEqual(['b', 'c'], _ids(policy.select_victims(entries, 25)))
+        self.assertEqual(['b'], _ids(policy.select_victims(entries, 30)))
+        self.assertEqual([], _ids(policy.select_victims(entries, 40)))
+        self.assertEqual(['b', 'c', 'a', 'd'],
+                         _ids(policy.select_victims(entries, 0)))
+
+    def test_select_victims_frees_enough_space(self):
+        entries = [_entry('a', size=5, last_accessed=1),
+                   _entry('b', size=50, last_accessed=2),
+                   _entry('c', size=5, last_accessed=3)]
+        policy = lru.Policy()
+        self.assertEqual(['a', 'b'], _ids(policy.select_victims(entries, 50)))
+
+    def test_select_victims_overage(self):
+        entries = [_entry('a', last_accessed=1), _entry('b', last_accessed=2)]
+        policy = lru.Policy()
+        # Files the entries don't account for take up space as well
+        self.assertEqual(['a'],
+                         _ids(policy.select_victims(entries, 20, overage=5)))
+        self.assertIsNone(policy.get_state())
+
+
+class TestLFUPolicy(utils.BaseTestCase):
+
+    def test_select_victims(self):
+        entries = [_entry('a', hits=1, last_accessed=1),
+                   _entry('b', hits=5, last_accessed=2),
+                   _entry('c', hits=1, last_accessed=0),
+                   _entry('d', hits=0, last_accessed=4)]
+        policy = lfu.Policy()
+        self.assertEqual(['d', 'c', 'a'],
+                         _ids(policy.select_victims(entries, 10)))
+
+
+class TestGDSFPolicy(utils.BaseTestCase):
+
+    def test_large_images_evicted_first(self):
+        entries = [_entry('golden', size=100, hits=10, last_accessed=1),
+                   _entry('snapshot', size=1000, hits=0, last_accessed=2),
+                   _entry('small', size=10, hits=0, last_accessed=3)]
+        policy = gdsf.Policy()
+        self.assertEqual(['snapshot'],
+                         _ids(policy.select_victims(entries, 500)))
+
+    def test_inflation_ages_images(self):
+        policy = gdsf.Policy()
+        popular = _entry('popular', size=10, hits=9, last_accessed=1)
+        entries = [popular, _entry('a', size=10, last_accessed=2)]
+        self.assertEqual(['a'], _ids(policy.select_victims(entries, 10)))
+        self.assertEqual(0.1, policy.inflation)
+
+        # Images requested since keep getting the inflation value added,
+        # until they outrank the popular image which no longer is
+        for i, image_id in enumerate(['b', 'c', 'd', 'e', 'f', 'g', 'h',
+                                      'i', 'j', 'k']):
+            entries = [popular, _entry(image_id, size=10, hits=i + 1,
+                                       last_accessed=3 + i)]
+            victims = _ids(policy.select_victims(entries, 10))
+            if victims == ['popular']:
+                break
+        else:
+            self.fail('Popular image was never evicted')
+
+    def test_state(self):
+        policy = gdsf.Policy()
+        entries = [_entry('a', size=10, hits=4, last_accessed=1),
+                   _entry('b', size=10, last_accessed=2)]
+        self.assertEqual(['b'], _ids(policy.select_victims(entries, 10)))
+
+        restored = gdsf.Policy()
+        restored.set_state(jsonutils.loads(jsonutils.dumps(
+            policy.get_state())))
+        self.assertEqual(policy.inflation, restored.inflation)
+        self.assertEqual(policy.priorities, restored.priorities)
+
+
+class TestARCPolicy(utils.BaseTestCase):
+
+    def test_recent_images_evicted_first(self):
+        entries = [_entry('frequent', hits=3, last_accessed=1),
+                   _entry('recent1', last_accessed=2),
+                   _entry('recent2', last_accessed=3)]
+        policy = arc.Policy()
+        self.assertEqual(['recent1', 'recent2'],
+                         _ids(policy.select_victims(entries, 10)))
+        # Only as many evicted images as fit in the cache are remembered
+        self.assertEqual(['recent2'], list(policy.recent_ghosts))
+
+    def test_frequent_images_evicted_without_recent_ones(self):
+        entries = [_entry('frequent1', hits=3, last_accessed=2),
+                   _entry('frequent2', hits=3, last_accessed=1)]
+        policy = arc.Policy()
+        self.assertEqual(['frequent2'],
+                         _ids(policy.select_victims(entries, 10)))
+        self.assertEqual(['frequent2'], list(policy.frequent_ghosts))
+
+    def test_target_adapts(self):
+        policy = arc.Policy()
+        entries = [_entry('frequent', hits=3, last_accessed=1),
+                   _entry('recent1', last_accessed=2),
+                   _entry('recent2', size=5, last_accessed=3)]
+        self.assertEqual(['recent1'],
+                         _ids(policy.select_victims(entries, 15)))
+        self.assertEqual(0, policy.target)
+
+        # recent1 is cached again after being evicted as a recent image,
+        # so more room is made for recent images
+        entries = [_entry('frequent', hits=3, last_accessed=1),
+                   _entry('recent2', size=5, last_accessed=3),
+                   _entry('recent1', last_accessed=4)]
+        self.assertEqual(['recent2', 'frequent'],
+                         _ids(policy.select_victims(entries, 15)))
+        self.assertEqual(10, policy.target)
+        self.assertEqual(['recent2'], list(policy.recent_ghosts))
+        self.assertEqual(['frequent'], list(policy.frequent_ghosts))
+
+        # frequent is cached again after being evicted as a frequent image
+        entries = [_entry('recent1', last_accessed=4),
+                   _entry('frequent', last_accessed=5)]
+        self.assertEqual([], policy.select_victims(entries, 30))
+        self.assertEqual(0, policy.target)
+
+    def test_ghosts_limited_to_cache_size(self):
+        policy = arc.Policy()
+        entries = [_entry('image%d' % i, last_accessed=i) for i in range(5)]
+        self.assertEqual(['image0', 'image1', 'image2'],
+                         _ids(policy.select_victims(entries, 20)))
+        self.assertEqual(['image1', 'image2'], list(policy.recent_ghosts))
+
+    def test_state(self):
+        policy = arc.Policy()
+        entries = [_entry('frequent', hits=3, last_accessed=1),
+                   _entry('recent1', last_accessed=2),
+                   _entry('recent2', size=5, last_accessed=3)]
+        policy.select_victims(entries, 15)
+
+        restored = arc.Policy()
+        restored.set_state(jsonutils.loads(jsonutils.dumps(
+            policy.get_state())))
+        # recent1 is cached again, which the restored policy recognises
+        entries = [_entry('frequent', hits=3, last_accessed=1),
+                   _entry('recent2', size=5, last_accessed=3),
+                   _entry('recent1', last_accessed=4)]
+        self.assertEqual(['recent2', 'frequent'],
+                         _ids(restored.select_victims(entries, 15)))
+        self.assertEqual(10, restored.target)
@@ -0,0 +1,174 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import fcntl
+import hashlib
+import os
+import time
+
+import eventlet
+import fixtures
+import glance_store
+import mock
+from oslo_utils import units
+
+from glance.image_cache import prefetcher
+import glance.registry.client.v1.api as registry
+from glance.tests.unit import base
+from glance.tests import utils
+
+
+class TestBandwidthLimiter(utils.BaseTestCase):
+
+    @mock.patch.object(eventlet, 'sleep')
+    @mock.patch.object(time, 'time', return_value=100.0)
+    def test_limit(self, mock_time, mock_sleep):
+        limiter = prefetcher.BandwidthLimiter(1000)
+        first = limiter.limit([b'*' * 1000, b'*' * 500])
+        second = limiter.limit([b'*' * 500])
+
+        self.assertEqual(b'*' * 1000, next(first))
+        mock_sleep.assert_called_once_with(1.0)
+        # The bandwidth is shared by all the iterators
+        self.assertEqual(b'*' * 500, next(second))
+        mock_sleep.assert_called_with(1.5)
+
+        mock_time.return_value = 110.0
+        self.assertEqual(b'*' * 500, next(first))
+        mock_sleep.assert_called_with(0.5)
+
+    def test_no_limit(self):
+        image_iter = iter([b'*'])
+        self.assertIs(image_iter,
+                      prefetcher.BandwidthLimiter(0).limit(image_iter))
+
+
+class TestPrefetcher(base.StoreClearingUnitTest):
+
+    def setUp(self):
+        super(TestPrefetcher, self).setUp()
+        self.cache_dir = self.useFixture(fixtures.TempDir()).path
+        self.config(image_cache_dir=self.cache_dir,
+                    image_cache_driver='sqlite',
+                    image_cache_prefetch_workers=2)
+        for name in ('configure_registry_client',
+                     'configure_registry_admin_creds'):
+            patcher = mock.patch.object(registry, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.prefetcher = prefetcher.Prefetcher()
+        self.cache = self.prefetcher.cache
+
+    def test_run_by_priority(self):
+        for image_id, priority in (('a', 0), ('b', 5), ('c', 0), ('d', 10)):
+            self.cache.queue_image(image_id, priority)
+        fetched = []
+        active = []
+
+        def fetch_image_into_cache(image_id):
+            active.append(image_id)
+            self.assertLessEqual(len(active), 2)
+            eventlet.sleep(0)
+            fetched.append(image_id)
+            active.remove(image_id)
+            return True
+
+        self.prefetcher.fetch_image_into_cache = fetch_image_into_cache
+        self.assertTrue(self.prefetcher.run())
+        self.assertEqual(['d', 'b', 'a', 'c'], fetched)
+
+    @mock.patch.object(glance_store, 'get_from_backend')
+    @mock.patch.object(registry, 'get_image_metadata')
+    def test_fetch_image_into_cache_resumes(self, mock_get_image_metadata,
+                                            mock_get_from_backend):
+        data = b'0123456789' * 100
+        mock_get_image_metadata.return_value = {
+            'status': 'active', 'location': 'file:///image',
+            'size': len(data), 'checksum': hashlib.md5(data).hexdigest()}
+        mock_get_from_backend.return_value = (iter([data[400:]]), 600)
+
+        # An earlier run was killed after writing part of the image
+        incomplete_path = os.path.join(self.cache_dir, 'incomplete', 'a')
+        with open(incomplete_path, 'wb') as incomplete_file:
+            incomplete_file.write(data[:400])
+
+        self.assertTrue(self.prefetcher.fetch_image_into_cache('a'))
+        mock_get_from_backend.assert_called_once_with(
+            'file:///image', offset=400, context=mock.ANY)
+        with self.cache.open_for_read('a') as cache_file:
+            self.assertEqual(data, cache_file.read())
+
+    @mock.patch.object(glance_store, 'get_from_backend')
+    @mock.patch.object(registry, 'get_image_metadata')
+    def test_fetch_image_into_cache_offset_ignored(self,
+                                                   mock_get_image_metadata,
+                                                   mock_get_from_backend):
+        data = b'0123456789' * 100
+        # Without a checksum to catch an image file appended to itself
+        mock_get_image_metadata.return_value = {
+            'status': 'active', 'location': 'http://example.com/image',
+            'size': len(data), 'checksum': None}
+        # Like the http store, which returns the whole image whatever the
+        # offset
+        mock_get_from_backend.side_effect = (
+            lambda location, offset=0, context=None: (iter([data]),
+                                                      len(data)))
+
+        incomplete_path = os.path.join(self.cache_dir, 'incomplete', 'a')
+        with open(incomplete_path, 'wb') as incomplete_file:
+            incomplete_file.write(data[:400])
+
+        self.assertTrue(self.prefetcher.fetch_image_into_cache('a'))
+        self.assertEqual([mock.call('http://example.com/image', offset=400,
+                                    context=mock.ANY),
+                          mock.call('http://example.com/image',
+                                    context=mock.ANY)],
+                         mock_get_from_backend.call_args_list)
+        with self.cache.open_for_read('a') as cache_file:
+            self.assertEqual(data, cache_file.read())
+
+    @mock.patch.object(registry, 'get_image_metadata')
+    def test_fetch_image_into_cache_from_store(self, mock_get_image_metadata):
+        # Larger than the buffers of the pool, from a real store
+        self.config(image_cache_buffer_size=64 * units.Ki)
+        data = os.urandom(3 * 64 * units.Ki + 100)
+        path = os.path.join(self.test_dir, 'image')
+        with open(path, 'wb') as image_file:
+            image_file.write(data)
+        mock_get_image_metadata.return_value = {
+            'status': 'active', 'location': 'file://' + path,
+            'size': len(data), 'checksum': hashlib.md5(data).hexdigest()}
+
+        self.assertTrue(self.prefetcher.fetch_image_into_cache('a'))
+        with self.cache.open_for_read('a') as cache_file:
+            self.assertEqual(data, cache_file.read())
+
+    @mock.patch.object(glance_store, 'get_from_backend')
+    @mock.patch.object(registry, 'get_image_metadata')
+    def test_fetch_image_into_cache_being_cached(self,
+                                                 mock_get_image_metadata,
+                                                 mock_get_from_backend):
+        mock_get_image_metadata.return_value = {
+            'status': 'active', 'location': 'file:///image',
+            'checksum': None}
+        incomplete_path = os.path.join(self.cache_dir, 'incomplete', 'a')
+        with open(incomplete_path, 'wb') as incomplete_file:
+            incomplete_file.write(b'*')
+            incomplete_file.flush()
+            # Another process writing the file holds a lock on it
+            fcntl.flock(incomplete_file, fcntl.LOCK_EX)
+
+            self.assertFalse(self.prefetcher.fetch_image_into_cache('a'))
+        self.assertFalse(mock_get_from_backend.called)
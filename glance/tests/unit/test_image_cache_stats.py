@@ -0,0 +1,165 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import subprocess
+import sys
+
+import fixtures
+import mock
+from oslo_serialization import jsonutils
+from oslo_utils import units
+
+from glance.image_cache import stats
+from glance.tests import utils as test_utils
+
+
+class TestCacheStats(test_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestCacheStats, self).setUp()
+        self.stats_dir = self.useFixture(fixtures.TempDir()).path
+
+    def _get_dead_pid(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        return process.pid
+
+    def test_counters(self):
+        cache_stats = stats.CacheStats(self.stats_dir)
+        cache_stats.incr('hits')
+        cache_stats.incr('bytes_from_cache', 1024)
+        cache_stats.incr('bytes_from_cache', 1024)
+
+        counters = cache_stats.get_stats()['counters']
+        self.assertEqual(1, counters['hits'])
+        self.assertEqual(2048, counters['bytes_from_cache'])
+        self.assertEqual(0, counters['misses'])
+        self.assertEqual(set(stats.COUNTERS), set(counters))
+
+    def test_histograms(self):
+        cache_stats = stats.CacheStats(self.stats_dir)
+        cache_stats.record_fill(2, 20 * units.Mi)
+        cache_stats.record_fill(0.05, units.Ki)
+        cache_stats.observe('fill_seconds', 3600)
+
+        fill_seconds = cache_stats.get_stats()['histograms']['fill_seconds']
+        self.assertEqual(list(stats.HISTOGRAMS['fill_seconds']),
+                         fill_seconds['buckets'])
+        # 0.05 is at most 0.1, 2 at most 5, and 3600 above all bounds
+        self.assertEqual([1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1],
+                         fill_seconds['counts'])
+        self.assertAlmostEqual(3602.05, fill_seconds['sum'])
+
+        throughput = cache_stats.get_stats()['histograms'][
+            'fill_bytes_per_second']
+        # 10 MiB/s is at most 10 MiB/s, 20 KiB/s at most 1 MiB/s
+        self.assertEqual([1, 1, 0, 0, 0, 0, 0, 0], throughput['counts'])
+
+    def test_flush_interval(self):
+        cache_stats = stats.CacheStats(self.stats_dir)
+        with mock.patch('time.time', return_value=cache_stats.last_flush):
+            cache_stats.incr('misses')
+        self.assertEqual([], os.listdir(self.stats_dir))
+
+        with mock.patch('time.time',
+                        return_value=cache_stats.last_flush +
+                        stats.FLUSH_INTERVAL):
+            cache_stats.incr('misses')
+        self.assertEqual([os.path.basename(cache_stats.path)],
+                         os.listdir(self.stats_dir))
+        self.assertFalse(cache_stats.dirty)
+
+    def test_flushed_when_idle(self):
+        cache_stats = stats.CacheStats(self.stats_dir)
+        with mock.patch.object(stats.greenthread,
+                               'spawn_after') as spawn_after:
+            cache_stats.incr('misses')
+            cache_stats.incr('misses')
+        # A single flush is scheduled for what changed since the last one
+        self.assertEqual(1, spawn_after.call_count)
+        self.assertEqual([], os.listdir(self.stats_dir))
+        spawn_after.call_args[0][1]()
+        self.assertEqual(2, cache_stats.get_stats()['counters']['misses'])
+        self.assertFalse(cache_stats.dirty)
+
+    def test_flushed_at_exit(self):
+        cache_stats = stats.CacheStats(self.stats_dir)
+        cache_stats.incr('hits')
+        stats._flush_all()
+        self.assertEqual([os.path.basename(cache_stats.path)],
+                         os.listdir(self.stats_dir))
+
+    def test_get_stats_adds_up_instances(self):
+        worker1 = stats.CacheStats(self.stats_dir)
+        worker2 = stats.CacheStats(self.stats_dir)
+        worker1.incr('hits')
+        worker1.flush()
+        worker2.incr('hits', 2)
+        worker2.incr('misses')
+        worker2.record_fill(1, units.Mi)
+
+        # Each instance flushes its own statistics before adding them up
+        for cache_stats in (worker2, worker1):
+            result = cache_stats.get_stats()
+            self.assertEqual(3, result['counters']['hits'])
+            self.assertEqual(1, result['counters']['misses'])
+            self.assertEqual(
+                1, sum(result['histograms']['fill_seconds']['counts']))
+
+    def test_get_stats_skips_changed_histograms(self):
+        path = os.path.join(self.stats_dir, 'old.json')
+        with open(path, 'w') as stats_file:
+            jsonutils.dump({'counters': {'hits': 1, 'removed': 5},
+                            'histograms': {'fill_seconds': {'counts': [1, 1],
+                                                            'sum': 2},
+                                           'removed': {'counts': [1],
+                                                       'sum': 1}}},
+                           stats_file)
+
+        result = stats.CacheStats(self.stats_dir).get_stats()
+        self.assertEqual(1, result['counters']['hits'])
+        self.assertNotIn('removed', result['counters'])
+        self.assertEqual(0, result['histograms']['fill_seconds']['sum'])
+        self.assertNotIn('removed', result['histograms'])
+
+    def test_compact(self):
+        running = stats.CacheStats(self.stats_dir)
+        running.incr('hits')
+        running.flush()
+        gone = stats.CacheStats(self.stats_dir)
+        gone.incr('hits', 2)
+        gone.path = os.path.join(self.stats_dir, '%s-%d-token.json' % (
+            gone.hostname, self._get_dead_pid()))
+        gone.flush()
+        other_host = stats.CacheStats(self.stats_dir)
+        other_host.incr('hits', 4)
+        other_host.path = os.path.join(self.stats_dir,
+                                       'otherhost-1-token.json')
+        other_host.flush()
+
+        running.compact()
+        self.assertEqual(
+            sorted([stats.TOTALS_NAME, os.path.basename(running.path),
+                    'otherhost-1-token.json']),
+            sorted(os.listdir(self.stats_dir)))
+        self.assertEqual(7, running.get_stats()['counters']['hits'])
+
+        gone.path = os.path.join(self.stats_dir, '%s-%d-token.json' % (
+            gone.hostname, self._get_dead_pid()))
+        gone.dirty = True
+        gone.flush()
+        running.compact()
+        self.assertEqual(9, running.get_stats()['counters']['hits'])
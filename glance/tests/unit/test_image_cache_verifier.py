@@ -0,0 +1,154 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import os
+
+import fixtures
+import mock
+import six
+
+from glance.common import exception
+from glance.image_cache import verifier
+import glance.registry.client.v1.api as registry
+from glance.tests import utils
+
+
+class TestVerifier(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestVerifier, self).setUp()
+        self.cache_dir = self.useFixture(fixtures.TempDir()).path
+        self.config(image_cache_dir=self.cache_dir,
+                    image_cache_driver='sqlite',
+                    image_cache_verify_max_bytes=0,
+                    image_cache_verify_max_bandwidth=0)
+        for name in ('configure_registry_client',
+                     'configure_registry_admin_creds'):
+            patcher = mock.patch.object(registry, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.images = {}
+        patcher = mock.patch.object(registry, 'get_image_metadata',
+                                    side_effect=self._get_image_metadata)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.verifier = verifier.Verifier()
+        self.cache = self.verifier.cache
+
+    def _get_image_metadata(self, context, image_id):
+        try:
+            return self.images[image_id]
+        except KeyError:
+            raise exception.NotFound()
+
+    def _cache_image(self, image_id, data=b'*' * 10):
+        self.cache.cache_image_file(image_id, six.BytesIO(data))
+        return self.cache.driver.get_image_filepath(image_id)
+
+    def _corrupt(self, path):
+        with open(path, 'r+b') as image_file:
+            image_file.write(b'!')
+
+    def test_verify_intact_image(self):
+        self._cache_image('1')
+        self.assertEqual(verifier.INTACT, self.verifier.verify_image('1'))
+        self.assertTrue(self.cache.is_cached('1'))
+        # Reading the image file isn't a cache hit
+        self.assertEqual(0, self.cache.driver.get_hit_count('1'))
+
+    def test_verify_corrupt_image(self):
+        self._corrupt(self._cache_image('1'))
+        self.assertEqual(verifier.CORRUPT, self.verifier.verify_image('1'))
+        self.assertFalse(self.cache.is_cached('1'))
+        counters = self.cache.get_stats()['counters']
+        self.assertEqual(1, counters['evictions_corrupt'])
+        self.assertEqual(0, counters['evictions_deleted'])
+
+    def test_verify_replaced_image(self):
+        path = self._cache_image('1')
+        self._corrupt(path)
+        real_stat = os.stat
+
+        def stat(stat_path):
+            result = real_stat(stat_path)
+            if stat_path == path:
+                # Replaced by a new image file since it was opened
+                result = os.stat_result((result.st_mode,
+                                         result.st_ino + 1) +
+                                        tuple(result)[2:])
+            return result
+
+        with mock.patch('os.stat', side_effect=stat):
+            self.assertEqual(verifier.SKIPPED,
+                             self.verifier.verify_image('1'))
+        self.assertTrue(self.cache.is_cached('1'))
+
+    def test_verify_image_without_recorded_checksum(self):
+        data = b'*' * 10
+        self._cache_image('1', data)
+        self._cache_image('2', data)
+        self._cache_image('3', data)
+        for image_id in ('1', '2', '3'):
+            self.cache.set_image_checksum(image_id, None)
+        self.images['1'] = {'checksum': hashlib.md5(data).hexdigest()}
+        self.images['2'] = {'checksum': 'foobar'}
+
+        self.assertEqual(verifier.INTACT, self.verifier.verify_image('1'))
+        self.assertEqual(hashlib.md5(data).hexdigest(),
+                         self.cache.get_image_checksum('1'))
+        self.assertEqual(verifier.CORRUPT, self.verifier.verify_image('2'))
+        self.assertFalse(self.cache.is_cached('2'))
+        # Not in the registry
+        self.assertEqual(verifier.SKIPPED, self.verifier.verify_image('3'))
+        self.assertTrue(self.cache.is_cached('3'))
+
+    def test_select_images(self):
+        entries = [{'image_id': '1', 'size': 10},
+                   {'image_id': '2', 'size': 20},
+                   {'image_id': '3', 'size': 30}]
+        verified = {'1': 200, '2': 100}
+        self.assertEqual(['3', '2', '1'],
+                         self.verifier.select_images(entries, verified))
+
+        self.config(image_cache_verify_max_bytes=50)
+        self.assertEqual(['3', '2'],
+                         self.verifier.select_images(entries, verified))
+        # At least one image is verified whatever its size
+        self.config(image_cache_verify_max_bytes=5)
+        self.assertEqual(['3'],
+                         self.verifier.select_images(entries, verified))
+
+    def test_run(self):
+        self._cache_image('1')
+        self._cache_image('2', b'*' * 20)
+        self._corrupt(self._cache_image('3'))
+        self.config(image_cache_verify_max_bytes=30)
+
+        # Never verified images first
+        self.assertTrue(self.verifier.run())
+        self.assertEqual(['1', '2'], sorted(self.verifier.load_verified()))
+        # Then those verified the longest time ago, '1' fitting in the
+        # budget along with '3' but not '2'
+        verified = self.verifier.load_verified()
+        self.assertFalse(self.verifier.run())
+        self.assertEqual(['1', '2'], sorted(self.verifier.load_verified()))
+        self.assertFalse(self.cache.is_cached('3'))
+        self.assertEqual(verified['2'], self.verifier.load_verified()['2'])
+
+        # Images that are no longer cached are forgotten
+        self.cache.delete_cached_image('2')
+        self.assertTrue(self.verifier.run())
+        self.assertEqual(['1'], list(self.verifier.load_verified()))
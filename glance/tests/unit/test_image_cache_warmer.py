@@ -0,0 +1,159 @@
+# Copyright 2016 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+import eventlet
+import fixtures
+import mock
+import six
+
+from glance.common import exception
+from glance.image_cache import warmer
+import glance.registry.client.v1.api as registry
+from glance.tests import utils
+
+
+class TestWarmer(utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestWarmer, self).setUp()
+        self.cache_dir = self.useFixture(fixtures.TempDir()).path
+        self.config(image_cache_dir=self.cache_dir,
+                    image_cache_driver='sqlite',
+                    image_cache_warming_images=2,
+                    image_cache_warming_workers=2)
+        for name in ('configure_registry_client',
+                     'configure_registry_admin_creds'):
+            patcher = mock.patch.object(registry, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.images = {}
+        patcher = mock.patch.object(registry, 'get_image_metadata',
+                                    side_effect=self._get_image_metadata)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.warmer = warmer.Warmer()
+        self.cache = self.warmer.cache
+
+    def _get_image_metadata(self, context, image_id):
+        try:
+            return self.images[image_id]
+        except KeyError:
+            raise exception.NotFound()
+
+    def _add_image(self, image_id, size=10, status='active', misses=0):
+        self.images[image_id] = {'id': image_id, 'size': size,
+                                 'status': status}
+        for i in range(misses):
+            self.cache.record_miss(image_id)
+
+    def _cache_image(self, image_id, hits=0):
+        self.cache.cache_image_file(image_id, six.BytesIO(b'*' * 10))
+        for i in range(hits):
+            with self.cache.open_for_read(image_id):
+                pass
+
+    def test_parse_window(self):
+        self.assertEqual((60, 330), warmer.parse_window('01:00-05:30'))
+        self.assertEqual((1380, 0), warmer.parse_window('23:00 - 00:00'))
+        for window in ('1-5', '01:00', '25:00-05:00', '01:00-05:60'):
+            self.assertRaises(ValueError, warmer.parse_window, window)
+
+    def test_is_off_peak(self):
+        self.assertTrue(self.warmer.is_off_peak())
+        self.config(image_cache_warming_window='22:00-04:00')
+        for hour, expected in ((21, False), (22, True), (2, True),
+                               (4, False)):
+            now = datetime.datetime(2016, 1, 1, hour, 0)
+            self.assertEqual(expected, self.warmer.is_off_peak(now))
+        self.config(image_cache_warming_window='tonight')
+        self.assertRaises(RuntimeError, self.warmer.is_off_peak)
+
+    def test_record_and_decay_misses(self):
+        self._add_image('a', misses=5)
+        self._add_image('b', misses=1)
+        self.assertEqual({'a': 5, 'b': 1}, self.cache.get_miss_counts())
+        self.cache.decay_miss_counts()
+        self.assertEqual({'a': 2}, self.cache.get_miss_counts())
+        self.cache.forget_misses('a')
+        self.cache.forget_misses('a')
+        self.assertEqual({}, self.cache.get_miss_counts())
+
+    def test_hot_set_survives_cache_wipe(self):
+        self._cache_image('a', hits=4)
+        self._cache_image('b', hits=1)
+        self.assertEqual({'a': 4, 'b': 1}, self.warmer.update_hot_set())
+
+        self.cache.delete_all_cached_images()
+        self.assertEqual({'a': 2}, self.warmer.update_hot_set())
+
+    def test_select_images(self):
+        self._add_image('a', misses=1)
+        self._add_image('b', misses=3)
+        self._add_image('c', misses=2)
+        self._add_image('deleted', status='deleted', misses=9)
+        self._cache_image('cached')
+        # Remembered hits add up with the misses
+        hot_set = {'cached': 9, 'unknown': 9, 'a': 3}
+        self.assertEqual(['a', 'b'], self.warmer.select_images(
+            hot_set, self.cache.get_miss_counts()))
+        # Images that can't be warmed up are not counted any more
+        self.assertNotIn('deleted', self.cache.get_miss_counts())
+
+    def test_select_images_within_budget(self):
+        self.config(image_cache_warming_max_bytes=25)
+        self._add_image('a', size=20, misses=3)
+        self._add_image('b', size=10, misses=2)
+        self._add_image('c', size=5, misses=1)
+        self.assertEqual(['a', 'c'], self.warmer.select_images(
+            {}, self.cache.get_miss_counts()))
+
+    def test_run(self):
+        self.config(image_cache_warming_images=3)
+        for image_id in ('a', 'b', 'c'):
+            self._add_image(image_id, misses=3)
+        fetched = []
+        active = []
+
+        def fetch_image_into_cache(image_id):
+            active.append(image_id)
+            self.assertLessEqual(len(active), 2)
+            eventlet.sleep(0)
+            fetched.append(image_id)
+            active.remove(image_id)
+            return image_id != 'c'
+
+        self.warmer.fetch_image_into_cache = fetch_image_into_cache
+        self.assertFalse(self.warmer.run())
+        self.assertEqual(['a', 'b', 'c'], sorted(fetched))
+        # The image that failed to be fetched is left for the prefetcher
+        self.assertEqual({'c': 1}, self.cache.get_miss_counts())
+        self.assertEqual(['a', 'b', 'c'],
+                         sorted(self.cache.get_queued_images()))
+
+    def test_run_outside_window(self):
+        self.config(image_cache_warming_window='00:00-00:00')
+        self._add_image('a', misses=3)
+        self.warmer.fetch_image_into_cache = mock.Mock()
+        self.assertTrue(self.warmer.run())
+        self.assertFalse(self.warmer.fetch_image_into_cache.called)
+
+    def test_run_disabled(self):
+        self.config(image_cache_warming_images=0)
+        self._add_image('a', misses=3)
+        self.warmer.fetch_image_into_cache = mock.Mock()
+        self.assertTrue(self.warmer.run())
+        self.assertFalse(self.warmer.fetch_image_into_cache.called)
@@ -12,8 +12,11 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import hashlib
+
 import glance_store
 import mock
+import six
 
 from glance.common import exception
 from glance.common import signature_utils
@@ -188,6 +191,44 @@ class TestStoreImage(utils.BaseTestCase):
                           self.store_api.get_from_backend,
                           image.locations[0]['url'], context={})
 
+    def test_image_set_data_pipelined(self):
+        self.config(image_upload_pipeline_depth=2,
+                    image_upload_pipeline_chunk_size=2)
+        context = glance.context.RequestContext(user=USER1)
+        image_stub = ImageStub(UUID2, status='queued', locations=[])
+        written = []
+
+        def add_to_backend(conf, image_id, data, size, context=None):
+            while True:
+                chunk = data.read(3)
+                if not chunk:
+                    return (image_id, len(b''.join(written)), 'Z', {})
+                written.append(chunk)
+
+        self.store_api.add_to_backend = add_to_backend
+        image = glance.location.ImageProxy(image_stub, context,
+                                           self.store_api, self.store_utils)
+        image.set_data(six.BytesIO(b'YYYYYYY'), 7)
+        self.assertEqual([b'YYY', b'YYY', b'Y'], written)
+        self.assertEqual(7, image.size)
+        self.assertEqual('active', image.status)
+
+    def test_image_set_data_hashes(self):
+        self.config(image_hash_algorithms=['sha256'])
+        context = glance.context.RequestContext(user=USER1)
+        image_stub = ImageStub(UUID2, status='queued', locations=[])
+
+        def add_to_backend(conf, image_id, data, size, context=None):
+            return (image_id, len(data.read(size)), 'Z', {})
+
+        self.store_api.add_to_backend = add_to_backend
+        image = glance.location.ImageProxy(image_stub, context,
+                                           self.store_api, self.store_utils)
+        image.set_data(six.BytesIO(b'YYYY'), 4)
+        self.assertEqual(hashlib.sha256(b'YYYY').hexdigest(),
+                         image.extra_properties['os_hash_sha256'])
+        self.assertEqual('active', image.status)
+
     def test_image_set_data_valid_signature(self):
         context = glance.context.RequestContext(user=USER1)
         extra_properties = {
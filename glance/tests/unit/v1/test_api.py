@@ -4819,3 +4819,64 @@ class TestAPIPropertyQuotas(base.IsolatedUnitTest):
         res_body = jsonutils.loads(output.body)['image']
         self.assertEqual('1', res_body['properties']['x_all_permitted'])
         self.assertEqual('3', res_body['properties']['x_all_permitted_create'])
+
+
+class TestAPIReservedProps(base.IsolatedUnitTest):
+    def setUp(self):
+        """Establish a clean test environment"""
+        super(TestAPIReservedProps, self).setUp()
+        self.mapper = routes.Mapper()
+        self.api = test_utils.FakeAuthMiddleware(router.API(self.mapper))
+        db_api.get_engine()
+        db_models.unregister_models(db_api.get_engine())
+        db_models.register_models(db_api.get_engine())
+
+    def _request(self, path, method, headers):
+        request = unit_test_utils.get_fake_request(path=path, method=method)
+        request.headers['x-auth-token'] = 'user:tenant:admin'
+        for k, v in six.iteritems(headers):
+            request.headers[k] = v
+        return request.get_response(self.api)
+
+    def _create_image(self, props=None):
+        headers = {'x-image-meta-disk-format': 'ami',
+                   'x-image-meta-container-format': 'ami',
+                   'x-image-meta-name': 'foo',
+                   'x-image-meta-size': '0'}
+        headers.update(props or {})
+        return self._request('/images', 'POST', headers)
+
+    def _create_hashed_image(self):
+        image_id = jsonutils.loads(self._create_image().body)['image']['id']
+        # As computed by Glance when the image data was uploaded
+        context = glance.context.RequestContext(is_admin=True)
+        db_api.image_update(context, image_id,
+                            {'properties': {'os_hash_sha256': 'digest'}},
+                            purge_props=False)
+        return image_id
+
+    def test_create_reserved_prop(self):
+        output = self._create_image(
+            {'x-image-meta-property-os_hash_sha256': 'digest'})
+        self.assertEqual(403, output.status_int)
+        self.assertIn("Property 'os_hash_sha256' is reserved.", output.text)
+
+    def test_update_reserved_prop(self):
+        image_id = self._create_hashed_image()
+        for name in ('os_hash_sha256', 'os_hash_sha512'):
+            output = self._request(
+                '/images/%s' % image_id, 'PUT',
+                {'x-image-meta-property-%s' % name: 'forged'})
+            self.assertEqual(403, output.status_int)
+
+    def test_update_keeps_reserved_props(self):
+        image_id = self._create_hashed_image()
+        # Unchanged reserved properties may be sent back, and purging
+        # properties keeps those that are not
+        for headers in ({'x-image-meta-property-os_hash_sha256': 'digest'},
+                        {'x-image-meta-property-foo': 'bar'}):
+            output = self._request('/images/%s' % image_id, 'PUT', headers)
+            self.assertEqual(200, output.status_int)
+            res_body = jsonutils.loads(output.body)['image']
+            self.assertEqual('digest',
+                             res_body['properties']['os_hash_sha256'])
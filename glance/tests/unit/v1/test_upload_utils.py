@@ -14,10 +14,12 @@
 #    under the License.
 
 from contextlib import contextmanager
+import hashlib
 
 import glance_store
 import mock
 from mock import patch
+import six
 import webob.exc
 
 from glance.api.v1 import upload_utils
@@ -136,6 +138,30 @@ class TestUploadUtils(base.StoreClearingUnitTest):
                     req.context, image_meta['id'], update_data,
                     from_state='saving')
 
+    def test_upload_data_to_store_hashes(self):
+        self.config(image_hash_algorithms=['sha256'])
+
+        def store_add(image_id, data, size, **kwargs):
+            self.assertEqual(b'blah', data.read(size))
+            return location, 4, "checksum", {}
+
+        req = unit_test_utils.get_fake_request()
+        with self._get_store_and_notifier(
+                image_size=4,
+                ext_update_data={'size': 4},
+                exc_class=store_add) as (location, checksum, image_meta,
+                                         image_data, store, notifier,
+                                         update_data):
+            update_data['properties'] = {
+                'os_hash_sha256': hashlib.sha256(b'blah').hexdigest()}
+            with patch.object(registry, 'update_image_metadata',
+                              return_value=image_meta) as mock_update:
+                upload_utils.upload_data_to_store(
+                    req, image_meta, six.BytesIO(b'blah'), store, notifier)
+                mock_update.assert_called_once_with(
+                    req.context, image_meta['id'], update_data,
+                    from_state='saving')
+
     def test_upload_data_to_store_user_storage_quota_enabled(self):
         # Enable user_storage_quota
         self.config(user_storage_quota='100B')
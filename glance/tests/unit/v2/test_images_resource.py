@@ -2181,6 +2181,12 @@ class TestImagesDeserializer(test_utils.BaseTestCase):
             self.assertRaises(webob.exc.HTTPForbidden,
                               self.deserializer.create, request)
 
+    def test_create_reserved_prefix_forbidden(self):
+        request = unit_test_utils.get_fake_request()
+        request.body = jsonutils.dump_as_bytes({'os_hash_sha256': 'digest'})
+        self.assertRaises(webob.exc.HTTPForbidden,
+                          self.deserializer.create, request)
+
     def _get_fake_patch_request(self, content_type_minor_version=1):
         request = unit_test_utils.get_fake_request()
         template = 'application/openstack-images-v2.%d-json-patch'
@@ -2435,6 +2441,16 @@ class TestImagesDeserializer(test_utils.BaseTestCase):
             else:
                 self.fail("Updating %s did not result in HTTPForbidden" % key)
 
+    def test_update_reserved_prefix(self):
+        for op in ('add', 'replace', 'remove'):
+            request = self._get_fake_patch_request()
+            change = {'op': op, 'path': '/os_hash_sha256'}
+            if op != 'remove':
+                change['value'] = 'digest'
+            request.body = jsonutils.dump_as_bytes([change])
+            self.assertRaises(webob.exc.HTTPForbidden,
+                              self.deserializer.update, request)
+
     def test_update_invalid_attributes(self):
         keys = [
             'noslash',
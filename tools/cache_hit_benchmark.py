@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures the latency of image cache hits with the sqlite cache driver
+when several worker processes serve many concurrent cache hits each.
+
+Every run primes a fresh cache directory with a number of small images,
+then forks the workers, which each spawn a number of green threads that
+read cached images in a loop. The latency of each hit, from opening the
+cache file to recording the hit in the cache database, is reported for
+a few configurations of the driver::
+
+    python tools/cache_hit_benchmark.py --workers 4 --concurrency 100
+"""
+
+import argparse
+import multiprocessing
+import shutil
+import tempfile
+import time
+
+import eventlet
+from oslo_config import cfg
+import six
+
+from glance.image_cache.drivers import sqlite
+
+CONF = cfg.CONF
+
+CONFIGURATIONS = [
+    ('rollback journal, write every hit',
+     {'image_cache_sqlite_wal': False,
+      'image_cache_sqlite_flush_interval': 0}),
+    ('WAL, write every hit',
+     {'image_cache_sqlite_wal': True,
+      'image_cache_sqlite_flush_interval': 0}),
+    ('WAL, buffered hits',
+     {'image_cache_sqlite_wal': True,
+      'image_cache_sqlite_flush_interval': 5}),
+]
+
+
+def make_driver(cache_dir, overrides):
+    CONF.set_override('image_cache_dir', cache_dir)
+    for name, value in overrides.items():
+        CONF.set_override(name, value)
+    driver = sqlite.Driver()
+    driver.configure()
+    return driver
+
+
+def prime_cache(driver, images, image_size):
+    data = b'*' * image_size
+    for image_id in range(images):
+        with driver.open_for_write(str(image_id)) as cache_file:
+            cache_file.write(data)
+
+
+def run_worker(cache_dir, overrides, images, concurrency, hits, results):
+    driver = make_driver(cache_dir, overrides)
+    latencies = []
+
+    def reader(offset):
+        for i in range(hits):
+            image_id = str((offset + i) % images)
+            start = time.time()
+            with driver.open_for_read(image_id) as cache_file:
+                cache_file.read()
+            latencies.append(time.time() - start)
+            # Let the other readers run, as a real download would
+            eventlet.sleep(0)
+
+    pool = eventlet.GreenPool(concurrency)
+    for offset in range(concurrency):
+        pool.spawn_n(reader, offset)
+    pool.waitall()
+    driver.flush_hits()
+    results.put(latencies)
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(name, overrides, args):
+    cache_dir = tempfile.mkdtemp(prefix='glance-cache-benchmark-')
+    try:
+        prime_cache(make_driver(cache_dir, overrides), args.images,
+                    args.image_size)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(
+            target=run_worker,
+            args=(cache_dir, overrides, args.images, args.concurrency,
+                  args.hits, results)) for i in range(args.workers)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        latencies = []
+        for worker in workers:
+            latencies.extend(results.get())
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    latencies.sort()
+    six.print_('%-34s %9.0f %9.2f %9.2f %9.2f' % (
+        name, len(latencies) / elapsed,
+        percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.99) * 1000,
+        latencies[-1] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of worker processes')
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='Number of concurrent readers per worker')
+    parser.add_argument('--hits', type=int, default=20,
+                        help='Number of cache hits per reader')
+    parser.add_argument('--images', type=int, default=50,
+                        help='Number of cached images')
+    parser.add_argument('--image-size', type=int, default=4096,
+                        help='Size of the cached images in bytes')
+    args = parser.parse_args()
+
+    six.print_('%-34s %9s %9s %9s %9s' % ('configuration', 'hits/s',
+                                          'p50 ms', 'p99 ms', 'max ms'))
+    for name, overrides in CONFIGURATIONS:
+        run(name, overrides, args)
+
+
+if __name__ == '__main__':
+    main()
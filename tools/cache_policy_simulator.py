@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Replays a trace of image downloads against an image cache of a given size
+and reports the hit ratio each image cache eviction policy achieves.
+
+A trace is a text file with one download per line, giving the image ID and
+the image size in bytes separated by whitespace. Lines starting with '#'
+are ignored. Without a trace, a synthetic one is generated in which a few
+popular base images are downloaded among bursts of one-off snapshots::
+
+    python tools/cache_policy_simulator.py --cache-size 100G trace.txt
+"""
+
+import argparse
+import random
+
+from oslo_utils import importutils
+from oslo_utils import strutils
+import six
+
+POLICIES = ('lru', 'lfu', 'gdsf', 'arc')
+
+
+def read_trace(path):
+    with open(path) as trace:
+        for line in trace:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            image_id, size = line.split()[:2]
+            yield image_id, int(size)
+
+
+def synthetic_trace(requests, seed):
+    """
+    Generates downloads of 20 popular base images, with a skewed
+    popularity, interleaved with bursts of downloads of snapshots which
+    are each downloaded only a couple of times.
+    """
+    rand = random.Random(seed)
+    base_images = [('base-%d' % i, rand.randint(1, 10) * 2 ** 30)
+                   for i in range(20)]
+    weights = [1.0 / (i + 1) for i in range(len(base_images))]
+    snapshot = 0
+    produced = 0
+    while True:
+        if rand.random() < 0.1:
+            # A burst of snapshot downloads
+            for i in range(rand.randint(5, 50)):
+                snapshot += 1
+                image = ('snapshot-%d' % snapshot,
+                         rand.randint(1, 40) * 2 ** 30)
+                for j in range(rand.choice((1, 1, 2))):
+                    if produced == requests:
+                        return
+                    yield image
+                    produced += 1
+        else:
+            point = rand.random() * sum(weights)
+            for image, weight in zip(base_images, weights):
+                point -= weight
+                if point <= 0:
+                    break
+            if produced == requests:
+                return
+            yield image
+            produced += 1
+
+
+def simulate(policy_name, trace, cache_size):
+    """
+    Replays the trace with the named eviction policy, pruning the cache
+    whenever an image added to it makes it grow beyond cache_size, and
+    returns the number of requests, hits, bytes requested and bytes hit.
+    """
+    policy = importutils.import_object(
+        'glance.image_cache.policies.%s.Policy' % policy_name)
+    cached = {}
+    current_size = 0
+    requests = hits = requested_bytes = hit_bytes = 0
+
+    for clock, (image_id, size) in enumerate(trace):
+        requests += 1
+        requested_bytes += size
+        entry = cached.get(image_id)
+        if entry is not None:
+            hits += 1
+            hit_bytes += size
+            entry['hits'] += 1
+            entry['last_accessed'] = clock
+            continue
+
+        cached[image_id] = {'image_id': image_id, 'size': size, 'hits': 0,
+                            'last_accessed': clock, 'last_modified': clock}
+        current_size += size
+        if current_size > cache_size:
+            for victim in policy.select_victims(list(cached.values()),
+                                                cache_size):
+                del cached[victim['image_id']]
+                current_size -= victim['size']
+
+    return requests, hits, requested_bytes, hit_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('trace', nargs='?',
+                        help='Trace file to replay, a synthetic trace is '
+                             'used if omitted')
+    parser.add_argument('--cache-size', default='100G',
+                        help='Size of the image cache, e.g. 500G')
+    parser.add_argument('--requests', type=int, default=20000,
+                        help='Number of downloads in the synthetic trace')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed of the synthetic trace')
+    parser.add_argument('--policy', action='append', choices=POLICIES,
+                        help='Policy to simulate, all by default')
+    args = parser.parse_args()
+
+    cache_size = strutils.string_to_bytes(args.cache_size + 'B',
+                                          return_int=True)
+    if args.trace:
+        trace = list(read_trace(args.trace))
+    else:
+        trace = list(synthetic_trace(args.requests, args.seed))
+
+    six.print_('%-8s %10s %10s %15s' % ('policy', 'requests', 'hit ratio',
+                                        'byte hit ratio'))
+    for policy_name in args.policy or POLICIES:
+        requests, hits, requested_bytes, hit_bytes = simulate(
+            policy_name, trace, cache_size)
+        six.print_('%-8s %10d %10.3f %15.3f' % (
+            policy_name, requests, float(hits) / max(requests, 1),
+            float(hit_bytes) / max(requested_bytes, 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures how fast glance.common.utils.CooperativeReader hands the chunks
+of an image upload over to a backend store, in GB/s on a single core.
+
+The image data comes from an iterator of chunks, as it does when an image
+is uploaded through the API, and is read with read() or readinto() in
+pieces of the size a backend store asks for. Each configuration pairs the
+size of the incoming chunks with the size of the reads::
+
+    python tools/cooperative_reader_benchmark.py --size 1024
+"""
+
+import argparse
+import time
+
+from oslo_utils import units
+import six
+
+from glance.common import utils
+
+CONFIGURATIONS = [
+    # incoming chunk size, read size
+    (64 * units.Ki, 64 * units.Ki),
+    (64 * units.Ki, 4 * units.Mi),
+    (4 * units.Mi, 64 * units.Ki),
+    (16 * units.Mi, 8 * units.Ki),
+]
+
+
+def make_chunks(size, chunk_size):
+    chunk = b'*' * chunk_size
+    for i in range(size // chunk_size):
+        yield chunk
+
+
+def read(reader, read_size):
+    total = 0
+    while True:
+        data = reader.read(read_size)
+        if not data:
+            return total
+        total += len(data)
+
+
+def readinto(reader, read_size):
+    buf = bytearray(read_size)
+    total = 0
+    while True:
+        size = reader.readinto(buf)
+        if not size:
+            return total
+        total += size
+
+
+def run(method, chunk_size, read_size, size, repeat):
+    best = None
+    for i in range(repeat):
+        reader = utils.CooperativeReader(make_chunks(size, chunk_size))
+        start = time.time()
+        total = method(reader, read_size)
+        elapsed = time.time() - start
+        assert total == size // chunk_size * chunk_size
+        best = elapsed if best is None else min(best, elapsed)
+    return float(total) / units.Gi / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=1024,
+                        help='Size of the uploaded image in MiB')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs of each configuration, the '
+                             'fastest of which is reported')
+    args = parser.parse_args()
+    size = args.size * units.Mi
+
+    six.print_('%10s %10s %12s %12s' % ('chunk KiB', 'read KiB',
+                                        'read GB/s', 'readinto GB/s'))
+    for chunk_size, read_size in CONFIGURATIONS:
+        six.print_('%10d %10d %12.2f %12.2f' % (
+            chunk_size // units.Ki, read_size // units.Ki,
+            run(read, chunk_size, read_size, size, args.repeat),
+            run(readinto, chunk_size, read_size, size, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures the throughput and fairness of many image uploads and downloads
+streamed at the same time by a single worker, for several settings of
+cooperative_yield_interval and cooperative_yield_bytes.
+
+Downloads go through glance.common.utils.cooperative_iter and uploads
+through glance.common.utils.CooperativeReader, each hashing the chunks it
+streams as the API does. For each setting, the benchmark reports the
+aggregate throughput, Jain's fairness index of the throughput of the
+streams (1.0 when they all stream as fast as each other), and how late a
+green thread standing for the other requests of the worker, which asks to
+run every millisecond, gets to run::
+
+    python tools/cooperative_yield_benchmark.py --streams 32 --duration 5
+"""
+
+import argparse
+import hashlib
+import time
+
+import eventlet
+from oslo_config import cfg
+from oslo_utils import units
+import six
+
+from glance.common import utils
+
+CHUNK_SIZE = 64 * units.Ki
+
+POLICIES = [
+    # cooperative_yield_interval in milliseconds, cooperative_yield_bytes
+    (0, 0),
+    (0, 256 * units.Ki),
+    (0, units.Mi),
+    (0, 4 * units.Mi),
+    (1, 0),
+    (10, 0),
+    (1, 256 * units.Ki),
+]
+
+
+class Source(object):
+    """An endless image file, as an upload reads it from the request."""
+
+    def __init__(self):
+        self.chunk = b'*' * CHUNK_SIZE
+
+    def read(self, size):
+        return self.chunk[:size]
+
+
+def endless_chunks():
+    chunk = b'*' * CHUNK_SIZE
+    while True:
+        yield chunk
+
+
+def download(deadline, counts, index):
+    checksum = hashlib.md5()
+    for chunk in utils.cooperative_iter(endless_chunks()):
+        checksum.update(chunk)
+        counts[index] += len(chunk)
+        if time.time() >= deadline:
+            return
+
+
+def upload(deadline, counts, index):
+    checksum = hashlib.md5()
+    reader = utils.CooperativeReader(Source())
+    while time.time() < deadline:
+        chunk = reader.read(CHUNK_SIZE)
+        checksum.update(chunk)
+        counts[index] += len(chunk)
+
+
+def probe(deadline, delays):
+    while time.time() < deadline:
+        start = time.time()
+        eventlet.sleep(0.001)
+        delays.append(time.time() - start - 0.001)
+
+
+def run(streams, duration):
+    pool = eventlet.GreenPool(streams + 1)
+    counts = [0] * streams
+    delays = []
+    deadline = time.time() + duration
+    pool.spawn_n(probe, deadline, delays)
+    for index in range(streams):
+        stream = download if index % 2 else upload
+        pool.spawn_n(stream, deadline, counts, index)
+    start = time.time()
+    pool.waitall()
+    elapsed = time.time() - start
+
+    total = sum(counts)
+    fairness = float(total) ** 2 / (streams * sum(c ** 2 for c in counts))
+    delays.sort()
+    p99 = delays[min(len(delays) - 1, int(len(delays) * 0.99))]
+    return (float(total) / units.Gi / elapsed, fairness,
+            p99 * 1000, delays[-1] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--streams', type=int, default=32,
+                        help='Number of concurrent streams, half of them '
+                             'uploads and half downloads')
+    parser.add_argument('--duration', type=float, default=5,
+                        help='Number of seconds each setting runs for')
+    args = parser.parse_args()
+    cfg.CONF([], project='glance', default_config_files=[])
+
+    six.print_('%12s %10s %8s %9s %12s %12s' % (
+        'interval ms', 'bytes KiB', 'GB/s', 'fairness', 'p99 wait ms',
+        'max wait ms'))
+    for interval, max_bytes in POLICIES:
+        cfg.CONF.set_override('cooperative_yield_interval', interval)
+        cfg.CONF.set_override('cooperative_yield_bytes', max_bytes)
+        six.print_('%12d %10d %8.2f %9.3f %12.2f %12.2f' % (
+            (interval, max_bytes // units.Ki) +
+            run(args.streams, args.duration)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures how fast an image stream is hashed with several algorithms by
+glance.common.multihash.MultiHasher, compared with hashing each chunk in
+the green thread streaming the image.
+
+Each configuration hashes the image, sent in chunks of 64 KiB, with a set
+of algorithms. The benchmark reports the throughput of the stream and how
+late a green thread standing for the other requests of the worker, which
+asks to run every millisecond, gets to run::
+
+    python tools/multihash_benchmark.py --size 512
+"""
+
+import argparse
+import hashlib
+import time
+
+import eventlet
+from oslo_utils import units
+import six
+
+from glance.common import multihash
+
+CHUNK_SIZE = 64 * units.Ki
+
+CONFIGURATIONS = [
+    ['md5'],
+    ['md5', 'sha256'],
+    ['md5', 'sha256', 'sha512'],
+]
+
+
+class InlineHasher(object):
+    """Hashes each chunk in the calling green thread."""
+
+    def __init__(self, algorithms):
+        self.digests = [hashlib.new(name) for name in algorithms]
+
+    def update(self, chunk):
+        for digest in self.digests:
+            digest.update(chunk)
+        eventlet.sleep(0)
+
+    def hexdigests(self):
+        return [digest.hexdigest() for digest in self.digests]
+
+
+class ThreadedHasher(multihash.MultiHasher):
+    """
+    Hashes in worker threads, and yields after each chunk like
+    InlineHasher does.
+    """
+
+    def __init__(self, algorithms):
+        super(ThreadedHasher, self).__init__(algorithms, threaded=True)
+
+    def update(self, chunk):
+        super(ThreadedHasher, self).update(chunk)
+        eventlet.sleep(0)
+
+
+def probe(done, delays):
+    while not done:
+        start = time.time()
+        eventlet.sleep(0.001)
+        delays.append(time.time() - start - 0.001)
+
+
+def run(hasher_class, algorithms, size):
+    chunk = b'*' * CHUNK_SIZE
+    done = []
+    delays = []
+    prober = eventlet.spawn(probe, done, delays)
+    eventlet.sleep(0)
+    start = time.time()
+    hasher = hasher_class(algorithms)
+    for i in range(size // CHUNK_SIZE):
+        hasher.update(chunk)
+    hasher.hexdigests()
+    elapsed = time.time() - start
+    done.append(True)
+    prober.wait()
+    delays.sort()
+    p99 = delays[min(len(delays) - 1, int(len(delays) * 0.99))]
+    return float(size) / units.Gi / elapsed, p99 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=512,
+                        help='Size of the image in MiB')
+    args = parser.parse_args()
+    size = args.size * units.Mi
+
+    six.print_('%-20s %12s %12s %14s %14s' % (
+        'algorithms', 'inline GB/s', 'inline p99', 'threaded GB/s',
+        'threaded p99'))
+    for algorithms in CONFIGURATIONS:
+        six.print_('%-20s %12.2f %10.2fms %14.2f %12.2fms' % (
+            (','.join(algorithms),) +
+            run(InlineHasher, algorithms, size) +
+            run(ThreadedHasher, algorithms, size)))
+
+
+if __name__ == '__main__':
+    main()
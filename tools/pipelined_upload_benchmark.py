@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures how fast an image is uploaded to a backend store with a high
+latency, for several settings of image_upload_pipeline_depth.
+
+The client sends the image data at a given rate, as long as the socket
+buffer of the server has room for it, and the store writes it
+in chunks of a given size, each write waiting for the store as a Swift or
+RBD store waits on the network. The upload goes through
+glance.common.utils.upload_pipeline as in the API. For each setting, the
+benchmark reports the throughput of the upload and the most image data
+read from the client but not written to the store yet::
+
+    python tools/pipelined_upload_benchmark.py --size 64 --latency 20
+"""
+
+import argparse
+import time
+
+import eventlet
+from oslo_config import cfg
+from oslo_utils import units
+import six
+
+from glance.common import utils
+
+DEPTHS = [0, 4, 16, 64, 256]
+
+
+class Client(object):
+    """
+    The request body of an upload, sent at a fixed rate as long as the
+    socket buffer of the server has room for it, like TCP does.
+    """
+
+    def __init__(self, size, rate, window, progress):
+        self.remaining = size
+        self.rate = rate
+        self.window = window
+        self.progress = progress
+        self.buffered = 0
+        self.clock = None
+
+    def _arrive(self, window):
+        now = time.time()
+        if self.clock is not None:
+            self.buffered = min(window, self.buffered +
+                                (now - self.clock) * self.rate)
+        self.clock = now
+
+    def read(self, size):
+        size = min(size, self.remaining)
+        self._arrive(self.window)
+        if self.buffered < size:
+            # The data keeps arriving while it is read. The hub rounds
+            # short sleeps up, so this reads whatever arrived meanwhile
+            # rather than assuming it took the time asked for.
+            eventlet.sleep(float(size - self.buffered) / self.rate)
+            self._arrive(self.window + size)
+        self.buffered = min(self.window, max(0, self.buffered - size))
+        self.remaining -= size
+        self.progress['read'] += size
+        self.progress['peak'] = max(self.progress['peak'],
+                                    self.progress['read'] -
+                                    self.progress['written'])
+        return b'*' * size
+
+
+def add_to_backend(data, chunk_size, latency, progress):
+    while True:
+        chunk = data.read(chunk_size)
+        if not chunk:
+            return
+        eventlet.sleep(latency)
+        progress['written'] += len(chunk)
+
+
+def run(size, rate, window, chunk_size, latency):
+    progress = {'read': 0, 'written': 0, 'peak': 0}
+    data = utils.CooperativeReader(Client(size, rate, window, progress))
+    start = time.time()
+    with utils.upload_pipeline(data) as data:
+        add_to_backend(data, chunk_size, latency, progress)
+    elapsed = time.time() - start
+    assert progress['written'] == size
+    return float(size) / units.Mi / elapsed, progress['peak'] // units.Ki
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=64,
+                        help='Size of the uploaded image in MiB')
+    parser.add_argument('--rate', type=int, default=100,
+                        help='Rate the client sends the image at in MiB/s')
+    parser.add_argument('--window', type=int, default=256,
+                        help='Size of the socket buffer of the server in '
+                             'KiB, beyond which the client waits')
+    parser.add_argument('--chunk-size', type=int, default=4096,
+                        help='Size of the writes to the store in KiB')
+    parser.add_argument('--latency', type=float, default=20,
+                        help='Time each write to the store takes in ms')
+    args = parser.parse_args()
+    cfg.CONF([], project='glance', default_config_files=[])
+
+    six.print_('%6s %10s %16s' % ('depth', 'MiB/s', 'peak ahead KiB'))
+    for depth in DEPTHS:
+        cfg.CONF.set_override('image_upload_pipeline_depth', depth)
+        six.print_('%6d %10.1f %16d' % (
+            (depth,) + run(args.size * units.Mi, args.rate * units.Mi,
+                           args.window * units.Ki, args.chunk_size * units.Ki,
+                           args.latency / 1000.0)))
+
+
+if __name__ == '__main__':
+    main()